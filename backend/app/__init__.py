@@ -23,6 +23,12 @@ def create_app(config_name='development'):
     migrate.init_app(app, db)
     jwt.init_app(app)
     CORS(app)
+
+    from app import db_pool, cache
+    from app.services import sesiones_imagen
+    db_pool.init_app(app)
+    cache.init_app(app)
+    sesiones_imagen.init_app(app)
     
     # Crear directorios necesarios
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -49,7 +55,10 @@ def create_app(config_name='development'):
             'status': 'ok',
             'message': 'Centro Diagnóstico API',
             'environment': app.config.get('FLASK_ENV', 'production'),
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'db_pool': db_pool.pool.stats(),
+            'cache': cache.cache_stats(),
+            'sesiones_imagen': sesiones_imagen.sesiones.stats()
         }), 200
     
     # =====================
@@ -80,5 +89,12 @@ def create_app(config_name='development'):
     def unauthorized(error):
         from flask import jsonify
         return jsonify({'error': 'No autorizado'}), 401
-    
+
+    from app.utils.pagination import CursorInvalido
+
+    @app.errorhandler(CursorInvalido)
+    def cursor_invalido(error):
+        from flask import jsonify
+        return jsonify({'error': str(error)}), 400
+
     return app
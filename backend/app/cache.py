@@ -1,40 +1,264 @@
+"""
+Cache de respuestas para endpoints de lectura costosos.
+
+Backends:
+- 'sqlite': archivo local compartido por todos los workers de gunicorn
+  (por defecto): entradas y versiones de etiquetas son las mismas en todos.
+- 'memory': LRU por proceso con límite de entradas, solo para un proceso
+  (run.py en desarrollo, tests); con varios workers una invalidación no
+  llegaría a los demás.
+
+Las entradas se etiquetan (p. ej. 'pacientes', 'facturas', 'pagos') y
+invalidate('pagos') descarta de una vez todo lo que dependía de pagos:
+cada etiqueta tiene un número de versión que forma parte de la clave.
+"""
+from collections import OrderedDict
 from functools import wraps
-from flask import request
+from flask import request, current_app, has_request_context
 import hashlib
 import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
 
-# Cache simple en memoria (para producción usar Redis)
-_cache = {}
 
-def cache_key(*args, **kwargs):
-    """Generar clave de cache"""
-    key_data = f"{args}{kwargs}{request.path}"
+class MemoryCache:
+    """LRU en memoria con TTL por entrada"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_version(self, tag):
+        return self._versions.get(tag, 0)
+
+    def incr_version(self, tag):
+        with self._lock:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+            return self._versions[tag]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Cache en un archivo SQLite (modo WAL), compartido entre procesos"""
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                clave TEXT PRIMARY KEY,
+                valor BLOB NOT NULL,
+                expira REAL,
+                usado REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_usado ON cache(usado)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        # Una conexión por hilo y por proceso (no se comparten tras un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        ahora = time.time()
+        row = conn.execute("SELECT valor, expira FROM cache WHERE clave = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < ahora:
+            conn.execute("DELETE FROM cache WHERE clave = ?", (key,))
+            return None
+        conn.execute("UPDATE cache SET usado = ? WHERE clave = ?", (ahora, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=None):
+        conn = self._conn()
+        ahora = time.time()
+        expires = ahora + timeout if timeout else None
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (clave, valor, expira, usado) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires, ahora)
+        )
+        self._evict(conn, ahora)
+
+    def get_version(self, tag):
+        row = self._conn().execute("SELECT version FROM cache_tags WHERE tag = ?", (tag,)).fetchone()
+        return row[0] if row else 0
+
+    def incr_version(self, tag):
+        conn = self._conn()
+        conn.execute("""
+            INSERT INTO cache_tags (tag, version) VALUES (?, 1)
+            ON CONFLICT(tag) DO UPDATE SET version = version + 1
+        """, (tag,))
+        return self.get_version(tag)
+
+    def _evict(self, conn, ahora):
+        conn.execute("DELETE FROM cache WHERE expira IS NOT NULL AND expira < ?", (ahora,))
+        total = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        exceso = total - self.max_entries
+        if exceso > 0:
+            conn.execute("""
+                DELETE FROM cache WHERE clave IN (
+                    SELECT clave FROM cache ORDER BY usado LIMIT ?
+                )
+            """, (exceso,))
+            self.evictions += exceso
+
+    def clear(self):
+        # Las versiones de etiquetas se conservan para no revivir claves antiguas
+        self._conn().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+_backend = MemoryCache()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidaciones': 0}
+
+
+def init_app(app):
+    """Seleccionar el backend según CACHE_BACKEND"""
+    global _backend
+    backend = app.config.get('CACHE_BACKEND', 'sqlite')
+    max_entries = app.config.get('CACHE_MAX_ENTRIES', 1024)
+    if backend == 'sqlite':
+        _backend = SQLiteCache(app.config.get('CACHE_SQLITE_PATH', './cache/respuestas.db'), max_entries)
+    else:
+        _backend = MemoryCache(max_entries)
+
+
+def _contar(campo):
+    with _lock:
+        _stats[campo] += 1
+
+
+def _user_scope():
+    """Identidad JWT del request, si la hay"""
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        identidad = get_jwt_identity()
+    except Exception:
+        identidad = None
+    return str(identidad) if identidad is not None else 'anon'
+
+
+def _make_key(args, kwargs, tags=(), per_user=True):
+    partes = {
+        'args': [str(a) for a in args],
+        'kwargs': {k: str(v) for k, v in sorted(kwargs.items())},
+        'tags': [(tag, _backend.get_version(tag)) for tag in tags],
+    }
+    if has_request_context():
+        partes['path'] = request.path
+        partes['query'] = sorted(request.args.items(multi=True))
+        if per_user:
+            partes['user'] = _user_scope()
+    key_data = json.dumps(partes, sort_keys=True, default=str)
     return hashlib.md5(key_data.encode()).hexdigest()
 
-def cached(timeout=300):
-    """Decorador para cachear respuestas"""
+
+def cache_key(*args, **kwargs):
+    """Generar clave de cache: ruta, query string, usuario y argumentos"""
+    return _make_key(args, kwargs)
+
+
+def cached(timeout=300, tags=(), per_user=True):
+    """Decorador para cachear respuestas 200 de un endpoint.
+
+    tags: etiquetas cuya invalidación descarta la entrada.
+    per_user: incluir la identidad JWT en la clave (False para catálogos).
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            key = f"{f.__name__}:{cache_key(*args, **kwargs)}"
-            
-            # Verificar si está en cache
-            if key in _cache:
-                cached_data, timestamp = _cache[key]
-                from time import time
-                if time() - timestamp < timeout:
-                    return cached_data
-            
-            # Ejecutar función y guardar en cache
-            result = f(*args, **kwargs)
-            from time import time
-            _cache[key] = (result, time())
-            
-            return result
+            key = f"{f.__name__}:{_make_key(args, kwargs, tags, per_user)}"
+
+            entrada = _backend.get(key)
+            if entrada is not None:
+                _contar('hits')
+                body, status, mimetype = entrada
+                return current_app.response_class(body, status=status, mimetype=mimetype)
+
+            _contar('misses')
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                _backend.set(key, (response.get_data(), response.status_code, response.mimetype), timeout)
+                _contar('sets')
+            return response
         return decorated_function
     return decorator
 
+
+def invalidate(*tags):
+    """Invalidar todas las entradas marcadas con alguna de las etiquetas"""
+    for tag in tags:
+        _backend.incr_version(tag)
+        _contar('invalidaciones')
+
+
+def cache_stats():
+    """Contadores de uso del cache"""
+    with _lock:
+        stats = dict(_stats)
+    consultas = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / consultas, 3) if consultas else 0.0
+    stats['backend'] = type(_backend).__name__
+    stats['entradas'] = len(_backend)
+    stats['desalojos'] = _backend.evictions
+    return stats
+
+
 def clear_cache():
     """Limpiar todo el cache"""
-    global _cache
-    _cache = {}
+    _backend.clear()
@@ -0,0 +1,244 @@
+"""
+Pool de conexiones PostgreSQL compartido por los blueprints que usan SQL directo
+(psycopg2) en lugar de SQLAlchemy.
+
+Cada request toma conexiones del pool con get_db_connection() y las devuelve
+con conn.close(); las que no se devuelven se recuperan al terminar el request
+y se cuentan como fugas.
+"""
+from flask import g, has_app_context
+from psycopg2 import pool as pg_pool
+import psycopg2
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(pg_pool.PoolError):
+    """No hubo una conexión libre dentro del tiempo de espera"""
+
+
+class PooledConnection:
+    """Conexión prestada por el pool: close() la devuelve en vez de cerrarla"""
+
+    def __init__(self, owner, conn):
+        self._owner = owner
+        self._conn = conn
+        self.checked_out_at = time.monotonic()
+        self.returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        self._owner.putconn(self)
+
+
+class ConnectionPool:
+    """Pool acotado, con verificación de salud y detección de fugas"""
+
+    def __init__(self, dsn=None, minconn=1, maxconn=10, timeout=10.0,
+                 health_check_after=30.0, leak_seconds=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.leak_seconds = leak_seconds
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._last_used = {}
+        self._in_use = {}
+        self._counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'leaks': 0,
+        }
+
+    def configure(self, dsn, minconn=None, maxconn=None, timeout=None,
+                  health_check_after=None, leak_seconds=None):
+        """Actualizar parámetros; el pool se recrea en el próximo uso"""
+        with self._lock:
+            self.dsn = dsn
+            if minconn is not None:
+                self.minconn = minconn
+            if maxconn is not None:
+                self.maxconn = maxconn
+            if timeout is not None:
+                self.timeout = timeout
+            if health_check_after is not None:
+                self.health_check_after = health_check_after
+            if leak_seconds is not None:
+                self.leak_seconds = leak_seconds
+            self._reset()
+
+    def _reset(self):
+        if self._pool is not None and self._pid == os.getpid():
+            try:
+                self._pool.closeall()
+            except pg_pool.PoolError:
+                pass
+        self._pool = None
+        self._pid = None
+        self._last_used = {}
+        self._in_use = {}
+
+    def _ensure_pool(self):
+        # Con preload_app de gunicorn el pool no debe cruzar un fork
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = None
+                self._last_used = {}
+                self._in_use = {}
+                self._pool = pg_pool.ThreadedConnectionPool(
+                    self.minconn, self.maxconn, self.dsn or os.getenv('DATABASE_URL')
+                )
+                self._slots = threading.BoundedSemaphore(self.maxconn)
+                self._pid = os.getpid()
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Tomar una conexión del pool, esperando hasta `timeout` segundos"""
+        pool = self._ensure_pool()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self._counters['waits'] += 1
+            if not slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._counters['timeouts'] += 1
+                raise PoolTimeout(
+                    f'No hay conexiones disponibles tras {self.timeout}s '
+                    f'({self.maxconn} en uso)'
+                )
+        try:
+            conn = pool.getconn()
+            while not self._is_healthy(conn):
+                with self._lock:
+                    self._counters['discarded'] += 1
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+        wrapper = PooledConnection(self, conn)
+        with self._lock:
+            self._counters['checkouts'] += 1
+            self._in_use[id(wrapper)] = wrapper
+        return wrapper
+
+    def putconn(self, wrapper, leaked=False):
+        """Devolver una conexión al pool (idempotente)"""
+        with self._lock:
+            if wrapper.returned:
+                return
+            wrapper.returned = True
+            self._in_use.pop(id(wrapper), None)
+            if leaked:
+                self._counters['leaks'] += 1
+        conn = wrapper._conn
+        pool = self._pool
+        try:
+            if pool is None or self._pid != os.getpid():
+                conn.close()
+                return
+            discard = bool(conn.closed)
+            if not discard and conn.status != psycopg2.extensions.STATUS_READY:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            if discard:
+                with self._lock:
+                    self._counters['discarded'] += 1
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=discard)
+        finally:
+            self._slots.release()
+
+    def find_leaks(self):
+        """Conexiones prestadas por más de `leak_seconds`"""
+        ahora = time.monotonic()
+        with self._lock:
+            return [w for w in self._in_use.values()
+                    if ahora - w.checked_out_at > self.leak_seconds]
+
+    def stats(self):
+        """Métricas del pool para /api/health"""
+        ahora = time.monotonic()
+        with self._lock:
+            activo = self._pool is not None and self._pid == os.getpid()
+            en_uso = len(self._in_use) if activo else 0
+            retenidas = sum(1 for w in self._in_use.values()
+                            if ahora - w.checked_out_at > self.leak_seconds)
+            libres = len(self._pool._pool) if activo else 0
+            return {
+                'inicializado': activo,
+                'min': self.minconn,
+                'max': self.maxconn,
+                'en_uso': en_uso,
+                'libres': libres,
+                'abiertas': en_uso + libres,
+                'retenidas': retenidas,
+                **self._counters,
+            }
+
+
+pool = ConnectionPool()
+
+
+def get_db_connection():
+    """Obtener una conexión del pool compartido"""
+    conn = pool.getconn()
+    if has_app_context():
+        g.setdefault('_db_pool_conns', []).append(conn)
+    return conn
+
+
+def _release_request_connections(exc=None):
+    """Devolver al pool las conexiones que el request no cerró"""
+    conns = g.pop('_db_pool_conns', None) if has_app_context() else None
+    for conn in conns or []:
+        if not conn.returned:
+            logger.warning('Conexión del pool no devuelta por el request; recuperada')
+            pool.putconn(conn, leaked=True)
+
+
+def init_app(app):
+    """Configurar el pool desde la configuración de la app"""
+    pool.configure(
+        os.getenv('DATABASE_URL'),
+        minconn=app.config.get('DB_POOL_MINCONN', 1),
+        maxconn=app.config.get('DB_POOL_MAXCONN', 10),
+        timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+        health_check_after=app.config.get('DB_POOL_HEALTH_CHECK_AFTER', 30.0),
+        leak_seconds=app.config.get('DB_POOL_LEAK_SECONDS', 30.0),
+    )
+    app.teardown_appcontext(_release_request_connections)
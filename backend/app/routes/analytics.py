@@ -1,16 +1,10 @@
 from flask import Blueprint, jsonify, request
 from functools import wraps
-import psycopg2
-import os
+from app.db_pool import get_db_connection
 from datetime import datetime, timedelta
 
 analytics_bp = Blueprint('analytics', __name__)
 
-def get_db_connection():
-    """Obtener conexión a la base de datos"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    return conn
-
 def require_auth(f):
     """Decorador para requerir autenticación"""
     @wraps(f)
@@ -3,6 +3,8 @@ from flask_jwt_extended import jwt_required
 from app import db
 from app.models import Paciente, Orden, Factura, Estudio
 from app.utils.validators import sanitize_string
+from app.utils.pagination import validate_cursor_params, keyset_paginate, respuesta_paginada
+from app.services.busqueda_service import BusquedaPacientes
 from sqlalchemy import or_, cast, String
 
 bp = Blueprint('busqueda', __name__)
@@ -20,18 +22,8 @@ def busqueda_global():
     search = f'%{termino}%'
     resultados = {}
 
-    # Buscar pacientes
-    pacientes = Paciente.query.filter(
-        or_(
-            Paciente.nombre.ilike(search),
-            Paciente.apellido.ilike(search),
-            Paciente.cedula.ilike(search),
-            Paciente.telefono.ilike(search),
-            Paciente.celular.ilike(search),
-            Paciente.email.ilike(search),
-            Paciente.codigo_paciente.ilike(search)
-        )
-    ).limit(10).all()
+    # Buscar pacientes (índice trigram, ordenado por relevancia)
+    pacientes = BusquedaPacientes.aplicar(Paciente.query, termino).limit(10).all()
 
     resultados['pacientes'] = [{
         'id': p.id,
@@ -93,18 +85,10 @@ def buscar_pacientes():
     seguro = sanitize_string(request.args.get('seguro', ''), max_length=100)
 
     query = Paciente.query
+    buscando = bool(termino and len(termino) >= 2)
 
-    if termino and len(termino) >= 2:
-        search = f'%{termino}%'
-        query = query.filter(
-            or_(
-                Paciente.nombre.ilike(search),
-                Paciente.apellido.ilike(search),
-                Paciente.cedula.ilike(search),
-                Paciente.codigo_paciente.ilike(search),
-                Paciente.telefono.ilike(search)
-            )
-        )
+    if buscando:
+        query = BusquedaPacientes.aplicar(query, termino)
 
     if estado and estado in ('activo', 'inactivo'):
         query = query.filter(Paciente.estado == estado)
@@ -112,16 +96,18 @@ def buscar_pacientes():
     if seguro:
         query = query.filter(Paciente.seguro_medico.ilike(f'%{seguro}%'))
 
-    page = max(1, request.args.get('page', 1, type=int))
-    per_page = min(50, max(1, request.args.get('per_page', 20, type=int)))
-
-    result = query.order_by(Paciente.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    if buscando:
+        # Ordenado por relevancia: se devuelven los mejores resultados
+        _, limite, _ = validate_cursor_params(default=20, maximo=50)
+        pacientes = query.limit(limite).all()
+        return jsonify(respuesta_paginada(
+            'pacientes', [p.to_dict() for p in pacientes], None, total=len(pacientes)
+        ))
+
+    posicion, limite, modo_total = validate_cursor_params(default=20, maximo=50)
+    pacientes, siguiente, total = keyset_paginate(
+        query, Paciente.created_at, Paciente.id, posicion, limite, modo_total
     )
-
-    return jsonify({
-        'pacientes': [p.to_dict() for p in result.items],
-        'total': result.total,
-        'pages': result.pages,
-        'current_page': page
-    })
+    return jsonify(respuesta_paginada(
+        'pacientes', [p.to_dict() for p in pacientes], siguiente, total, limite
+    ))
@@ -1,16 +1,14 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required
-import psycopg2
-import os
+from app.db_pool import get_db_connection
+from app.cache import cached
 from datetime import datetime, timedelta
 
 bp = Blueprint('dashboard', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/stats', methods=['GET'])
 @jwt_required()
+@cached(timeout=60, tags=('pacientes', 'ordenes', 'facturas'))
 def get_stats():
     try:
         conn = get_db_connection()
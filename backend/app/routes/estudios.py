@@ -1,15 +1,13 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-import psycopg2
-import os
+from app.db_pool import get_db_connection
+from app.cache import cached, invalidate
 
 bp = Blueprint('estudios', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/', methods=['GET'])
 @jwt_required()
+@cached(timeout=3600, tags=('estudios',), per_user=False)
 def listar_estudios():
     """Listar todos los estudios"""
     try:
@@ -88,6 +86,7 @@ def crear_estudio():
         conn.commit()
         cur.close()
         conn.close()
+        invalidate('estudios')
         
         return jsonify({'message': 'Estudio creado', 'id': estudio_id}), 201
     except Exception as e:
@@ -129,6 +128,7 @@ def actualizar_estudio(estudio_id):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate('estudios')
         
         return jsonify({'message': 'Estudio actualizado'}), 200
     except Exception as e:
@@ -151,6 +151,7 @@ def eliminar_estudio(estudio_id):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate('estudios')
         
         return jsonify({'message': 'Estudio desactivado'}), 200
     except Exception as e:
@@ -158,6 +159,7 @@ def eliminar_estudio(estudio_id):
 
 @bp.route('/categorias', methods=['GET'])
 @jwt_required()
+@cached(timeout=3600, tags=('estudios',), per_user=False)
 def listar_categorias():
     """Listar categorías"""
     try:
@@ -183,6 +185,7 @@ def listar_categorias():
 
 @bp.route('/precios', methods=['GET'])
 @jwt_required()
+@cached(timeout=3600, tags=('estudios',), per_user=False)
 def listar_precios():
     """Listar precios para facturación"""
     try:
@@ -1,11 +1,11 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from app.models import Factura, Pago, Paciente
 from app.services.facturacion import FacturacionService
-from app.services.pdf_service import PDFService
-import os
-import tempfile
+from app.routes.trabajos import encolar_documento, descargar_documento
+from app.cache import invalidate
+from app.utils.pagination import validate_cursor_params, keyset_paginate, respuesta_paginada
 
 bp = Blueprint('facturas', __name__)
 
@@ -17,8 +17,13 @@ def listar_facturas():
     query = Factura.query
     if estado:
         query = query.filter(Factura.estado == estado)
-    facturas = query.order_by(Factura.fecha_factura.desc()).limit(100).all()
-    return jsonify({'facturas': [f.to_dict() for f in facturas], 'total': len(facturas)})
+    posicion, limite, modo_total = validate_cursor_params()
+    facturas, siguiente, total = keyset_paginate(
+        query, Factura.fecha_factura, Factura.id, posicion, limite, modo_total
+    )
+    return jsonify(respuesta_paginada(
+        'facturas', [f.to_dict() for f in facturas], siguiente, total, limite
+    ))
 
 
 @bp.route('/<int:factura_id>', methods=['GET'])
@@ -55,6 +60,7 @@ def crear_factura_desde_orden(orden_id):
         usuario_id = int(get_jwt_identity())
         datos['usuario_id'] = usuario_id
         factura = FacturacionService.crear_factura_desde_orden(orden_id, datos)
+        invalidate('facturas', 'ordenes')
         return jsonify({'success': True, 'message': 'Factura creada', 'factura': factura.to_dict()}), 201
     except ValueError as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -73,6 +79,7 @@ def registrar_pago(factura_id):
         usuario_id = int(get_jwt_identity())
         datos['usuario_id'] = usuario_id
         pago = FacturacionService.registrar_pago(factura_id, datos)
+        invalidate('pagos', 'facturas')
         return jsonify({
             'success': True, 
             'message': 'Pago registrado', 
@@ -97,26 +104,23 @@ def facturas_pendientes():
     return jsonify({'facturas': [f.to_dict() for f in facturas], 'total': len(facturas)})
 
 
-@bp.route('/<int:factura_id>/pdf', methods=['GET'])
+@bp.route('/<int:factura_id>/pdf', methods=['GET', 'POST'])
 @jwt_required()
 def descargar_factura_pdf(factura_id):
+    """
+    POST encola la generación del PDF (202), o devuelve el trabajo vigente si
+    ya se pidió y la factura no cambió desde entonces. GET descarga el PDF ya
+    generado (202 mientras está en cola).
+    """
+    factura = Factura.query.get_or_404(factura_id)
+    documento = ('factura_pdf', {'factura_id': factura.id}, 'facturas', factura.id)
+    if request.method == 'GET':
+        return descargar_documento(*documento, vigente_desde=factura.updated_at)
     try:
-        factura = Factura.query.get_or_404(factura_id)
-        
-        # Usar directorio temporal del sistema
-        pdf_filename = f'factura_{factura.numero_factura.replace("-", "_")}.pdf'
-        pdf_path = os.path.join(tempfile.gettempdir(), pdf_filename)
-        
-        PDFService.generar_factura_pdf(factura, pdf_path)
-        
-        return send_file(
-            pdf_path, 
-            as_attachment=True, 
-            download_name=pdf_filename, 
-            mimetype='application/pdf'
-        )
+        return encolar_documento(*documento, f'PDF de la factura {factura.numero_factura} en cola',
+                                 vigente_desde=factura.updated_at)
     except Exception as e:
-        return jsonify({'error': f'Error al generar PDF: {str(e)}'}), 500
+        return jsonify({'error': f'Error al encolar el PDF: {str(e)}'}), 500
 
 
 @bp.route('/crear-directa', methods=['POST'])
@@ -1,105 +1,78 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app import db
 from app.models import Factura, Orden, Pago, Paciente
-from app.services.impresion_termica import ImpresionTermica
-from app.services.pdf_service import PDFService
-import tempfile
-import os
+from app.routes.trabajos import encolar_documento, descargar_documento
 
 bp = Blueprint('impresion', __name__)
 
+# Los PDFs se generan en backend/worker.py. POST valida y encola (202), o
+# devuelve el trabajo ya pedido si el registro no cambió desde entonces;
+# GET a la misma ruta descarga el archivo cuando está listo. Son documentos
+# que alguien está esperando en el mostrador: van primero en la cola.
 
-@bp.route('/recibo-pago/<int:pago_id>', methods=['GET'])
+
+def _documento(tipo, datos, tabla, registro_id, mensaje, vigente_desde):
+    if request.method == 'GET':
+        return descargar_documento(tipo, datos, tabla, registro_id, vigente_desde)
+    return encolar_documento(tipo, datos, tabla, registro_id, mensaje, vigente_desde)
+
+
+@bp.route('/recibo-pago/<int:pago_id>', methods=['GET', 'POST'])
 @jwt_required()
 def imprimir_recibo_pago(pago_id):
     """Generar recibo de pago para impresora 80mm"""
     pago = Pago.query.get_or_404(pago_id)
-    factura = pago.factura
     
-    if not factura:
+    if not pago.factura:
         return jsonify({'error': 'Factura no encontrada'}), 404
     
-    pdf_buffer = ImpresionTermica.generar_recibo_pago(factura, pago)
-    
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'recibo_{pago_id}.pdf'
-    )
+    # El recibo muestra el saldo de la factura
+    return _documento('recibo_pago', {'pago_id': pago.id}, 'pagos', pago.id, f'Recibo {pago_id} en cola',
+                      pago.factura.updated_at)
 
 
-@bp.route('/ticket-orden/<int:orden_id>', methods=['GET'])
+@bp.route('/ticket-orden/<int:orden_id>', methods=['GET', 'POST'])
 @jwt_required()
 def imprimir_ticket_orden(orden_id):
     """Generar ticket de orden para impresora 80mm"""
     orden = Orden.query.get_or_404(orden_id)
     
-    pdf_buffer = ImpresionTermica.generar_ticket_orden(orden)
-    
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'ticket_{orden.numero_orden}.pdf'
-    )
+    return _documento('ticket_orden', {'orden_id': orden.id}, 'ordenes', orden.id,
+                      f'Ticket de la orden {orden.numero_orden} en cola', orden.updated_at)
 
 
-@bp.route('/etiqueta/<int:orden_id>/<int:detalle_id>', methods=['GET'])
+@bp.route('/etiqueta/<int:orden_id>/<int:detalle_id>', methods=['GET', 'POST'])
 @jwt_required()
 def imprimir_etiqueta(orden_id, detalle_id):
     """Generar etiqueta para muestra"""
     from app.models import OrdenDetalle
     
     orden = Orden.query.get_or_404(orden_id)
-    detalle = OrdenDetalle.query.get_or_404(detalle_id)
-    paciente = orden.paciente
+    OrdenDetalle.query.get_or_404(detalle_id)
     
-    estudio_nombre = detalle.estudio.nombre if detalle.estudio else 'Estudio'
-    
-    pdf_buffer = ImpresionTermica.generar_etiqueta_muestra(paciente, orden, estudio_nombre)
-    
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'etiqueta_{paciente.id}_{detalle_id}.pdf'
-    )
+    return _documento('etiqueta_muestra', {'orden_id': orden.id, 'detalle_id': detalle_id}, 'ordenes', orden.id,
+                      f'Etiqueta de la orden {orden.numero_orden} en cola', orden.updated_at)
 
 
-@bp.route('/factura/<int:factura_id>', methods=['GET'])
+@bp.route('/factura/<int:factura_id>', methods=['GET', 'POST'])
 @jwt_required()
 def imprimir_factura(factura_id):
     """Generar PDF de factura tamaño carta"""
     factura = Factura.query.get_or_404(factura_id)
     
-    pdf_path = os.path.join(tempfile.gettempdir(), f'factura_{factura.numero_factura}.pdf')
-    PDFService.generar_factura_pdf(factura, pdf_path)
-    
-    return send_file(
-        pdf_path,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'factura_{factura.numero_factura}.pdf'
-    )
+    return _documento('factura_pdf', {'factura_id': factura.id}, 'facturas', factura.id,
+                      f'Factura {factura.numero_factura} en cola', factura.updated_at)
 
 
-@bp.route('/factura-termica/<int:factura_id>', methods=['GET'])
+@bp.route('/factura-termica/<int:factura_id>', methods=['GET', 'POST'])
 @jwt_required()
 def imprimir_factura_termica(factura_id):
     """Generar factura para impresora 80mm"""
-    from app.services.impresion_service import ImpresionService
-    
     factura = Factura.query.get_or_404(factura_id)
     
     try:
-        pdf_buffer = ImpresionService.generar_factura_80mm(factura)
-        return send_file(
-            pdf_buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'factura_{factura.numero_factura}_80mm.pdf'
-        )
+        return _documento('factura_termica', {'factura_id': factura.id}, 'facturas', factura.id,
+                          f'Factura {factura.numero_factura} (80mm) en cola', factura.updated_at)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2,7 +2,6 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app.services.hl7_service import HL7Service
 from app.services.dicom_service import DICOMService
-import os
 
 bp = Blueprint('integraciones', __name__)
 
@@ -18,10 +17,8 @@ def parse_hl7():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        filepath = f"/tmp/{file.filename}"
-        file.save(filepath)
-        data = HL7Service.parse_hl7_file(filepath)
-        os.remove(filepath)
+        # Se parsea en memoria, sin pasar por /tmp
+        data = HL7Service.parse_hl7(file.read())
         return jsonify({'success': True, 'data': data})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -38,10 +35,8 @@ def parse_dicom():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        filepath = f"/tmp/{file.filename}"
-        file.save(filepath)
-        metadata = DICOMService.parse_dicom_file(filepath)
-        os.remove(filepath)
+        # Solo se lee el encabezado, directo del upload
+        metadata = DICOMService.parse_dicom_file(file.stream)
         return jsonify({'success': True, 'metadata': metadata})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,19 +1,25 @@
 from flask import Blueprint, request, jsonify
-import psycopg2
-import os
+from app.db_pool import get_db_connection
+from app.services.ingesta_resultados import IngestaResultados, MAX_LOTE
+from app.services.archivos_equipos import ArchivosEquipos, ErrorSubida
+from app.utils.agentes import requiere_clave_agente
 import json
 from datetime import datetime
 
 bp = Blueprint('maquinas', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/recibir-json', methods=['POST'])
+@requiere_clave_agente
 def recibir_resultado_json():
-    """Recibir resultados en formato JSON desde máquinas"""
+    """
+    Recibir resultados en formato JSON desde máquinas.
+    
+    La cabecera Idempotency-Key (o idempotency_key en el cuerpo) se guarda
+    con el resultado: reenviar la misma clave devuelve el ya creado.
+    """
     try:
         data = request.json
+        idempotency_key = str(request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '')[:64] or None
         
         paciente_id = data.get('paciente_id')
         orden_id = data.get('orden_id')
@@ -22,32 +28,46 @@ def recibir_resultado_json():
         if not paciente_id or not orden_id:
             return jsonify({'error': 'paciente_id y orden_id requeridos'}), 400
         
+        clave_dedup = IngestaResultados.clave_dedup(data)
         conn = get_db_connection()
         cur = conn.cursor()
         
-        cur.execute("SELECT id FROM orden_detalles WHERE orden_id = %s ORDER BY id DESC LIMIT 1", (orden_id,))
-        row = cur.fetchone()
-        
-        if not row:
-            return jsonify({'error': 'Orden no encontrada'}), 404
+        # Reenvío del mismo resultado: no se inserta otra fila
+        existente = IngestaResultados.existente(cur, clave_dedup, idempotency_key)
+        if existente:
+            cur.close()
+            conn.close()
+            return jsonify({
+                'success': True,
+                'resultado_id': existente,
+                'duplicado': True,
+                'message': 'Resultado ya recibido'
+            }), 200
         
-        orden_detalle_id = row[0]
+        # Orden por id o numero_orden; si no existe queda sin asignar con la referencia
+        orden_detalle_id = IngestaResultados.detalle_orden(cur, orden_id)
         
         cur.execute("""
             INSERT INTO resultados (
                 orden_detalle_id, tipo_archivo, nombre_archivo, datos_dicom,
-                estado_validacion, fecha_importacion, created_at
-            ) VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+                estado_validacion, clave_dedup, idempotency_key, orden_referencia,
+                paciente_referencia, fecha_importacion, created_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT DO NOTHING
             RETURNING id
         """, (
             orden_detalle_id,
             'json',
             f'resultado_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
             json.dumps(valores),
-            'pendiente'
+            'pendiente',
+            clave_dedup,
+            idempotency_key,
+            *IngestaResultados.referencias(data)
         ))
         
-        resultado_id = cur.fetchone()[0]
+        row = cur.fetchone()
+        resultado_id = row[0] if row else IngestaResultados.existente(cur, clave_dedup, idempotency_key)
         conn.commit()
         cur.close()
         conn.close()
@@ -55,12 +75,124 @@ def recibir_resultado_json():
         return jsonify({
             'success': True,
             'resultado_id': resultado_id,
+            'sin_asignar': orden_detalle_id is None,
             'message': 'Resultado recibido'
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _leer_lote():
+    """Items del lote: JSON (lista o {"resultados": [...]}) o NDJSON, una línea por resultado"""
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for linea in request.stream:
+            linea = linea.strip()
+            if linea:
+                items.append(json.loads(linea))
+            if len(items) > MAX_LOTE:
+                break
+        return items
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('resultados')
+    return data
+
+
+@bp.route('/recibir-lote', methods=['POST'])
+@requiere_clave_agente
+def recibir_lote():
+    """Recibir varios resultados en una petición (ver services/ingesta_resultados.py)"""
+    try:
+        items = _leer_lote()
+    except ValueError:
+        return jsonify({'error': 'NDJSON inválido'}), 400
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Se requiere una lista de resultados'}), 400
+    if len(items) > MAX_LOTE:
+        return jsonify({'error': f'Máximo {MAX_LOTE} resultados por lote'}), 413
+
+    try:
+        estados = IngestaResultados.insertar_lote(items)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    conteo = {'creado': 0, 'duplicado': 0, 'error': 0}
+    for estado in estados:
+        conteo[estado['estado']] += 1
+
+    return jsonify({
+        'success': conteo['error'] == 0,
+        'creados': conteo['creado'],
+        'duplicados': conteo['duplicado'],
+        'errores': conteo['error'],
+        'resultados': estados
+    }), 207 if conteo['error'] else 200
+
+
+def _error_subida(e):
+    respuesta = {'error': str(e)}
+    if e.offset is not None:
+        respuesta['offset'] = e.offset
+    return jsonify(respuesta), e.codigo
+
+
+@bp.route('/archivos', methods=['POST'])
+@requiere_clave_agente
+def iniciar_subida():
+    """
+    Declarar (o retomar) la subida de un archivo grande por bloques.
+    Body: {upload_id, nombre, tamano, sha256}. Devuelve el offset desde donde enviar.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        estado = ArchivosEquipos.iniciar(
+            data.get('upload_id'), data.get('nombre'), data.get('tamano'), data.get('sha256'),
+            estacion=data.get('station_name')
+        )
+    except ErrorSubida as e:
+        return _error_subida(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(estado), 200 if estado['offset'] or estado['completo'] else 201
+
+
+@bp.route('/archivos/<upload_id>', methods=['GET'])
+@requiere_clave_agente
+def estado_subida(upload_id):
+    """Offset recibido de una subida, para reanudarla"""
+    estado = ArchivosEquipos.estado(upload_id)
+    if estado is None:
+        return jsonify({'error': 'Subida no encontrada'}), 404
+    return jsonify(estado), 200
+
+
+@bp.route('/archivos/<upload_id>', methods=['PATCH'])
+@requiere_clave_agente
+def escribir_bloque(upload_id):
+    """
+    Enviar un bloque. Headers: Upload-Offset (obligatorio) y
+    Upload-Checksum: sha256 <hex> (opcional); el cuerpo son los bytes.
+    """
+    offset = request.headers.get('Upload-Offset', '')
+    if not offset.isdigit() or request.content_length is None:
+        return jsonify({'error': 'Upload-Offset y Content-Length requeridos'}), 400
+    checksum = None
+    algoritmo, _, valor = request.headers.get('Upload-Checksum', '').partition(' ')
+    if algoritmo:
+        if algoritmo.lower() != 'sha256':
+            return jsonify({'error': 'Solo se acepta Upload-Checksum sha256'}), 400
+        checksum = valor.strip()
+    try:
+        estado = ArchivosEquipos.escribir(upload_id, int(offset), request.stream, request.content_length, checksum)
+    except ErrorSubida as e:
+        return _error_subida(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(estado), 200
+
+
 @bp.route('/estado', methods=['GET'])
 def estado_servicio():
     """Estado del servicio"""
@@ -69,6 +201,8 @@ def estado_servicio():
         'servicio': 'Integración Máquinas',
         'endpoints': {
             'json': '/api/maquinas/recibir-json',
+            'lote': '/api/maquinas/recibir-lote',
+            'archivos': '/api/maquinas/archivos',
             'estado': '/api/maquinas/estado'
         }
     }), 200
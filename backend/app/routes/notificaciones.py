@@ -3,17 +3,19 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from app.models import Paciente, Factura, Orden, OrdenDetalle, Resultado
 from app.services.email_service import EmailService
-from app.services.pdf_service import PDFService
-import tempfile
-import os
+from app.services.cola_trabajos import ColaTrabajos, PRIORIDAD_MASIVA
+from app.routes.trabajos import respuesta_encolado
 
 bp = Blueprint('notificaciones', __name__)
 
+# Pacientes por trabajo de envío masivo: más se parte en varias peticiones
+MAX_PACIENTES_LOTE = 500
+
 
 @bp.route('/enviar-resultados/<int:paciente_id>', methods=['POST'])
 @jwt_required()
 def enviar_resultados(paciente_id):
-    """Enviar notificación de resultados listos por email"""
+    """Encolar la notificación de resultados listos por email (202 + id del trabajo)"""
     paciente = Paciente.query.get_or_404(paciente_id)
     
     if not paciente.email:
@@ -22,16 +24,42 @@ def enviar_resultados(paciente_id):
     datos = request.get_json() or {}
     estudio_nombre = datos.get('estudio', 'Estudios de laboratorio')
     
-    email_service = EmailService()
-    resultado = email_service.enviar_resultados(paciente, estudio_nombre)
+    trabajo_id = ColaTrabajos.encolar(
+        'email_resultados', {'paciente_id': paciente.id, 'estudio': estudio_nombre},
+        tabla='pacientes', registro_id=paciente.id, solicitado_por=get_jwt_identity()
+    )
+    return respuesta_encolado(trabajo_id, f'Email a {paciente.email} en cola')
+
+
+@bp.route('/enviar-resultados-lote', methods=['POST'])
+@jwt_required()
+def enviar_resultados_lote():
+    """Encolar la notificación de resultados a varios pacientes (una sola sesión SMTP)"""
+    datos = request.get_json() or {}
+    paciente_ids = datos.get('paciente_ids') or []
+    if not isinstance(paciente_ids, list) or not all(isinstance(i, int) for i in paciente_ids):
+        return jsonify({'success': False, 'error': 'paciente_ids debe ser una lista de ids'}), 400
+    if not paciente_ids:
+        return jsonify({'success': False, 'error': 'paciente_ids es requerido'}), 400
+    paciente_ids = list(dict.fromkeys(paciente_ids))
+    if len(paciente_ids) > MAX_PACIENTES_LOTE:
+        return jsonify({
+            'success': False,
+            'error': f'Máximo {MAX_PACIENTES_LOTE} pacientes por envío; divídalo en varios lotes'
+        }), 400
     
-    return jsonify(resultado), 200 if resultado['success'] else 500
+    trabajo_id = ColaTrabajos.encolar(
+        'email_resultados_lote',
+        {'paciente_ids': paciente_ids, 'estudio': datos.get('estudio', 'Estudios de laboratorio')},
+        tabla='pacientes', prioridad=PRIORIDAD_MASIVA, solicitado_por=get_jwt_identity()
+    )
+    return respuesta_encolado(trabajo_id, f'Resultados de {len(paciente_ids)} pacientes en cola')
 
 
 @bp.route('/enviar-factura/<int:factura_id>', methods=['POST'])
 @jwt_required()
 def enviar_factura(factura_id):
-    """Enviar factura por email"""
+    """Encolar el envío de la factura por email (el PDF se genera en el worker)"""
     factura = Factura.query.get_or_404(factura_id)
     paciente = factura.paciente
     
@@ -39,20 +67,11 @@ def enviar_factura(factura_id):
         return jsonify({'success': False, 'error': 'Paciente no tiene email'}), 400
     
     try:
-        # Generar PDF
-        pdf_path = os.path.join(tempfile.gettempdir(), f'factura_{factura.numero_factura}.pdf')
-        PDFService.generar_factura_pdf(factura, pdf_path)
-        
-        # Enviar
-        email_service = EmailService()
-        resultado = email_service.enviar_factura(paciente, factura, pdf_path)
-        
-        # Limpiar
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
-        
-        return jsonify(resultado), 200 if resultado['success'] else 500
-        
+        trabajo_id = ColaTrabajos.encolar(
+            'email_factura', {'factura_id': factura.id},
+            tabla='facturas', registro_id=factura.id, solicitado_por=get_jwt_identity()
+        )
+        return respuesta_encolado(trabajo_id, f'Factura {factura.numero_factura} en cola para {paciente.email}')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -3,6 +3,8 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from app.models import Orden, OrdenDetalle, Paciente, Estudio
 from sqlalchemy import text
+from app.cache import invalidate
+from app.utils.pagination import validate_cursor_params, keyset_paginate, respuesta_paginada
 
 bp = Blueprint('ordenes', __name__)
 
@@ -13,8 +15,13 @@ def listar_ordenes():
     query = Orden.query
     if estado:
         query = query.filter(Orden.estado == estado)
-    ordenes = query.order_by(Orden.fecha_orden.desc()).limit(50).all()
-    return jsonify({'ordenes': [o.to_dict() for o in ordenes], 'total': len(ordenes)})
+    posicion, limite, modo_total = validate_cursor_params()
+    ordenes, siguiente, total = keyset_paginate(
+        query, Orden.fecha_orden, Orden.id, posicion, limite, modo_total
+    )
+    return jsonify(respuesta_paginada(
+        'ordenes', [o.to_dict() for o in ordenes], siguiente, total, limite
+    ))
 
 @bp.route('/<int:orden_id>', methods=['GET'])
 @jwt_required()
@@ -72,6 +79,7 @@ def crear_orden():
             db.session.add(detalle)
             total_orden += precio_final
         db.session.commit()
+        invalidate('ordenes', 'estudios')
         return jsonify({'success': True, 'message': 'Orden creada', 'orden': orden.to_dict(), 'total': float(total_orden)}), 201
     except Exception as e:
         db.session.rollback()
@@ -2,9 +2,11 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app import db
 from app.models import Paciente
-from app.utils.validators import sanitize_string, sanitize_dict, validate_cedula, validate_email, validate_phone, validate_pagination
+from app.cache import invalidate
+from app.services.busqueda_service import BusquedaPacientes
+from app.utils.validators import sanitize_string, sanitize_dict, validate_cedula, validate_email, validate_phone
+from app.utils.pagination import validate_cursor_params, keyset_paginate, respuesta_paginada
 from datetime import datetime
-from sqlalchemy import or_
 import random
 import string
 import bcrypt
@@ -15,28 +17,23 @@ bp = Blueprint('pacientes', __name__)
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def listar_pacientes():
-    page, per_page = validate_pagination()
     buscar = sanitize_string(request.args.get('buscar', ''), max_length=100)
 
-    query = Paciente.query
     if buscar:
-        # Uso seguro con parámetros - NO concatenación de strings
-        search_term = f'%{buscar}%'
-        query = query.filter(
-            or_(
-                Paciente.nombre.ilike(search_term),
-                Paciente.apellido.ilike(search_term),
-                Paciente.cedula.ilike(search_term)
-            )
-        )
-    query = query.order_by(Paciente.created_at.desc())
-    pacientes = query.paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify({
-        'pacientes': [p.to_dict() for p in pacientes.items],
-        'total': pacientes.total,
-        'pages': pacientes.pages,
-        'current_page': page
-    })
+        # Búsqueda: los más relevantes primero, sin paginar
+        _, limite, _ = validate_cursor_params()
+        pacientes = BusquedaPacientes.aplicar(Paciente.query, buscar).limit(limite).all()
+        return jsonify(respuesta_paginada(
+            'pacientes', [p.to_dict() for p in pacientes], None, total=len(pacientes)
+        ))
+
+    posicion, limite, modo_total = validate_cursor_params()
+    pacientes, siguiente, total = keyset_paginate(
+        Paciente.query, Paciente.created_at, Paciente.id, posicion, limite, modo_total
+    )
+    return jsonify(respuesta_paginada(
+        'pacientes', [p.to_dict() for p in pacientes], siguiente, total, limite
+    ))
 
 
 @bp.route('/<int:paciente_id>', methods=['GET'])
@@ -109,6 +106,8 @@ def crear_paciente():
 
         db.session.add(paciente)
         db.session.commit()
+        invalidate('pacientes')
+        BusquedaPacientes.indexar(paciente)
         return jsonify({
             'success': True,
             'message': 'Paciente creado',
@@ -144,6 +143,8 @@ def actualizar_paciente(paciente_id):
                 setattr(paciente, campo, datos[campo])
 
         db.session.commit()
+        invalidate('pacientes')
+        BusquedaPacientes.indexar(paciente)
         return jsonify({
             'success': True,
             'message': 'Paciente actualizado',
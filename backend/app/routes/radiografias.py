@@ -1,13 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file, current_app, Response
 from flask_jwt_extended import jwt_required
-import psycopg2
+from app.db_pool import get_db_connection
+from app.services.dicom_render import DicomRender, FORMATOS
+from app.services.radiografia_service import RadiologiaService, EXTENSIONES, es_dicom, firma
+from app.services.sesiones_imagen import sesiones
+import hashlib
 import os
+import tempfile
 
 bp = Blueprint('radiografias', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def listar_radiografias():
@@ -41,3 +43,207 @@ def listar_tipos():
     tipos = ['Radiografía de Tórax', 'Radiografía de Columna', 'Radiografía de Extremidades',
              'Radiografía Dental', 'Radiografía Abdominal', 'Mamografía', 'Tomografía', 'Resonancia Magnética']
     return jsonify(tipos), 200
+
+def _ruta_imagen(radiografia_id):
+    """imagen_original de la radiografía; None si no existe la fila o el archivo."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT imagen_original FROM radiografias WHERE id = %s", (radiografia_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not row or not row[0] or not os.path.isfile(row[0]):
+        return None
+    return row[0]
+
+def _cache_privado(resp, max_age=3600):
+    """Las imágenes son datos de pacientes: solo el navegador puede cachearlas."""
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.cache_control.max_age = max_age
+    return resp
+
+@bp.route('/<int:radiografia_id>/imagen', methods=['GET'])
+@jwt_required()
+def imagen_radiografia(radiografia_id):
+    """
+    Imagen original. Si es DICOM se sirve renderizada (?nivel=miniatura|
+    preview|completa, frame, wc, ww, formato=png|jpeg|webp), desde la caché
+    de disco con la ventana por defecto.
+    """
+    try:
+        params = DicomRender.parametros(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        ruta = _ruta_imagen(radiografia_id)
+        if not ruta:
+            return jsonify({'error': 'Radiografía sin imagen'}), 404
+        if not es_dicom(ruta):
+            return _cache_privado(send_file(ruta, conditional=True, max_age=86400), 86400)
+        archivo = DicomRender.renderizar(ruta, **params)
+        return _cache_privado(send_file(archivo, mimetype=FORMATOS[params['formato']][1],
+                                        conditional=True, max_age=86400), 86400)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/<int:radiografia_id>/imagen', methods=['POST'])
+@jwt_required()
+def subir_imagen_radiografia(radiografia_id):
+    """
+    Sube la imagen original (multipart, campo `archivo`: DICOM, PNG, JPEG o TIFF).
+
+    Se decodifica una vez al recibirla y queda en las sesiones de imagen.
+    """
+    if 'archivo' not in request.files:
+        return jsonify({'error': 'No se envió archivo'}), 400
+    archivo = request.files['archivo']
+    extension = os.path.splitext(archivo.filename or '')[1].lower().lstrip('.')
+    if es_dicom(archivo.stream):
+        extension = 'dcm'
+    if extension not in EXTENSIONES:
+        return jsonify({'error': f'Formato no soportado: {extension or "desconocido"}'}), 400
+
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT imagen_original FROM radiografias WHERE id = %s", (radiografia_id,))
+        row = cur.fetchone()
+        if not row:
+            cur.close()
+            conn.close()
+            return jsonify({'error': 'Radiografía no encontrada'}), 404
+
+        carpeta = os.path.join(current_app.config['UPLOAD_FOLDER'], 'radiografias')
+        os.makedirs(carpeta, exist_ok=True)
+        ruta = os.path.join(carpeta, f'radiografia_{radiografia_id}.{extension}')
+        # Se escribe aparte y se renombra: un visor abierto nunca lee un archivo a medias
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+        os.close(fd)
+        archivo.save(temporal)
+        try:
+            entrada = RadiologiaService.cargar(temporal)
+        except Exception as e:
+            os.remove(temporal)
+            cur.close()
+            conn.close()
+            return jsonify({'error': f'No se pudo leer la imagen: {e}'}), 400
+        os.replace(temporal, ruta)
+        anterior = row[0]
+        if anterior and anterior != ruta and os.path.dirname(os.path.abspath(anterior)) == os.path.abspath(carpeta) \
+                and os.path.isfile(anterior):
+            os.remove(anterior)
+
+        # Los frames cacheados del archivo anterior ya no valen
+        sesiones.invalidar(radiografia_id)
+        RadiologiaService.imagen(radiografia_id, ruta, entrada=entrada)
+        cur.execute("""
+            UPDATE radiografias SET imagen_original = %s, formato = %s, ancho = %s, alto = %s
+            WHERE id = %s
+        """, (ruta, extension.upper(), entrada.ancho, entrada.alto, radiografia_id))
+        conn.commit()
+        cur.close()
+        conn.close()
+        return jsonify({'id': radiografia_id, 'formato': extension.upper(),
+                        'ancho': entrada.ancho, 'alto': entrada.alto}), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/<int:radiografia_id>/procesada', methods=['GET'])
+@jwt_required()
+def imagen_procesada(radiografia_id):
+    """
+    Imagen con los ajustes del visor (?contraste, brillo, invertir, nitidez,
+    wc, ww, frame, formato=png|webp, sesion) como binario. La imagen
+    decodificada sale de las sesiones de imagen y la respuesta lleva ETag:
+    repetir unos ajustes ya vistos devuelve 304.
+    """
+    try:
+        params = RadiologiaService.parametros(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        ruta = _ruta_imagen(radiografia_id)
+        if not ruta:
+            return jsonify({'error': 'Radiografía sin imagen'}), 404
+        etag = hashlib.sha1(repr((firma(ruta), sorted(params.items()))).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return _cache_privado(resp)
+
+        formato = params.pop('formato')
+        entrada = RadiologiaService.imagen(radiografia_id, ruta, params.pop('frame'),
+                                           sesion_id=request.args.get('sesion'))
+        img = RadiologiaService.renderizar(entrada, **params)
+        resp = Response(RadiologiaService.codificar(img, formato), mimetype=FORMATOS[formato][1])
+        resp.set_etag(etag)
+        return _cache_privado(resp)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/<int:radiografia_id>/sesion', methods=['POST'])
+@jwt_required()
+def abrir_sesion(radiografia_id):
+    """
+    Abre el estudio en el visor: lo decodifica (o lo toma de memoria) y lo
+    mantiene hasta cerrar la sesión. Los ajustes de /procesada con
+    ?sesion=<id> se calculan sobre él.
+    """
+    try:
+        frame = int(request.args.get('frame', 0))
+        ruta = _ruta_imagen(radiografia_id)
+        if not ruta:
+            return jsonify({'error': 'Radiografía sin imagen'}), 404
+        entrada = RadiologiaService.imagen(radiografia_id, ruta, frame)
+        sesion_id = sesiones.abrir((radiografia_id, frame))
+        return jsonify({
+            'sesion': sesion_id,
+            'ancho': entrada.ancho,
+            'alto': entrada.alto,
+            'frames': entrada.frames,
+            'ventana': {'centro': entrada.meta.get('WindowCenter'), 'ancho': entrada.meta.get('WindowWidth')},
+            'ttl': sesiones.ttl
+        }), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/sesiones/<sesion_id>', methods=['DELETE'])
+@jwt_required()
+def cerrar_sesion(sesion_id):
+    """Cierra la sesión del visor y libera la imagen si nadie más la usa."""
+    if not sesiones.cerrar(sesion_id):
+        return jsonify({'error': 'Sesión no encontrada'}), 404
+    return '', 204
+
+@bp.route('/sesiones/estado', methods=['GET'])
+@jwt_required()
+def estado_sesiones():
+    """Hit rate y memoria residente de las sesiones de imagen de este worker."""
+    return jsonify(sesiones.stats()), 200
+
+@bp.route('/procesar', methods=['POST'])
+@jwt_required()
+def procesar_imagen():
+    """
+    Mejora automática (contraste, brillo y nitidez) de una imagen subida en
+    multipart (campo `archivo`), sin guardarla. Devuelve la imagen en binario.
+    """
+    if 'archivo' not in request.files:
+        return jsonify({'error': 'No se envió archivo'}), 400
+    formato = request.form.get('formato', request.args.get('formato', 'png')).lower()
+    if formato not in ('png', 'webp'):
+        return jsonify({'error': f'Formato no soportado: {formato}'}), 400
+    try:
+        datos, ancho, alto = RadiologiaService.procesar_imagen(request.files['archivo'].stream, formato)
+    except Exception as e:
+        return jsonify({'error': f'No se pudo procesar la imagen: {e}'}), 400
+    resp = Response(datos, mimetype=FORMATOS[formato][1])
+    resp.headers['X-Imagen-Ancho'] = str(ancho)
+    resp.headers['X-Imagen-Alto'] = str(alto)
+    resp.cache_control.no_store = True
+    return resp
@@ -1,160 +1,71 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app import db
-from app.models import Factura, Orden, Paciente, Estudio, Pago, OrdenDetalle
+from app.models import Factura, Orden, Paciente, Estudio, Pago, OrdenDetalle, CategoriaEstudio
 from app.utils.validators import sanitize_string
-from sqlalchemy import func, extract, text, and_, or_
+from app.services.resumen_service import ResumenService
+from app.services.exportacion_service import ExportacionService, FORMATOS
+from app.cache import cached
+from app.utils.query_budget import presupuesto_consultas
+from sqlalchemy import func, extract, text, and_, or_, select, case, Date
 from datetime import datetime, timedelta
 from decimal import Decimal
 
 bp = Blueprint('reportes', __name__)
 
 
-@bp.route('/dashboard', methods=['GET'])
-@jwt_required()
-def dashboard():
-    """Dashboard principal con todas las estadísticas"""
-    hoy = datetime.now().date()
-    inicio_mes = hoy.replace(day=1)
-    inicio_semana = hoy - timedelta(days=hoy.weekday())
+def _exportar(formato, nombre, columnas, stmt):
+    """Exportación en streaming (?formato=csv|ndjson|xlsx) de las filas de stmt"""
+    if formato not in FORMATOS:
+        return jsonify({'error': f"Formato no soportado. Use: {', '.join(FORMATOS)}"}), 400
+    return ExportacionService.respuesta(formato, nombre, columnas, stmt)
 
-    # ========== PACIENTES ==========
-    total_pacientes = Paciente.query.filter_by(estado='activo').count()
 
-    pacientes_hoy = Paciente.query.filter(
-        func.date(Paciente.created_at) == hoy
-    ).count()
+def _nombre_paciente():
+    return (Paciente.nombre + ' ' + Paciente.apellido).label('paciente')
 
-    pacientes_mes = Paciente.query.filter(
-        Paciente.created_at >= inicio_mes
-    ).count()
 
-    # ========== ÓRDENES ==========
-    ordenes_pendientes = Orden.query.filter(
-        Orden.estado.in_(['pendiente', 'en_proceso'])
-    ).count()
-
-    ordenes_hoy = Orden.query.filter(
-        func.date(Orden.fecha_orden) == hoy
-    ).count()
-
-    ordenes_mes = Orden.query.filter(
-        Orden.fecha_orden >= inicio_mes
-    ).count()
-
-    # ========== FACTURAS ==========
-    facturas_mes = Factura.query.filter(
-        Factura.fecha_factura >= inicio_mes,
-        Factura.estado != 'anulada'
-    ).all()
+def _pagado_por_factura():
+    """Subconsulta con el total pagado de cada factura"""
+    return select(
+        Pago.factura_id, func.sum(Pago.monto).label('pagado')
+    ).group_by(Pago.factura_id).subquery('pagos_factura')
 
-    total_facturado_mes = sum(float(f.total) for f in facturas_mes)
-    facturas_pendientes = len([f for f in facturas_mes if f.estado in ('pendiente', 'parcial')])
-    facturas_pagadas = len([f for f in facturas_mes if f.estado == 'pagada'])
-
-    # ========== INGRESOS ==========
-    ingresos_hoy = db.session.query(
-        func.coalesce(func.sum(Pago.monto), 0)
-    ).filter(
-        func.date(Pago.fecha_pago) == hoy
-    ).scalar()
-
-    ingresos_mes = db.session.query(
-        func.coalesce(func.sum(Pago.monto), 0)
-    ).filter(
-        Pago.fecha_pago >= inicio_mes
-    ).scalar()
-
-    ingresos_semana = db.session.query(
-        func.coalesce(func.sum(Pago.monto), 0)
-    ).filter(
-        Pago.fecha_pago >= inicio_semana
-    ).scalar()
 
-    # ========== CUENTAS POR COBRAR ==========
-    facturas_con_saldo = Factura.query.filter(
+def _consulta_cuentas_por_cobrar():
+    """Facturas pendientes con paciente, pagado y saldo calculados en una sola consulta"""
+    pagos_factura = _pagado_por_factura()
+    pagado = func.coalesce(pagos_factura.c.pagado, 0)
+    dias_vencido = func.coalesce(
+        func.greatest(func.current_date() - Factura.fecha_vencimiento, 0), 0
+    )
+    return select(
+        Factura.id, Factura.numero_factura, _nombre_paciente(), Paciente.telefono,
+        Factura.fecha_factura, Factura.fecha_vencimiento, Factura.total,
+        pagado.label('pagado'), (Factura.total - pagado).label('saldo'),
+        dias_vencido.label('dias_vencido'),
+        case((dias_vencido > 0, 'vencida'), else_=Factura.estado).label('estado')
+    ).outerjoin(Paciente, Paciente.id == Factura.paciente_id).outerjoin(
+        pagos_factura, pagos_factura.c.factura_id == Factura.id
+    ).where(
         Factura.estado.in_(['pendiente', 'parcial'])
-    ).all()
+    ).order_by(Factura.fecha_factura.asc())
 
-    cuentas_por_cobrar = 0
-    for f in facturas_con_saldo:
-        pagado = sum(float(p.monto) for p in f.pagos)
-        cuentas_por_cobrar += float(f.total) - pagado
 
-    # ========== ESTUDIOS MÁS SOLICITADOS ==========
-    estudios_populares = db.session.query(
-        Estudio.nombre,
-        func.count(OrdenDetalle.id).label('cantidad')
-    ).join(
-        OrdenDetalle, Estudio.id == OrdenDetalle.estudio_id
-    ).group_by(
-        Estudio.nombre
-    ).order_by(
-        func.count(OrdenDetalle.id).desc()
-    ).limit(5).all()
-
-    # ========== INGRESOS POR DÍA (últimos 7 días) ==========
-    ingresos_diarios = []
-    for i in range(6, -1, -1):
-        dia = hoy - timedelta(days=i)
-        ingreso = db.session.query(
-            func.coalesce(func.sum(Pago.monto), 0)
-        ).filter(
-            func.date(Pago.fecha_pago) == dia
-        ).scalar()
-        ingresos_diarios.append({
-            'fecha': dia.isoformat(),
-            'dia': dia.strftime('%a'),
-            'monto': float(ingreso)
-        })
-
-    # ========== INGRESOS POR MÉTODO DE PAGO ==========
-    pagos_por_metodo = db.session.query(
-        Pago.metodo_pago,
-        func.sum(Pago.monto).label('total'),
-        func.count(Pago.id).label('cantidad')
-    ).filter(
-        Pago.fecha_pago >= inicio_mes
-    ).group_by(Pago.metodo_pago).all()
-
-    return jsonify({
-        'fecha': hoy.isoformat(),
-        'pacientes': {
-            'total': total_pacientes,
-            'hoy': pacientes_hoy,
-            'mes': pacientes_mes
-        },
-        'ordenes': {
-            'pendientes': ordenes_pendientes,
-            'hoy': ordenes_hoy,
-            'mes': ordenes_mes
-        },
-        'facturacion': {
-            'total_mes': total_facturado_mes,
-            'facturas_mes': len(facturas_mes),
-            'pendientes': facturas_pendientes,
-            'pagadas': facturas_pagadas,
-            'cuentas_por_cobrar': cuentas_por_cobrar
-        },
-        'ingresos': {
-            'hoy': float(ingresos_hoy),
-            'semana': float(ingresos_semana),
-            'mes': float(ingresos_mes),
-            'diarios': ingresos_diarios
-        },
-        'estudios_populares': [
-            {'nombre': nombre, 'cantidad': cantidad}
-            for nombre, cantidad in estudios_populares
-        ],
-        'pagos_por_metodo': [
-            {'metodo': metodo, 'total': float(total), 'cantidad': cantidad}
-            for metodo, total, cantidad in pagos_por_metodo
-        ]
-    })
+@bp.route('/dashboard', methods=['GET'])
+@jwt_required()
+@cached(timeout=60, tags=('pacientes', 'ordenes', 'estudios', 'facturas', 'pagos'))
+@presupuesto_consultas(2)
+def dashboard():
+    """Dashboard principal con todas las estadísticas"""
+    # Se lee de resumen_diario (database/resumen_diario.sql), mantenido por triggers
+    return jsonify(ResumenService.dashboard())
 
 
 @bp.route('/ventas', methods=['GET'])
 @jwt_required()
+@cached(tags=('facturas', 'pagos', 'pacientes'))
+@presupuesto_consultas(2)
 def reporte_ventas():
     """Reporte de ventas con filtros"""
     fecha_inicio = request.args.get('fecha_inicio')
@@ -171,23 +82,40 @@ def reporte_ventas():
         except ValueError:
             return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
 
-    facturas = Factura.query.filter(
+    formato = request.args.get('formato')
+    if formato:
+        stmt = select(
+            Factura.id, Factura.numero_factura, Factura.ncf, Factura.fecha_factura,
+            _nombre_paciente(), Factura.subtotal, Factura.descuento, Factura.itbis,
+            Factura.total, Factura.estado
+        ).outerjoin(Paciente, Paciente.id == Factura.paciente_id).where(
+            Factura.fecha_factura >= fecha_inicio_dt,
+            Factura.fecha_factura <= fecha_fin_dt,
+            Factura.estado != 'anulada'
+        ).order_by(Factura.fecha_factura.desc())
+        return _exportar(formato, 'ventas', [
+            'id', 'numero', 'ncf', 'fecha', 'paciente', 'subtotal',
+            'descuento', 'itbis', 'total', 'estado'
+        ], stmt)
+
+    facturas = db.session.execute(select(
+        Factura.id, Factura.numero_factura, Factura.ncf, Factura.fecha_factura,
+        _nombre_paciente(), Factura.descuento, Factura.itbis, Factura.total, Factura.estado
+    ).outerjoin(Paciente, Paciente.id == Factura.paciente_id).where(
         Factura.fecha_factura >= fecha_inicio_dt,
         Factura.fecha_factura <= fecha_fin_dt,
         Factura.estado != 'anulada'
-    ).order_by(Factura.fecha_factura.desc()).all()
+    ).order_by(Factura.fecha_factura.desc())).all()
 
     total_ventas = sum(float(f.total) for f in facturas)
-    total_itbis = sum(float(f.itbis) for f in facturas)
-    total_descuentos = sum(float(f.descuento) for f in facturas)
+    total_itbis = sum(float(f.itbis or 0) for f in facturas)
+    total_descuentos = sum(float(f.descuento or 0) for f in facturas)
 
     # Pagos en el período
-    pagos = Pago.query.filter(
+    total_cobrado = db.session.query(func.coalesce(func.sum(Pago.monto), 0)).filter(
         Pago.fecha_pago >= fecha_inicio_dt,
         Pago.fecha_pago <= fecha_fin_dt
-    ).all()
-
-    total_cobrado = sum(float(p.monto) for p in pagos)
+    ).scalar()
 
     return jsonify({
         'periodo': {
@@ -198,7 +126,7 @@ def reporte_ventas():
             'total_ventas': total_ventas,
             'total_itbis': total_itbis,
             'total_descuentos': total_descuentos,
-            'total_cobrado': total_cobrado,
+            'total_cobrado': float(total_cobrado),
             'cantidad_facturas': len(facturas)
         },
         'facturas': [{
@@ -206,7 +134,7 @@ def reporte_ventas():
             'numero': f.numero_factura,
             'ncf': f.ncf,
             'fecha': f.fecha_factura.isoformat(),
-            'paciente': f"{f.paciente.nombre} {f.paciente.apellido}" if f.paciente else 'N/A',
+            'paciente': f.paciente or 'N/A',
             'total': float(f.total),
             'estado': f.estado
         } for f in facturas]
@@ -215,43 +143,35 @@ def reporte_ventas():
 
 @bp.route('/cuentas-por-cobrar', methods=['GET'])
 @jwt_required()
+@cached(tags=('facturas', 'pagos', 'pacientes'))
+@presupuesto_consultas(1)
 def cuentas_por_cobrar():
     """Reporte de cuentas por cobrar"""
-    facturas = Factura.query.filter(
-        Factura.estado.in_(['pendiente', 'parcial'])
-    ).order_by(Factura.fecha_factura.asc()).all()
-
-    resultado = []
-    total_por_cobrar = 0
-
-    for f in facturas:
-        pagado = sum(float(p.monto) for p in f.pagos)
-        saldo = float(f.total) - pagado
-        dias_vencido = 0
-
-        if f.fecha_vencimiento:
-            dias_vencido = (datetime.now().date() - f.fecha_vencimiento).days
-            if dias_vencido < 0:
-                dias_vencido = 0
-
-        total_por_cobrar += saldo
-
-        resultado.append({
-            'factura_id': f.id,
-            'numero_factura': f.numero_factura,
-            'paciente': f"{f.paciente.nombre} {f.paciente.apellido}" if f.paciente else 'N/A',
-            'paciente_telefono': f.paciente.telefono if f.paciente else None,
-            'fecha_factura': f.fecha_factura.isoformat(),
-            'fecha_vencimiento': f.fecha_vencimiento.isoformat() if f.fecha_vencimiento else None,
-            'total': float(f.total),
-            'pagado': pagado,
-            'saldo': saldo,
-            'dias_vencido': dias_vencido,
-            'estado': 'vencida' if dias_vencido > 0 else f.estado
-        })
+    stmt = _consulta_cuentas_por_cobrar()
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'cuentas_por_cobrar', [
+            'factura_id', 'numero_factura', 'paciente', 'paciente_telefono', 'fecha_factura',
+            'fecha_vencimiento', 'total', 'pagado', 'saldo', 'dias_vencido', 'estado'
+        ], stmt)
+
+    resultado = [{
+        'factura_id': f.id,
+        'numero_factura': f.numero_factura,
+        'paciente': f.paciente or 'N/A',
+        'paciente_telefono': f.telefono,
+        'fecha_factura': f.fecha_factura.isoformat(),
+        'fecha_vencimiento': f.fecha_vencimiento.isoformat() if f.fecha_vencimiento else None,
+        'total': float(f.total),
+        'pagado': float(f.pagado),
+        'saldo': float(f.saldo),
+        'dias_vencido': int(f.dias_vencido),
+        'estado': f.estado
+    } for f in db.session.execute(stmt)]
 
     return jsonify({
-        'total_por_cobrar': total_por_cobrar,
+        'total_por_cobrar': sum(c['saldo'] for c in resultado),
         'cantidad': len(resultado),
         'cuentas': resultado
     })
@@ -259,6 +179,8 @@ def cuentas_por_cobrar():
 
 @bp.route('/estudios-realizados', methods=['GET'])
 @jwt_required()
+@cached(tags=('ordenes', 'estudios'))
+@presupuesto_consultas(1)
 def estudios_realizados():
     """Reporte de estudios realizados"""
     fecha_inicio = request.args.get('fecha_inicio')
@@ -274,7 +196,7 @@ def estudios_realizados():
     else:
         fecha_fin_dt = datetime.fromisoformat(fecha_fin)
 
-    estudios = db.session.query(
+    consulta = db.session.query(
         Estudio.codigo,
         Estudio.nombre,
         func.count(OrdenDetalle.id).label('cantidad'),
@@ -290,7 +212,14 @@ def estudios_realizados():
         Estudio.codigo, Estudio.nombre
     ).order_by(
         func.count(OrdenDetalle.id).desc()
-    ).all()
+    )
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'estudios_realizados',
+                         ['codigo', 'nombre', 'cantidad', 'total_facturado'], consulta.statement)
+
+    estudios = consulta.all()
 
     return jsonify({
         'periodo': {
@@ -309,6 +238,8 @@ def estudios_realizados():
 
 @bp.route('/contabilidad', methods=['GET'])
 @jwt_required()
+@cached(tags=('facturas', 'pagos', 'ordenes'))
+@presupuesto_consultas(5)
 def contabilidad():
     """Reporte de contabilidad por período"""
     from flask_jwt_extended import get_jwt_identity
@@ -342,59 +273,76 @@ def contabilidad():
 
     fecha_fin = hoy
 
-    # Ingresos (pagos recibidos)
-    pagos = Pago.query.filter(
-        func.date(Pago.fecha_pago) >= fecha_inicio,
-        func.date(Pago.fecha_pago) <= fecha_fin
-    ).all()
-
-    total_ingresos = sum(float(p.monto) for p in pagos)
-
-    # Por método de pago
+    formato = request.args.get('formato')
+    if formato:
+        # Detalle de los pagos del período (el resumen es una sola fila)
+        stmt = select(
+            Pago.id, Pago.fecha_pago, Factura.numero_factura, Factura.ncf, _nombre_paciente(),
+            Pago.metodo_pago, Pago.referencia, Pago.monto
+        ).outerjoin(Factura, Factura.id == Pago.factura_id).outerjoin(
+            Paciente, Paciente.id == Factura.paciente_id
+        ).where(
+            Pago.fecha_pago >= datetime.combine(fecha_inicio, datetime.min.time()),
+            Pago.fecha_pago < datetime.combine(fecha_fin + timedelta(days=1), datetime.min.time())
+        ).order_by(Pago.fecha_pago, Pago.id)
+        return _exportar(formato, f'contabilidad_{periodo}', [
+            'pago_id', 'fecha_pago', 'numero_factura', 'ncf', 'paciente',
+            'metodo_pago', 'referencia', 'monto'
+        ], stmt)
+
+    desde = datetime.combine(fecha_inicio, datetime.min.time())
+    hasta = datetime.combine(fecha_fin + timedelta(days=1), datetime.min.time())
+
+    # Ingresos (pagos recibidos), por método de pago
     pagos_por_metodo = db.session.query(
         Pago.metodo_pago,
         func.sum(Pago.monto).label('total'),
         func.count(Pago.id).label('cantidad')
     ).filter(
-        func.date(Pago.fecha_pago) >= fecha_inicio,
-        func.date(Pago.fecha_pago) <= fecha_fin
+        Pago.fecha_pago >= desde,
+        Pago.fecha_pago < hasta
     ).group_by(Pago.metodo_pago).all()
 
+    total_ingresos = sum(float(t or 0) for _, t, _ in pagos_por_metodo)
+    cantidad_pagos = sum(c for _, _, c in pagos_por_metodo)
+
     # Facturado
-    facturas = Factura.query.filter(
-        func.date(Factura.fecha_factura) >= fecha_inicio,
-        func.date(Factura.fecha_factura) <= fecha_fin,
+    total_facturado, cantidad_facturas = db.session.query(
+        func.coalesce(func.sum(Factura.total), 0),
+        func.count(Factura.id)
+    ).filter(
+        Factura.fecha_factura >= desde,
+        Factura.fecha_factura < hasta,
         Factura.estado != 'anulada'
-    ).all()
+    ).one()
 
-    total_facturado = sum(float(f.total) for f in facturas)
-
-    # Por cobrar
-    facturas_pendientes = Factura.query.filter(
+    # Por cobrar: saldo calculado en SQL
+    pagos_factura = _pagado_por_factura()
+    por_cobrar, facturas_pendientes = db.session.query(
+        func.coalesce(func.sum(Factura.total - func.coalesce(pagos_factura.c.pagado, 0)), 0),
+        func.count(Factura.id)
+    ).outerjoin(
+        pagos_factura, pagos_factura.c.factura_id == Factura.id
+    ).filter(
         Factura.estado.in_(['pendiente', 'parcial'])
-    ).all()
-
-    por_cobrar = 0
-    for f in facturas_pendientes:
-        pagado = sum(float(p.monto) for p in f.pagos)
-        por_cobrar += float(f.total) - pagado
+    ).one()
 
     # Órdenes
-    ordenes = Orden.query.filter(
-        func.date(Orden.fecha_orden) >= fecha_inicio,
-        func.date(Orden.fecha_orden) <= fecha_fin
-    ).count()
+    ordenes = db.session.query(func.count(Orden.id)).filter(
+        Orden.fecha_orden >= desde,
+        Orden.fecha_orden < hasta
+    ).scalar()
 
     return jsonify({
         'periodo': periodo,
         'fecha_inicio': fecha_inicio.isoformat(),
         'fecha_fin': fecha_fin.isoformat(),
         'ingresos': total_ingresos,
-        'cantidad_pagos': len(pagos),
-        'facturado': total_facturado,
-        'cantidad_facturas': len(facturas),
-        'por_cobrar': por_cobrar,
-        'facturas_pendientes': len(facturas_pendientes),
+        'cantidad_pagos': cantidad_pagos,
+        'facturado': float(total_facturado),
+        'cantidad_facturas': cantidad_facturas,
+        'por_cobrar': float(por_cobrar),
+        'facturas_pendientes': facturas_pendientes,
         'ordenes': ordenes,
         'por_metodo': [
             {'metodo': m, 'total': float(t), 'cantidad': c}
@@ -405,6 +353,8 @@ def contabilidad():
 
 @bp.route('/por-doctor', methods=['GET'])
 @jwt_required()
+@cached(tags=('ordenes',))
+@presupuesto_consultas(1)
 def reporte_por_doctor():
     """Reporte de órdenes/estudios por médico referente"""
     fecha_inicio = request.args.get('fecha_inicio')
@@ -415,7 +365,7 @@ def reporte_por_doctor():
     if not fecha_fin:
         fecha_fin = datetime.now().strftime('%Y-%m-%d')
     
-    resultado = db.session.query(
+    consulta = db.session.query(
         Orden.medico_referente,
         func.count(Orden.id).label('total_ordenes'),
         func.sum(
@@ -429,7 +379,13 @@ def reporte_por_doctor():
         Orden.fecha_orden <= fecha_fin,
         Orden.medico_referente.isnot(None),
         Orden.medico_referente != ''
-    ).group_by(Orden.medico_referente).order_by(func.count(Orden.id).desc()).all()
+    ).group_by(Orden.medico_referente).order_by(func.count(Orden.id).desc())
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'por_doctor', ['medico', 'ordenes', 'facturado'], consulta.statement)
+
+    resultado = consulta.all()
     
     return jsonify({
         'periodo': {'inicio': fecha_inicio, 'fin': fecha_fin},
@@ -443,6 +399,8 @@ def reporte_por_doctor():
 
 @bp.route('/por-seguro', methods=['GET'])
 @jwt_required()
+@cached(tags=('facturas', 'pacientes'))
+@presupuesto_consultas(1)
 def reporte_por_seguro():
     """Reporte de pacientes/facturación por seguro médico"""
     fecha_inicio = request.args.get('fecha_inicio')
@@ -453,7 +411,7 @@ def reporte_por_seguro():
     if not fecha_fin:
         fecha_fin = datetime.now().strftime('%Y-%m-%d')
     
-    resultado = db.session.query(
+    consulta = db.session.query(
         Paciente.seguro_medico,
         func.count(func.distinct(Factura.paciente_id)).label('pacientes'),
         func.count(Factura.id).label('facturas'),
@@ -464,7 +422,13 @@ def reporte_por_seguro():
         Factura.fecha_factura >= fecha_inicio,
         Factura.fecha_factura <= fecha_fin,
         Factura.estado != 'anulada'
-    ).group_by(Paciente.seguro_medico).order_by(func.sum(Factura.total).desc()).all()
+    ).group_by(Paciente.seguro_medico).order_by(func.sum(Factura.total).desc())
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'por_seguro', ['seguro', 'pacientes', 'facturas', 'total'], consulta.statement)
+
+    resultado = consulta.all()
     
     return jsonify({
         'periodo': {'inicio': fecha_inicio, 'fin': fecha_fin},
@@ -479,6 +443,8 @@ def reporte_por_seguro():
 
 @bp.route('/estudios-detallado', methods=['GET'])
 @jwt_required()
+@cached(tags=('ordenes', 'estudios'))
+@presupuesto_consultas(1)
 def reporte_estudios_detallado():
     """Reporte detallado de estudios realizados"""
     fecha_inicio = request.args.get('fecha_inicio')
@@ -511,9 +477,17 @@ def reporte_estudios_detallado():
     if categoria_id:
         query = query.filter(Estudio.categoria_id == categoria_id)
     
-    resultado = query.group_by(
+    query = query.group_by(
         Estudio.codigo, Estudio.nombre, CategoriaEstudio.nombre
-    ).order_by(func.count(OrdenDetalle.id).desc()).all()
+    ).order_by(func.count(OrdenDetalle.id).desc())
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'estudios_detallado', [
+            'codigo', 'nombre', 'categoria', 'cantidad', 'total', 'precio_promedio'
+        ], query.statement)
+
+    resultado = query.all()
     
     return jsonify({
         'periodo': {'inicio': fecha_inicio, 'fin': fecha_fin},
@@ -530,22 +504,30 @@ def reporte_estudios_detallado():
 
 @bp.route('/ingresos-diarios', methods=['GET'])
 @jwt_required()
+@cached(tags=('pagos',))
+@presupuesto_consultas(1)
 def reporte_ingresos_diarios():
     """Reporte de ingresos día por día"""
     dias = request.args.get('dias', 30, type=int)
     dias = min(dias, 365)  # Máximo un año
     
     fecha_inicio = datetime.now().date() - timedelta(days=dias)
+    # type_=Date: el resultado llega como date también en SQLite (tests)
+    dia = func.date(Pago.fecha_pago, type_=Date)
     
-    resultado = db.session.query(
-        func.date(Pago.fecha_pago).label('fecha'),
+    consulta = db.session.query(
+        dia.label('fecha'),
         func.sum(Pago.monto).label('total'),
         func.count(Pago.id).label('cantidad')
     ).filter(
-        func.date(Pago.fecha_pago) >= fecha_inicio
-    ).group_by(
-        func.date(Pago.fecha_pago)
-    ).order_by(func.date(Pago.fecha_pago)).all()
+        dia >= fecha_inicio
+    ).group_by(dia).order_by(dia)
+
+    formato = request.args.get('formato')
+    if formato:
+        return _exportar(formato, 'ingresos_diarios', ['fecha', 'total', 'cantidad'], consulta.statement)
+
+    resultado = consulta.all()
     
     return jsonify({
         'dias': dias,
@@ -1,22 +1,26 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-import psycopg2
-import os
+from app.db_pool import get_db_connection
+from app.utils.pagination import validate_cursor_params, keyset_rows, keyset_sql, valores_cursor, respuesta_paginada
+from app.services.ingesta_resultados import IngestaResultados
 import json
 
 bp = Blueprint('resultados', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def listar_resultados():
+    posicion, limite, _ = validate_cursor_params()
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        cur.execute("""
+
+        orden, despues = keyset_sql('r.fecha_importacion', 'r.id')
+        filtro, params = '', []
+        if posicion is not None:
+            filtro, params = f'WHERE {despues}', valores_cursor(posicion)
+
+        cur.execute(f"""
             SELECT 
                 r.id, 
                 r.tipo_archivo, 
@@ -30,12 +34,14 @@ def listar_resultados():
             LEFT JOIN orden_detalles od ON r.orden_detalle_id = od.id
             LEFT JOIN ordenes o ON od.orden_id = o.id
             LEFT JOIN pacientes p ON o.paciente_id = p.id
-            ORDER BY r.fecha_importacion DESC
-            LIMIT 50
-        """)
+            {filtro}
+            ORDER BY {orden}
+            LIMIT %s
+        """, params + [limite + 1])
         
+        filas, siguiente = keyset_rows(cur.fetchall(), limite, 3, 0)
         resultados = []
-        for row in cur.fetchall():
+        for row in filas:
             resultados.append({
                 'id': row[0],
                 'tipo_archivo': row[1] or 'pdf',
@@ -49,7 +55,7 @@ def listar_resultados():
         
         cur.close()
         conn.close()
-        return jsonify({'resultados': resultados}), 200
+        return jsonify(respuesta_paginada('resultados', resultados, siguiente, limite=limite)), 200
     except Exception as e:
         return jsonify({'error': str(e), 'resultados': []}), 500
 
@@ -130,3 +136,60 @@ def ver_resultado(resultado_id):
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sin-asignar', methods=['GET'])
+@jwt_required()
+def listar_sin_asignar():
+    """Resultados de equipos recibidos sin orden (ver database/resultados_sin_asignar.sql)"""
+    posicion, limite, _ = validate_cursor_params()
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        orden, despues = keyset_sql('r.fecha_importacion', 'r.id')
+        filtro, params = '', []
+        if posicion is not None:
+            filtro, params = f'AND {despues}', valores_cursor(posicion)
+
+        cur.execute(f"""
+            SELECT r.id, r.tipo_archivo, r.nombre_archivo, r.fecha_importacion,
+                   r.orden_referencia, r.paciente_referencia, r.estacion
+            FROM resultados r
+            WHERE r.orden_detalle_id IS NULL {filtro}
+            ORDER BY {orden}
+            LIMIT %s
+        """, params + [limite + 1])
+
+        filas, siguiente = keyset_rows(cur.fetchall(), limite, 3, 0)
+        resultados = [{
+            'id': row[0],
+            'tipo_archivo': row[1],
+            'nombre_archivo': row[2],
+            'fecha': row[3].isoformat() if row[3] else None,
+            'orden_referencia': row[4],
+            'paciente_referencia': row[5],
+            'estacion': row[6]
+        } for row in filas]
+
+        cur.close()
+        conn.close()
+        return jsonify(respuesta_paginada('resultados', resultados, siguiente, limite=limite)), 200
+    except Exception as e:
+        return jsonify({'error': str(e), 'resultados': []}), 500
+
+
+@bp.route('/<int:resultado_id>/asignar', methods=['PUT'])
+@jwt_required()
+def asignar_resultado(resultado_id):
+    """Asignar un resultado sin orden. Body: {orden_id} (id o número de orden)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        detalle_id = IngestaResultados.asignar(resultado_id, data.get('orden_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'resultado_id': resultado_id, 'orden_detalle_id': detalle_id}), 200
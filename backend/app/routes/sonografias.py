@@ -1,13 +1,11 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required
-import psycopg2
+from app.db_pool import get_db_connection
+from app.services.dicom_render import DicomRender, FORMATOS
 import os
 
 bp = Blueprint('sonografias', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def listar_sonografias():
@@ -35,3 +33,39 @@ def listar_sonografias():
 def listar_tipos():
     tipos = ['Sonografía Abdominal', 'Sonografía Pélvica', 'Sonografía Obstétrica']
     return jsonify(tipos), 200
+
+@bp.route('/<int:sonografia_id>/imagenes/<int:indice>', methods=['GET'])
+@jwt_required()
+def imagen_sonografia(sonografia_id, indice):
+    """
+    Imagen `indice` de la sonografía renderizada desde su DICOM (mismos
+    parámetros que /api/radiografias/<id>/imagen), desde la caché de disco
+    con la ventana por defecto.
+    """
+    try:
+        params = DicomRender.parametros(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT imagenes FROM sonografias WHERE id = %s", (sonografia_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        if not row:
+            return jsonify({'error': 'Sonografía no encontrada'}), 404
+        imagenes = row[0] or []
+        if not 0 <= indice < len(imagenes):
+            return jsonify({'error': 'Imagen no encontrada'}), 404
+        ruta = imagenes[indice]
+        if isinstance(ruta, dict):
+            ruta = ruta.get('ruta') or ruta.get('path')
+        if not ruta or not os.path.isfile(ruta):
+            return jsonify({'error': 'La imagen no tiene un archivo DICOM'}), 404
+        archivo = DicomRender.renderizar(ruta, **params)
+        return send_file(archivo, mimetype=FORMATOS[params['formato']][1], max_age=86400, conditional=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services.cola_trabajos import ColaTrabajos, PRIORIDAD_URGENTE
+import os
+
+bp = Blueprint('trabajos', __name__)
+
+
+def respuesta_encolado(trabajo_id, mensaje='Trabajo en cola'):
+    """Respuesta 202 de las rutas que encolan: el cliente consulta /api/trabajos/<id>."""
+    return jsonify({
+        'success': True,
+        'message': mensaje,
+        'trabajo_id': trabajo_id,
+        'estado': 'pendiente',
+        'url': f'/api/trabajos/{trabajo_id}'
+    }), 202, {'Location': f'/api/trabajos/{trabajo_id}'}
+
+
+def _enviar_archivo(trabajo):
+    resultado = trabajo.get('resultado') or {}
+    ruta = resultado.get('archivo')
+    if not ruta:
+        return jsonify({'error': 'El trabajo no generó un archivo'}), 404
+    if not os.path.isfile(ruta):
+        return jsonify({'error': 'El archivo ya no está disponible; vuelva a solicitarlo'}), 410
+    return send_file(ruta, mimetype=resultado.get('mimetype'), as_attachment=True,
+                     download_name=resultado.get('nombre') or os.path.basename(ruta))
+
+
+def encolar_documento(tipo, datos, tabla, registro_id, mensaje, vigente_desde=None):
+    """
+    POST de las rutas de documentos (PDFs, tickets, etiquetas): reutiliza el
+    trabajo vigente del registro o encola uno nuevo. 200 con la descarga si
+    el documento ya está generado, 202 si está en cola.
+    """
+    trabajo_id = ColaTrabajos.encolar(
+        tipo, datos, tabla=tabla, registro_id=registro_id, prioridad=PRIORIDAD_URGENTE,
+        solicitado_por=get_jwt_identity(), reutilizar=True, vigente_desde=vigente_desde
+    )
+    trabajo = ColaTrabajos.obtener(trabajo_id)
+    if trabajo and trabajo['estado'] == 'completado':
+        return jsonify({
+            'success': True,
+            'message': mensaje,
+            'trabajo_id': trabajo_id,
+            'estado': 'completado',
+            'url': f'/api/trabajos/{trabajo_id}',
+            'descarga': f'/api/trabajos/{trabajo_id}/archivo'
+        }), 200
+    return respuesta_encolado(trabajo_id, mensaje)
+
+
+def descargar_documento(tipo, datos, tabla, registro_id, vigente_desde=None):
+    """
+    GET de las rutas de documentos: el archivo del trabajo vigente si ya
+    terminó, 202 con su estado si sigue en cola, 404 si nadie lo pidió (o
+    el registro cambió después): se solicita con POST a la misma ruta.
+    """
+    trabajo = ColaTrabajos.documento(tipo, datos, tabla, registro_id, vigente_desde)
+    if trabajo is None:
+        return jsonify({'error': 'Documento no generado; solicítelo con POST a esta misma ruta'}), 404
+    if trabajo['estado'] == 'completado':
+        return _enviar_archivo(trabajo)
+    respuesta, codigo, cabeceras = respuesta_encolado(trabajo['id'], 'Documento en preparación')
+    return respuesta, codigo, dict(cabeceras, **{'Retry-After': '2'})
+
+
+@bp.route('/', methods=['GET'])
+@jwt_required()
+def listar_trabajos():
+    """Últimos trabajos (?estado=muerto para la dead-letter, ?tipo=) y totales por estado"""
+    limite = min(request.args.get('limite', 100, type=int), 500)
+    return jsonify(ColaTrabajos.listar(request.args.get('estado'), request.args.get('tipo'), limite)), 200
+
+
+@bp.route('/<int:trabajo_id>', methods=['GET'])
+@jwt_required()
+def estado_trabajo(trabajo_id):
+    trabajo = ColaTrabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    resultado = trabajo.get('resultado') or {}
+    if trabajo['estado'] == 'completado' and resultado.get('archivo'):
+        trabajo['descarga'] = f'/api/trabajos/{trabajo_id}/archivo'
+    return jsonify(trabajo), 200
+
+
+@bp.route('/<int:trabajo_id>/archivo', methods=['GET'])
+@jwt_required()
+def archivo_trabajo(trabajo_id):
+    """Archivo generado por el trabajo (PDF de factura, ticket, etiqueta...)"""
+    trabajo = ColaTrabajos.obtener(trabajo_id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if trabajo['estado'] != 'completado':
+        return jsonify({'error': 'El trabajo no ha terminado', 'estado': trabajo['estado']}), 409
+    return _enviar_archivo(trabajo)
+
+
+@bp.route('/<int:trabajo_id>/reintentar', methods=['POST'])
+@jwt_required()
+def reintentar_trabajo(trabajo_id):
+    """Devuelve a la cola un trabajo muerto (dead-letter)"""
+    if not ColaTrabajos.reintentar(trabajo_id):
+        return jsonify({'error': 'Solo se pueden reintentar trabajos muertos o con error'}), 409
+    return jsonify({'success': True, 'trabajo_id': trabajo_id, 'estado': 'pendiente'}), 200
@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from app.models import Paciente
+from app.services.campanas_whatsapp import CampanasWhatsApp, TASA_MINIMA
 from app.services.whatsapp_service import WhatsAppService
+from datetime import datetime
 
 bp = Blueprint('whatsapp', __name__)
 
@@ -18,28 +18,87 @@ def enviar_mensaje():
 @bp.route('/campana', methods=['POST'])
 @jwt_required()
 def crear_campana():
-    """Crear campaña de WhatsApp"""
-    try:
-        datos = request.get_json()
-        
-        # Obtener pacientes según filtros
-        query = Paciente.query.filter_by(estado='activo')
-        
-        if datos.get('filtro_ciudad'):
-            query = query.filter_by(ciudad=datos['filtro_ciudad'])
-        
-        pacientes = query.all()
-        
-        # Enviar campaña
-        ws = WhatsAppService()
-        resultados = ws.enviar_campana(pacientes, datos['mensaje'])
-        
-        return jsonify({
-            'success': True,
-            'resultados': resultados
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    """
+    Crear campaña de WhatsApp. Se envía en segundo plano (worker.py);
+    el progreso se consulta en /api/whatsapp/campanas/<id>.
+    """
+    datos = request.get_json() or {}
+    if not datos.get('mensaje'):
+        return jsonify({'success': False, 'error': 'mensaje es requerido'}), 400
+    tasa = datos.get('tasa')
+    if tasa is not None and not (isinstance(tasa, (int, float)) and TASA_MINIMA <= tasa <= 1000):
+        return jsonify({'success': False, 'error': f'tasa debe ser mensajes/segundo entre {TASA_MINIMA} y 1000'}), 400
+
+    campana_id, total, trabajo_id = CampanasWhatsApp.crear(
+        datos.get('nombre') or f"Campaña {datetime.now():%Y-%m-%d %H:%M}",
+        datos['mensaje'],
+        ciudad=datos.get('filtro_ciudad'),
+        tasa=tasa,
+        creada_por=get_jwt_identity()
+    )
+    url = f'/api/whatsapp/campanas/{campana_id}'
+    return jsonify({
+        'success': True,
+        'campana_id': campana_id,
+        'total': total,
+        'trabajo_id': trabajo_id,
+        'estado': 'pendiente',
+        'url': url
+    }), 202, {'Location': url}
+
+
+@bp.route('/campanas', methods=['GET'])
+@jwt_required()
+def listar_campanas():
+    limite = min(request.args.get('limite', 50, type=int), 200)
+    return jsonify({'campanas': CampanasWhatsApp.listar(limite)})
+
+
+@bp.route('/campanas/<int:campana_id>', methods=['GET'])
+@jwt_required()
+def progreso_campana(campana_id):
+    """Progreso en vivo: envíos por estado, porcentaje, mensajes/segundo y tiempo restante"""
+    progreso = CampanasWhatsApp.progreso(campana_id)
+    if progreso is None:
+        return jsonify({'error': 'Campaña no encontrada'}), 404
+    return jsonify(progreso)
+
+
+@bp.route('/campanas/<int:campana_id>/envios', methods=['GET'])
+@jwt_required()
+def envios_campana(campana_id):
+    """Detalle por destinatario (?estado=fallido, ?despues_de=<id> para la siguiente página)"""
+    limite = min(request.args.get('limite', 100, type=int), 500)
+    return jsonify(CampanasWhatsApp.envios(
+        campana_id, request.args.get('estado'), request.args.get('despues_de', 0, type=int), limite
+    ))
+
+
+@bp.route('/campanas/<int:campana_id>/pausar', methods=['POST'])
+@jwt_required()
+def pausar_campana(campana_id):
+    if not CampanasWhatsApp.pausar(campana_id):
+        return jsonify({'error': 'Solo se pueden pausar campañas pendientes o en envío'}), 409
+    return jsonify({'success': True, 'campana_id': campana_id, 'estado': 'pausada'})
+
+
+@bp.route('/campanas/<int:campana_id>/reanudar', methods=['POST'])
+@jwt_required()
+def reanudar_campana(campana_id):
+    """Continúa una campaña pausada; con reintentar_fallidos también reenvía los fallidos"""
+    datos = request.get_json(silent=True) or {}
+    trabajo_id = CampanasWhatsApp.reanudar(campana_id, bool(datos.get('reintentar_fallidos')))
+    if trabajo_id is None:
+        return jsonify({'error': 'La campaña no está pausada (o completada, con reintentar_fallidos)'}), 409
+    return jsonify({'success': True, 'campana_id': campana_id, 'trabajo_id': trabajo_id, 'estado': 'pendiente'}), 202
+
+
+@bp.route('/campanas/<int:campana_id>/cancelar', methods=['POST'])
+@jwt_required()
+def cancelar_campana(campana_id):
+    if not CampanasWhatsApp.cancelar(campana_id):
+        return jsonify({'error': 'La campaña ya terminó'}), 409
+    return jsonify({'success': True, 'campana_id': campana_id, 'estado': 'cancelada'})
 
 @bp.route('/plantillas', methods=['GET'])
 @jwt_required()
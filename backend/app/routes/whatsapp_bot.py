@@ -1,13 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-import psycopg2
-import os
+from app.db_pool import get_db_connection
 
 bp = Blueprint('whatsapp_bot', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
-
 @bp.route('/historial', methods=['GET'])
 @jwt_required()
 def historial_mensajes():
@@ -0,0 +1,326 @@
+"""
+Subida por bloques reanudable de archivos de equipos (desktop-agent)
+
+El agente declara el archivo (nombre, tamaño y sha256) con iniciar() y lo
+envía en bloques con escribir(), cada uno en el offset donde terminó el
+anterior y con su propio sha256. El offset vigente es el tamaño del archivo
+parcial en disco, así una subida cortada (o un reinicio del agente o del
+servidor) continúa desde ahí. Al completarse se verifica el sha256 del
+archivo entero y se guarda por contenido: si ya se recibió el mismo archivo
+no se vuelve a transferir. La memoria usada no depende del tamaño del
+archivo: los bloques se copian al disco de a BUFFER bytes.
+
+El tamaño declarado no puede superar ARCHIVOS_EQUIPOS_MAX_MB, y las
+subidas sin bloques nuevos durante ARCHIVOS_EQUIPOS_TTL_HORAS se borran
+(fila y parcial) con limpiar_abandonadas(), que corre en worker.py.
+"""
+from app.db_pool import get_db_connection
+from flask import current_app
+import hashlib
+import os
+import re
+import time
+
+MAX_BLOQUE = 8 * 1024 * 1024
+BUFFER = 1024 * 1024
+
+_UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ErrorSubida(Exception):
+    """Error de la subida con el código HTTP y el offset vigente para reanudar."""
+
+    def __init__(self, mensaje, codigo=400, offset=None):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.offset = offset
+
+
+def _carpeta(*partes):
+    carpeta = os.path.join(current_app.config.get('ARCHIVOS_EQUIPOS_FOLDER') or os.path.join(
+        current_app.config['UPLOAD_FOLDER'], 'archivos_equipos'), *partes)
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def _parcial(upload_id):
+    return os.path.join(_carpeta('parciales'), f'{upload_id}.part')
+
+
+def _tamano(ruta):
+    try:
+        return os.path.getsize(ruta)
+    except FileNotFoundError:
+        return 0
+
+
+def _modificado(ruta):
+    try:
+        return os.path.getmtime(ruta)
+    except FileNotFoundError:
+        return 0
+
+
+def _sha256(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(BUFFER), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _truncar(ruta, offset):
+    with open(ruta, 'r+b') as f:
+        f.truncate(offset)
+
+
+class ArchivosEquipos:
+
+    @staticmethod
+    def _fila(cur, upload_id):
+        cur.execute("""
+            SELECT id, upload_id, nombre, tamano, sha256, estado, ruta
+            FROM archivos_equipos WHERE upload_id = %s
+        """, (upload_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        return dict(zip(('id', 'upload_id', 'nombre', 'tamano', 'sha256', 'estado', 'ruta'), row))
+
+    @staticmethod
+    def _estado(fila):
+        completo = fila['estado'] == 'completo'
+        return {
+            'upload_id': fila['upload_id'],
+            'archivo_id': fila['id'],
+            'nombre': fila['nombre'],
+            'tamano': fila['tamano'],
+            'sha256': fila['sha256'],
+            'offset': fila['tamano'] if completo else _tamano(_parcial(fila['upload_id'])),
+            'completo': completo
+        }
+
+    @staticmethod
+    def iniciar(upload_id, nombre, tamano, sha256, estacion=None):
+        """
+        Declarar una subida (o retomarla: mismo upload_id, mismo archivo).
+
+        Si ya se recibió un archivo con el mismo sha256 y tamaño, la subida
+        queda completa sin transferir nada.
+
+        Returns:
+            Estado de la subida (ver estado())
+        """
+        upload_id = str(upload_id or '')
+        sha256 = str(sha256 or '').lower()
+        if not _UPLOAD_ID.match(upload_id):
+            raise ErrorSubida('upload_id inválido')
+        if not _SHA256.match(sha256):
+            raise ErrorSubida('sha256 inválido')
+        if not isinstance(tamano, int) or tamano < 0:
+            raise ErrorSubida('tamano inválido')
+        maximo = current_app.config.get('ARCHIVOS_EQUIPOS_MAX_MB', 2048) * 1024 * 1024
+        if tamano > maximo:
+            raise ErrorSubida(f'El archivo supera el máximo de {maximo // (1024 * 1024)} MB', 413)
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO archivos_equipos (upload_id, nombre, tamano, sha256, estacion)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (upload_id) DO NOTHING
+            """, (upload_id, os.path.basename(nombre or 'archivo')[:255], tamano, sha256, estacion))
+            fila = ArchivosEquipos._fila(cur, upload_id)
+            if fila['sha256'] != sha256 or fila['tamano'] != tamano:
+                raise ErrorSubida('upload_id ya usado con otro archivo', 409)
+
+            if fila['estado'] != 'completo':
+                cur.execute("""
+                    SELECT ruta FROM archivos_equipos
+                    WHERE sha256 = %s AND tamano = %s AND estado = 'completo' LIMIT 1
+                """, (sha256, tamano))
+                igual = cur.fetchone()
+                if igual and os.path.exists(igual[0]):
+                    cur.execute("""
+                        UPDATE archivos_equipos SET estado = 'completo', ruta = %s, completado_en = NOW()
+                        WHERE id = %s
+                    """, (igual[0], fila['id']))
+                    fila.update(estado='completo', ruta=igual[0])
+                    if os.path.exists(_parcial(upload_id)):
+                        os.remove(_parcial(upload_id))
+            conn.commit()
+            return ArchivosEquipos._estado(fila)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def estado(upload_id):
+        """Estado de la subida: offset desde donde continuar y si está completa (None si no existe)"""
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            fila = ArchivosEquipos._fila(cur, upload_id)
+            return ArchivosEquipos._estado(fila) if fila else None
+        finally:
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def escribir(upload_id, offset, stream, longitud, checksum=None):
+        """
+        Agregar un bloque de `longitud` bytes leídos de `stream` en `offset`.
+
+        Args:
+            checksum: sha256 hexadecimal del bloque (opcional); si no coincide
+                      el bloque se descarta
+
+        Returns:
+            Estado de la subida después del bloque
+
+        Raises:
+            ErrorSubida: 404 sin subida, 409 offset distinto al vigente o
+                         subida en curso desde otra conexión, 422 checksum
+        """
+        if longitud > MAX_BLOQUE:
+            raise ErrorSubida(f'Bloque mayor a {MAX_BLOQUE} bytes', 413)
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        bloqueado = False
+        try:
+            fila = ArchivosEquipos._fila(cur, upload_id)
+            if fila is None:
+                raise ErrorSubida('Subida no encontrada', 404)
+            if fila['estado'] == 'completo':
+                return ArchivosEquipos._estado(fila)
+
+            # Un solo escritor por subida (p. ej. un reintento del agente
+            # mientras la petición anterior sigue llegando)
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('archivos_equipos:' || %s))", (upload_id,))
+            bloqueado = cur.fetchone()[0]
+            conn.commit()
+            parcial = _parcial(upload_id)
+            actual = _tamano(parcial)
+            if not bloqueado:
+                raise ErrorSubida('Subida en curso desde otra conexión', 409, actual)
+            if offset != actual:
+                raise ErrorSubida(f'Offset {offset} distinto al recibido ({actual})', 409, actual)
+            if offset + longitud > fila['tamano']:
+                raise ErrorSubida('El bloque excede el tamaño declarado', 400, actual)
+
+            h = hashlib.sha256()
+            recibidos = 0
+            with open(parcial, 'ab') as f:
+                while recibidos < longitud:
+                    bloque = stream.read(min(BUFFER, longitud - recibidos))
+                    if not bloque:
+                        break
+                    h.update(bloque)
+                    f.write(bloque)
+                    recibidos += len(bloque)
+            if recibidos != longitud:
+                _truncar(parcial, offset)
+                raise ErrorSubida('Bloque incompleto', 400, offset)
+            if checksum and h.hexdigest() != checksum.lower():
+                _truncar(parcial, offset)
+                raise ErrorSubida('Checksum del bloque no coincide', 422, offset)
+
+            if offset + longitud == fila['tamano']:
+                ArchivosEquipos._completar(cur, fila, parcial)
+                conn.commit()
+            return ArchivosEquipos._estado(fila)
+        finally:
+            if bloqueado:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('archivos_equipos:' || %s))", (upload_id,))
+                conn.commit()
+            cur.close()
+            conn.close()
+
+    @staticmethod
+    def _completar(cur, fila, parcial):
+        """Verifica el sha256 del archivo entero y lo mueve a su ruta por contenido."""
+        if _sha256(parcial) != fila['sha256']:
+            os.remove(parcial)
+            raise ErrorSubida('sha256 del archivo no coincide; se debe subir de nuevo', 422, 0)
+        extension = os.path.splitext(fila['nombre'])[1].lower()
+        ruta = os.path.join(_carpeta(fila['sha256'][:2]), f"{fila['sha256']}{extension}")
+        if os.path.exists(ruta):
+            os.remove(parcial)
+        else:
+            os.replace(parcial, ruta)
+        cur.execute("""
+            UPDATE archivos_equipos SET estado = 'completo', ruta = %s, completado_en = NOW()
+            WHERE id = %s
+        """, (ruta, fila['id']))
+        fila.update(estado='completo', ruta=ruta)
+
+    @staticmethod
+    def limpiar_abandonadas(horas=None):
+        """
+        Borra las subidas incompletas sin actividad en `horas` (por defecto
+        ARCHIVOS_EQUIPOS_TTL_HORAS) y los parciales huérfanos de esa edad.
+        La actividad es la fecha de modificación del parcial, así una subida
+        larga pero viva no se corta. Si el agente vuelve, su PATCH recibe 404
+        y la subida empieza de nuevo.
+
+        Returns:
+            (filas borradas, parciales borrados)
+        """
+        horas = horas or current_app.config.get('ARCHIVOS_EQUIPOS_TTL_HORAS', 48)
+        limite = time.time() - horas * 3600
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT upload_id FROM archivos_equipos
+                WHERE estado <> 'completo' AND created_at < NOW() - make_interval(hours => %s)
+            """, (horas,))
+            viejas = [u for (u,) in cur.fetchall() if _modificado(_parcial(u)) < limite]
+            filas = 0
+            if viejas:
+                cur.execute("""
+                    DELETE FROM archivos_equipos WHERE upload_id = ANY(%s) AND estado <> 'completo'
+                """, (viejas,))
+                filas = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+        parciales = 0
+        with os.scandir(_carpeta('parciales')) as entradas:
+            for entrada in entradas:
+                if entrada.name.endswith('.part') and entrada.stat().st_mtime < limite:
+                    try:
+                        os.remove(entrada.path)
+                        parciales += 1
+                    except FileNotFoundError:
+                        pass
+        return filas, parciales
+
+    @staticmethod
+    def rutas(upload_ids):
+        """{upload_id: ruta} de las subidas completas, para la ingesta de resultados"""
+        upload_ids = [str(u) for u in upload_ids if u]
+        if not upload_ids:
+            return {}
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT upload_id, ruta FROM archivos_equipos
+                WHERE upload_id = ANY(%s) AND estado = 'completo'
+            """, (upload_ids,))
+            return dict(cur.fetchall())
+        finally:
+            cur.close()
+            conn.close()
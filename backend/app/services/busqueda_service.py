@@ -0,0 +1,155 @@
+from app import db
+from app.models import Paciente
+from sqlalchemy import or_, and_, case, literal_column, func
+from collections import defaultdict
+import re
+import threading
+import unicodedata
+
+# Términos que parecen cédula, teléfono o código de paciente
+_PATRON_IDENTIFICADOR = re.compile(r'^(PAC-?)?[\d\-\s\(\)\+]+$', re.IGNORECASE)
+_CAMPOS_INDICE = ('nombre', 'apellido', 'cedula', 'telefono', 'celular', 'email', 'codigo_paciente')
+_MAX_CANDIDATOS = 1000
+
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class _IndiceMemoria:
+    """Índice trigram en proceso para bases sin pg_trgm (config de testing)"""
+
+    def __init__(self):
+        self._docs = {}
+        self._trigramas = defaultdict(set)
+        self._cargado = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _trigramas_de(texto):
+        texto = f'  {texto} '
+        return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+    def _cargar(self):
+        columnas = [Paciente.id] + [getattr(Paciente, c) for c in _CAMPOS_INDICE]
+        for fila in db.session.query(*columnas).yield_per(1000):
+            self._agregar(fila[0], fila[1:])
+        self._cargado = True
+
+    def _agregar(self, paciente_id, valores):
+        doc = BusquedaPacientes.normalizar(' '.join(v for v in valores if v))
+        self._docs[paciente_id] = doc
+        for tri in self._trigramas_de(doc):
+            self._trigramas[tri].add(paciente_id)
+
+    def _quitar(self, paciente_id):
+        doc = self._docs.pop(paciente_id, None)
+        if doc is None:
+            return
+        for tri in self._trigramas_de(doc):
+            ids = self._trigramas.get(tri)
+            if ids:
+                ids.discard(paciente_id)
+
+    def indexar(self, paciente):
+        with self._lock:
+            if not self._cargado:
+                return
+            self._quitar(paciente.id)
+            self._agregar(paciente.id, [getattr(paciente, c, None) for c in _CAMPOS_INDICE])
+
+    def buscar(self, palabras, limite=_MAX_CANDIDATOS):
+        with self._lock:
+            if not self._cargado:
+                self._cargar()
+            candidatos = None
+            for palabra in palabras:
+                # Solo trigramas internos: los de borde exigirían inicio/fin de palabra.
+                # Palabras de menos de 3 letras se resuelven con el recorrido final.
+                tris = {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+                for tri in tris:
+                    ids = self._trigramas.get(tri, set())
+                    candidatos = set(ids) if candidatos is None else candidatos & ids
+                    if not candidatos:
+                        return []
+            if candidatos is None:
+                candidatos = set(self._docs)
+
+            puntuados = []
+            for paciente_id in candidatos:
+                doc = self._docs[paciente_id]
+                posiciones = [doc.find(p) for p in palabras]
+                if min(posiciones) < 0:
+                    continue
+                prefijos = sum(1 for p in palabras if doc.startswith(p) or f' {p}' in doc)
+                puntuados.append((-prefijos, posiciones[0], len(doc), paciente_id))
+            puntuados.sort()
+            return [p[-1] for p in puntuados[:limite]]
+
+
+class BusquedaPacientes:
+    """Búsqueda de pacientes por nombre, cédula, teléfono, email o código.
+
+    En PostgreSQL usa la columna pacientes.busqueda (database/busqueda_pacientes.sql)
+    con índice trigram; en otros motores usa un índice en memoria.
+    """
+
+    _indice = _IndiceMemoria()
+
+    @staticmethod
+    def normalizar(texto):
+        """Minúsculas, sin acentos y con espacios simples (igual que unaccent/lower)"""
+        if not texto:
+            return ''
+        texto = unicodedata.normalize('NFKD', texto)
+        texto = ''.join(c for c in texto if not unicodedata.combining(c))
+        return ' '.join(texto.lower().split())
+
+    @staticmethod
+    def _usa_postgres():
+        return db.engine.dialect.name == 'postgresql'
+
+    @classmethod
+    def indexar(cls, paciente):
+        """Actualizar el índice en memoria tras crear/editar un paciente"""
+        if not cls._usa_postgres():
+            cls._indice.indexar(paciente)
+
+    @classmethod
+    def aplicar(cls, query, termino):
+        """Filtrar una query de Paciente por el término y ordenarla por relevancia"""
+        palabras = cls.normalizar(termino).split()
+        if not palabras:
+            return query
+        if cls._usa_postgres():
+            return cls._aplicar_postgres(query, termino.strip(), palabras)
+        ids = cls._indice.buscar(palabras)
+        if not ids:
+            return query.filter(db.false())
+        orden = case({paciente_id: i for i, paciente_id in enumerate(ids)}, value=Paciente.id)
+        return query.filter(Paciente.id.in_(ids)).order_by(orden)
+
+    @staticmethod
+    def _aplicar_postgres(query, termino, palabras):
+        busqueda = literal_column('pacientes.busqueda')
+        texto = ' '.join(palabras)
+        coincide = and_(*[
+            busqueda.like(f'%{_escapar_like(p)}%', escape='\\') for p in palabras
+        ])
+
+        if _PATRON_IDENTIFICADOR.match(termino):
+            # Prefijo exacto sobre los índices varchar_pattern_ops
+            prefijo = f'{_escapar_like(termino)}%'
+            prefijo_codigo = f'{_escapar_like(termino.upper())}%'
+            es_prefijo = or_(
+                Paciente.cedula.like(prefijo, escape='\\'),
+                Paciente.telefono.like(prefijo, escape='\\'),
+                Paciente.celular.like(prefijo, escape='\\'),
+                Paciente.codigo_paciente.like(prefijo_codigo, escape='\\'),
+            )
+            return query.filter(or_(es_prefijo, coincide)).order_by(
+                case((es_prefijo, 0), else_=1),
+                func.similarity(busqueda, texto).desc()
+            )
+
+        return query.filter(coincide).order_by(func.similarity(busqueda, texto).desc())
@@ -0,0 +1,491 @@
+"""
+Campañas de WhatsApp - envío concurrente con límite de tasa y reanudable
+
+Crear una campaña copia los destinatarios a campanas_envios con un único
+INSERT ... SELECT y encola un trabajo 'campana_whatsapp' (prioridad masiva).
+El worker toma los destinatarios pendientes por lotes, los envía con un pool
+de hilos que no pasa de `tasa` mensajes por segundo entre todos, y guarda el
+resultado de cada uno a medida que llega. Cada trabajo envía como máximo
+DURACION_MAXIMA segundos y encola su continuación, así una campaña grande no
+monopoliza un hilo del worker y, si el proceso muere, la siguiente pasada
+sigue desde el último destinatario guardado.
+
+Cada lote se limita a lo que la tasa permite enviar en el tiempo que le
+queda a la pasada, así ningún lote se alarga más allá de DURACION_MAXIMA.
+Los destinatarios tomados ('enviando') llevan la hora en tomado_en y solo
+se devuelven a pendiente cuando pasaron BLOQUEO_MAXIMO segundos: son de
+una pasada que murió, no de otra que sigue enviando.
+
+Pausar o cancelar cambia el estado de la campaña; el motor lo revisa entre
+lotes.
+"""
+from app.db_pool import get_db_connection
+from app.services.cola_trabajos import ColaTrabajos, TrabajoFallido, PRIORIDAD_MASIVA, BLOQUEO_MAXIMO
+from app.services.whatsapp_service import WhatsAppService, personalizar
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from psycopg2.extras import Json, execute_values
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LOTE = 100              # destinatarios tomados por consulta
+GUARDAR_CADA = 25       # resultados por UPDATE
+DURACION_MAXIMA = 300   # segundos por trabajo (menos que BLOQUEO_MAXIMO de la cola)
+TASA_MINIMA = 0.5       # mensajes/segundo: menos no llena un lote útil en DURACION_MAXIMA
+REINTENTOS = 3          # llamadas por destinatario ante 429, 5xx o error de red
+
+ACTIVAS = ('pendiente', 'enviando')
+
+_COLUMNAS = ('id', 'nombre', 'mensaje', 'estado', 'total', 'total_enviados', 'total_fallidos', 'tasa',
+             'filtros', 'creada_por', 'created_at', 'iniciada_en', 'finalizada_en', 'segundos')
+
+
+class LimiteTasa:
+    """Reparte las llamadas a `por_segundo` como máximo entre todos los hilos."""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo else 0.0
+        self._siguiente = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(self._siguiente, ahora)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+    def frenar(self, segundos):
+        """Twilio respondió 429: ningún hilo envía durante `segundos`."""
+        with self._lock:
+            self._siguiente = max(self._siguiente, time.monotonic() + segundos)
+
+
+def _enviar_uno(servicio, limite, numero, mensaje):
+    """Envía con reintentos para errores transitorios. Devuelve (resultado, llamadas)."""
+    resultado = None
+    for intento in range(REINTENTOS):
+        limite.esperar()
+        try:
+            resultado = servicio.enviar_mensaje(numero, mensaje)
+        except Exception as e:
+            resultado = {'success': False, 'error': str(e)}
+        if resultado['success'] or not resultado.get('reintentable'):
+            break
+        if resultado.get('codigo') == 429:
+            limite.frenar(resultado.get('retry_after') or 1)
+        elif intento + 1 < REINTENTOS:
+            time.sleep(2 ** intento)
+    return resultado, intento + 1
+
+
+def enviar_concurrente(servicio, destinatarios, plantilla, limite, pool):
+    """
+    Envía la plantilla personalizada a cada (id, numero, nombre, apellido)
+    con los hilos de `pool`. Genera (id, resultado, llamadas) a medida que
+    terminan.
+    """
+    futuros = {
+        pool.submit(_enviar_uno, servicio, limite, numero, personalizar(plantilla, nombre, apellido)): envio_id
+        for envio_id, numero, nombre, apellido in destinatarios
+    }
+    for futuro in as_completed(futuros):
+        resultado, llamadas = futuro.result()
+        yield futuros[futuro], resultado, llamadas
+
+
+def _fila(row):
+    campana = dict(zip(_COLUMNAS, row))
+    segundos = campana.pop('segundos')
+    for campo in ('created_at', 'iniciada_en', 'finalizada_en'):
+        if campana[campo]:
+            campana[campo] = campana[campo].isoformat()
+    if campana['tasa'] is not None:
+        campana['tasa'] = float(campana['tasa'])
+    return campana, segundos
+
+
+class CampanasWhatsApp:
+
+    @staticmethod
+    def crear(nombre, mensaje, ciudad=None, tasa=None, creada_por=None):
+        """
+        Registra la campaña con un envío por paciente activo (opcionalmente de
+        una ciudad) y la encola.
+
+        Returns:
+            (campana_id, total de destinatarios, trabajo_id)
+        """
+        filtros = {'ciudad': ciudad} if ciudad else {}
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO campanas_whatsapp (nombre, mensaje, estado, tasa, filtros, creada_por)
+                VALUES (%s, %s, 'pendiente', %s, %s, %s)
+                RETURNING id
+            """, (nombre, mensaje, tasa, Json(filtros),
+                  str(creada_por) if creada_por is not None else None))
+            campana_id = cur.fetchone()[0]
+            cur.execute(f"""
+                INSERT INTO campanas_envios (campana_id, paciente_id, numero_telefono, estado)
+                SELECT %s, id, LEFT(numero, 20), CASE WHEN numero IS NULL THEN 'sin_numero' ELSE 'pendiente' END
+                FROM (
+                    SELECT id, COALESCE(NULLIF(TRIM(celular), ''), NULLIF(TRIM(telefono), '')) AS numero
+                    FROM pacientes
+                    WHERE estado = 'activo' {'AND ciudad = %s' if ciudad else ''}
+                ) p
+                ORDER BY id
+            """, [campana_id] + ([ciudad] if ciudad else []))
+            total = cur.rowcount
+            cur.execute("UPDATE campanas_whatsapp SET total = %s WHERE id = %s", (total, campana_id))
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return campana_id, total, CampanasWhatsApp._encolar(campana_id)
+
+    @staticmethod
+    def _encolar(campana_id):
+        """Encola el envío salvo que ya haya un trabajo de esta campaña pendiente o en curso."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id FROM sync_queue
+                WHERE tipo = 'campana_whatsapp' AND registro_id = %s AND estado IN ('pendiente', 'procesando')
+                LIMIT 1
+            """, (campana_id,))
+            row = cur.fetchone()
+            cur.close()
+        finally:
+            conn.close()
+        if row:
+            return row[0]
+        return ColaTrabajos.encolar('campana_whatsapp', {'campana_id': campana_id}, tabla='campanas_whatsapp',
+                                    registro_id=campana_id, prioridad=PRIORIDAD_MASIVA)
+
+    @staticmethod
+    def _consultar(campana_id, conn):
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {', '.join(_COLUMNAS[:-1])},
+                   EXTRACT(EPOCH FROM COALESCE(finalizada_en, CURRENT_TIMESTAMP) - iniciada_en)
+            FROM campanas_whatsapp WHERE id = %s
+        """, (campana_id,))
+        row = cur.fetchone()
+        cur.close()
+        return row
+
+    @staticmethod
+    def progreso(campana_id):
+        """
+        Estado de la campaña, conteo de envíos por estado, porcentaje,
+        mensajes/segundo y segundos estimados para terminar. None si no existe.
+        """
+        conn = get_db_connection()
+        try:
+            row = CampanasWhatsApp._consultar(campana_id, conn)
+            if row is None:
+                return None
+            cur = conn.cursor()
+            cur.execute("SELECT estado, COUNT(*) FROM campanas_envios WHERE campana_id = %s GROUP BY estado",
+                        (campana_id,))
+            por_estado = dict(cur.fetchall())
+            cur.close()
+        finally:
+            conn.close()
+
+        campana, segundos = _fila(row)
+        pendientes = por_estado.get('pendiente', 0) + por_estado.get('enviando', 0)
+        llamadas = por_estado.get('enviado', 0) + por_estado.get('fallido', 0)
+        velocidad = llamadas / float(segundos) if segundos else 0.0
+        campana.update({
+            'envios': por_estado,
+            'pendientes': pendientes,
+            'porcentaje': round(100.0 * (campana['total'] - pendientes) / campana['total'], 1)
+                          if campana['total'] else 100.0,
+            'mensajes_por_segundo': round(velocidad, 2),
+            'segundos_restantes': round(pendientes / velocidad) if velocidad and campana['estado'] in ACTIVAS
+                                  else None,
+        })
+        return campana
+
+    @staticmethod
+    def listar(limite=50):
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT {', '.join(_COLUMNAS[:-1])}, NULL
+                FROM campanas_whatsapp ORDER BY id DESC LIMIT %s
+            """, (limite,))
+            campanas = [_fila(r)[0] for r in cur.fetchall()]
+            cur.close()
+            return campanas
+        finally:
+            conn.close()
+
+    @staticmethod
+    def envios(campana_id, estado=None, despues_de=0, limite=100):
+        """Envíos de la campaña por id (?estado=fallido para ver los errores), paginados por cursor."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT e.id, e.paciente_id, p.nombre, p.apellido, e.numero_telefono, e.estado,
+                       e.mensaje_id, e.error, e.intentos, e.fecha_envio
+                FROM campanas_envios e JOIN pacientes p ON p.id = e.paciente_id
+                WHERE e.campana_id = %s AND e.id > %s {'AND e.estado = %s' if estado else ''}
+                ORDER BY e.id LIMIT %s
+            """, [campana_id, despues_de] + ([estado] if estado else []) + [limite])
+            columnas = ('id', 'paciente_id', 'nombre', 'apellido', 'numero', 'estado',
+                        'mensaje_id', 'error', 'intentos', 'fecha_envio')
+            envios = [dict(zip(columnas, r)) for r in cur.fetchall()]
+            cur.close()
+        finally:
+            conn.close()
+        for envio in envios:
+            if envio['fecha_envio']:
+                envio['fecha_envio'] = envio['fecha_envio'].isoformat()
+        return {'envios': envios, 'siguiente': envios[-1]['id'] if len(envios) == limite else None}
+
+    @staticmethod
+    def _cambiar_estado(campana_id, nuevo, desde, sql_envios=None):
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE campanas_whatsapp
+                SET estado = %s, finalizada_en = CASE WHEN %s = 'cancelada' THEN CURRENT_TIMESTAMP END
+                WHERE id = %s AND estado = ANY(%s)
+            """, (nuevo, nuevo, campana_id, list(desde)))
+            ok = cur.rowcount == 1
+            if ok and sql_envios:
+                cur.execute(sql_envios, (campana_id,))
+            conn.commit()
+            cur.close()
+            return ok
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def pausar(campana_id):
+        """El motor se detiene al terminar el lote en curso."""
+        return CampanasWhatsApp._cambiar_estado(campana_id, 'pausada', ACTIVAS)
+
+    @staticmethod
+    def cancelar(campana_id):
+        return CampanasWhatsApp._cambiar_estado(
+            campana_id, 'cancelada', ACTIVAS + ('pausada',),
+            "UPDATE campanas_envios SET estado = 'cancelado' WHERE campana_id = %s AND estado = 'pendiente'"
+        )
+
+    @staticmethod
+    def reanudar(campana_id, reintentar_fallidos=False):
+        """
+        Vuelve a encolar una campaña pausada. Con reintentar_fallidos también
+        una completada, devolviendo sus envíos fallidos a pendiente.
+
+        Returns:
+            trabajo_id, o None si la campaña no estaba en un estado reanudable
+        """
+        desde = ('pausada', 'completada') if reintentar_fallidos else ('pausada',)
+        sql_fallidos = """
+            WITH reintentos AS (
+                UPDATE campanas_envios SET estado = 'pendiente', error = NULL
+                WHERE campana_id = %(id)s AND estado = 'fallido'
+                RETURNING 1
+            )
+            UPDATE campanas_whatsapp SET total_fallidos = total_fallidos - (SELECT COUNT(*) FROM reintentos)
+            WHERE id = %(id)s
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE campanas_whatsapp SET estado = 'pendiente', finalizada_en = NULL
+                WHERE id = %s AND estado = ANY(%s)
+            """, (campana_id, list(desde)))
+            if cur.rowcount != 1:
+                conn.rollback()
+                return None
+            if reintentar_fallidos:
+                cur.execute(sql_fallidos, {'id': campana_id})
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return CampanasWhatsApp._encolar(campana_id)
+
+    # =====================
+    # MOTOR (worker)
+    # =====================
+
+    @staticmethod
+    def enviar(campana_id, duracion_maxima=DURACION_MAXIMA):
+        """
+        Una pasada del envío: lotes de LOTE destinatarios hasta terminar,
+        hasta que la pausen/cancelen o hasta duracion_maxima segundos, en
+        cuyo caso encola la continuación.
+
+        Returns:
+            progreso de la campaña al terminar la pasada
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE campanas_whatsapp
+                SET estado = 'enviando', iniciada_en = COALESCE(iniciada_en, CURRENT_TIMESTAMP)
+                WHERE id = %s AND estado = ANY(%s)
+                RETURNING mensaje, tasa
+            """, (campana_id, list(ACTIVAS)))
+            row = cur.fetchone()
+            if row:
+                # Una pasada anterior murió con estos tomados: se envían de nuevo
+                cur.execute("""
+                    UPDATE campanas_envios SET estado = 'pendiente', tomado_en = NULL
+                    WHERE campana_id = %s AND estado = 'enviando'
+                      AND (tomado_en IS NULL OR tomado_en < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                """, (campana_id, BLOQUEO_MAXIMO))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        if row is None:
+            progreso = CampanasWhatsApp.progreso(campana_id)
+            if progreso is None:
+                raise TrabajoFallido(f'Campaña {campana_id} no encontrada')
+            return progreso
+
+        plantilla, tasa = row
+        tasa = max(float(tasa or current_app.config.get('WHATSAPP_TASA', 10)), TASA_MINIMA)
+        hilos = int(current_app.config.get('WHATSAPP_HILOS', 8))
+        servicio = WhatsAppService(conexiones=hilos)
+        if servicio.session is None:
+            raise TrabajoFallido('Twilio no configurado')
+
+        limite = LimiteTasa(tasa)
+        inicio = time.monotonic()
+        try:
+            with ThreadPoolExecutor(hilos, thread_name_prefix=f'campana-{campana_id}') as pool:
+                while time.monotonic() - inicio < duracion_maxima:
+                    restante = duracion_maxima - (time.monotonic() - inicio)
+                    lote = CampanasWhatsApp._tomar_lote(campana_id, max(1, min(LOTE, int(tasa * restante))))
+                    if not lote:
+                        break
+                    resultados = []
+                    for envio_id, resultado, llamadas in enviar_concurrente(servicio, lote, plantilla, limite, pool):
+                        resultados.append((
+                            envio_id,
+                            'enviado' if resultado['success'] else 'fallido',
+                            resultado.get('message_id'),
+                            None if resultado['success'] else str(resultado.get('error'))[:1000],
+                            llamadas,
+                        ))
+                        if len(resultados) >= GUARDAR_CADA:
+                            CampanasWhatsApp._guardar(campana_id, resultados)
+                            resultados = []
+                    CampanasWhatsApp._guardar(campana_id, resultados)
+        finally:
+            servicio.close()
+
+        progreso = CampanasWhatsApp._cerrar_pasada(campana_id)
+        logger.info('Campaña %s: %s%% (%s enviados, %s fallidos, %.1f msg/s)', campana_id, progreso['porcentaje'],
+                    progreso['total_enviados'], progreso['total_fallidos'], progreso['mensajes_por_segundo'])
+        return progreso
+
+    @staticmethod
+    def _tomar_lote(campana_id, limite=LOTE):
+        """Marca como 'enviando' el siguiente lote, si la campaña sigue activa."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE campanas_envios e
+                SET estado = 'enviando', tomado_en = CURRENT_TIMESTAMP
+                FROM pacientes p
+                WHERE p.id = e.paciente_id AND e.id IN (
+                    SELECT id FROM campanas_envios
+                    WHERE campana_id = %s AND estado = 'pendiente'
+                      AND EXISTS (SELECT 1 FROM campanas_whatsapp WHERE id = %s AND estado = ANY(%s))
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING e.id, e.numero_telefono, p.nombre, p.apellido
+            """, (campana_id, campana_id, list(ACTIVAS), limite))
+            lote = cur.fetchall()
+            conn.commit()
+            cur.close()
+            return lote
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _guardar(campana_id, resultados):
+        """Guarda (id, estado, mensaje_id, error, llamadas) y actualiza los contadores de la campaña."""
+        if not resultados:
+            return
+        enviados = sum(1 for r in resultados if r[1] == 'enviado')
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            execute_values(cur, """
+                UPDATE campanas_envios e
+                SET estado = v.estado, mensaje_id = v.mensaje_id, error = v.error,
+                    intentos = e.intentos + v.llamadas, fecha_envio = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, estado, mensaje_id, error, llamadas)
+                WHERE e.id = v.id
+            """, resultados, template='(%s, %s, %s::varchar, %s::text, %s)')
+            cur.execute("""
+                UPDATE campanas_whatsapp
+                SET total_enviados = total_enviados + %s, total_fallidos = total_fallidos + %s
+                WHERE id = %s
+            """, (enviados, len(resultados) - enviados, campana_id))
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _cerrar_pasada(campana_id):
+        """Marca la campaña completada si no quedan pendientes, o encola la siguiente pasada."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE campanas_whatsapp SET estado = 'completada', finalizada_en = CURRENT_TIMESTAMP
+                WHERE id = %s AND estado = ANY(%s) AND NOT EXISTS (
+                    SELECT 1 FROM campanas_envios WHERE campana_id = %s AND estado IN ('pendiente', 'enviando')
+                )
+            """, (campana_id, list(ACTIVAS), campana_id))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        progreso = CampanasWhatsApp.progreso(campana_id)
+        if progreso['estado'] in ACTIVAS and progreso['pendientes']:
+            # No pasa por _encolar: el trabajo de esta pasada todavía figura 'procesando'.
+            # Si solo quedan tomados por otra pasada se espera a que venzan
+            ColaTrabajos.encolar('campana_whatsapp', {'campana_id': campana_id}, tabla='campanas_whatsapp',
+                                 registro_id=campana_id, prioridad=PRIORIDAD_MASIVA,
+                                 retraso=0 if progreso['envios'].get('pendiente') else BLOQUEO_MAXIMO)
+        return progreso
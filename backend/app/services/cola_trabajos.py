@@ -0,0 +1,359 @@
+"""
+Cola de trabajos en segundo plano sobre la tabla sync_queue (PostgreSQL)
+
+Las rutas encolan el trabajo y responden 202 con su id; backend/worker.py
+los ejecuta fuera de gunicorn. Cada worker toma filas con
+FOR UPDATE SKIP LOCKED, así varios procesos comparten la cola sin tomar
+dos veces el mismo trabajo. Un trabajo que falla vuelve a la cola con
+espera exponencial y, al agotar max_intentos, queda en estado 'muerto'
+(dead-letter) hasta que alguien lo reintente a mano.
+
+Los tipos de trabajo se registran con @trabajo('nombre') en
+app/services/trabajos.py.
+
+Los documentos (PDFs de facturas, tickets, etiquetas) se encolan con
+reutilizar=True: si ya hay un trabajo pendiente para el mismo registro, o
+uno completado posterior a la última modificación cuyo archivo sigue en
+disco, se devuelve ese en vez de generar otro.
+"""
+from app.db_pool import get_db_connection
+from psycopg2.extras import Json
+import importlib
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+PRIORIDAD_URGENTE = 0
+PRIORIDAD_NORMAL = 100
+PRIORIDAD_MASIVA = 200
+
+ESPERA_BASE = 30        # segundos antes del primer reintento; se duplica en cada uno
+ESPERA_MAXIMA = 3600
+BLOQUEO_MAXIMO = 900    # un trabajo 'procesando' sin latido más tiempo que esto se da por huérfano
+LATIDO = BLOQUEO_MAXIMO // 3   # cada cuánto el worker renueva bloqueado_en del trabajo en curso
+
+_COLUMNAS = ('id', 'tipo', 'tabla', 'registro_id', 'datos', 'estado', 'prioridad', 'intentos',
+             'max_intentos', 'error_mensaje', 'resultado', 'created_at', 'disponible_en', 'processed_at')
+
+# nombre -> función(datos) que devuelve un dict serializable
+TRABAJOS = {}
+
+
+def trabajo(nombre):
+    """Registra una función como tipo de trabajo de la cola."""
+    def registrar(funcion):
+        TRABAJOS[nombre] = funcion
+        return funcion
+    return registrar
+
+
+def _registrar_tipos():
+    """
+    Importa app.services.trabajos, cuyos @trabajo llenan TRABAJOS. Se hace
+    al encolar y no arriba: trabajos importa este módulo.
+    """
+    importlib.import_module('app.services.trabajos')
+
+
+class TrabajoFallido(Exception):
+    """El trabajo no se pudo completar y debe reintentarse."""
+
+
+def _archivo_disponible(resultado):
+    ruta = (resultado or {}).get('archivo')
+    return bool(ruta) and os.path.isfile(ruta)
+
+
+def _fila(row):
+    datos = dict(zip(_COLUMNAS, row))
+    for campo in ('created_at', 'disponible_en', 'processed_at'):
+        if datos[campo]:
+            datos[campo] = datos[campo].isoformat()
+    return datos
+
+
+class ColaTrabajos:
+
+    @staticmethod
+    def _vigente(cur, tipo, datos, tabla, registro_id, vigente_desde=None):
+        """Último trabajo reutilizable para el registro (fila completa) o None."""
+        cur.execute(f"""
+            SELECT {', '.join(_COLUMNAS)} FROM sync_queue
+            WHERE tipo = %s AND tabla = %s AND registro_id = %s AND datos = %s
+              AND (estado IN ('pendiente', 'procesando')
+                   OR (estado = 'completado' AND (%s::timestamp IS NULL OR processed_at >= %s)))
+            ORDER BY id DESC
+            LIMIT 1
+        """, (tipo, tabla, registro_id, Json(datos or {}), vigente_desde, vigente_desde))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        trabajo = _fila(row)
+        # Un completado cuyo archivo ya se borró (retención) se vuelve a generar
+        if trabajo['estado'] == 'completado' and not _archivo_disponible(trabajo['resultado']):
+            return None
+        return trabajo
+
+    @staticmethod
+    def documento(tipo, datos, tabla, registro_id, vigente_desde=None):
+        """
+        Trabajo vigente que genera el documento de un registro: pendiente, en
+        curso o completado después de vigente_desde (la última modificación
+        del registro) con su archivo aún en disco. None si no hay.
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            trabajo = ColaTrabajos._vigente(cur, tipo, datos, tabla, registro_id, vigente_desde)
+            cur.close()
+            return trabajo
+        finally:
+            conn.close()
+
+    @staticmethod
+    def encolar(tipo, datos=None, tabla='trabajos', registro_id=None, prioridad=PRIORIDAD_NORMAL,
+                max_intentos=5, solicitado_por=None, reutilizar=False, vigente_desde=None, retraso=0):
+        """
+        Agrega un trabajo a la cola.
+
+        Con reutilizar=True, si documento() encuentra un trabajo vigente para
+        el mismo tipo, registro y datos se devuelve ese. Un bloqueo asesor por
+        registro evita que dos peticiones simultáneas encolen dos trabajos.
+        Con retraso (segundos) el trabajo no se toma antes de ese tiempo.
+
+        Returns:
+            id del trabajo (para /api/trabajos/<id>)
+        """
+        if tipo not in TRABAJOS:
+            _registrar_tipos()
+        if tipo not in TRABAJOS:
+            raise ValueError(f'Tipo de trabajo desconocido: {tipo}')
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            if reutilizar:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                            (f'{tipo}:{tabla}:{registro_id}:{json.dumps(datos or {}, sort_keys=True)}',))
+                vigente = ColaTrabajos._vigente(cur, tipo, datos, tabla, registro_id, vigente_desde)
+                if vigente:
+                    conn.commit()
+                    cur.close()
+                    return vigente['id']
+            cur.execute("""
+                INSERT INTO sync_queue (tipo, tabla, registro_id, accion, datos, prioridad, max_intentos,
+                                        solicitado_por, disponible_en)
+                VALUES (%s, %s, %s, 'trabajo', %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                RETURNING id
+            """, (tipo, tabla, registro_id, Json(datos or {}), prioridad, max_intentos,
+                  str(solicitado_por) if solicitado_por is not None else None, retraso))
+            trabajo_id = cur.fetchone()[0]
+            # Despierta a los workers en espera (se entrega al hacer commit)
+            cur.execute("SELECT pg_notify('cola_trabajos', %s)", (tipo,))
+            conn.commit()
+            cur.close()
+            return trabajo_id
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def obtener(trabajo_id):
+        """Estado de un trabajo, o None si no existe."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT {', '.join(_COLUMNAS)} FROM sync_queue WHERE id = %s AND tipo IS NOT NULL",
+                        (trabajo_id,))
+            row = cur.fetchone()
+            cur.close()
+            return _fila(row) if row else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def listar(estado=None, tipo=None, limite=100):
+        """Últimos trabajos (opcionalmente de un estado/tipo) y el total por estado."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            filtros, params = ['tipo IS NOT NULL'], []
+            if estado:
+                filtros.append('estado = %s')
+                params.append(estado)
+            if tipo:
+                filtros.append('tipo = %s')
+                params.append(tipo)
+            cur.execute(f"""
+                SELECT {', '.join(_COLUMNAS)} FROM sync_queue
+                WHERE {' AND '.join(filtros)}
+                ORDER BY id DESC LIMIT %s
+            """, params + [limite])
+            trabajos = [_fila(r) for r in cur.fetchall()]
+            cur.execute("SELECT estado, COUNT(*) FROM sync_queue WHERE tipo IS NOT NULL GROUP BY estado")
+            totales = dict(cur.fetchall())
+            cur.close()
+            return {'trabajos': trabajos, 'totales': totales}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def reintentar(trabajo_id):
+        """Devuelve a la cola un trabajo muerto o con error; False si no estaba en esos estados."""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE sync_queue
+                SET estado = 'pendiente', intentos = 0, disponible_en = CURRENT_TIMESTAMP, error_mensaje = NULL
+                WHERE id = %s AND tipo IS NOT NULL AND estado IN ('muerto', 'error')
+            """, (trabajo_id,))
+            ok = cur.rowcount == 1
+            conn.commit()
+            cur.close()
+            return ok
+        finally:
+            conn.close()
+
+    @staticmethod
+    def tomar(worker, limite=1, tipos=None):
+        """
+        Marca como 'procesando' los siguientes trabajos disponibles y los
+        devuelve. Las filas que otro worker tiene bloqueadas se saltan.
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            filtro_tipos = 'AND tipo = ANY(%s)' if tipos else ''
+            cur.execute(f"""
+                UPDATE sync_queue
+                SET estado = 'procesando', intentos = intentos + 1,
+                    bloqueado_por = %s, bloqueado_en = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM sync_queue
+                    WHERE estado = 'pendiente' AND tipo IS NOT NULL
+                      AND disponible_en <= CURRENT_TIMESTAMP {filtro_tipos}
+                    ORDER BY prioridad, disponible_en, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, tipo, datos, intentos, max_intentos
+            """, [worker] + ([list(tipos)] if tipos else []) + [limite])
+            filas = cur.fetchall()
+            conn.commit()
+            cur.close()
+            return filas
+        finally:
+            conn.close()
+
+    @staticmethod
+    def latido(trabajo_id, worker):
+        """
+        Renueva bloqueado_en de un trabajo en curso, para que un trabajo largo
+        (un lote de emails, un PDF grande) no se dé por huérfano mientras su
+        worker sigue vivo. False si el trabajo ya no es de este worker.
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE sync_queue SET bloqueado_en = CURRENT_TIMESTAMP
+                WHERE id = %s AND estado = 'procesando' AND bloqueado_por = %s
+            """, (trabajo_id, worker))
+            ok = cur.rowcount == 1
+            conn.commit()
+            cur.close()
+            return ok
+        finally:
+            conn.close()
+
+    @staticmethod
+    def completar(trabajo_id, resultado):
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE sync_queue
+                SET estado = 'completado', resultado = %s, error_mensaje = NULL,
+                    processed_at = CURRENT_TIMESTAMP, bloqueado_por = NULL
+                WHERE id = %s
+            """, (Json(resultado, dumps=lambda o: json.dumps(o, default=str)), trabajo_id))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def fallar(trabajo_id, error, intentos, max_intentos):
+        """Reprograma el trabajo con espera exponencial, o lo pasa a 'muerto'."""
+        muerto = intentos >= max_intentos
+        espera = min(ESPERA_BASE * 2 ** (intentos - 1), ESPERA_MAXIMA)
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE sync_queue
+                SET estado = %s, error_mensaje = %s, bloqueado_por = NULL,
+                    disponible_en = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    processed_at = CASE WHEN %s THEN CURRENT_TIMESTAMP ELSE processed_at END
+                WHERE id = %s
+            """, ('muerto' if muerto else 'pendiente', str(error)[:2000], espera, muerto, trabajo_id))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return muerto
+
+    @staticmethod
+    def recuperar_huerfanos(segundos=BLOQUEO_MAXIMO):
+        """
+        Devuelve a 'pendiente' los trabajos de un worker que murió a mitad: los
+        vivos renuevan bloqueado_en cada LATIDO segundos con latido().
+        """
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE sync_queue
+                SET estado = 'pendiente', bloqueado_por = NULL, disponible_en = CURRENT_TIMESTAMP
+                WHERE estado = 'procesando' AND tipo IS NOT NULL
+                  AND bloqueado_en < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (segundos,))
+            recuperados = cur.rowcount
+            conn.commit()
+            cur.close()
+            return recuperados
+        finally:
+            conn.close()
+
+    @staticmethod
+    def ejecutar(fila):
+        """
+        Ejecuta un trabajo ya tomado y registra el resultado.
+
+        Returns:
+            'completado', 'pendiente' (se reintentará) o 'muerto'
+        """
+        trabajo_id, tipo, datos, intentos, max_intentos = fila
+        funcion = TRABAJOS.get(tipo)
+        try:
+            if funcion is None:
+                raise TrabajoFallido(f'Tipo de trabajo desconocido: {tipo}')
+            resultado = funcion(datos or {}) or {}
+        except Exception as e:
+            logger.warning('Trabajo %s (%s) falló en el intento %s/%s: %s',
+                           trabajo_id, tipo, intentos, max_intentos, e)
+            # Un tipo desconocido no se arregla reintentando
+            if funcion is None:
+                intentos = max_intentos
+            return 'muerto' if ColaTrabajos.fallar(trabajo_id, e, intentos, max_intentos) else 'pendiente'
+        ColaTrabajos.completar(trabajo_id, resultado)
+        return 'completado'
+
+
+def nombre_worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
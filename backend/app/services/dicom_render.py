@@ -0,0 +1,380 @@
+"""
+Render DICOM - Ventaneo vectorizado y pirámide miniatura/vista previa/completa
+
+Los píxeles se decodifican una vez por estudio: la LUT de modalidad
+(RescaleSlope/Intercept), la ventana VOI (WindowCenter/Width) y la inversión
+de MONOCHROME1 se combinan en una sola transformación lineal que se aplica
+con una tabla de 8 bits (enteros de hasta 16 bits) o en float32 en el sitio.
+Cada resolución se renderiza cuando se pide (las que falten en la misma
+petición salen de una sola decodificación). Solo la ventana por defecto se
+guarda en disco, así los visores de radiografías y sonografías no vuelven a
+decodificar un estudio que ya se mostró; una ventana elegida en el visor
+(wc/ww arbitrarios) se renderiza en memoria y la cachea el navegador. La
+caché de disco tiene un tope (DICOM_CACHE_MAX_MB) y descarta primero lo
+usado hace más tiempo.
+"""
+from app.utils.dicom_header import read_header
+from io import BytesIO
+import hashlib
+import os
+import tempfile
+
+# Lado mayor de cada nivel; None es la resolución original
+NIVELES = {
+    'miniatura': 256,
+    'preview': 1024,
+    'completa': None,
+}
+
+FORMATOS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# Forma parte de la clave de la caché: cambiarlo invalida lo ya renderizado
+VERSION = 1
+
+CACHE_MAX_MB = 2048
+
+
+def _primero(valor):
+    """WindowCenter/Width pueden traer varios valores: se usa el primero."""
+    if isinstance(valor, (list, tuple)):
+        return valor[0] if valor else None
+    return valor
+
+
+def _cache_dir():
+    try:
+        from flask import current_app
+        return current_app.config['DICOM_CACHE_FOLDER']
+    except (RuntimeError, KeyError):
+        return os.path.join(os.getenv('UPLOAD_FOLDER', './uploads'), 'cache_dicom')
+
+
+def _cache_max_bytes():
+    try:
+        from flask import current_app
+        return int(current_app.config.get('DICOM_CACHE_MAX_MB', CACHE_MAX_MB)) * 1024 * 1024
+    except RuntimeError:
+        return CACHE_MAX_MB * 1024 * 1024
+
+
+def _transformacion(meta, minimo, maximo, centro=None, ancho=None):
+    """
+    Coeficientes (a, b) tales que salida = clip(a * pixel + b, 0, 255).
+
+    Combina la LUT de modalidad, la ventana lineal de PS3.3 C.11.2.1.2 y la
+    inversión de MONOCHROME1. Sin ventana en la petición ni en el archivo se
+    usa el rango de valores del frame; una imagen constante queda en gris
+    medio en vez de dividir por cero.
+    """
+    pendiente = float(_primero(meta.get('RescaleSlope')) or 1.0)
+    intercepto = float(_primero(meta.get('RescaleIntercept')) or 0.0)
+
+    if centro is None or ancho is None:
+        centro_dcm = _primero(meta.get('WindowCenter'))
+        ancho_dcm = _primero(meta.get('WindowWidth'))
+        if centro is None and ancho is None and centro_dcm is not None and ancho_dcm:
+            centro, ancho = float(centro_dcm), float(ancho_dcm)
+        else:
+            bajo = minimo * pendiente + intercepto
+            alto = maximo * pendiente + intercepto
+            bajo, alto = min(bajo, alto), max(bajo, alto)
+            if bajo == alto and centro is None and ancho is None:
+                return 0.0, 128.0
+            centro = (bajo + alto) / 2 if centro is None else float(centro)
+            ancho = (alto - bajo + 1) if ancho is None else float(ancho)
+
+    # y = ((x - (c - 0.5)) / (w - 1) + 0.5) * 255, con x = pendiente * pixel + intercepto
+    k = 255.0 / max(float(ancho) - 1, 1e-3)
+    a = pendiente * k
+    b = (intercepto - float(centro) + 0.5) * k + 127.5
+    if meta.get('PhotometricInterpretation') == 'MONOCHROME1':
+        a, b = -a, 255.0 - b
+    # +0.5 para redondear al truncar a uint8
+    return a, b + 0.5
+
+
+def tabla_ventana(dtype, meta, minimo, maximo, centro=None, ancho=None):
+    """
+    Tabla uint8 de la ventana para frames enteros de 8 o 16 bits.
+
+    Tiene 256/65536 entradas y se indexa con la vista sin signo del frame
+    (ver vista_sin_signo), así los valores con signo también caen en su sitio.
+    """
+    import numpy as np
+
+    dtype = np.dtype(dtype)
+    a, b = _transformacion(meta, float(minimo), float(maximo), centro, ancho)
+    # Cada posición de la tabla es el patrón de bits del valor con signo
+    valores = np.arange(2 ** (8 * dtype.itemsize), dtype=f'u{dtype.itemsize}').view(dtype)
+    tabla = valores.astype(np.float32)
+    tabla *= a
+    tabla += b
+    np.clip(tabla, 0, 255, out=tabla)
+    return tabla.astype(np.uint8)
+
+
+def usa_tabla(frame):
+    """True si el frame se ventanea con tabla_ventana (enteros de hasta 16 bits)."""
+    return frame.dtype.kind in 'iu' and frame.dtype.itemsize <= 2
+
+
+def vista_sin_signo(frame):
+    """El frame reinterpretado como enteros sin signo, sin copiarlo."""
+    import numpy as np
+    return np.ascontiguousarray(frame).view(f'u{frame.dtype.itemsize}')
+
+
+def a_uint8(frame, meta, centro=None, ancho=None):
+    """
+    Frame monocromo (2D) en modalidad original -> uint8 ventaneado.
+
+    Enteros de 8 y 16 bits pasan por tabla_ventana: una sola pasada y un
+    único array de salida. El resto se transforma en float32 en el sitio.
+    """
+    import numpy as np
+
+    minimo, maximo = frame.min(), frame.max()
+    if usa_tabla(frame):
+        tabla = tabla_ventana(frame.dtype, meta, minimo, maximo, centro, ancho)
+        # Indexar con [] convierte los índices por bloques; np.take los
+        # pasaría enteros a int64 (8 bytes por píxel)
+        return tabla[vista_sin_signo(frame)]
+
+    a, b = _transformacion(meta, float(minimo), float(maximo), centro, ancho)
+    salida = frame.astype(np.float32)
+    salida *= a
+    salida += b
+    np.clip(salida, 0, 255, out=salida)
+    return salida.astype(np.uint8)
+
+
+def color_uint8(frame):
+    """Frame RGB (ecografía, fotografía) a uint8 sin ventaneo."""
+    import numpy as np
+
+    if frame.dtype == np.uint8:
+        return frame
+    minimo, maximo = float(frame.min()), float(frame.max())
+    escala = 255.0 / (maximo - minimo) if maximo > minimo else 0.0
+    salida = frame.astype(np.float32)
+    salida -= minimo
+    salida *= escala
+    return salida.astype(np.uint8)
+
+
+class DicomRender:
+
+    @staticmethod
+    def numero_frames(dicom_path):
+        """Frames del estudio según el encabezado (1 si no es multi-frame)."""
+        return int(read_header(dicom_path).get('NumberOfFrames') or 1)
+
+    @staticmethod
+    def frame(dicom_path, frame=0):
+        """
+        Decodifica un frame sin ventanear.
+
+        Returns:
+            (array 2D en modalidad original, o 3D RGB si es color; metadatos del encabezado)
+        """
+        import pydicom
+
+        meta = read_header(dicom_path)
+        ds = pydicom.dcmread(dicom_path, force=True)
+        pixeles = ds.pixel_array
+        muestras = int(ds.get('SamplesPerPixel', 1) or 1)
+        frames = int(ds.get('NumberOfFrames', 1) or 1)
+
+        if frames > 1:
+            if not 0 <= frame < frames:
+                raise ValueError(f'Frame {frame} fuera de rango (0-{frames - 1})')
+            # Copia: una vista mantendría vivo el array de todos los frames
+            pixeles = pixeles[frame].copy()
+        elif frame:
+            raise ValueError('El estudio tiene un solo frame')
+
+        if muestras == 3:
+            interpretacion = str(ds.get('PhotometricInterpretation', ''))
+            # Los decodificadores JPEG ya entregan RGB; sin comprimir llega en YBR
+            sintaxis = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+            if interpretacion.startswith('YBR') and not (sintaxis and sintaxis.is_compressed):
+                from pydicom.pixel_data_handlers.util import convert_color_space
+                pixeles = convert_color_space(pixeles, interpretacion, 'RGB')
+        return pixeles, meta
+
+    @staticmethod
+    def frame_uint8(dicom_path, frame=0, centro=None, ancho=None):
+        """
+        Decodifica un frame y lo devuelve ventaneado en uint8.
+
+        Returns:
+            (array uint8 de 2 dimensiones, o 3 si es color; metadatos del encabezado)
+        """
+        pixeles, meta = DicomRender.frame(dicom_path, frame)
+        if pixeles.ndim == 3:
+            return color_uint8(pixeles), meta
+        return a_uint8(pixeles, meta, centro, ancho), meta
+
+    @staticmethod
+    def piramide(dicom_path, frame=0, formato='png', cache_dir=None, niveles=None, max_bytes=None):
+        """
+        Niveles de NIVELES (por defecto todos) con la ventana por defecto,
+        desde la caché de disco. Los que falten se renderizan con una sola
+        decodificación; si ya están todos no se abre el DICOM.
+
+        La clave es ruta real + mtime + tamaño + frame, así un archivo
+        reemplazado se vuelve a renderizar.
+
+        Returns:
+            Dict nivel -> ruta del archivo renderizado
+        """
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no soportado: {formato}')
+        niveles = list(NIVELES) if niveles is None else list(niveles)
+        for nivel in niveles:
+            if nivel not in NIVELES:
+                raise ValueError(f'Nivel no soportado: {nivel}')
+        st = os.stat(dicom_path)
+        clave = '|'.join(str(v) for v in (
+            os.path.realpath(dicom_path), st.st_mtime_ns, st.st_size, frame, VERSION
+        ))
+        clave = hashlib.sha1(clave.encode()).hexdigest()
+        cache_dir = cache_dir or _cache_dir()
+        directorio = os.path.join(cache_dir, clave[:2], clave)
+        rutas = {nivel: os.path.join(directorio, f'{nivel}.{formato}') for nivel in niveles}
+        faltan = [nivel for nivel, ruta in rutas.items() if not _usar(ruta)]
+        if not faltan:
+            return rutas
+
+        os.makedirs(directorio, exist_ok=True)
+        for nivel, imagen in DicomRender._niveles(dicom_path, frame, None, None, faltan):
+            _guardar(imagen, rutas[nivel], formato)
+        _recortar(cache_dir, max_bytes or _cache_max_bytes(), conservar=set(rutas.values()))
+        return rutas
+
+    @staticmethod
+    def _niveles(dicom_path, frame, centro, ancho, niveles):
+        """Decodifica una vez e itera (nivel, imagen PIL) de los niveles pedidos."""
+        from PIL import Image
+
+        pixeles, _ = DicomRender.frame_uint8(dicom_path, frame, centro, ancho)
+        fuente = Image.fromarray(pixeles)
+        del pixeles
+        # De mayor a menor: cada nivel se reduce desde el anterior, no desde el original
+        for nivel in sorted(niveles, key=lambda n: -(NIVELES[n] or 1 << 30)):
+            lado = NIVELES[nivel]
+            if lado is not None and max(fuente.size) > lado:
+                fuente = fuente.copy()
+                fuente.thumbnail((lado, lado), Image.LANCZOS, reducing_gap=2.0)
+            yield nivel, fuente
+
+    @staticmethod
+    def parametros(args):
+        """
+        Lee nivel, frame, wc/ww (centro/ancho) y formato de los query params.
+
+        Raises:
+            ValueError: si algún valor no es válido
+        """
+        nivel = args.get('nivel', 'preview')
+        formato = args.get('formato', 'png').lower()
+        if nivel not in NIVELES:
+            raise ValueError(f'Nivel no soportado: {nivel}')
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no soportado: {formato}')
+        centro, ancho = args.get('wc'), args.get('ww')
+        return {
+            'nivel': nivel,
+            'formato': formato,
+            'frame': int(args.get('frame', 0)),
+            'centro': float(centro) if centro not in (None, '') else None,
+            'ancho': float(ancho) if ancho not in (None, '') else None,
+        }
+
+    @staticmethod
+    def renderizar(dicom_path, nivel='preview', frame=0, centro=None, ancho=None, formato='png', cache_dir=None):
+        """
+        Nivel pedido: ruta en la caché de disco con la ventana por defecto, o
+        BytesIO con una ventana elegida (no se guarda).
+        """
+        if nivel not in NIVELES:
+            raise ValueError(f'Nivel no soportado: {nivel}')
+        if centro is None and ancho is None:
+            return DicomRender.piramide(dicom_path, frame, formato, cache_dir, niveles=(nivel,))[nivel]
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no soportado: {formato}')
+        _, imagen = next(DicomRender._niveles(dicom_path, frame, centro, ancho, (nivel,)))
+        return BytesIO(_codificar(imagen, formato))
+
+
+def _codificar(imagen, formato):
+    nombre_pil = FORMATOS[formato][0]
+    if nombre_pil == 'JPEG' and imagen.mode not in ('L', 'RGB'):
+        imagen = imagen.convert('RGB')
+    buffer = BytesIO()
+    opciones = {} if nombre_pil == 'PNG' else {'quality': 90}
+    imagen.save(buffer, format=nombre_pil, **opciones)
+    return buffer.getvalue()
+
+
+def _usar(ruta):
+    """True si el archivo está en la caché; marca el uso (mtime) para el LRU."""
+    try:
+        os.utime(ruta)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _recortar(cache_dir, max_bytes, conservar=()):
+    """
+    Borra los renders usados hace más tiempo hasta quedar bajo max_bytes.
+
+    El uso se lleva en el mtime (atime no es fiable con relatime/noatime).
+    Solo se recorre el directorio tras escribir, que ya costó una
+    decodificación; `conservar` protege lo que se está por servir.
+    """
+    archivos, total = [], 0
+    for raiz, _, nombres in os.walk(cache_dir):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((st.st_mtime, st.st_size, ruta))
+            total += st.st_size
+    if total <= max_bytes:
+        return
+    for _, tamano, ruta in sorted(archivos):
+        if total <= max_bytes:
+            break
+        if ruta in conservar:
+            continue
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        try:
+            os.rmdir(os.path.dirname(ruta))  # solo si quedó vacío
+        except OSError:
+            pass
+
+
+def _guardar(imagen, ruta, formato):
+    """Escribe la imagen de forma atómica (otro worker puede estar leyéndola)."""
+    datos = _codificar(imagen, formato)
+    fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
@@ -1,4 +1,4 @@
-import pydicom
+from app.utils.dicom_header import read_header
 from datetime import datetime
 import os
 
@@ -6,24 +6,36 @@ class DICOMService:
     
     @staticmethod
     def parse_dicom_file(filepath):
-        """Leer archivo DICOM y extraer metadatos"""
+        """
+        Leer archivo DICOM y extraer metadatos
+        
+        Acepta una ruta o un archivo abierto (upload). Solo lee el encabezado,
+        sin píxeles, y las rutas quedan en caché por SOPInstanceUID+mtime.
+        """
         try:
-            ds = pydicom.dcmread(filepath)
+            ds = read_header(filepath)
+            
+            def texto(tag):
+                valor = ds.get(tag)
+                if isinstance(valor, list):
+                    return '\\'.join(str(v) for v in valor)
+                return str(valor) if valor is not None else None
             
             metadata = {
-                'patient_id': str(ds.PatientID) if hasattr(ds, 'PatientID') else None,
-                'patient_name': str(ds.PatientName) if hasattr(ds, 'PatientName') else None,
-                'patient_dob': str(ds.PatientBirthDate) if hasattr(ds, 'PatientBirthDate') else None,
-                'patient_sex': str(ds.PatientSex) if hasattr(ds, 'PatientSex') else None,
-                'study_date': str(ds.StudyDate) if hasattr(ds, 'StudyDate') else None,
-                'study_time': str(ds.StudyTime) if hasattr(ds, 'StudyTime') else None,
-                'study_description': str(ds.StudyDescription) if hasattr(ds, 'StudyDescription') else None,
-                'modality': str(ds.Modality) if hasattr(ds, 'Modality') else None,
-                'institution_name': str(ds.InstitutionName) if hasattr(ds, 'InstitutionName') else None,
-                'series_description': str(ds.SeriesDescription) if hasattr(ds, 'SeriesDescription') else None,
-                'image_type': str(ds.ImageType) if hasattr(ds, 'ImageType') else None,
-                'rows': int(ds.Rows) if hasattr(ds, 'Rows') else None,
-                'columns': int(ds.Columns) if hasattr(ds, 'Columns') else None
+                'patient_id': texto('PatientID'),
+                'patient_name': texto('PatientName'),
+                'patient_dob': texto('PatientBirthDate'),
+                'patient_sex': texto('PatientSex'),
+                'study_date': texto('StudyDate'),
+                'study_time': texto('StudyTime'),
+                'study_description': texto('StudyDescription'),
+                'modality': texto('Modality'),
+                'institution_name': texto('InstitutionName'),
+                'series_description': texto('SeriesDescription'),
+                'image_type': texto('ImageType'),
+                'sop_instance_uid': texto('SOPInstanceUID'),
+                'rows': int(ds['Rows']) if ds.get('Rows') is not None else None,
+                'columns': int(ds['Columns']) if ds.get('Columns') is not None else None
             }
             
             return metadata
@@ -31,21 +43,19 @@ class DICOMService:
             raise Exception(f"Error parsing DICOM: {str(e)}")
     
     @staticmethod
-    def convert_dicom_to_png(dicom_path, output_path):
-        """Convertir DICOM a PNG para visualización"""
+    def convert_dicom_to_png(dicom_path, output_path, frame=0, centro=None, ancho=None):
+        """
+        Convertir DICOM a PNG para visualización
+
+        Aplica RescaleSlope/Intercept y la ventana (la del archivo o centro/ancho)
+        con el motor de app/services/dicom_render.py.
+        """
         try:
-            ds = pydicom.dcmread(dicom_path)
-            pixel_array = ds.pixel_array
-            
+            from app.services.dicom_render import DicomRender
             from PIL import Image
-            import numpy as np
-            
-            # Normalizar y convertir a imagen
-            pixel_array = pixel_array - np.min(pixel_array)
-            pixel_array = pixel_array / np.max(pixel_array)
-            pixel_array = (pixel_array * 255).astype(np.uint8)
             
-            image = Image.fromarray(pixel_array)
+            pixeles, _ = DicomRender.frame_uint8(dicom_path, frame, centro, ancho)
+            image = Image.fromarray(pixeles)
             image.save(output_path)
             return output_path
         except Exception as e:
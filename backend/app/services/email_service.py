@@ -1,9 +1,10 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+from app.services.smtp_sesion import construir, pool
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
+
 
 class EmailService:
     
@@ -12,52 +13,77 @@ class EmailService:
         self.smtp_port = int(os.getenv('MAIL_PORT', 587))
         self.username = os.getenv('MAIL_USERNAME')
         self.password = os.getenv('MAIL_PASSWORD')
+        self.use_tls = os.getenv('MAIL_USE_TLS', 'true').lower() != 'false'
         self.from_email = os.getenv('MAIL_FROM', self.username)
         self.enabled = bool(self.username and self.password)
     
+    def _sesion(self):
+        return pool.sesion(self.smtp_server, self.smtp_port, self.username, self.password, self.use_tls)
+    
+    def _mensaje(self, to_email, subject, body_html, attachments=None):
+        return construir(f"Centro Diagnóstico <{self.from_email}>", to_email, subject, body_html, attachments)
+    
     def enviar(self, to_email, subject, body_html, attachments=None):
-        """Enviar email con HTML y adjuntos opcionales"""
+        """Enviar email con HTML y adjuntos opcionales (sesión SMTP reutilizada)"""
         if not self.enabled:
             return {'success': False, 'error': 'Email no configurado'}
         
         try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"Centro Diagnóstico <{self.from_email}>"
-            msg['To'] = to_email
-            
-            # Cuerpo HTML
-            html_part = MIMEText(body_html, 'html', 'utf-8')
-            msg.attach(html_part)
-            
-            # Adjuntos
-            if attachments:
-                for filepath in attachments:
-                    if os.path.exists(filepath):
-                        with open(filepath, 'rb') as f:
-                            part = MIMEBase('application', 'octet-stream')
-                            part.set_payload(f.read())
-                            encoders.encode_base64(part)
-                            filename = os.path.basename(filepath)
-                            part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                            msg.attach(part)
-            
-            # Enviar
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.send_message(msg)
-            
+            with self._sesion() as sesion:
+                sesion.enviar(self.from_email, [to_email], self._mensaje(to_email, subject, body_html, attachments))
             return {'success': True, 'message': f'Email enviado a {to_email}'}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def enviar_lote(self, mensajes):
+        """
+        Enviar varios emails por la misma sesión SMTP.
+        
+        Args:
+            mensajes: iterable de dicts con to_email, subject, body_html y
+                attachments (opcional); se consume a medida que se envía
+        
+        Returns:
+            dict con total, enviados, fallidos, errores (destinatario -> error),
+            segundos, mensajes_por_segundo, conexiones y reconexiones
+        """
+        if not self.enabled:
+            return {'success': False, 'error': 'Email no configurado'}
+        
+        resultado = {'total': 0, 'enviados': 0, 'fallidos': 0, 'errores': {}}
+        inicio = time.monotonic()
+        with self._sesion() as sesion:
+            conexiones, reconexiones = sesion.conexiones, sesion.reconexiones
+            for mensaje in mensajes:
+                resultado['total'] += 1
+                try:
+                    sesion.enviar(self.from_email, [mensaje['to_email']], self._mensaje(**mensaje))
+                    resultado['enviados'] += 1
+                except Exception as e:
+                    resultado['fallidos'] += 1
+                    resultado['errores'][mensaje['to_email']] = str(e)
+            resultado['conexiones'] = sesion.conexiones - conexiones
+            resultado['reconexiones'] = sesion.reconexiones - reconexiones
+        segundos = time.monotonic() - inicio
+        resultado.update({
+            'success': resultado['fallidos'] == 0,
+            'segundos': round(segundos, 2),
+            'mensajes_por_segundo': round(resultado['enviados'] / segundos, 1) if segundos else 0.0,
+        })
+        logger.info('Lote de email: %s/%s enviados en %.1f s (%.1f msg/s, %s conexiones, %s reconexiones)',
+                    resultado['enviados'], resultado['total'], segundos, resultado['mensajes_por_segundo'],
+                    resultado['conexiones'], resultado['reconexiones'])
+        return resultado
+    
     def enviar_resultados(self, paciente, estudio_nombre, pdf_path=None):
         """Enviar notificación de resultados listos"""
         if not paciente.email:
             return {'success': False, 'error': 'Paciente sin email'}
-        
+        return self.enviar(**self.mensaje_resultados(paciente, estudio_nombre, pdf_path))
+    
+    def mensaje_resultados(self, paciente, estudio_nombre, pdf_path=None):
+        """Email de resultados listos como dict para enviar()/enviar_lote()"""
         html = f"""
         <!DOCTYPE html>
         <html>
@@ -97,8 +123,12 @@ class EmailService:
         </html>
         """
         
-        attachments = [pdf_path] if pdf_path and os.path.exists(pdf_path) else None
-        return self.enviar(paciente.email, f'Resultados Listos - {estudio_nombre}', html, attachments)
+        return {
+            'to_email': paciente.email,
+            'subject': f'Resultados Listos - {estudio_nombre}',
+            'body_html': html,
+            'attachments': [pdf_path] if pdf_path else None,
+        }
     
     def enviar_factura(self, paciente, factura, pdf_path):
         """Enviar factura por email"""
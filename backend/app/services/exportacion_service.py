@@ -0,0 +1,174 @@
+"""
+Exportación de reportes en streaming (CSV, NDJSON, XLSX).
+
+Las filas se leen con un cursor del lado del servidor y se escriben al
+cliente por bloques, así que la memoria del worker no depende del
+número de filas del reporte.
+"""
+from flask import Response, stream_with_context
+from app import db
+from datetime import datetime, date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+import csv
+import io
+import json
+import re
+import zipfile
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+LOTE_FILAS = 2000
+
+# Caracteres de control no permitidos en XML 1.0
+_XML_INVALIDO = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _valor(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+class _Sumidero(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes hasta que se vacían"""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def vaciar(self):
+        data = b''.join(self._partes)
+        self._partes = []
+        return data
+
+
+class ExportacionService:
+
+    @staticmethod
+    def iterar_filas(stmt, params=None, lote=LOTE_FILAS):
+        """Recorrer el resultado con un cursor del servidor, de a `lote` filas"""
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=lote).execute(stmt, params or {})
+            for particion in result.partitions(lote):
+                yield from particion
+
+    @staticmethod
+    def generar_csv(columnas, filas, lote=500):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM para que Excel detecte UTF-8
+        writer.writerow(columnas)
+        for i, fila in enumerate(filas, 1):
+            writer.writerow([_valor(v) for v in fila])
+            if i % lote == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def generar_ndjson(columnas, filas, lote=500):
+        partes = []
+        for fila in filas:
+            partes.append(json.dumps(dict(zip(columnas, map(_valor, fila))), default=str, ensure_ascii=False))
+            if len(partes) >= lote:
+                yield ('\n'.join(partes) + '\n').encode('utf-8')
+                partes = []
+        if partes:
+            yield ('\n'.join(partes) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _celda(v):
+        v = _valor(v)
+        if v is None:
+            return '<c/>'
+        if isinstance(v, bool):
+            return f'<c t="b"><v>{int(v)}</v></c>'
+        if isinstance(v, (int, float)):
+            return f'<c><v>{v}</v></c>'
+        texto = escape(_XML_INVALIDO.sub('', str(v)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+    @staticmethod
+    def generar_xlsx(columnas, filas, lote=500, hoja='Reporte'):
+        """XLSX mínimo (una hoja, inlineStr) escrito como zip en streaming"""
+        sumidero = _Sumidero()
+        with zipfile.ZipFile(sumidero, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('[Content_Types].xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                '</Types>'
+            ))
+            zf.writestr('_rels/.rels', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>'
+            ))
+            zf.writestr('xl/workbook.xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                f'<sheets><sheet name="{escape(hoja[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+                '</workbook>'
+            ))
+            zf.writestr('xl/_rels/workbook.xml.rels', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                '</Relationships>'
+            ))
+            yield sumidero.vaciar()
+
+            with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja_xml:
+                hoja_xml.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                )
+                encabezado = ''.join(ExportacionService._celda(c) for c in columnas)
+                hoja_xml.write(f'<row>{encabezado}</row>'.encode('utf-8'))
+                partes = []
+                for fila in filas:
+                    partes.append('<row>' + ''.join(ExportacionService._celda(v) for v in fila) + '</row>')
+                    if len(partes) >= lote:
+                        hoja_xml.write(''.join(partes).encode('utf-8'))
+                        partes = []
+                        data = sumidero.vaciar()
+                        if data:
+                            yield data
+                hoja_xml.write(''.join(partes).encode('utf-8'))
+                hoja_xml.write(b'</sheetData></worksheet>')
+        yield sumidero.vaciar()
+
+    @staticmethod
+    def respuesta(formato, nombre, columnas, stmt, params=None):
+        """Response en streaming con las filas de `stmt` en el formato pedido"""
+        mimetype, extension = FORMATOS[formato]
+        generador = getattr(ExportacionService, f'generar_{formato}')
+        filas = ExportacionService.iterar_filas(stmt, params)
+        archivo = f"{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        return Response(
+            stream_with_context(generador(columnas, filas)),
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename="{archivo}"',
+                'X-Accel-Buffering': 'no',  # que nginx no acumule la respuesta
+            }
+        )
@@ -4,33 +4,149 @@ from app.services.hl7_service import HL7Service
 from app.services.dicom_service import DICOMService
 from app import db
 from app.models import Resultado, OrdenDetalle
+import logging
 import os
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 class FileMonitor(FileSystemEventHandler):
+    """
+    Procesa los archivos que exportan los equipos sin dormir en el hilo de
+    watchdog: los eventos solo registran el archivo, y un hilo revisor lo da
+    por completo cuando recibe su close_write (Linux) o cuando su tamaño y
+    mtime no cambian durante ESPERA segundos. Los completos se procesan en
+    un pool de WORKERS hilos.
+
+    Cada archivo se mueve a procesados/ (junto a él) antes de procesarlo, así
+    el barrido inicial de start_monitoring() solo encuentra lo que se exportó
+    con el backend detenido. Si el procesamiento falla se aparta en errores/:
+    devuelto a su carpeta, el evento del movimiento lo volvería a procesar
+    sin fin.
+    """
+    
+    ESPERA = 2
+    WORKERS = 4
+    REVISION = 0.2
+    PROCESADOS = 'procesados'
+    ERRORES = 'errores'
+    EXTENSIONES = ('.hl7', '.dcm')
     
     def __init__(self, watch_path='/home/equipos/export'):
         self.watch_path = watch_path
         os.makedirs(watch_path, exist_ok=True)
+        self._pendientes = {}   # ruta -> [firma, desde, cerrado]
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='FileMonitor')
+        threading.Thread(target=self._revisar, daemon=True, name='FileMonitorRevisor').start()
+    
+    def _es_procesado(self, filepath):
+        relativa = os.path.relpath(filepath, self.watch_path)
+        return bool({self.PROCESADOS, self.ERRORES} & set(relativa.split(os.sep)[:-1]))
+    
+    def _registrar(self, filepath, nuevo=True, cerrado=False):
+        if self._es_procesado(filepath):
+            return  # el propio movimiento a procesados/ o errores/
+        with self._lock:
+            pendiente = self._pendientes.get(filepath)
+            if pendiente is None:
+                if not nuevo:
+                    return  # modificación de un archivo ya procesado
+                pendiente = self._pendientes[filepath] = [None, time.monotonic(), False]
+            pendiente[2] = pendiente[2] or cerrado
     
     def on_created(self, event):
-        if event.is_directory:
-            return
-        
-        filepath = event.src_path
+        if not event.is_directory:
+            self._registrar(event.src_path)
+    
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._registrar(event.dest_path)
+    
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._registrar(event.src_path, nuevo=False)
+    
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._registrar(event.src_path, nuevo=False, cerrado=True)
+    
+    def barrer(self):
+        """Registrar los archivos que ya estaban en la carpeta (backend detenido)"""
+        encontrados = 0
+        for carpeta, subcarpetas, archivos in os.walk(self.watch_path):
+            subcarpetas[:] = [d for d in subcarpetas if d not in (self.PROCESADOS, self.ERRORES)]
+            for filename in archivos:
+                if filename.lower().endswith(self.EXTENSIONES):
+                    self._registrar(os.path.join(carpeta, filename))
+                    encontrados += 1
+        return encontrados
+    
+    def _revisar(self):
+        while True:
+            time.sleep(self.REVISION)
+            ahora = time.monotonic()
+            with self._lock:
+                pendientes = list(self._pendientes.items())
+            listos = []
+            for filepath, pendiente in pendientes:
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    listos.append((filepath, False))
+                    continue
+                firma = (st.st_size, st.st_mtime_ns)
+                if firma != pendiente[0]:
+                    pendiente[0], pendiente[1] = firma, ahora
+                    if not pendiente[2]:
+                        continue
+                elif not pendiente[2] and ahora - pendiente[1] < self.ESPERA:
+                    continue
+                listos.append((filepath, True))
+            with self._lock:
+                for filepath, existe in listos:
+                    self._pendientes.pop(filepath, None)
+            for filepath, existe in listos:
+                if existe:
+                    self._executor.submit(self.procesar, filepath)
+    
+    def _mover(self, filepath, subcarpeta, origen=None):
+        """Mueve `origen` (por defecto filepath) a <carpeta de filepath>/<subcarpeta>/"""
+        carpeta = os.path.join(os.path.dirname(filepath), subcarpeta)
+        os.makedirs(carpeta, exist_ok=True)
+        destino = os.path.join(carpeta, os.path.basename(filepath))
+        if os.path.exists(destino):
+            nombre, ext = os.path.splitext(os.path.basename(filepath))
+            destino = os.path.join(carpeta, f"{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{ext}")
+        os.replace(origen or filepath, destino)
+        return destino
+    
+    def procesar(self, filepath):
         filename = os.path.basename(filepath)
-        
-        # Esperar a que el archivo termine de escribirse
-        time.sleep(2)
-        
+        if not filename.lower().endswith(self.EXTENSIONES):
+            return
+        try:
+            destino = self._mover(filepath, self.PROCESADOS)
+        except PermissionError:
+            self._registrar(filepath)  # el equipo todavía lo tiene abierto (Windows)
+            return
+        except OSError as e:
+            logger.warning('No se pudo mover %s a %s/: %s', filepath, self.PROCESADOS, e)
+            return
         try:
-            if filename.endswith('.hl7'):
-                self.process_hl7(filepath)
-            elif filename.endswith('.dcm'):
-                self.process_dicom(filepath)
+            if filename.lower().endswith('.hl7'):
+                self.process_hl7(destino)
+            else:
+                self.process_dicom(destino)
         except Exception as e:
-            print(f"Error processing {filepath}: {str(e)}")
+            try:
+                apartado = self._mover(filepath, self.ERRORES, origen=destino)
+            except OSError:
+                apartado = destino
+            logger.error('Error procesando %s (apartado en %s): %s', filepath, apartado, e)
     
     def process_hl7(self, filepath):
         """Procesar archivo HL7"""
@@ -51,5 +167,7 @@ class FileMonitor(FileSystemEventHandler):
         observer = Observer()
         observer.schedule(event_handler, watch_path, recursive=True)
         observer.start()
-        print(f"Monitoring {watch_path} for new files...")
+        # Con el observer ya activo no queda hueco entre el barrido y los eventos
+        existentes = event_handler.barrer()
+        print(f"Monitoring {watch_path} for new files... ({existentes} pre-existing)")
         return observer
@@ -1,52 +1,90 @@
-from hl7apy.parser import parse_message
-from hl7apy.core import Message
+from app.utils.hl7_message import HL7Message, interpret_flag
 from datetime import datetime
-import os
 
 class HL7Service:
-    
+
     @staticmethod
-    def parse_hl7_file(filepath):
-        """Parsear archivo HL7 y extraer datos del paciente y resultados"""
+    def parse_hl7(data):
+        """
+        Parsear un mensaje HL7 en memoria (bytes o str) y extraer paciente y resultados.
+
+        Usa el tokenizador compartido con el desktop-agent (app/utils/hl7_message.py);
+        no carga hl7apy.
+        """
         try:
-            with open(filepath, 'r') as f:
-                hl7_content = f.read()
-            
-            message = parse_message(hl7_content)
-            
+            message = data if isinstance(data, HL7Message) else HL7Message(data)
+
+            msh = message.segment('MSH')
+            pid = message.segment('PID')
+
             # Extraer datos del paciente (PID segment)
-            pid = message.pid
             patient_data = {
-                'patient_id': str(pid.pid_3) if pid.pid_3 else None,
-                'name': str(pid.pid_5) if pid.pid_5 else None,
-                'dob': str(pid.pid_7) if pid.pid_7 else None,
-                'sex': str(pid.pid_8) if pid.pid_8 else None
-            }
-            
-            # Extraer resultados (OBX segments)
+                'patient_id': pid.value(3) or None,
+                'name': pid.field(5) or None,
+                'dob': pid.value(7) or None,
+                'sex': pid.value(8) or None
+            } if pid else {'patient_id': None, 'name': None, 'dob': None, 'sex': None}
+
+            # Extraer resultados (OBX segments), agrupados bajo su OBR
             results = []
-            for obx in message.obx:
-                results.append({
-                    'test_id': str(obx.obx_3) if obx.obx_3 else None,
-                    'test_name': str(obx.obx_3.obx_3_2) if obx.obx_3.obx_3_2 else None,
-                    'value': str(obx.obx_5) if obx.obx_5 else None,
-                    'units': str(obx.obx_6) if obx.obx_6 else None,
-                    'reference_range': str(obx.obx_7) if obx.obx_7 else None,
-                    'status': str(obx.obx_11) if obx.obx_11 else None
-                })
-            
+            for obr, observaciones in message.groups('OBR', 'OBX'):
+                order_id = (obr.value(2) or obr.value(3) or None) if obr else None
+                for obx in observaciones:
+                    results.append({
+                        'order_id': order_id,
+                        'test_id': obx.value(3, 1) or None,
+                        'test_name': obx.value(3, 2) or obx.value(3, 1) or None,
+                        'value': obx.value(5, component=None) or None,
+                        'units': obx.value(6) or None,
+                        'reference_range': obx.value(7, component=None) or None,
+                        'flag': obx.value(8) or None,
+                        'status': obx.value(11) or None
+                    })
+
             return {
+                'raw': message.text,
                 'patient': patient_data,
                 'results': results,
-                'message_type': str(message.msh.msh_9) if message.msh.msh_9 else None,
+                'message_type': msh.field(9) or None,
+                'control_id': msh.value(10) or None,
+                'sending_application': msh.value(3) or None,
                 'timestamp': datetime.now().isoformat()
             }
         except Exception as e:
             raise Exception(f"Error parsing HL7: {str(e)}")
-    
+
+    @staticmethod
+    def parse_hl7_file(filepath):
+        """Parsear archivo HL7 y extraer datos del paciente y resultados"""
+        with open(filepath, 'rb') as f:
+            return HL7Service.parse_hl7(f.read())
+
+    @staticmethod
+    def valores(parsed):
+        """
+        Resultados de parse_hl7 en el formato de `valores` de los resultados:
+        {"hemoglobina": {"valor": "14.5", "unidad": "g/dL", "referencia": "12-16", "estado": "normal"}}
+        """
+        valores = {}
+        for r in parsed['results']:
+            nombre = r['test_name'] or r['test_id']
+            if not nombre:
+                continue
+            valores[nombre] = {
+                'valor': r['value'],
+                'unidad': r['units'],
+                'referencia': r['reference_range'],
+                'estado': interpret_flag(r['flag'])
+            }
+        return valores
+
     @staticmethod
     def create_hl7_message(patient_data, order_data):
         """Crear mensaje HL7 para enviar a equipos"""
+        # hl7apy solo se necesita para generar mensajes: se importa aquí para
+        # no cargarlo al arrancar cada worker
+        from hl7apy.core import Message
+
         msg = Message("ORM_O01")
         msg.msh.msh_3 = "CENTRO_DIAGNOSTICO"
         msg.msh.msh_4 = "LAB"
@@ -55,11 +93,11 @@ class HL7Service:
         msg.msh.msh_10 = str(order_data['order_id'])
         msg.msh.msh_11 = "P"
         msg.msh.msh_12 = "2.5"
-        
+
         msg.pid.pid_1 = "1"
         msg.pid.pid_3 = patient_data['patient_id']
         msg.pid.pid_5 = patient_data['name']
         msg.pid.pid_7 = patient_data.get('dob', '')
         msg.pid.pid_8 = patient_data.get('sex', '')
-        
+
         return msg.to_er7()
@@ -0,0 +1,326 @@
+"""
+Ingesta de resultados por lotes desde los equipos (desktop-agent)
+
+Un lote se resuelve con una consulta para las órdenes, un INSERT
+multi-fila y una consulta para los duplicados, todo en una transacción.
+Cada resultado puede traer una idempotency_key: reenviarlo devuelve el
+resultado ya creado en vez de insertar otra fila. Además cada fila lleva
+una clave_dedup (MSH-3, MSH-10 y MSH-7 del HL7, SOPInstanceUID del DICOM o
+hash del contenido), así el mismo resultado recibido por dos vías tampoco se
+duplica.
+
+Un resultado sin orden (los archivos DICOM/PDF no la traen) o con una orden
+que no existe no se rechaza: se guarda sin asignar (orden_detalle_id NULL)
+con la referencia que envió el equipo, y se asigna después con asignar().
+"""
+from app.db_pool import get_db_connection
+from app.services.archivos_equipos import ArchivosEquipos
+from app.services.hl7_service import HL7Service
+from app.utils.hl7_message import HL7Message, HL7Segment
+from psycopg2.extras import execute_values
+from datetime import datetime
+import hashlib
+import json
+import uuid
+
+MAX_LOTE = 1000
+MAX_CLAVE_DEDUP = 200
+MAX_REFERENCIA = 100
+
+
+class IngestaResultados:
+
+    @staticmethod
+    def _control_hl7(mensaje):
+        """
+        (MSH-3, MSH-10, MSH-7) del mensaje HL7: aplicación emisora, ID de
+        control y fecha. Se leen con el tokenizador del agente, así la clave
+        es la misma que arma el agente con los campos que envía.
+        """
+        try:
+            msh = HL7Segment(HL7Message(mensaje or ''), 0)
+        except ValueError:
+            return '', '', ''
+        return msh.value(3), msh.value(10), msh.value(7)
+
+    @staticmethod
+    def _clave(tipo, valor):
+        clave = f'{tipo}:{valor}'
+        if len(clave) > MAX_CLAVE_DEDUP:
+            clave = f'{tipo}:sha256:{hashlib.sha256(valor.encode()).hexdigest()}'
+        return clave
+
+    @staticmethod
+    def clave_dedup(item, contenido=None):
+        """
+        Clave de deduplicación del resultado.
+
+        Por orden de preferencia: 'hl7:<MSH-3>|<MSH-10>|<MSH-7>',
+        'dicom:<SOPInstanceUID>' o 'sha256:<hash>' del contenido (los bytes del
+        archivo si se pasan en `contenido`, si no la orden y los valores).
+        La fecha del mensaje distingue dos resultados con el mismo MSH-10
+        cuando el equipo reinicia su contador.
+        """
+        emisor = item.get('aplicacion_emisora') or ''
+        control = item.get('control_id')
+        fecha = item.get('fecha_mensaje') or ''
+        if item.get('mensaje_hl7') and (not control or not fecha):
+            msh3, msh10, msh7 = IngestaResultados._control_hl7(item['mensaje_hl7'])
+            if not control:
+                emisor, control = msh3, msh10
+            fecha = fecha or msh7
+        if control:
+            return IngestaResultados._clave('hl7', f'{emisor}|{control}|{fecha}')
+
+        uid = item.get('sop_instance_uid')
+        if uid:
+            return IngestaResultados._clave('dicom', str(uid).strip())
+
+        if contenido is None:
+            campos = {k: item.get(k) for k in ('tipo_estudio', 'valores', 'mensaje_hl7', 'file_path')}
+            campos['orden_id'] = str(item.get('orden_id') or '').strip()
+            contenido = json.dumps(campos, sort_keys=True, default=str).encode()
+        return f'sha256:{hashlib.sha256(contenido).hexdigest()}'
+
+    @staticmethod
+    def existente(cur, clave_dedup, idempotency_key=None):
+        """
+        Id del resultado ya registrado con esa clave de deduplicación (o con
+        esa idempotency_key, si se pasa), o None. Búsqueda por índice único.
+        """
+        cur.execute("SELECT id FROM resultados WHERE clave_dedup = %s OR idempotency_key = %s LIMIT 1",
+                    (clave_dedup, idempotency_key))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _orden_ref(item):
+        """Referencia de orden del item: id numérico o número de orden"""
+        orden = item.get('orden_id')
+        if orden is None or orden == '':
+            return None
+        orden = str(orden).strip()
+        return int(orden) if orden.isdigit() else orden
+
+    @staticmethod
+    def _resolver_detalles(cur, refs):
+        """Último orden_detalle de cada orden, por id o por numero_orden, en una consulta"""
+        ids = [r for r in refs if isinstance(r, int)]
+        numeros = [r for r in refs if isinstance(r, str)]
+        if not ids and not numeros:
+            return {}
+        cur.execute("""
+            SELECT DISTINCT ON (o.id) o.id, o.numero_orden, od.id
+            FROM ordenes o
+            JOIN orden_detalles od ON od.orden_id = o.id
+            WHERE o.id = ANY(%s) OR o.numero_orden = ANY(%s)
+            ORDER BY o.id, od.id DESC
+        """, (ids, numeros))
+        detalles = {}
+        for orden_id, numero_orden, detalle_id in cur.fetchall():
+            detalles[orden_id] = detalle_id
+            if numero_orden:
+                detalles[numero_orden] = detalle_id
+        return detalles
+
+    @staticmethod
+    def detalle_orden(cur, orden_id):
+        """
+        Último orden_detalle de la orden, buscada por id numérico o por
+        numero_orden (los equipos envían el código alfanumérico en OBR-2),
+        o None si no hay orden o no existe.
+        """
+        ref = IngestaResultados._orden_ref({'orden_id': orden_id})
+        if ref is None:
+            return None
+        return IngestaResultados._resolver_detalles(cur, {ref}).get(ref)
+
+    @staticmethod
+    def _referencia(valor):
+        valor = str(valor or '').strip()
+        return valor[:MAX_REFERENCIA] or None
+
+    @staticmethod
+    def referencias(item):
+        """(orden_referencia, paciente_referencia): lo que envió el equipo, para asignar después"""
+        return (IngestaResultados._referencia(item.get('orden_id')),
+                IngestaResultados._referencia(item.get('paciente_id') or item.get('cedula')))
+
+    @staticmethod
+    def _fila(item, detalle_id, sello):
+        tipo = item.get('tipo_archivo')
+        if tipo not in ('dicom', 'pdf'):
+            tipo = 'dicom' if item.get('file_path') else 'hl7'
+        es_archivo = tipo != 'hl7'
+        if es_archivo:
+            datos = {k: item.get(k) for k in ('tipo_estudio', 'study_date', 'series_description')}
+            nombre = item.get('file_name') or f"{tipo}_{sello}.{'dcm' if tipo == 'dicom' else 'pdf'}"
+        else:
+            datos = item.get('valores')
+            if not datos and item.get('mensaje_hl7'):
+                datos = HL7Service.valores(HL7Service.parse_hl7(item['mensaje_hl7']))
+            nombre = f'resultado_{item.get("tipo_estudio") or "analisis"}_{sello}.hl7'
+        return (
+            detalle_id,
+            tipo,
+            nombre[:255],
+            item.get('file_path') if es_archivo else None,
+            item.get('mensaje_hl7'),
+            json.dumps(datos),
+            'pendiente',
+            item.get('idempotency_key'),
+            item.get('clave_dedup'),
+            *IngestaResultados.referencias(item),
+            IngestaResultados._referencia(item.get('station_name')),
+        )
+
+    @staticmethod
+    def insertar_lote(items):
+        """
+        Insertar un lote de resultados.
+
+        Returns:
+            Lista con un estado por item, en el mismo orden:
+            {'indice', 'idempotency_key', 'estado': creado|duplicado|error, 'resultado_id'|'error'}
+            y 'sin_asignar': True en los creados sin orden
+        """
+        estados = [None] * len(items)
+        vistos = {}
+        pendientes = []
+
+        # Archivos subidos antes por /api/maquinas/archivos: el item trae
+        # archivo_id (upload_id) y se guarda la ruta del servidor
+        rutas = ArchivosEquipos.rutas(
+            item.get('archivo_id') for item in items if isinstance(item, dict)
+        )
+
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                estados[i] = {'indice': i, 'estado': 'error', 'error': 'Elemento inválido'}
+                continue
+            # Sin clave del cliente se genera una, para mapear el RETURNING a cada item
+            clave = str(item.get('idempotency_key') or f'srv-{uuid.uuid4().hex}')[:64]
+            if item.get('archivo_id'):
+                item['file_path'] = rutas.get(str(item['archivo_id']))
+            dedup = IngestaResultados.clave_dedup(item)
+            item['idempotency_key'] = clave
+            item['clave_dedup'] = dedup
+            estados[i] = {'indice': i, 'idempotency_key': clave}
+            if item.get('archivo_id') and not item['file_path']:
+                estados[i].update(estado='error', error='Archivo no recibido')
+            elif ('clave', clave) in vistos or ('dedup', dedup) in vistos:
+                # Repetido dentro del mismo lote: se resuelve con el primero
+                estados[i]['duplicado_de'] = vistos.get(('clave', clave), vistos.get(('dedup', dedup)))
+            else:
+                vistos[('clave', clave)] = vistos[('dedup', dedup)] = i
+                pendientes.append(i)
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            detalles = IngestaResultados._resolver_detalles(
+                cur, {IngestaResultados._orden_ref(items[i]) for i in pendientes} - {None}
+            )
+
+            sello = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filas, indices = [], []
+            for i in pendientes:
+                # Sin orden o con una que no existe: queda sin asignar
+                detalle_id = detalles.get(IngestaResultados._orden_ref(items[i]))
+                if detalle_id is None:
+                    estados[i]['sin_asignar'] = True
+                try:
+                    filas.append(IngestaResultados._fila(items[i], detalle_id, f'{sello}_{i}'))
+                except Exception as e:
+                    estados[i].update(estado='error', error=str(e))
+                    continue
+                indices.append(i)
+
+            creados = {}
+            if filas:
+                insertados = execute_values(cur, """
+                    INSERT INTO resultados (
+                        orden_detalle_id, tipo_archivo, nombre_archivo, ruta_archivo,
+                        datos_hl7, datos_dicom, estado_validacion, idempotency_key,
+                        clave_dedup, orden_referencia, paciente_referencia, estacion,
+                        fecha_importacion, created_at
+                    ) VALUES %s
+                    ON CONFLICT DO NOTHING
+                    RETURNING id, idempotency_key
+                """, filas, template='(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())',
+                    page_size=len(filas), fetch=True)
+                creados = {clave: rid for rid, clave in insertados}
+
+                # Lo que no entró chocó con una idempotency_key o una clave_dedup ya registrada
+                por_clave, por_dedup = {}, {}
+                faltantes = [items[i] for i in indices if items[i]['idempotency_key'] not in creados]
+                if faltantes:
+                    cur.execute("""
+                        SELECT idempotency_key, clave_dedup, id FROM resultados
+                        WHERE idempotency_key = ANY(%s) OR clave_dedup = ANY(%s)
+                    """, ([f['idempotency_key'] for f in faltantes], [f['clave_dedup'] for f in faltantes]))
+                    for clave, dedup, rid in cur.fetchall():
+                        por_clave[clave] = rid
+                        por_dedup[dedup] = rid
+
+                for i in indices:
+                    clave = items[i]['idempotency_key']
+                    if clave in creados:
+                        estados[i].update(estado='creado', resultado_id=creados[clave])
+                    else:
+                        rid = por_clave.get(clave) or por_dedup.get(items[i]['clave_dedup'])
+                        estados[i].pop('sin_asignar', None)
+                        estados[i].update(estado='duplicado', resultado_id=rid)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+        for estado in estados:
+            if 'duplicado_de' in estado:
+                original = estados[estado.pop('duplicado_de')]
+                if original.get('estado') == 'error':
+                    estado.update(estado='error', error=original.get('error'))
+                else:
+                    estado.update(estado='duplicado', resultado_id=original.get('resultado_id'))
+        return estados
+
+    @staticmethod
+    def asignar(resultado_id, orden_id):
+        """
+        Asignar un resultado sin orden al último detalle de la orden
+        (id numérico o numero_orden).
+
+        Returns:
+            orden_detalle_id asignado
+
+        Raises:
+            ValueError: sin orden_id
+            LookupError: orden inexistente o resultado ya asignado / inexistente
+        """
+        if IngestaResultados._orden_ref({'orden_id': orden_id}) is None:
+            raise ValueError('orden_id requerido')
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            detalle_id = IngestaResultados.detalle_orden(cur, orden_id)
+            if detalle_id is None:
+                raise LookupError('Orden no encontrada')
+            cur.execute("""
+                UPDATE resultados SET orden_detalle_id = %s
+                WHERE id = %s AND orden_detalle_id IS NULL
+            """, (detalle_id, resultado_id))
+            if cur.rowcount != 1:
+                raise LookupError('Resultado no encontrado o ya asignado')
+            conn.commit()
+            return detalle_id
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
@@ -4,7 +4,9 @@ Recibe resultados vía HL7, DICOM o API REST desde las máquinas
 """
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-import psycopg2
+from app.db_pool import get_db_connection
+from app.services.ingesta_resultados import IngestaResultados
+from app.services.hl7_service import HL7Service
 import os
 import json
 from datetime import datetime
@@ -12,53 +14,66 @@ import hashlib
 
 maquinas_bp = Blueprint('maquinas', __name__)
 
-def get_db_connection():
-    return psycopg2.connect(os.getenv('DATABASE_URL'))
+def _respuesta_duplicado(cur, conn, resultado_id):
+    """Respuesta para un resultado que ya estaba registrado (reintento del equipo)"""
+    cur.close()
+    conn.close()
+    return jsonify({
+        'success': True,
+        'resultado_id': resultado_id,
+        'duplicado': True,
+        'message': 'Resultado ya recibido'
+    }), 200
 
 @maquinas_bp.route('/recibir-hl7', methods=['POST'])
 def recibir_resultado_hl7():
     """
     Endpoint para que las máquinas de laboratorio envíen resultados en formato HL7
     La máquina hace POST a: http://192.9.135.84:5000/api/maquinas/recibir-hl7
+    
+    Acepta JSON {"mensaje_hl7": ..., "paciente_id": ..., "orden_id": ...} o el
+    mensaje HL7 crudo en el cuerpo (paciente_id/orden_id en la query string o,
+    si faltan, PID-3 y OBR-2 del mensaje). La orden se busca por id o por
+    numero_orden; si no aparece el resultado queda sin asignar con la
+    referencia recibida, no se rechaza el mensaje.
     """
     try:
-        data = request.json
+        if request.is_json:
+            data = request.json
+        else:
+            data = request.args.to_dict()
+            data['mensaje_hl7'] = request.get_data()
         
         # Validar datos requeridos
         if not data.get('mensaje_hl7'):
             return jsonify({'error': 'mensaje_hl7 es requerido'}), 400
         
-        # Parsear mensaje HL7
-        mensaje_hl7 = data['mensaje_hl7']
+        # Parsear mensaje HL7 en memoria: OBX -> valores estructurados
+        try:
+            parsed = HL7Service.parse_hl7(data['mensaje_hl7'])
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        mensaje_hl7 = parsed['raw']
+        data['mensaje_hl7'] = mensaje_hl7
         
-        # Extraer información del mensaje HL7
-        # Formato típico: MSH|^~\&|LAB|HOSPITAL|...
-        lineas = mensaje_hl7.split('\n')
-        
-        paciente_id = data.get('paciente_id')
-        orden_id = data.get('orden_id')
-        
-        if not paciente_id or not orden_id:
-            return jsonify({'error': 'paciente_id y orden_id son requeridos'}), 400
+        data['paciente_id'] = data.get('paciente_id') or parsed['patient']['patient_id']
+        data['orden_id'] = data.get('orden_id') or next(
+            (r['order_id'] for r in parsed['results'] if r['order_id']), None
+        )
         
+        clave_dedup = IngestaResultados.clave_dedup(data)
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Buscar orden_detalle_id
-        cur.execute("""
-            SELECT id FROM orden_detalles 
-            WHERE orden_id = %s 
-            ORDER BY id DESC LIMIT 1
-        """, (orden_id,))
+        existente = IngestaResultados.existente(cur, clave_dedup)
+        if existente:
+            return _respuesta_duplicado(cur, conn, existente)
         
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'error': 'Orden no encontrada'}), 404
-        
-        orden_detalle_id = row[0]
+        # Orden por id o numero_orden; sin orden queda sin asignar (NULL)
+        orden_detalle_id = IngestaResultados.detalle_orden(cur, data['orden_id'])
         
         # Crear resultado
-        valores_json = data.get('valores', {})
+        valores_json = data.get('valores') or HL7Service.valores(parsed)
         
         cur.execute("""
             INSERT INTO resultados (
@@ -68,9 +83,13 @@ def recibir_resultado_hl7():
                 datos_hl7,
                 datos_dicom,
                 estado_validacion,
+                clave_dedup,
+                orden_referencia,
+                paciente_referencia,
                 fecha_importacion,
                 created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT (clave_dedup) DO NOTHING
             RETURNING id
         """, (
             orden_detalle_id,
@@ -78,10 +97,16 @@ def recibir_resultado_hl7():
             f'resultado_hl7_{datetime.now().strftime("%Y%m%d_%H%M%S")}.hl7',
             mensaje_hl7,
             json.dumps(valores_json),
-            'pendiente'
+            'pendiente',
+            clave_dedup,
+            *IngestaResultados.referencias(data)
         ))
         
-        resultado_id = cur.fetchone()[0]
+        row = cur.fetchone()
+        if not row:
+            conn.commit()
+            return _respuesta_duplicado(cur, conn, IngestaResultados.existente(cur, clave_dedup))
+        resultado_id = row[0]
         conn.commit()
         
         cur.close()
@@ -90,6 +115,7 @@ def recibir_resultado_hl7():
         return jsonify({
             'success': True,
             'resultado_id': resultado_id,
+            'sin_asignar': orden_detalle_id is None,
             'message': 'Resultado recibido y almacenado correctamente'
         }), 201
         
@@ -115,6 +141,25 @@ def recibir_resultado_dicom():
         if not paciente_id or not orden_id:
             return jsonify({'error': 'paciente_id y orden_id son requeridos'}), 400
         
+        # Calcular hashes por bloques antes de guardar: si la instancia ya se
+        # recibió no se escribe otra copia en disco
+        md5, sha256 = hashlib.md5(), hashlib.sha256()
+        for bloque in iter(lambda: archivo.stream.read(1024 * 1024), b''):
+            md5.update(bloque)
+            sha256.update(bloque)
+        archivo.stream.seek(0)
+        file_hash = md5.hexdigest()
+        clave_dedup = IngestaResultados.clave_dedup(
+            {'sop_instance_uid': request.form.get('sop_instance_uid')}, sha256.digest()
+        )
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        existente = IngestaResultados.existente(cur, clave_dedup)
+        if existente:
+            return _respuesta_duplicado(cur, conn, existente)
+        
         # Guardar archivo
         upload_dir = '/home/opc/centro-diagnostico/uploads/dicom'
         os.makedirs(upload_dir, exist_ok=True)
@@ -123,25 +168,8 @@ def recibir_resultado_dicom():
         filepath = os.path.join(upload_dir, filename)
         archivo.save(filepath)
         
-        # Calcular hash
-        with open(filepath, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        
-        # Guardar en BD
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT id FROM orden_detalles 
-            WHERE orden_id = %s 
-            ORDER BY id DESC LIMIT 1
-        """, (orden_id,))
-        
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'error': 'Orden no encontrada'}), 404
-        
-        orden_detalle_id = row[0]
+        # Guardar en BD; una orden que no existe deja el resultado sin asignar
+        orden_detalle_id = IngestaResultados.detalle_orden(cur, orden_id)
         
         cur.execute("""
             INSERT INTO resultados (
@@ -152,9 +180,13 @@ def recibir_resultado_dicom():
                 tamano_bytes,
                 hash_archivo,
                 estado_validacion,
+                clave_dedup,
+                orden_referencia,
+                paciente_referencia,
                 fecha_importacion,
                 created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT (clave_dedup) DO NOTHING
             RETURNING id
         """, (
             orden_detalle_id,
@@ -163,10 +195,18 @@ def recibir_resultado_dicom():
             filepath,
             os.path.getsize(filepath),
             file_hash,
-            'pendiente'
+            'pendiente',
+            clave_dedup,
+            *IngestaResultados.referencias(request.form)
         ))
         
-        resultado_id = cur.fetchone()[0]
+        row = cur.fetchone()
+        if not row:
+            # Otra petición concurrente registró la misma instancia
+            conn.commit()
+            os.remove(filepath)
+            return _respuesta_duplicado(cur, conn, IngestaResultados.existente(cur, clave_dedup))
+        resultado_id = row[0]
         conn.commit()
         
         cur.close()
@@ -176,6 +216,7 @@ def recibir_resultado_dicom():
             'success': True,
             'resultado_id': resultado_id,
             'filename': filename,
+            'sin_asignar': orden_detalle_id is None,
             'message': 'Imagen DICOM recibida correctamente'
         }), 201
         
@@ -210,21 +251,16 @@ def recibir_resultado_json():
         if not paciente_id or not orden_id:
             return jsonify({'error': 'paciente_id y orden_id son requeridos'}), 400
         
+        clave_dedup = IngestaResultados.clave_dedup(data)
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Buscar orden_detalle
-        cur.execute("""
-            SELECT id FROM orden_detalles 
-            WHERE orden_id = %s 
-            ORDER BY id DESC LIMIT 1
-        """, (orden_id,))
-        
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'error': 'Orden no encontrada'}), 404
+        existente = IngestaResultados.existente(cur, clave_dedup)
+        if existente:
+            return _respuesta_duplicado(cur, conn, existente)
         
-        orden_detalle_id = row[0]
+        # Buscar orden_detalle (id o numero_orden); si no existe queda sin asignar
+        orden_detalle_id = IngestaResultados.detalle_orden(cur, orden_id)
         
         # Insertar resultado
         cur.execute("""
@@ -234,19 +270,29 @@ def recibir_resultado_json():
                 nombre_archivo,
                 datos_dicom,
                 estado_validacion,
+                clave_dedup,
+                orden_referencia,
+                paciente_referencia,
                 fecha_importacion,
                 created_at
-            ) VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            ON CONFLICT (clave_dedup) DO NOTHING
             RETURNING id
         """, (
             orden_detalle_id,
             'json',
             f'resultado_{data.get("tipo_estudio", "analisis")}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
             json.dumps(valores),
-            'pendiente'
+            'pendiente',
+            clave_dedup,
+            *IngestaResultados.referencias(data)
         ))
         
-        resultado_id = cur.fetchone()[0]
+        row = cur.fetchone()
+        if not row:
+            conn.commit()
+            return _respuesta_duplicado(cur, conn, IngestaResultados.existente(cur, clave_dedup))
+        resultado_id = row[0]
         conn.commit()
         
         cur.close()
@@ -255,6 +301,7 @@ def recibir_resultado_json():
         return jsonify({
             'success': True,
             'resultado_id': resultado_id,
+            'sin_asignar': orden_detalle_id is None,
             'message': 'Resultado recibido correctamente'
         }), 201
         
@@ -262,6 +309,15 @@ def recibir_resultado_json():
         print(f"Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@maquinas_bp.route('/recibir-lote', methods=['POST'])
+def recibir_lote():
+    """
+    Endpoint de lotes para el desktop-agent y equipos que envían muchos resultados
+    La máquina hace POST a: http://192.9.135.84:5000/api/maquinas/recibir-lote
+    """
+    from app.routes.maquinas import recibir_lote as recibir_lote_route
+    return recibir_lote_route()
+
 @maquinas_bp.route('/estado', methods=['GET'])
 def estado_servicio():
     """Verificar que el servicio de integración está activo"""
@@ -271,7 +327,8 @@ def estado_servicio():
         'endpoints': {
             'hl7': '/api/maquinas/recibir-hl7',
             'dicom': '/api/maquinas/recibir-dicom',
-            'json': '/api/maquinas/recibir-json'
+            'json': '/api/maquinas/recibir-json',
+            'lote': '/api/maquinas/recibir-lote'
         },
         'timestamp': datetime.now().isoformat()
     }), 200
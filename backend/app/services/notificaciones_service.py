@@ -1,6 +1,4 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from app.services.smtp_sesion import construir, pool
 import os
 
 class NotificacionService:
@@ -8,7 +6,7 @@ class NotificacionService:
     
     @staticmethod
     def enviar_email(destinatario, asunto, cuerpo):
-        """Enviar email usando SMTP"""
+        """Enviar email usando SMTP (sesión reutilizada del pool)"""
         try:
             smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
             smtp_port = int(os.getenv('SMTP_PORT', 587))
@@ -19,16 +17,8 @@ class NotificacionService:
                 print("?? Credenciales SMTP no configuradas")
                 return False
             
-            msg = MIMEMultipart()
-            msg['From'] = smtp_user
-            msg['To'] = destinatario
-            msg['Subject'] = asunto
-            msg.attach(MIMEText(cuerpo, 'html'))
-            
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(smtp_user, smtp_pass)
-                server.send_message(msg)
+            with pool.sesion(smtp_server, smtp_port, smtp_user, smtp_pass) as sesion:
+                sesion.enviar(smtp_user, [destinatario], construir(smtp_user, destinatario, asunto, cuerpo))
             
             print(f"? Email enviado a {destinatario}")
             return True
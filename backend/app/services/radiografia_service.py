@@ -1,80 +1,215 @@
-from PIL import Image, ImageEnhance, ImageFilter
-import base64
+"""
+Procesado de radiografías sobre la imagen ya decodificada.
+
+La imagen original de cada radiografía se decodifica una vez y queda en las
+sesiones de imagen (app/services/sesiones_imagen.py): los DICOM monocromo en
+modalidad original, para poder cambiar la ventana, y el resto como PIL.
+Ventana, contraste, brillo e inversión son transformaciones por píxel, así
+que se combinan en una sola tabla y se aplican en una pasada; la nitidez es
+el único filtro que recorre la imagen otra vez.
+"""
+from app.services.sesiones_imagen import EntradaImagen, sesiones
+from PIL import Image, ImageFilter, ImageStat
 from io import BytesIO
 import os
 
+FORMATOS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# Extensiones que se aceptan como imagen original de una radiografía
+EXTENSIONES = {'dcm', 'png', 'jpg', 'jpeg', 'tif', 'tiff'}
+
+
+def firma(ruta):
+    """Identifica la versión del archivo en disco (ruta, mtime, tamaño)."""
+    st = os.stat(ruta)
+    return (os.path.realpath(ruta), st.st_mtime_ns, st.st_size)
+
+
+def es_dicom(fuente):
+    """True si la ruta o el archivo abierto tiene el prefijo DICM del Part 10."""
+    if isinstance(fuente, (str, os.PathLike)):
+        if str(fuente).lower().endswith('.dcm'):
+            return True
+        with open(fuente, 'rb') as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    inicio = fuente.tell()
+    try:
+        fuente.seek(128)
+        return fuente.read(4) == b'DICM'
+    finally:
+        fuente.seek(inicio)
+
+
 class RadiologiaService:
-    
+
     @staticmethod
-    def procesar_imagen(imagen_base64):
-        """Procesar imagen radiográfica"""
-        # Decodificar base64
-        img_data = base64.b64decode(imagen_base64.split(',')[1] if ',' in imagen_base64 else imagen_base64)
-        img = Image.open(BytesIO(img_data))
-        
-        # Convertir a escala de grises si no lo está
-        if img.mode != 'L':
+    def decodificar(fuente):
+        """
+        Imagen original (ruta o archivo abierto) -> PIL en modo L o RGB.
+
+        Los DICOM salen con su LUT de modalidad y ventana por defecto.
+        """
+        if es_dicom(fuente):
+            from app.services.dicom_render import DicomRender
+            pixeles, _ = DicomRender.frame_uint8(fuente)
+            return Image.fromarray(pixeles)
+        img = Image.open(fuente)
+        img.load()
+        if img.mode not in ('L', 'RGB'):
             img = img.convert('L')
-        
-        # Mejoras automáticas
-        # 1. Ajustar contraste
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
-        
-        # 2. Ajustar brillo
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.2)
-        
-        # 3. Nitidez
-        img = img.filter(ImageFilter.SHARPEN)
-        
-        # Convertir de vuelta a base64
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        return {
-            'imagen_procesada': f"data:image/png;base64,{img_base64}",
-            'ancho': img.width,
-            'alto': img.height,
-            'formato': 'PNG'
+        return img
+
+    @staticmethod
+    def cargar(ruta, frame=0):
+        """
+        Decodifica la imagen original en una EntradaImagen.
+
+        De un DICOM monocromo se guardan los píxeles sin ventanear y su
+        histograma (la media de gris de cualquier ventana sale de él sin
+        recorrer la imagen).
+        """
+        if not es_dicom(ruta):
+            img = RadiologiaService.decodificar(ruta)
+            return EntradaImagen(imagen=img, media=_media(img))
+
+        import numpy as np
+        from app.services.dicom_render import DicomRender, usa_tabla, vista_sin_signo, color_uint8
+
+        pixeles, meta = DicomRender.frame(ruta, frame)
+        frames = int(meta.get('NumberOfFrames') or 1)
+        if pixeles.ndim == 3:
+            img = Image.fromarray(color_uint8(pixeles))
+            return EntradaImagen(imagen=img, media=_media(img), meta=meta, frames=frames)
+        histograma = None
+        if usa_tabla(pixeles):
+            histograma = np.bincount(vista_sin_signo(pixeles).ravel(),
+                                     minlength=2 ** (8 * pixeles.dtype.itemsize))
+        return EntradaImagen(pixeles=pixeles, meta=meta, histograma=histograma, frames=frames)
+
+    @staticmethod
+    def imagen(radiografia_id, ruta, frame=0, entrada=None, sesion_id=None):
+        """
+        EntradaImagen de la radiografía, desde las sesiones si el archivo no
+        cambió. Con `entrada` (recién subida) se guarda sin volver a leer el
+        archivo.
+        """
+        clave = (radiografia_id, frame)
+        f = firma(ruta)
+        if entrada is None:
+            entrada = sesiones.get(clave, f, sesion_id)
+            if entrada is not None:
+                return entrada
+            entrada = RadiologiaService.cargar(ruta, frame)
+        return sesiones.put(clave, f, entrada)
+
+    @staticmethod
+    def renderizar(entrada, contraste=1.0, brillo=1.0, invertir=False, nitidez=False, centro=None, ancho=None):
+        """
+        Imagen de 8 bits con la ventana (centro/ancho; por defecto la del
+        DICOM) y los ajustes aplicados. No modifica la entrada.
+        """
+        if entrada.pixeles is None:
+            return RadiologiaService.ajustar(entrada.imagen, entrada.media, contraste, brillo, invertir, nitidez)
+
+        import numpy as np
+        from app.services.dicom_render import a_uint8, tabla_ventana, vista_sin_signo
+
+        ajustes = contraste != 1.0 or brillo != 1.0 or invertir
+        if entrada.histograma is None:
+            img = Image.fromarray(a_uint8(entrada.pixeles, entrada.meta, centro, ancho))
+            return RadiologiaService.ajustar(img, _media(img), contraste, brillo, invertir, nitidez)
+
+        tabla = tabla_ventana(entrada.pixeles.dtype, entrada.meta, entrada.minimo, entrada.maximo, centro, ancho)
+        if ajustes:
+            media = int(entrada.histograma @ tabla / entrada.pixeles.size + 0.5)
+            # Ventana y ajustes en una sola tabla: un único recorrido de los píxeles
+            tabla = np.asarray(RadiologiaService.tabla(media, contraste, brillo, invertir), dtype=np.uint8)[tabla]
+        img = Image.fromarray(tabla[vista_sin_signo(entrada.pixeles)])
+        if nitidez:
+            img = img.filter(ImageFilter.SHARPEN)
+        return img
+
+    @staticmethod
+    def parametros(args):
+        """
+        Lee contraste, brillo, invertir, nitidez, wc/ww (centro/ancho de la
+        ventana), frame y formato (query o form).
+
+        Raises:
+            ValueError: si algún valor no es válido
+        """
+        formato = args.get('formato', 'png').lower()
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no soportado: {formato}')
+        params = {
+            'contraste': float(args.get('contraste', 1.0)),
+            'brillo': float(args.get('brillo', 1.0)),
+            'invertir': str(args.get('invertir', '')).lower() in ('1', 'true', 'si', 'sí'),
+            'nitidez': str(args.get('nitidez', '')).lower() in ('1', 'true', 'si', 'sí'),
+            'formato': formato,
+            'centro': float(args['wc']) if args.get('wc') not in (None, '') else None,
+            'ancho': float(args['ww']) if args.get('ww') not in (None, '') else None,
+            'frame': int(args.get('frame', 0)),
         }
-    
+        if not (0 <= params['contraste'] <= 10 and 0 <= params['brillo'] <= 10):
+            raise ValueError('contraste y brillo deben estar entre 0 y 10')
+        return params
+
+    @staticmethod
+    def tabla(media, contraste=1.0, brillo=1.0, invertir=False):
+        """
+        Tabla de 256 entradas equivalente a ImageEnhance.Contrast seguido de
+        ImageEnhance.Brightness (con el mismo recorte entre pasos) e inversión.
+        """
+        tabla = []
+        for x in range(256):
+            y = min(max(int(media + contraste * (x - media)), 0), 255)
+            y = min(max(int(brillo * y), 0), 255)
+            tabla.append(255 - y if invertir else y)
+        return tabla
+
     @staticmethod
-    def ajustar_contraste(imagen_base64, factor):
-        """Ajustar contraste de imagen"""
-        img_data = base64.b64decode(imagen_base64.split(',')[1])
-        img = Image.open(BytesIO(img_data))
-        
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(factor)
-        
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-    
+    def ajustar(img, media, contraste=1.0, brillo=1.0, invertir=False, nitidez=False):
+        """Aplica los ajustes combinados; no modifica la imagen de la caché."""
+        if contraste != 1.0 or brillo != 1.0 or invertir:
+            tabla = RadiologiaService.tabla(media, contraste, brillo, invertir)
+            img = img.point(tabla * len(img.getbands()))
+        if nitidez:
+            img = img.filter(ImageFilter.SHARPEN)
+        return img
+
     @staticmethod
-    def ajustar_brillo(imagen_base64, factor):
-        """Ajustar brillo de imagen"""
-        img_data = base64.b64decode(imagen_base64.split(',')[1])
-        img = Image.open(BytesIO(img_data))
-        
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(factor)
-        
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-    
+    def codificar(img, formato='png'):
+        """
+        Imagen -> bytes. PNG es sin pérdida; WebP (calidad 90) pesa unas
+        cuatro veces menos y es el formato para previsualizar los ajustes.
+        """
+        buffer = BytesIO()
+        if formato == 'webp':
+            # El modo sin pérdida de WebP tarda varios segundos en una placa completa
+            img.save(buffer, format='WEBP', quality=90)
+        else:
+            img.save(buffer, format=FORMATOS[formato][0], compress_level=3)
+        return buffer.getvalue()
+
     @staticmethod
-    def invertir_colores(imagen_base64):
-        """Invertir colores de radiografía"""
-        img_data = base64.b64decode(imagen_base64.split(',')[1])
-        img = Image.open(BytesIO(img_data))
-        
-        from PIL import ImageOps
-        img = ImageOps.invert(img.convert('RGB'))
-        
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+    def procesar_imagen(fuente, formato='png'):
+        """
+        Mejora automática de una imagen subida (contraste 1.5, brillo 1.2 y
+        nitidez), sin guardarla.
+
+        Returns:
+            (bytes codificados, ancho, alto)
+        """
+        img = RadiologiaService.decodificar(fuente)
+        img = RadiologiaService.ajustar(img, _media(img), contraste=1.5, brillo=1.2, nitidez=True)
+        return RadiologiaService.codificar(img, formato), img.width, img.height
+
+
+def _media(img):
+    """Media de gris como la calcula ImageEnhance.Contrast."""
+    return int(ImageStat.Stat(img.convert('L') if img.mode != 'L' else img).mean[0] + 0.5)
@@ -0,0 +1,120 @@
+from app import db
+from sqlalchemy import text
+from datetime import datetime, timedelta
+
+ESTADOS_FACTURA_PENDIENTE = ('pendiente', 'parcial')
+ESTADOS_ORDEN_PENDIENTE = ('pendiente', 'en_proceso')
+
+
+class ResumenService:
+    """Lectura de la tabla resumen_diario (ver database/resumen_diario.sql)"""
+
+    @staticmethod
+    def reconstruir():
+        """Recalcular todos los resúmenes desde las tablas base"""
+        filas = db.session.execute(text("SELECT reconstruir_resumen_diario()")).scalar()
+        db.session.commit()
+        return filas
+
+    @staticmethod
+    def dashboard(hoy=None):
+        """Estadísticas del dashboard a partir de los agregados diarios"""
+        hoy = hoy or datetime.now().date()
+        inicio_mes = hoy.replace(day=1)
+        inicio_semana = hoy - timedelta(days=hoy.weekday())
+        desde_diario = hoy - timedelta(days=6)
+
+        # Una fila por métrica/clave, desglosada por día solo en la última semana
+        filas = db.session.execute(text("""
+            SELECT metrica, clave,
+                   CASE WHEN fecha >= :desde_diario THEN fecha END AS dia,
+                   SUM(cantidad), SUM(total), SUM(pagado),
+                   COALESCE(SUM(cantidad) FILTER (WHERE fecha >= :inicio_mes), 0),
+                   COALESCE(SUM(total) FILTER (WHERE fecha >= :inicio_mes), 0)
+            FROM resumen_diario
+            WHERE metrica <> 'estudios'
+            GROUP BY metrica, clave, dia
+        """), {'desde_diario': desde_diario, 'inicio_mes': inicio_mes}).fetchall()
+
+        estudios_populares = db.session.execute(text("""
+            SELECT e.nombre, SUM(r.cantidad) AS cantidad
+            FROM resumen_diario r
+            JOIN estudios e ON e.id::text = r.clave
+            WHERE r.metrica = 'estudios'
+            GROUP BY e.nombre
+            HAVING SUM(r.cantidad) > 0
+            ORDER BY cantidad DESC
+            LIMIT 5
+        """)).fetchall()
+
+        pacientes = {'total': 0, 'hoy': 0, 'mes': 0}
+        ordenes = {'pendientes': 0, 'hoy': 0, 'mes': 0}
+        facturacion = {'total_mes': 0.0, 'facturas_mes': 0, 'pendientes': 0,
+                       'pagadas': 0, 'cuentas_por_cobrar': 0.0}
+        ingresos = {'hoy': 0.0, 'semana': 0.0, 'mes': 0.0}
+        ingresos_por_dia = {}
+        por_metodo = {}
+
+        for metrica, clave, dia, cantidad, total, pagado, cantidad_mes, total_mes in filas:
+            cantidad, cantidad_mes = int(cantidad or 0), int(cantidad_mes or 0)
+            total, pagado, total_mes = float(total or 0), float(pagado or 0), float(total_mes or 0)
+
+            if metrica == 'pacientes':
+                if clave == 'activo':
+                    pacientes['total'] += cantidad
+                pacientes['mes'] += cantidad_mes
+                if dia == hoy:
+                    pacientes['hoy'] += cantidad
+
+            elif metrica == 'ordenes':
+                if clave in ESTADOS_ORDEN_PENDIENTE:
+                    ordenes['pendientes'] += cantidad
+                ordenes['mes'] += cantidad_mes
+                if dia == hoy:
+                    ordenes['hoy'] += cantidad
+
+            elif metrica == 'facturas':
+                if clave in ESTADOS_FACTURA_PENDIENTE:
+                    facturacion['cuentas_por_cobrar'] += total - pagado
+                if clave != 'anulada':
+                    facturacion['total_mes'] += total_mes
+                    facturacion['facturas_mes'] += cantidad_mes
+                if clave in ESTADOS_FACTURA_PENDIENTE:
+                    facturacion['pendientes'] += cantidad_mes
+                elif clave == 'pagada':
+                    facturacion['pagadas'] += cantidad_mes
+
+            elif metrica == 'pagos':
+                ingresos['mes'] += total_mes
+                if dia is not None:
+                    ingresos_por_dia[dia] = ingresos_por_dia.get(dia, 0.0) + total
+                    if dia >= inicio_semana:
+                        ingresos['semana'] += total
+                    if dia == hoy:
+                        ingresos['hoy'] += total
+                if cantidad_mes:
+                    metodo = por_metodo.setdefault(clave, {'metodo': clave, 'total': 0.0, 'cantidad': 0})
+                    metodo['total'] += total_mes
+                    metodo['cantidad'] += cantidad_mes
+
+        ingresos['diarios'] = []
+        for i in range(6, -1, -1):
+            dia = hoy - timedelta(days=i)
+            ingresos['diarios'].append({
+                'fecha': dia.isoformat(),
+                'dia': dia.strftime('%a'),
+                'monto': ingresos_por_dia.get(dia, 0.0)
+            })
+
+        return {
+            'fecha': hoy.isoformat(),
+            'pacientes': pacientes,
+            'ordenes': ordenes,
+            'facturacion': facturacion,
+            'ingresos': ingresos,
+            'estudios_populares': [
+                {'nombre': nombre, 'cantidad': int(cantidad)}
+                for nombre, cantidad in estudios_populares
+            ],
+            'pagos_por_metodo': list(por_metodo.values())
+        }
@@ -0,0 +1,319 @@
+"""
+Sesiones de imagen - Estudios decodificados en memoria mientras se visualizan
+
+Cuando un radiólogo abre una radiografía se decodifica una vez y el array
+queda en una caché LRU limitada por bytes; los ajustes de ventana, contraste
+o brillo se calculan sobre él en milisegundos. Al cerrar la sesión la
+entrada se libera si nadie más la tiene abierta, y las sesiones que no se
+cierran (pestaña cerrada) caducan tras IMAGEN_SESION_TTL segundos sin uso.
+
+Las sesiones (id, estudio, último uso) viven en un registro compartido por
+los workers de gunicorn, un archivo SQLite como el de app/cache.py: el
+DELETE o el /procesada?sesion= que llega a otro worker encuentra la sesión
+abierta por el primero. Los arrays decodificados sí son por worker y solo
+una caché: cada worker carga el estudio la primera vez que lo sirve y lo
+suelta cuando el registro dice que la sesión se cerró o caducó.
+"""
+from collections import OrderedDict
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# Cada cuánto un worker contrasta sus sesiones con el registro (cierres en otro worker)
+REVISION = 30
+_SESION_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class EntradaImagen:
+    """
+    Imagen decodificada de un estudio.
+
+    Los DICOM monocromo guardan los píxeles en modalidad original (para
+    cambiar la ventana) y su histograma; el resto guarda la imagen PIL.
+    """
+
+    __slots__ = ('firma', 'imagen', 'media', 'pixeles', 'meta', 'histograma',
+                 'minimo', 'maximo', 'frames', 'tamano', 'sesiones', 'ultimo_uso')
+
+    def __init__(self, imagen=None, media=None, pixeles=None, meta=None, histograma=None, frames=1):
+        self.firma = None
+        self.imagen = imagen
+        self.media = media
+        self.pixeles = pixeles
+        self.meta = meta or {}
+        self.histograma = histograma
+        self.minimo = self.maximo = None
+        if pixeles is not None:
+            self.minimo, self.maximo = pixeles.min(), pixeles.max()
+        self.frames = frames
+        self.tamano = sum(a.nbytes for a in (pixeles, histograma) if a is not None)
+        if imagen is not None:
+            self.tamano += imagen.width * imagen.height * len(imagen.getbands())
+        self.sesiones = set()
+        self.ultimo_uso = time.time()
+
+    @property
+    def ancho(self):
+        return self.imagen.width if self.imagen is not None else self.pixeles.shape[1]
+
+    @property
+    def alto(self):
+        return self.imagen.height if self.imagen is not None else self.pixeles.shape[0]
+
+
+class RegistroMemoria:
+    """Registro de sesiones en un dict, solo para un proceso (run.py, tests)"""
+
+    def __init__(self):
+        self._datos = {}  # sesion_id -> (clave, último uso)
+        self._lock = threading.Lock()
+
+    def abrir(self, sesion_id, clave, ahora):
+        with self._lock:
+            self._datos[sesion_id] = (clave, ahora)
+
+    def tocar(self, sesion_id, ahora, limite):
+        """Renueva una sesión vigente; devuelve su clave, o None si no existe o caducó."""
+        with self._lock:
+            sesion = self._datos.get(sesion_id)
+            if sesion is None or sesion[1] < limite:
+                return None
+            self._datos[sesion_id] = (sesion[0], ahora)
+            return sesion[0]
+
+    def cerrar(self, sesion_id):
+        with self._lock:
+            return self._datos.pop(sesion_id, None) is not None
+
+    def vigentes(self, ids, limite):
+        with self._lock:
+            return {s for s in ids if s in self._datos and self._datos[s][1] >= limite}
+
+    def expirar(self, limite):
+        with self._lock:
+            viejas = [s for s, (_, uso) in self._datos.items() if uso < limite]
+            for sesion_id in viejas:
+                del self._datos[sesion_id]
+            return len(viejas)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class RegistroSQLite:
+    """Registro de sesiones en un archivo SQLite (modo WAL), compartido entre procesos"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sesiones_imagen (
+                id TEXT PRIMARY KEY,
+                clave TEXT NOT NULL,
+                usado REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sesiones_imagen_usado ON sesiones_imagen(usado)")
+
+    def _conn(self):
+        # Una conexión por hilo y por proceso (no se comparten tras un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def abrir(self, sesion_id, clave, ahora):
+        self._conn().execute("INSERT INTO sesiones_imagen (id, clave, usado) VALUES (?, ?, ?)",
+                             (sesion_id, json.dumps(list(clave)), ahora))
+
+    def tocar(self, sesion_id, ahora, limite):
+        conn = self._conn()
+        cur = conn.execute("UPDATE sesiones_imagen SET usado = ? WHERE id = ? AND usado >= ?",
+                           (ahora, sesion_id, limite))
+        if not cur.rowcount:
+            return None
+        row = conn.execute("SELECT clave FROM sesiones_imagen WHERE id = ?", (sesion_id,)).fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def cerrar(self, sesion_id):
+        return self._conn().execute("DELETE FROM sesiones_imagen WHERE id = ?", (sesion_id,)).rowcount > 0
+
+    def vigentes(self, ids, limite):
+        ids = list(ids)
+        if not ids:
+            return set()
+        marcas = ','.join('?' * len(ids))
+        filas = self._conn().execute(
+            f"SELECT id FROM sesiones_imagen WHERE usado >= ? AND id IN ({marcas})", [limite] + ids
+        ).fetchall()
+        return {f[0] for f in filas}
+
+    def expirar(self, limite):
+        return self._conn().execute("DELETE FROM sesiones_imagen WHERE usado < ?", (limite,)).rowcount
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sesiones_imagen").fetchone()[0]
+
+
+class SesionesImagen:
+    """LRU de EntradaImagen limitada por bytes, con sesiones de visualización."""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, ttl=1800, registro=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.registro = registro if registro is not None else RegistroMemoria()
+        self._entradas = OrderedDict()
+        self._sesiones = {}  # sesion_id -> clave, las que retienen una entrada de este worker
+        self._lock = threading.Lock()
+        self._revisado = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.desalojos = 0
+        self.expiradas = 0
+
+    def get(self, clave, firma, sesion_id=None):
+        """
+        Entrada vigente para `clave` si el archivo no cambió (firma), o None.
+
+        La sesión se renueva en el registro haya o no entrada en este worker;
+        si es de esta clave, la entrada que se cargue a continuación (put)
+        queda retenida por ella.
+        """
+        ahora = time.time()
+        if sesion_id and _SESION_ID.fullmatch(sesion_id) \
+                and self.registro.tocar(sesion_id, ahora, ahora - self.ttl) == clave:
+            with self._lock:
+                self._sesiones[sesion_id] = clave
+        with self._lock:
+            self._expirar(ahora)
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada.firma != firma:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            entrada.ultimo_uso = ahora
+            if self._sesiones.get(sesion_id) == clave:
+                entrada.sesiones.add(sesion_id)
+            self.hits += 1
+            return entrada
+
+    def put(self, clave, firma, entrada):
+        entrada.firma = firma
+        entrada.ultimo_uso = time.time()
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= anterior.tamano
+            # Una entrada desalojada y vuelta a cargar conserva sus sesiones abiertas
+            entrada.sesiones |= {s for s, c in self._sesiones.items() if c == clave}
+            self._entradas[clave] = entrada
+            self.bytes += entrada.tamano
+            # La entrada recién puesta se conserva aunque sola supere el límite
+            while self.bytes > self.max_bytes and len(self._entradas) > 1:
+                _, desalojada = self._entradas.popitem(last=False)
+                self.bytes -= desalojada.tamano
+                self.desalojos += 1
+        return entrada
+
+    def abrir(self, clave):
+        """Registra una sesión sobre una entrada ya cargada; devuelve su id."""
+        sesion_id = uuid.uuid4().hex
+        ahora = time.time()
+        self.registro.abrir(sesion_id, clave, ahora)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                entrada.sesiones.add(sesion_id)
+                entrada.ultimo_uso = ahora
+            self._sesiones[sesion_id] = clave
+        return sesion_id
+
+    def cerrar(self, sesion_id):
+        """
+        Cierra la sesión (abierta en este worker o en otro); la entrada se
+        libera si no le quedan sesiones. Los demás workers sueltan la suya en
+        su próxima revisión del registro.
+        """
+        if not _SESION_ID.fullmatch(sesion_id or ''):
+            return False
+        cerrada = self.registro.cerrar(sesion_id)
+        with self._lock:
+            clave = self._sesiones.pop(sesion_id, None)
+            if clave is not None:
+                self._soltar(clave, sesion_id)
+        return cerrada
+
+    def invalidar(self, prefijo):
+        """Descarta las entradas cuya clave empieza por `prefijo` (p. ej. el id)."""
+        with self._lock:
+            for clave in [c for c in self._entradas if c[0] == prefijo]:
+                self.bytes -= self._entradas.pop(clave).tamano
+
+    def _soltar(self, clave, sesion_id):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return
+        entrada.sesiones.discard(sesion_id)
+        if not entrada.sesiones:
+            del self._entradas[clave]
+            self.bytes -= entrada.tamano
+
+    def _expirar(self, ahora):
+        """
+        Cada REVISION segundos (o ttl, si es menor): borra del registro las
+        sesiones sin uso en más de ttl segundos, suelta las de este worker que
+        ya no están vigentes (caducadas o cerradas en otro worker) y libera
+        las entradas sin sesiones ni uso en ese tiempo.
+        """
+        if ahora - self._revisado < min(REVISION, self.ttl):
+            return
+        self._revisado = ahora
+        limite = ahora - self.ttl
+        self.expiradas += self.registro.expirar(limite)
+        vigentes = self.registro.vigentes(self._sesiones, limite)
+        for sesion_id in [s for s in self._sesiones if s not in vigentes]:
+            self._soltar(self._sesiones.pop(sesion_id), sesion_id)
+        for clave in [c for c, e in self._entradas.items() if not e.sesiones and e.ultimo_uso < limite]:
+            self.bytes -= self._entradas.pop(clave).tamano
+
+    def stats(self):
+        with self._lock:
+            self._expirar(time.time())
+            consultas = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / consultas, 3) if consultas else 0.0,
+                'entradas': len(self._entradas),
+                'sesiones': len(self.registro),
+                'sesiones_worker': len(self._sesiones),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'desalojos': self.desalojos,
+                'sesiones_expiradas': self.expiradas,
+            }
+
+
+sesiones = SesionesImagen()
+
+
+def init_app(app):
+    """
+    Límite de memoria y caducidad según IMAGEN_SESION_MAX_MB / IMAGEN_SESION_TTL;
+    registro compartido en IMAGEN_SESION_DB (vacío: en memoria, un solo proceso).
+    """
+    sesiones.max_bytes = int(app.config.get('IMAGEN_SESION_MAX_MB', 512)) * 1024 * 1024
+    sesiones.ttl = int(app.config.get('IMAGEN_SESION_TTL', 1800))
+    path = app.config.get('IMAGEN_SESION_DB')
+    sesiones.registro = RegistroSQLite(path) if path else RegistroMemoria()
@@ -0,0 +1,250 @@
+"""
+Sesiones SMTP persistentes y envío de adjuntos en streaming
+
+Conectar, hacer STARTTLS y autenticarse cuesta un handshake TLS y varios
+round-trips por mensaje; en un lote de cientos de emails eso es casi todo
+el tiempo. Las sesiones quedan abiertas en un pool por servidor/usuario y
+se reutilizan entre envíos (y entre trabajos del worker). Una sesión se
+renueva tras MAX_MENSAJES envíos o MAX_INACTIVA segundos sin uso, y si el
+servidor la cerró se reconecta y el mensaje se reintenta una vez.
+
+Los adjuntos se leen del disco y se codifican en base64 por bloques durante
+el DATA: un PDF de 20 MB no se carga entero en memoria (el MIME completo
+de antes ocupaba unas 2,5 veces el archivo).
+"""
+from contextlib import contextmanager
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP as POLITICA_SMTP
+from email.utils import formatdate, make_msgid
+import base64
+import mimetypes
+import os
+import re
+import smtplib
+import ssl
+import threading
+import time
+
+MAX_MENSAJES = 100      # muchos servidores (Gmail) cortan la conexión hacia los 100 mensajes
+MAX_INACTIVA = 60       # segundos; pasado esto el servidor probablemente ya la cerró
+BLOQUE = 57 * 1024      # bytes de archivo por bloque (57 bytes = una línea base64 de 76)
+ENVIO = 256 * 1024      # bytes por send() durante el DATA
+TIMEOUT = 30
+
+
+def _puntos(datos):
+    """Duplica el punto inicial de cada línea (RFC 5321 4.5.2)."""
+    return re.sub(rb'(?m)^\.', b'..', datos)
+
+
+def _base64(ruta):
+    with open(ruta, 'rb') as f:
+        while True:
+            bloque = f.read(BLOQUE)
+            if not bloque:
+                return
+            codificado = base64.b64encode(bloque)
+            yield b'\r\n'.join(codificado[i:i + 76] for i in range(0, len(codificado), 76)) + b'\r\n'
+
+
+def construir(remitente, destinatario, asunto, html, adjuntos=None):
+    """
+    Mensaje HTML con adjuntos como función que genera los bytes del DATA
+    (cada llamada empieza de nuevo, para poder reintentar). Los adjuntos que
+    no existen se omiten.
+    """
+    adjuntos = [ruta for ruta in (adjuntos or []) if ruta and os.path.exists(ruta)]
+    msg = MIMEMultipart('mixed', policy=POLITICA_SMTP)
+    msg['Subject'] = asunto
+    msg['From'] = remitente
+    msg['To'] = destinatario
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    msg.attach(MIMEText(html, 'html', 'utf-8', policy=POLITICA_SMTP))
+    inicio = msg.as_bytes()
+    frontera = f'--{msg.get_boundary()}'.encode()
+    # Se quita el cierre de la frontera para intercalar los adjuntos
+    inicio = _puntos(inicio[:inicio.rindex(frontera + b'--')])
+
+    cabeceras = []
+    for ruta in adjuntos:
+        tipo = (mimetypes.guess_type(ruta)[0] or 'application/octet-stream').split('/')
+        parte = MIMEBase(*tipo, policy=POLITICA_SMTP)
+        parte.add_header('Content-Disposition', 'attachment', filename=os.path.basename(ruta))
+        parte['Content-Transfer-Encoding'] = 'base64'
+        cabeceras.append(frontera + b'\r\n' + parte.as_bytes())
+
+    def partes():
+        yield inicio
+        for ruta, cabecera in zip(adjuntos, cabeceras):
+            yield cabecera
+            yield from _base64(ruta)
+        yield frontera + b'--\r\n'
+
+    return partes
+
+
+class SesionSMTP:
+    """Una conexión SMTP autenticada que se reutiliza entre mensajes."""
+
+    def __init__(self, servidor, puerto, usuario=None, clave=None, tls=True, timeout=TIMEOUT):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.clave = clave
+        self.tls = tls
+        self.timeout = timeout
+        self.smtp = None
+        self.mensajes = 0       # en la conexión actual
+        self.ultimo_uso = 0.0
+        self.conexiones = 0
+        self.reconexiones = 0
+
+    def abrir(self):
+        self.cerrar()
+        smtp = smtplib.SMTP(self.servidor, self.puerto, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.tls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            if self.usuario:
+                smtp.login(self.usuario, self.clave)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.mensajes = 0
+        self.conexiones += 1
+
+    def vigente(self):
+        return (self.smtp is not None and self.mensajes < MAX_MENSAJES
+                and time.monotonic() - self.ultimo_uso < MAX_INACTIVA)
+
+    def enviar(self, remitente, destinatarios, partes):
+        """
+        Envía el mensaje que genera `partes()` (ver construir). Si la conexión
+        se cayó, reconecta y lo reintenta una vez.
+
+        Raises:
+            smtplib.SMTPException u OSError si el servidor lo rechaza o no responde
+        """
+        for intento in (0, 1):
+            if not self.vigente():
+                self.abrir()
+            try:
+                self._transaccion(remitente, destinatarios, partes())
+                self.mensajes += 1
+                self.ultimo_uso = time.monotonic()
+                return
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421:
+                    self._rset()
+                    raise
+                error = e  # 421: el servidor cierra la conexión
+            except smtplib.SMTPRecipientsRefused:
+                self._rset()
+                raise
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                error = e
+            self.cerrar()
+            if intento:
+                raise error
+            self.reconexiones += 1
+
+    def _transaccion(self, remitente, destinatarios, partes):
+        """MAIL/RCPT/DATA como smtplib.sendmail, pero escribiendo el DATA por partes."""
+        smtp = self.smtp
+        codigo, respuesta = smtp.mail(remitente)
+        if codigo != 250:
+            raise smtplib.SMTPSenderRefused(codigo, respuesta, remitente)
+        rechazados = {}
+        for destinatario in destinatarios:
+            codigo, respuesta = smtp.rcpt(destinatario)
+            if codigo not in (250, 251):
+                rechazados[destinatario] = (codigo, respuesta)
+        if len(rechazados) == len(destinatarios):
+            raise smtplib.SMTPRecipientsRefused(rechazados)
+        codigo, respuesta = smtp.docmd('data')
+        if codigo != 354:
+            raise smtplib.SMTPDataError(codigo, respuesta)
+        # Se agrupa en bloques: muchos send() pequeños chocan con Nagle/ACK retardado
+        buffer = bytearray()
+        for datos in partes:
+            buffer += datos
+            if len(buffer) >= ENVIO:
+                smtp.send(bytes(buffer))
+                buffer.clear()
+        buffer += b'.\r\n'
+        smtp.send(bytes(buffer))
+        codigo, respuesta = smtp.getreply()
+        if codigo != 250:
+            raise smtplib.SMTPDataError(codigo, respuesta)
+
+    def _rset(self):
+        try:
+            self.smtp.rset()
+        except Exception:
+            self.cerrar()
+
+    def cerrar(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+        self.smtp = None
+
+
+class PoolSMTP:
+    """Sesiones libres por (servidor, puerto, usuario); una sesión la usa un hilo a la vez."""
+
+    def __init__(self, maximo=4):
+        self.maximo = maximo
+        self._libres = {}
+        self._lock = threading.Lock()
+        self.conexiones = 0
+        self.reconexiones = 0
+
+    @contextmanager
+    def sesion(self, servidor, puerto, usuario=None, clave=None, tls=True):
+        clave_pool = (servidor, puerto, usuario, clave, tls)
+        with self._lock:
+            libres = self._libres.get(clave_pool)
+            sesion = libres.pop() if libres else None
+        if sesion is None:
+            sesion = SesionSMTP(servidor, puerto, usuario, clave, tls)
+        antes = (sesion.conexiones, sesion.reconexiones)
+        try:
+            yield sesion
+        finally:
+            with self._lock:
+                self.conexiones += sesion.conexiones - antes[0]
+                self.reconexiones += sesion.reconexiones - antes[1]
+                libres = self._libres.setdefault(clave_pool, [])
+                if len(libres) < self.maximo:
+                    libres.append(sesion)
+                    sesion = None
+            if sesion is not None:
+                sesion.cerrar()
+
+    def cerrar_todas(self):
+        with self._lock:
+            sesiones = [s for libres in self._libres.values() for s in libres]
+            self._libres.clear()
+        for sesion in sesiones:
+            sesion.cerrar()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'conexiones': self.conexiones,
+                'reconexiones': self.reconexiones,
+                'sesiones_libres': sum(len(l) for l in self._libres.values()),
+            }
+
+
+pool = PoolSMTP()
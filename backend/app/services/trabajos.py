@@ -0,0 +1,220 @@
+"""
+Tipos de trabajo de la cola (app/services/cola_trabajos.py)
+
+Cada función recibe los `datos` del trabajo y se ejecuta en backend/worker.py
+con un app context propio. Devuelve un dict que queda en la columna
+resultado; si genera un archivo incluye 'archivo', 'nombre' y 'mimetype'
+para que /api/trabajos/<id>/archivo lo pueda servir. Para que el trabajo se
+reintente basta con lanzar una excepción.
+
+Los archivos generados se borran a las TRABAJOS_RETENCION_HORAS
+(limpiar_archivos, desde el mantenimiento de worker.py); pedir otra vez el
+documento lo vuelve a generar.
+"""
+from app.services.cola_trabajos import trabajo, TrabajoFallido
+from flask import current_app
+import os
+import tempfile
+import time
+
+
+def _carpeta():
+    carpeta = current_app.config.get('TRABAJOS_FOLDER') or os.path.join(
+        current_app.config['UPLOAD_FOLDER'], 'trabajos')
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def limpiar_archivos(horas=None):
+    """
+    Borra los archivos de la carpeta de trabajos con más de `horas`
+    (TRABAJOS_RETENCION_HORAS por defecto). Devuelve cuántos borró.
+    """
+    if horas is None:
+        horas = current_app.config.get('TRABAJOS_RETENCION_HORAS', 24)
+    limite = time.time() - horas * 3600
+    borrados = 0
+    with os.scandir(_carpeta()) as entradas:
+        for entrada in entradas:
+            if entrada.is_file() and entrada.stat().st_mtime < limite:
+                try:
+                    os.remove(entrada.path)
+                    borrados += 1
+                except FileNotFoundError:
+                    pass
+    return borrados
+
+
+def _obtener(modelo, registro_id, nombre):
+    registro = modelo.query.get(registro_id)
+    if registro is None:
+        raise TrabajoFallido(f'{nombre} {registro_id} no encontrado(a)')
+    return registro
+
+
+def _guardar_pdf(buffer, nombre):
+    """Escribe un PDF generado en memoria en la carpeta de trabajos."""
+    ruta = os.path.join(_carpeta(), nombre)
+    with open(ruta, 'wb') as f:
+        f.write(buffer.getvalue())
+    return {'archivo': ruta, 'nombre': nombre, 'mimetype': 'application/pdf'}
+
+
+def _exito(resultado):
+    """Los servicios de envío devuelven {'success': False, 'error': ...} en vez de lanzar."""
+    if not resultado.get('success'):
+        raise TrabajoFallido(resultado.get('error') or 'Envío fallido')
+    return resultado
+
+
+# =====================
+# PDF E IMPRESIÓN
+# =====================
+
+@trabajo('factura_pdf')
+def factura_pdf(datos):
+    from app.models import Factura
+    from app.services.pdf_service import PDFService
+
+    factura = _obtener(Factura, datos['factura_id'], 'Factura')
+    nombre = f'factura_{factura.numero_factura.replace("-", "_")}.pdf'
+    ruta = PDFService.generar_factura_pdf(factura, os.path.join(_carpeta(), nombre))
+    return {'archivo': ruta, 'nombre': nombre, 'mimetype': 'application/pdf'}
+
+
+@trabajo('factura_termica')
+def factura_termica(datos):
+    from app.models import Factura
+    from app.services.impresion_service import ImpresionService
+
+    factura = _obtener(Factura, datos['factura_id'], 'Factura')
+    return _guardar_pdf(ImpresionService.generar_factura_80mm(factura),
+                        f'factura_{factura.numero_factura}_80mm.pdf')
+
+
+@trabajo('recibo_pago')
+def recibo_pago(datos):
+    from app.models import Pago
+    from app.services.impresion_termica import ImpresionTermica
+
+    pago = _obtener(Pago, datos['pago_id'], 'Pago')
+    if not pago.factura:
+        raise TrabajoFallido('Factura no encontrada')
+    return _guardar_pdf(ImpresionTermica.generar_recibo_pago(pago.factura, pago), f'recibo_{pago.id}.pdf')
+
+
+@trabajo('ticket_orden')
+def ticket_orden(datos):
+    from app.models import Orden
+    from app.services.impresion_termica import ImpresionTermica
+
+    orden = _obtener(Orden, datos['orden_id'], 'Orden')
+    return _guardar_pdf(ImpresionTermica.generar_ticket_orden(orden), f'ticket_{orden.numero_orden}.pdf')
+
+
+@trabajo('etiqueta_muestra')
+def etiqueta_muestra(datos):
+    from app.models import Orden, OrdenDetalle
+    from app.services.impresion_termica import ImpresionTermica
+
+    orden = _obtener(Orden, datos['orden_id'], 'Orden')
+    detalle = _obtener(OrdenDetalle, datos['detalle_id'], 'Detalle')
+    estudio_nombre = detalle.estudio.nombre if detalle.estudio else 'Estudio'
+    paciente = orden.paciente
+    return _guardar_pdf(ImpresionTermica.generar_etiqueta_muestra(paciente, orden, estudio_nombre),
+                        f'etiqueta_{paciente.id}_{detalle.id}.pdf')
+
+
+# =====================
+# EMAIL Y WHATSAPP
+# =====================
+
+@trabajo('email_factura')
+def email_factura(datos):
+    from app.models import Factura
+    from app.services.email_service import EmailService
+    from app.services.pdf_service import PDFService
+
+    factura = _obtener(Factura, datos['factura_id'], 'Factura')
+    paciente = factura.paciente
+    if not paciente or not paciente.email:
+        raise TrabajoFallido('Paciente no tiene email')
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf', prefix=f'factura_{factura.id}_')
+    os.close(fd)
+    try:
+        PDFService.generar_factura_pdf(factura, pdf_path)
+        return _exito(EmailService().enviar_factura(paciente, factura, pdf_path))
+    finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+
+@trabajo('email_resultados')
+def email_resultados(datos):
+    from app.models import Paciente
+    from app.services.email_service import EmailService
+
+    paciente = _obtener(Paciente, datos['paciente_id'], 'Paciente')
+    return _exito(EmailService().enviar_resultados(paciente, datos.get('estudio', 'Estudios de laboratorio')))
+
+
+@trabajo('email_resultados_lote')
+def email_resultados_lote(datos):
+    """
+    Resultados listos a varios pacientes por una sola sesión SMTP. Los
+    fallos individuales quedan en el resultado; solo se reintenta el
+    trabajo si no salió ninguno (reintentar todo duplicaría los enviados).
+    """
+    from app.models import Paciente
+    from app.services.email_service import EmailService
+
+    servicio = EmailService()
+    estudio = datos.get('estudio', 'Estudios de laboratorio')
+    pacientes = Paciente.query.filter(Paciente.id.in_(datos['paciente_ids']), Paciente.email.isnot(None)) \
+        .order_by(Paciente.id).yield_per(200)
+    resultado = servicio.enviar_lote(servicio.mensaje_resultados(p, estudio) for p in pacientes if p.email)
+    if resultado.get('error') or (resultado['fallidos'] and not resultado['enviados']):
+        raise TrabajoFallido(resultado.get('error') or next(iter(resultado['errores'].values())))
+    return resultado
+
+
+@trabajo('email')
+def email(datos):
+    from app.services.notificaciones_service import NotificacionService
+
+    if not NotificacionService.enviar_email(datos['destinatario'], datos['asunto'], datos['cuerpo']):
+        raise TrabajoFallido(f"No se pudo enviar el email a {datos['destinatario']}")
+    return {'success': True, 'destinatario': datos['destinatario']}
+
+
+@trabajo('whatsapp')
+def whatsapp(datos):
+    from app.services.whatsapp_service import WhatsAppService
+
+    return _exito(WhatsAppService().enviar_mensaje(datos['numero'], datos['mensaje']))
+
+
+@trabajo('campana_whatsapp')
+def campana_whatsapp(datos):
+    """Una pasada de la campaña; si quedan destinatarios encola la siguiente."""
+    from app.services.campanas_whatsapp import CampanasWhatsApp
+
+    return CampanasWhatsApp.enviar(datos['campana_id'])
+
+
+# =====================
+# NUBE
+# =====================
+
+@trabajo('nube_resultado')
+def nube_resultado(datos):
+    from app.services.cloud_sync import CloudSyncService
+
+    return _exito(CloudSyncService().upload_resultado(datos['ruta'], datos['paciente_id'], datos['tipo']))
+
+
+@trabajo('nube_respaldo')
+def nube_respaldo(datos):
+    from app.services.cloud_sync import CloudSyncService
+
+    return _exito(CloudSyncService().upload_backup(datos['ruta'], datos.get('remote_name')))
@@ -1,77 +1,88 @@
-from twilio.rest import Client
+"""
+Envío de WhatsApp por la API REST de Twilio (Messages.json)
+
+Se usa una requests.Session con su pool de conexiones, así los envíos de una
+campaña (app/services/campanas_whatsapp.py) reutilizan la conexión TLS desde
+varios hilos. TWILIO_API_URL permite apuntar a un servidor falso local
+(ver bench_campana_whatsapp.py).
+"""
+from requests.adapters import HTTPAdapter
 import os
-from datetime import datetime
+import requests
+
+API_URL = 'https://api.twilio.com'
+TIMEOUT = (5, 30)  # conexión, lectura
+
+
+def formatear_numero(numero):
+    """Número -> 'whatsapp:+...' (los 809/829/849 sin código son de República Dominicana)."""
+    numero = numero.strip()
+    if numero.startswith('whatsapp:'):
+        return numero
+    if numero.startswith(('809', '829', '849')):
+        return f'whatsapp:+1{numero}'
+    return f'whatsapp:{numero}'
+
+
+def personalizar(plantilla, nombre, apellido):
+    return plantilla.replace('{nombre}', nombre or '').replace('{apellido}', apellido or '')
+
 
 class WhatsAppService:
-    
-    def __init__(self):
+
+    def __init__(self, conexiones=10):
         self.account_sid = os.getenv('TWILIO_ACCOUNT_SID')
         self.auth_token = os.getenv('TWILIO_AUTH_TOKEN')
         self.whatsapp_from = os.getenv('TWILIO_WHATSAPP_FROM', 'whatsapp:+14155238886')
-        
+        self.api_url = os.getenv('TWILIO_API_URL', API_URL).rstrip('/')
+
         if self.account_sid and self.auth_token:
-            self.client = Client(self.account_sid, self.auth_token)
+            self.session = requests.Session()
+            self.session.auth = (self.account_sid, self.auth_token)
+            self.session.mount(self.api_url, HTTPAdapter(pool_connections=1, pool_maxsize=conexiones))
         else:
-            self.client = None
-    
+            self.session = None
+
     def enviar_mensaje(self, numero, mensaje):
-        """Enviar mensaje de WhatsApp"""
-        if not self.client:
+        """
+        Enviar mensaje de WhatsApp.
+
+        Si falla, 'reintentable' indica si vale la pena repetirlo (429, 5xx o
+        error de red) y 'retry_after' los segundos que pidió Twilio.
+        """
+        if not self.session:
             return {'success': False, 'error': 'Twilio no configurado'}
-        
+
         try:
-            # Formatear número (debe incluir código de país)
-            if not numero.startswith('whatsapp:'):
-                if numero.startswith('809') or numero.startswith('829') or numero.startswith('849'):
-                    numero = f'whatsapp:+1{numero}'  # República Dominicana
-                else:
-                    numero = f'whatsapp:{numero}'
-            
-            message = self.client.messages.create(
-                body=mensaje,
-                from_=self.whatsapp_from,
-                to=numero
+            r = self.session.post(
+                f'{self.api_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json',
+                data={'From': self.whatsapp_from, 'To': formatear_numero(numero), 'Body': mensaje},
+                timeout=TIMEOUT
             )
-            
+        except requests.RequestException as e:
+            return {'success': False, 'error': str(e), 'reintentable': True}
+
+        try:
+            cuerpo = r.json()
+        except ValueError:
+            cuerpo = {}
+
+        if r.status_code in (200, 201):
             return {
                 'success': True,
-                'message_id': message.sid,
-                'status': message.status
+                'message_id': cuerpo.get('sid'),
+                'status': cuerpo.get('status')
             }
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-    
-    def enviar_campana(self, pacientes, mensaje_plantilla):
-        """Enviar campaña masiva"""
-        resultados = {
-            'total': len(pacientes),
-            'enviados': 0,
-            'fallidos': 0,
-            'detalles': []
+
+        retry_after = r.headers.get('Retry-After')
+        return {
+            'success': False,
+            'error': cuerpo.get('message') or f'HTTP {r.status_code}',
+            'codigo': r.status_code,
+            'reintentable': r.status_code == 429 or r.status_code >= 500,
+            'retry_after': float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else None
         }
-        
-        for paciente in pacientes:
-            numero = paciente.celular or paciente.telefono
-            if not numero:
-                resultados['fallidos'] += 1
-                continue
-            
-            # Personalizar mensaje
-            mensaje = mensaje_plantilla.replace('{nombre}', paciente.nombre)
-            mensaje = mensaje.replace('{apellido}', paciente.apellido)
-            
-            resultado = self.enviar_mensaje(numero, mensaje)
-            
-            if resultado['success']:
-                resultados['enviados'] += 1
-            else:
-                resultados['fallidos'] += 1
-            
-            resultados['detalles'].append({
-                'paciente': f"{paciente.nombre} {paciente.apellido}",
-                'numero': numero,
-                'success': resultado['success'],
-                'error': resultado.get('error')
-            })
-        
-        return resultados
+
+    def close(self):
+        if self.session:
+            self.session.close()
@@ -0,0 +1,32 @@
+"""
+Autenticación de los desktop-agent en /api/maquinas.
+
+El agente envía `Authorization: Bearer <api_key>` (su config.json); las
+claves válidas se configuran en AGENTES_API_KEYS, separadas por coma. Sin
+claves configuradas las rutas protegidas rechazan todo: un servidor mal
+configurado no queda abierto.
+"""
+from functools import wraps
+from flask import request, jsonify, current_app
+import hmac
+
+
+def clave_agente_valida(clave):
+    """True si la clave coincide con alguna de AGENTES_API_KEYS (comparación en tiempo constante)"""
+    if not clave:
+        return False
+    return any(hmac.compare_digest(clave.encode(), k.encode())
+               for k in current_app.config.get('AGENTES_API_KEYS') or ())
+
+
+def requiere_clave_agente(f):
+    """Decorador: 401 si la petición no trae una API key de agente válida"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        esquema, _, clave = request.headers.get('Authorization', '').partition(' ')
+        if esquema.lower() != 'bearer' or not clave_agente_valida(clave.strip()):
+            if not current_app.config.get('AGENTES_API_KEYS'):
+                current_app.logger.error('AGENTES_API_KEYS sin configurar: se rechaza %s', request.path)
+            return jsonify({'error': 'API key de agente inválida o ausente'}), 401
+        return f(*args, **kwargs)
+    return decorated
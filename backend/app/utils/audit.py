@@ -1,6 +1,7 @@
 from flask import request
 from app import db
 from sqlalchemy import text
+from app.utils.pagination import keyset_rows, keyset_sql, valores_cursor
 from datetime import datetime
 import json
 
@@ -32,6 +33,12 @@ def registrar_auditoria(usuario_id, accion, tabla, registro_id, datos_antes=None
 
 def obtener_auditoria(tabla=None, registro_id=None, limit=50):
     """Obtener registros de auditoría"""
+    registros, _ = obtener_auditoria_pagina(tabla, registro_id, limite=limit)
+    return registros
+
+
+def obtener_auditoria_pagina(tabla=None, registro_id=None, posicion=None, limite=50):
+    """Página de auditoría por cursor (created_at, id); devuelve (registros, siguiente_cursor)"""
     query = "SELECT a.*, u.username FROM auditoria a LEFT JOIN usuarios u ON u.id = a.usuario_id WHERE 1=1"
     params = {}
 
@@ -41,12 +48,16 @@ def obtener_auditoria(tabla=None, registro_id=None, limit=50):
     if registro_id:
         query += " AND a.registro_id = :registro_id"
         params['registro_id'] = registro_id
+    orden, despues = keyset_sql('a.created_at', 'a.id', (':cursor_fecha', ':cursor_id'))
+    if posicion is not None:
+        query += f" AND {despues}"
+        params['cursor_fecha'], params['cursor_id'] = valores_cursor(posicion)
 
-    query += " ORDER BY a.created_at DESC LIMIT :limit"
-    params['limit'] = limit
+    query += f" ORDER BY {orden} LIMIT :limit"
+    params['limit'] = limite + 1
 
     result = db.session.execute(text(query), params)
-    rows = result.fetchall()
+    rows, siguiente = keyset_rows(result.fetchall(), limite, 9, 0)
 
     return [{
         'id': row[0],
@@ -60,4 +71,4 @@ def obtener_auditoria(tabla=None, registro_id=None, limit=50):
         'user_agent': row[8],
         'fecha': row[9].isoformat() if row[9] else None,
         'username': row[-1]
-    } for row in rows]
+    } for row in rows], siguiente
@@ -0,0 +1,166 @@
+"""
+DICOM Header - Lectura de metadatos DICOM sin cargar los píxeles
+
+Se mantiene una copia idéntica en desktop-agent/parsers/ y en
+backend/app/utils/: el agente se empaqueta e instala sin el backend, y un
+enlace simbólico no sobrevive a un checkout en Windows ni al instalador.
+tests/test_modulos_compartidos.py falla si las copias divergen.
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+# Tags que usan el agente y el backend; el resto del encabezado no se decodifica
+TAGS = (
+    'SpecificCharacterSet',
+    'PatientID', 'PatientName', 'PatientBirthDate', 'PatientSex',
+    'StudyInstanceUID', 'StudyDate', 'StudyTime', 'StudyDescription', 'AccessionNumber',
+    'SeriesInstanceUID', 'SeriesNumber', 'SeriesDescription',
+    'SOPInstanceUID', 'SOPClassUID', 'Modality', 'ImageType',
+    'InstitutionName', 'Manufacturer', 'ManufacturerModelName',
+    'Rows', 'Columns', 'NumberOfFrames', 'BitsAllocated', 'BitsStored',
+    'PhotometricInterpretation', 'WindowCenter', 'WindowWidth',
+    'RescaleSlope', 'RescaleIntercept',
+)
+
+# A partir de este tamaño el archivo se lee a través de un mmap
+MMAP_MIN_BYTES = 8 * 1024 * 1024
+
+
+class DicomHeaderCache:
+    """
+    Caché LRU de metadatos ya extraídos, compartida por el proceso.
+
+    Las claves son (SOPInstanceUID, mtime) y, para no abrir el archivo en
+    un acierto, también (ruta, mtime, tamaño).
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clave):
+        with self._lock:
+            valor = self._datos.get(clave)
+            if valor is None:
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def put(self, claves, valor):
+        with self._lock:
+            for clave in claves:
+                self._datos[clave] = valor
+                self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+cache = DicomHeaderCache()
+
+
+def _valor(valor):
+    """Valor de un elemento en tipos simples (serializables a JSON)."""
+    # IS, DSfloat y PersonName de pydicom son subclases: se normalizan
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, int):
+        return int(valor)
+    if isinstance(valor, float):
+        return float(valor)
+    if isinstance(valor, (bytes, bytearray)):
+        return None
+    if isinstance(valor, Sequence) and not isinstance(valor, str):
+        return [_valor(v) for v in valor]
+    return str(valor)
+
+
+def _sop_instance_uid(path):
+    """SOPInstanceUID del file meta (grupo 0002), sin leer el dataset."""
+    from pydicom.filereader import read_file_meta_info
+    try:
+        uid = read_file_meta_info(path).get('MediaStorageSOPInstanceUID')
+        return str(uid) if uid else None
+    except Exception:
+        return None
+
+
+def _dcmread(fp):
+    import pydicom
+    return pydicom.dcmread(fp, stop_before_pixels=True, specific_tags=list(TAGS), force=True)
+
+
+def _extraer(ds):
+    metadata = {}
+    for keyword in TAGS:
+        elem = ds.get(keyword)
+        if elem is not None and keyword != 'SpecificCharacterSet':
+            metadata[keyword] = _valor(elem)
+    return metadata
+
+
+def read_header(fuente, cache=cache):
+    """
+    Metadatos DICOM (keyword -> valor) leyendo solo el encabezado.
+
+    Args:
+        fuente: Ruta del archivo o archivo abierto (p. ej. un upload)
+        cache: Caché a usar, o None para no cachear
+
+    Returns:
+        Dict con los tags de TAGS presentes en el archivo. Es una copia:
+        el llamador puede modificarla.
+    """
+    if not isinstance(fuente, (str, bytes, os.PathLike)):
+        # Un stream no tiene mtime ni ruta: se lee siempre (solo el encabezado)
+        return _leer_stream(fuente)
+
+    path = os.fspath(fuente)
+    st = os.stat(path)
+    clave_ruta = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    if cache is not None:
+        metadata = cache.get(clave_ruta)
+        if metadata is not None:
+            return dict(metadata)
+        uid = _sop_instance_uid(path)
+        clave_uid = (uid, st.st_mtime_ns) if uid else None
+        metadata = cache.get(clave_uid) if clave_uid else None
+        if metadata is not None:
+            cache.put([clave_ruta], metadata)
+            return dict(metadata)
+
+    with open(path, 'rb') as f:
+        if st.st_size >= MMAP_MIN_BYTES:
+            # El encabezado se lee de las páginas mapeadas sin copiarlo a un buffer
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                metadata = _extraer(_dcmread(m))
+        else:
+            metadata = _extraer(_dcmread(f))
+
+    if cache is not None:
+        claves = [clave_ruta]
+        if metadata.get('SOPInstanceUID'):
+            claves.append((metadata['SOPInstanceUID'], st.st_mtime_ns))
+        cache.put(claves, metadata)
+    return dict(metadata)
+
+
+def _leer_stream(fp):
+    """Encabezado de un archivo abierto; deja la posición donde estaba."""
+    inicio = fp.tell()
+    try:
+        return _extraer(_dcmread(fp))
+    finally:
+        fp.seek(inicio)
@@ -0,0 +1,253 @@
+"""
+HL7 Message - Tokenizador de mensajes HL7 v2 en una pasada
+
+Se mantiene una copia idéntica en desktop-agent/parsers/ y en
+backend/app/utils/: el agente se empaqueta e instala sin el backend, y un
+enlace simbólico no sobrevive a un checkout en Windows ni al instalador.
+tests/test_modulos_compartidos.py falla si las copias divergen.
+"""
+
+import re
+
+# Un segmento termina en CR (estándar), LF o CRLF; VT/FS son framing MLLP.
+# str.splitlines() corta en todos ellos en una pasada en C, pero también en
+# otros caracteres que sí pueden venir dentro de un valor: si aparecen se usa
+# la expresión regular.
+_SEPARADOR = re.compile(r'[\r\n\x0b\x1c]+')
+_OTROS_SALTOS = '\x0c\x1d\x1e\x85\u2028\u2029'
+_ESCAPE_HEX = re.compile(r'[0-9A-Fa-f]{2}')
+
+# Interpretación de OBX-8 (Abnormal Flags): una sola tabla para el parser del
+# agente y app/services/hl7_service.py, así un resultado tiene la misma
+# gravedad llegue por donde llegue. HH/LL/AA son valores críticos.
+ABNORMAL_FLAGS = {
+    '': 'normal', 'N': 'normal',
+    'H': 'alto', '>': 'alto',
+    'L': 'bajo', '<': 'bajo',
+    'HH': 'critico', 'LL': 'critico', 'AA': 'critico',
+}
+
+
+def interpret_flag(flag):
+    """Estado de un OBX-8 ('normal', 'alto', 'bajo' o 'critico'); 'normal' si no se reconoce."""
+    return ABNORMAL_FLAGS.get((flag or '').upper().strip(), 'normal')
+
+
+class HL7Segment:
+    """
+    Vista de un segmento de un HL7Message.
+
+    Los campos se separan la primera vez que se consultan (y quedan en el
+    mensaje) y los componentes solo al pedirlos.
+    """
+
+    __slots__ = ('message', 'index', 'name')
+
+    def __init__(self, message, index):
+        self.message = message
+        self.index = index
+        self.name = message.lines[index][:3]
+
+    @property
+    def text(self):
+        return self.message.lines[self.index]
+
+    def fields(self):
+        """
+        Campos del segmento (sin escapes resueltos), separados una sola vez.
+
+        La posición 0 es el nombre; fuera de MSH la posición n es el campo n.
+        """
+        return self.message._fields(self.index)
+
+    def field(self, n):
+        """
+        Campo n (numeración HL7, sin escapes resueltos); '' si no existe.
+
+        En MSH el campo 1 es el separador de campos, así que MSH-n está en
+        la posición n-1 del segmento separado.
+        """
+        if self.name == 'MSH':
+            if n == 1:
+                return self.message.field_sep
+            n -= 1
+        campos = self.fields()
+        return campos[n] if 0 < n < len(campos) else ''
+
+    def value(self, n, component=1, repetition=1, subcomponent=None):
+        """Valor de un campo/componente con las secuencias de escape resueltas."""
+        if self.name == 'MSH' and n <= 2:
+            return self.field(n)
+        valor = self.field(n)
+        if not valor:
+            return ''
+        msg = self.message
+        if msg.repetition_sep in valor:
+            repeticiones = valor.split(msg.repetition_sep)
+            valor = repeticiones[repetition - 1] if repetition <= len(repeticiones) else ''
+        if component is not None and msg.component_sep in valor:
+            componentes = valor.split(msg.component_sep)
+            valor = componentes[component - 1] if component <= len(componentes) else ''
+        elif component is not None and component > 1:
+            return ''
+        if subcomponent is not None:
+            partes = valor.split(msg.subcomponent_sep)
+            valor = partes[subcomponent - 1] if subcomponent <= len(partes) else ''
+        return msg.unescape(valor)
+
+    def components(self, n, repetition=1):
+        """Lista de componentes del campo n, con escapes resueltos."""
+        valor = self.field(n)
+        msg = self.message
+        if msg.repetition_sep in valor:
+            repeticiones = valor.split(msg.repetition_sep)
+            valor = repeticiones[repetition - 1] if repetition <= len(repeticiones) else ''
+        return [msg.unescape(c) for c in valor.split(msg.component_sep)]
+
+    def __len__(self):
+        return len(self.fields())
+
+    def __repr__(self):
+        return f'<HL7Segment {self.index} {self.text[:40]!r}>'
+
+
+class HL7Message:
+    """
+    Mensaje HL7 v2 tokenizado en una pasada.
+
+    Los delimitadores salen de MSH-1/MSH-2. El texto se corta en segmentos
+    una sola vez; los objetos HL7Segment se crean al recorrerlos y cada uno
+    separa sus campos solo si se consultan, así leer MSH y PID no cuesta
+    los OBX que vienen detrás.
+    """
+
+    def __init__(self, data, encoding='utf-8'):
+        """
+        Args:
+            data: Mensaje como str o bytes (con o sin framing MLLP)
+            encoding: Codificación si data son bytes
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode(encoding, errors='replace')
+
+        inicio = data.find('MSH')
+        if inicio == -1 or len(data) < inicio + 8:
+            raise ValueError('Mensaje HL7 sin segmento MSH')
+        if inicio:
+            data = data[inicio:]
+        self.text = data
+
+        self.field_sep = data[3]
+        fin = data.find(self.field_sep, 4)
+        if fin == -1:
+            fin = 8
+        codificacion = data[4:fin]
+        # Los caracteres que falten toman el valor por defecto ^~\\&
+        codificacion = codificacion[:4] + '^~\\&'[len(codificacion):]
+        self.component_sep, self.repetition_sep, self.escape_char, self.subcomponent_sep = codificacion
+        # Sin caracteres de escape después de MSH-2 no hace falta resolverlos
+        self.has_escapes = data.find(self.escape_char, fin) != -1
+
+        # Texto de cada segmento, en orden; los campos se separan bajo demanda
+        if any(c in data for c in _OTROS_SALTOS):
+            self.lines = _SEPARADOR.split(data)
+        else:
+            self.lines = data.splitlines()
+        self._campos = [None] * len(self.lines)
+
+    def _fields(self, i):
+        campos = self._campos[i]
+        if campos is None:
+            campos = self._campos[i] = self.lines[i].split(self.field_sep)
+        return campos
+
+    def records(self):
+        """
+        Camino rápido: itera (índice, campos) de cada segmento sin crear
+        objetos HL7Segment. Los campos se separan una sola vez por mensaje.
+        """
+        sep = self.field_sep
+        cache = self._campos
+        for i, linea in enumerate(self.lines):
+            if len(linea) < 3 or linea.isspace():
+                continue
+            campos = cache[i]
+            if campos is None:
+                campos = cache[i] = linea.split(sep)
+            yield i, campos
+
+    def segments(self, name=None):
+        """Itera los segmentos (opcionalmente solo los de un tipo)."""
+        for i, linea in enumerate(self.lines):
+            if name is not None and not linea.startswith(name):
+                continue
+            if len(linea) < 3 or linea.isspace():
+                continue
+            yield HL7Segment(self, i)
+
+    def segment(self, name):
+        """Primer segmento del tipo dado, o None."""
+        return next(self.segments(name), None)
+
+    def groups(self, head='OBR', member='OBX'):
+        """
+        Agrupa segmentos repetidos bajo su cabecera, p. ej. los OBX de cada OBR.
+
+        Yields:
+            (segmento cabecera o None, [segmentos miembro])
+        """
+        actual, miembros = None, []
+        for seg in self.segments():
+            if seg.name == head:
+                if actual is not None or miembros:
+                    yield actual, miembros
+                actual, miembros = seg, []
+            elif seg.name == member:
+                miembros.append(seg)
+        if actual is not None or miembros:
+            yield actual, miembros
+
+    def unescape(self, valor):
+        """Resuelve las secuencias de escape HL7 (\\F\\, \\S\\, \\T\\, \\R\\, \\E\\, \\Xhh\\, \\.br\\)."""
+        esc = self.escape_char
+        if not self.has_escapes or esc not in valor:
+            return valor
+        partes = valor.split(esc)
+        salida = [partes[0]]
+        # Las secuencias ocupan las posiciones impares: texto\SEC\texto
+        for i in range(1, len(partes), 2):
+            secuencia = partes[i]
+            if i + 1 >= len(partes):
+                salida.append(esc + secuencia)  # escape sin cerrar: se deja literal
+                break
+            salida.append(self._secuencia(secuencia, esc))
+            salida.append(partes[i + 1])
+        return ''.join(salida)
+
+    def _secuencia(self, secuencia, esc):
+        if secuencia == 'F':
+            return self.field_sep
+        if secuencia == 'S':
+            return self.component_sep
+        if secuencia == 'T':
+            return self.subcomponent_sep
+        if secuencia == 'R':
+            return self.repetition_sep
+        if secuencia == 'E':
+            return esc
+        if secuencia == '.br':
+            return '\n'
+        if secuencia[:1] == 'X' and len(secuencia) % 2 == 1 and all(
+                _ESCAPE_HEX.fullmatch(secuencia[j:j + 2]) for j in range(1, len(secuencia), 2)):
+            return bytes.fromhex(secuencia[1:]).decode('latin-1')
+        return f'{esc}{secuencia}{esc}'
+
+    @staticmethod
+    def split_batch(data, encoding='utf-8'):
+        """Itera los mensajes de un archivo/lote con varios MSH."""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode(encoding, errors='replace')
+        inicios = [m.start() for m in re.finditer(r'(?:^|(?<=[\r\n\x0b]))MSH', data)]
+        for i, inicio in enumerate(inicios):
+            fin = inicios[i + 1] if i + 1 < len(inicios) else len(data)
+            yield HL7Message(data[inicio:fin])
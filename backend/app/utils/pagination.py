@@ -0,0 +1,172 @@
+"""
+Paginación por cursor (keyset) para listados.
+
+En lugar de OFFSET + COUNT(*), cada página pide las filas "después" de la
+última vista, ordenando por (fecha, id) descendente. El costo de la página
+1000 es el mismo que el de la página 1 si existe índice sobre (fecha, id).
+
+Una fecha NULL se ordena como '-infinity' (al final): el orden y la
+comparación usan COALESCE(fecha, '-infinity'), así una fila sin fecha no
+corta el listado (en PostgreSQL (NULL, id) < (...) no es verdadero para
+ninguna fila). Los índices de database/paginacion_indices.sql son sobre esa
+misma expresión.
+
+El cursor es opaco para el cliente: base64 de [fecha_iso, id].
+
+Compatibilidad: un cliente que todavía pide ?page=N recibe la respuesta
+anterior (OFFSET, con total, pages y current_page).
+"""
+from flask import request
+from app import db
+from sqlalchemy import tuple_, text, func, literal_column
+from datetime import datetime, date
+import base64
+import json
+import math
+
+# Posición de las fechas NULL en el orden descendente: después de todas
+_FECHA_NULA = "'-infinity'"
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def encode_cursor(valor, registro_id):
+    """Codificar la posición (fecha, id) de la última fila entregada"""
+    if isinstance(valor, (datetime, date)):
+        valor = valor.isoformat()
+    data = json.dumps([valor, registro_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodificar un cursor; lanza CursorInvalido si fue alterado"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valor, registro_id = json.loads(data)
+        if not isinstance(registro_id, int):
+            raise ValueError
+        if isinstance(valor, str):
+            valor = datetime.fromisoformat(valor)
+        return valor, registro_id
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise CursorInvalido('Cursor de paginación inválido')
+
+
+def validate_cursor_params(default=50, maximo=100):
+    """Obtener (cursor, limite, modo_total) validados desde el query string.
+
+    modo_total: None, 'aprox' (estimación del planificador) o 'exacto' (COUNT).
+    """
+    try:
+        limite = min(maximo, max(1, int(request.args.get('per_page', default))))
+    except (ValueError, TypeError):
+        limite = default
+    cursor = request.args.get('cursor') or None
+    posicion = decode_cursor(cursor) if cursor else None
+    total = request.args.get('total')
+    return posicion, limite, total if total in ('aprox', 'exacto') else None
+
+
+def pagina_legacy():
+    """Número de página si el cliente usa la paginación anterior (?page=N sin cursor), o None"""
+    if 'page' not in request.args or request.args.get('cursor'):
+        return None
+    try:
+        return max(1, int(request.args['page']))
+    except (ValueError, TypeError):
+        return 1
+
+
+def keyset_sql(columna, columna_id, marcadores=('%s', '%s')):
+    """
+    (ORDER BY, condición "después del cursor") para listados en SQL crudo,
+    con las fechas NULL al final. Los parámetros de la condición son
+    valores_cursor(posicion), en los `marcadores` del driver.
+    """
+    clave = f"COALESCE({columna}, {_FECHA_NULA})"
+    return (f"{clave} DESC, {columna_id} DESC",
+            f"({clave}, {columna_id}) < ({marcadores[0]}, {marcadores[1]})")
+
+
+def valores_cursor(posicion):
+    """Parámetros (fecha, id) de la condición de keyset_sql; una fecha NULL va como '-infinity'"""
+    fecha, registro_id = posicion
+    return [fecha if fecha is not None else _FECHA_NULA.strip("'"), registro_id]
+
+
+def _pagina(filas, limite, clave):
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    siguiente = encode_cursor(*clave(filas[-1])) if hay_mas and filas else None
+    return filas, siguiente
+
+
+def _estimar_filas(sql, params=None):
+    """Filas estimadas por el planificador de PostgreSQL (sin ejecutar la consulta)"""
+    plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params or {}).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_paginate(query, columna_orden, columna_id, posicion, limite, modo_total=None):
+    """Paginar una query ORM por (columna_orden, columna_id) descendente.
+
+    Devuelve (items, siguiente_cursor, total); total es None salvo que se pida
+    (o que el cliente use ?page=N, que conserva el OFFSET y el total de antes).
+    """
+    clave = func.coalesce(columna_orden, literal_column(_FECHA_NULA))
+    orden = (clave.desc(), columna_id.desc())
+
+    pagina = pagina_legacy()
+    if pagina is not None:
+        total = query.order_by(None).count()
+        items = query.order_by(*orden).offset((pagina - 1) * limite).limit(limite).all()
+        return items, None, total
+
+    total = None
+    if modo_total == 'exacto':
+        total = query.order_by(None).count()
+    elif modo_total == 'aprox':
+        if db.engine.dialect.name == 'postgresql':
+            compilada = query.order_by(None).statement.compile(
+                dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}
+            )
+            total = _estimar_filas(str(compilada))
+        else:
+            total = query.order_by(None).count()
+
+    if posicion is not None:
+        fecha, registro_id = posicion
+        query = query.filter(tuple_(clave, columna_id) < tuple_(
+            literal_column(_FECHA_NULA) if fecha is None else fecha, registro_id
+        ))
+
+    filas = query.order_by(*orden).limit(limite + 1).all()
+    nombre_orden, nombre_id = columna_orden.key, columna_id.key
+    items, siguiente = _pagina(
+        filas, limite, lambda f: (getattr(f, nombre_orden), getattr(f, nombre_id))
+    )
+    return items, siguiente, total
+
+
+def keyset_rows(filas, limite, indice_orden, indice_id):
+    """Cortar filas de SQL crudo (pedidas con LIMIT limite + 1) y calcular el cursor"""
+    return _pagina(list(filas), limite, lambda f: (f[indice_orden], f[indice_id]))
+
+
+def respuesta_paginada(clave, items, siguiente, total=None, limite=None):
+    """Cuerpo JSON común de los listados paginados por cursor"""
+    respuesta = {clave: items, 'siguiente_cursor': siguiente, 'hay_mas': siguiente is not None}
+    if limite is not None:
+        respuesta['per_page'] = limite
+    if total is not None:
+        respuesta['total'] = total
+    pagina = pagina_legacy()
+    if pagina is not None and total is not None and limite:
+        # Campos de la respuesta anterior a los cursores
+        respuesta['pages'] = math.ceil(total / limite)
+        respuesta['current_page'] = pagina
+    return respuesta
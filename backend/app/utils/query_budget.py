@@ -0,0 +1,48 @@
+"""
+Presupuesto de consultas SQL por endpoint.
+
+Cuenta las sentencias que ejecuta SQLAlchemy durante la vista y las
+devuelve en la cabecera X-Query-Count. Si se supera el presupuesto se
+registra un warning; con QUERY_BUDGET_STRICT (configuración de testing)
+se lanza PresupuestoExcedido, para detectar regresiones N+1
+(tests/test_presupuesto_consultas.py recorre las vistas con presupuesto).
+"""
+from functools import wraps
+from flask import g, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class PresupuestoExcedido(RuntimeError):
+    pass
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and getattr(g, '_consultas', None) is not None:
+        g._consultas += 1
+
+
+def presupuesto_consultas(maximo):
+    """Decorador: la vista no debe ejecutar más de `maximo` consultas"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            anterior = getattr(g, '_consultas', None)
+            g._consultas = 0
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+                usadas = g._consultas
+            finally:
+                g._consultas = anterior
+
+            response.headers['X-Query-Count'] = str(usadas)
+            if usadas > maximo:
+                mensaje = f'{f.__name__}: {usadas} consultas (presupuesto {maximo})'
+                if current_app.config.get('QUERY_BUDGET_STRICT'):
+                    raise PresupuestoExcedido(mensaje)
+                current_app.logger.warning(mensaje)
+            return response
+        decorated_function.presupuesto = maximo
+        return decorated_function
+    return decorator
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark del envío de campañas de WhatsApp contra un Twilio falso local.
+
+Levanta un servidor HTTP que imita POST .../Messages.json con una latencia
+fija (y, opcionalmente, respuestas 429/503), apunta WhatsAppService a él con
+TWILIO_API_URL y compara el envío en serie de antes con el pool concurrente
+de app/services/campanas_whatsapp.py, con y sin límite de tasa. No necesita
+PostgreSQL: mide solo el envío.
+
+Uso:
+    python bench_campana_whatsapp.py                 # 400 destinatarios, 150 ms por llamada
+    python bench_campana_whatsapp.py 2000 --latencia 0.3 --tasa 50 --errores 0.05
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+
+class TwilioFalso(BaseHTTPRequestHandler):
+    latencia = 0.15
+    errores = 0.0
+    por_segundo = Counter()   # segundo -> mensajes aceptados
+    destinos = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        datos = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        time.sleep(self.latencia)
+        if random.random() < self.errores:
+            codigo = random.choice((429, 503))
+            self._responder(codigo, {'code': 20429, 'message': 'Too Many Requests' if codigo == 429 else 'Unavailable'},
+                            {'Retry-After': '1'} if codigo == 429 else {})
+            return
+        with self.lock:
+            self.por_segundo[int(time.monotonic())] += 1
+            self.destinos[datos['To'][0]] += 1
+        self._responder(201, {'sid': f'SM{random.getrandbits(64):016x}', 'status': 'queued'})
+
+    def _responder(self, codigo, cuerpo, cabeceras=None):
+        contenido = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(contenido)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def log_message(self, *args):
+        pass
+
+
+def destinatarios(n):
+    return [(i, f'809555{i:04d}', f'Paciente{i}', 'Prueba') for i in range(1, n + 1)]
+
+
+def serie(servicio, lista):
+    """El envío de antes: una llamada bloqueante tras otra."""
+    for _, numero, nombre, apellido in lista:
+        servicio.enviar_mensaje(numero, f'Hola {nombre} {apellido}')
+
+
+def medir(nombre, funcion, n):
+    TwilioFalso.por_segundo.clear()
+    TwilioFalso.destinos.clear()
+    t0 = time.perf_counter()
+    ok = funcion()
+    segundos = time.perf_counter() - t0
+    pico = max(TwilioFalso.por_segundo.values(), default=0)
+    duplicados = sum(1 for c in TwilioFalso.destinos.values() if c > 1)
+    print(f'{nombre:28} {segundos:7.1f} s  {n / segundos:7.1f} msg/s  pico {pico:4} msg/s  '
+          f'enviados {ok if ok is not None else sum(TwilioFalso.destinos.values()):5}  duplicados {duplicados}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('n', nargs='?', type=int, default=400)
+    parser.add_argument('--latencia', type=float, default=0.15, help='segundos por llamada a Twilio')
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--tasa', type=float, default=20, help='límite en mensajes/segundo')
+    parser.add_argument('--errores', type=float, default=0.0, help='fracción de respuestas 429/503')
+    args = parser.parse_args()
+
+    TwilioFalso.latencia = args.latencia
+    TwilioFalso.errores = args.errores
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), TwilioFalso)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        'TWILIO_ACCOUNT_SID': 'ACfalso',
+        'TWILIO_AUTH_TOKEN': 'falso',
+        'TWILIO_API_URL': f'http://127.0.0.1:{servidor.server_port}',
+    })
+    from app.services.campanas_whatsapp import LimiteTasa, enviar_concurrente
+    from app.services.whatsapp_service import WhatsAppService
+
+    lista = destinatarios(args.n)
+    servicio = WhatsAppService(conexiones=args.hilos)
+    print(f'== {args.n} destinatarios, {args.latencia * 1000:.0f} ms por llamada, '
+          f'{args.errores:.0%} de 429/503 ==')
+
+    muestra = lista[:max(1, min(args.n, int(10 / args.latencia)))]
+    medir(f'serie ({len(muestra)} dest.)', lambda: serie(servicio, muestra), len(muestra))
+
+    def concurrente(tasa):
+        with ThreadPoolExecutor(args.hilos) as pool:
+            resultados = list(enviar_concurrente(servicio, lista, 'Hola {nombre} {apellido}', LimiteTasa(tasa), pool))
+        return sum(1 for _, r, _ in resultados if r['success'])
+
+    medir(f'{args.hilos} hilos sin límite', lambda: concurrente(None), args.n)
+    medir(f'{args.hilos} hilos, {args.tasa:g} msg/s', lambda: concurrente(args.tasa), args.n)
+    servicio.close()
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark del render DICOM (app/services/dicom_render.py).
+
+Sobre un frame sintético de 16 bits compara la normalización anterior de
+convert_dicom_to_png (resta, división a float64, multiplicación) con la
+tabla de 8 bits de a_uint8, y mide la pirámide completa en frío y desde
+la caché de disco.
+
+Uso:
+    python bench_dicom_render.py            # 3000x3000
+    python bench_dicom_render.py 4096
+"""
+from app.services.dicom_render import DicomRender, a_uint8
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def anterior(pixel_array):
+    pixel_array = pixel_array - np.min(pixel_array)
+    pixel_array = pixel_array / np.max(pixel_array)
+    return (pixel_array * 255).astype(np.uint8)
+
+
+def medir(nombre, funcion, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    funcion(*args)
+    segundos = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{nombre:22} {segundos * 1000:9.1f} ms  pico {pico / 1e6:8.1f} MB')
+
+
+def escribir_dicom(path, pixeles):
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = pixeles.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.WindowCenter, ds.WindowWidth = 2048, 4096
+    ds.PixelData = pixeles.tobytes()
+    ds.save_as(path)
+
+
+def main():
+    lado = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    pixeles = np.random.default_rng(1).integers(0, 4096, (lado, lado), dtype=np.uint16)
+    print(f'Frame {lado}x{lado} uint16, {pixeles.nbytes / 1e6:.1f} MB')
+
+    medir('anterior', anterior, pixeles)
+    medir('a_uint8 (tabla)', a_uint8, pixeles, {})
+    medir('a_uint8 (float32)', a_uint8, pixeles.astype(np.int32), {})
+
+    directorio = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directorio, 'estudio.dcm')
+        escribir_dicom(path, pixeles)
+        cache = os.path.join(directorio, 'cache')
+        medir('piramide (en frío)', DicomRender.piramide, path, 0, 'png', cache)
+        medir('piramide (caché)', DicomRender.piramide, path, 0, 'png', cache)
+    finally:
+        shutil.rmtree(directorio)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark del envío de email contra un servidor SMTP local (aiosmtpd).
+
+Compara el envío de antes (conexión, EHLO y login por mensaje, adjunto leído
+entero en memoria) con las sesiones reutilizadas de app/services/smtp_sesion.py
+y EmailService.enviar_lote. --espera simula el coste de STARTTLS + AUTH de un
+servidor real añadiéndolo al EHLO. También mide la memoria pico al enviar un
+adjunto grande y que el servidor lo reciba íntegro.
+
+Requiere aiosmtpd (pip install aiosmtpd), solo para este script.
+
+Uso:
+    python bench_email.py                       # 300 mensajes, 50 ms por conexión
+    python bench_email.py 1000 --espera 0.2 --adjunto-mb 25
+"""
+from email import message_from_bytes
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email import encoders
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+
+class Buzon:
+    """Handler de aiosmtpd: cuenta conexiones y mensajes y demora el EHLO."""
+
+    def __init__(self, espera, conexiones, recibidos, adjuntos):
+        self.espera = espera
+        self.conexiones = conexiones
+        self.recibidos = recibidos
+        self.adjuntos = adjuntos
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self.conexiones.get_lock():
+            self.conexiones.value += 1
+        await asyncio.sleep(self.espera)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.recibidos.get_lock():
+            self.recibidos.value += 1
+        if len(envelope.content) > 1024 * 1024:
+            adjunto = message_from_bytes(envelope.content).get_payload()[1].get_payload(decode=True)
+            self.adjuntos.put(hashlib.sha256(adjunto).hexdigest())
+        return '250 OK'
+
+
+def servidor(puerto, espera, conexiones, recibidos, adjuntos, listo):
+    """aiosmtpd en otro proceso, para que su memoria no cuente en las mediciones."""
+    controller = Controller(Buzon(espera, conexiones, recibidos, adjuntos), hostname='127.0.0.1', port=puerto,
+                            auth_require_tls=False, authenticator=lambda *_: AuthResult(success=True),
+                            data_size_limit=0)
+    controller.start()
+    listo.set()
+    threading.Event().wait()
+
+
+def envio_anterior(puerto, destinatario, html, adjunto=None):
+    """Lo que hacía EmailService.enviar: todo el MIME en memoria y una conexión por mensaje."""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = 'Resultados'
+    msg['From'] = 'centro@example.com'
+    msg['To'] = destinatario
+    msg.attach(MIMEText(html, 'html', 'utf-8'))
+    if adjunto:
+        with open(adjunto, 'rb') as f:
+            parte = MIMEBase('application', 'octet-stream')
+            parte.set_payload(f.read())
+            encoders.encode_base64(parte)
+            parte.add_header('Content-Disposition', f'attachment; filename="{os.path.basename(adjunto)}"')
+            msg.attach(parte)
+    with smtplib.SMTP('127.0.0.1', puerto) as server:
+        server.login('centro', 'clave')
+        server.send_message(msg)
+
+
+def medir(nombre, contadores, funcion, n):
+    conexiones, recibidos = contadores
+    conexiones.value = recibidos.value = 0
+    t0 = time.perf_counter()
+    funcion()
+    segundos = time.perf_counter() - t0
+    print(f'{nombre:24} {segundos:7.2f} s  {n / segundos:7.1f} msg/s  '
+          f'conexiones {conexiones.value:4}  recibidos {recibidos.value}')
+
+
+def pico_memoria(funcion):
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('n', nargs='?', type=int, default=300)
+    parser.add_argument('--espera', type=float, default=0.05, help='segundos extra por conexión')
+    parser.add_argument('--adjunto-mb', type=int, default=20)
+    args = parser.parse_args()
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        puerto = s.getsockname()[1]
+    contadores = (multiprocessing.Value('i', 0), multiprocessing.Value('i', 0))
+    adjuntos, listo = multiprocessing.Queue(), multiprocessing.Event()
+    proceso = multiprocessing.Process(target=servidor, args=(puerto, args.espera, *contadores, adjuntos, listo),
+                                      daemon=True)
+    proceso.start()
+    listo.wait()
+    os.environ.update({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(puerto), 'MAIL_USE_TLS': 'false',
+                       'MAIL_USERNAME': 'centro', 'MAIL_PASSWORD': 'clave', 'MAIL_FROM': 'centro@example.com'})
+    from app.services.email_service import EmailService
+    from app.services.smtp_sesion import pool
+
+    servicio = EmailService()
+    html = '<p>Sus resultados están listos.</p>' * 20
+    destinatarios = [f'paciente{i}@example.com' for i in range(args.n)]
+    print(f'== {args.n} mensajes, {args.espera * 1000:.0f} ms por conexión ==')
+    medir('conexión por mensaje', contadores, lambda: [envio_anterior(puerto, d, html) for d in destinatarios], args.n)
+    medir('enviar() con pool', contadores, lambda: [servicio.enviar(d, 'Resultados', html) for d in destinatarios], args.n)
+    lote = {}
+    medir('enviar_lote()', contadores, lambda: lote.update(servicio.enviar_lote(
+        {'to_email': d, 'subject': 'Resultados', 'body_html': html} for d in destinatarios)), args.n)
+    print(f'   lote: {lote["enviados"]} enviados, {lote["conexiones"]} conexiones, '
+          f'{lote["reconexiones"]} reconexiones, {lote["mensajes_por_segundo"]} msg/s')
+
+    # Reconexión: el servidor cierra la sesión que el pool tiene abierta
+    for sesiones in pool._libres.values():
+        for sesion in sesiones:
+            sesion.smtp.sock.close()
+    r = servicio.enviar(destinatarios[0], 'Tras caída', html)
+    print(f'tras cerrar el socket: {r}')
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(os.urandom(args.adjunto_mb * 1024 * 1024))
+        adjunto = f.name
+    try:
+        antes = pico_memoria(lambda: envio_anterior(puerto, destinatarios[0], html, adjunto))
+        ahora = pico_memoria(lambda: servicio.enviar(destinatarios[0], 'Resultados', html, [adjunto]))
+        with open(adjunto, 'rb') as f:
+            esperado = hashlib.sha256(f.read()).hexdigest()
+        adjuntos.get(timeout=30)  # el del envío anterior
+        recibido = adjuntos.get(timeout=30)
+        print(f'\n== Adjunto de {args.adjunto_mb} MB ==')
+        print(f'memoria pico antes {antes:7.1f} MB   ahora {ahora:7.1f} MB   '
+              f'íntegro: {recibido == esperado}')
+    finally:
+        os.remove(adjunto)
+        pool.cerrar_todas()
+        proceso.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la exportación en streaming de reportes.
+
+Mide memoria pico y velocidad de los generadores CSV/NDJSON/XLSX sobre
+filas sintéticas y, si DATABASE_URL apunta a PostgreSQL, compara leer una
+tabla temporal de pagos con cursor de servidor contra fetchall().
+
+Uso:
+    python bench_exportacion.py              # 1.000.000 filas
+    python bench_exportacion.py 200000
+"""
+from app.services.exportacion_service import ExportacionService, LOTE_FILAS
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+COLUMNAS = ['id', 'factura_id', 'fecha_pago', 'metodo_pago', 'monto']
+METODOS = ('efectivo', 'tarjeta', 'transferencia', 'cheque', 'seguro')
+
+
+def pagos_sinteticos(n):
+    inicio = datetime(2025, 1, 1)
+    for i in range(1, n + 1):
+        yield (i, i // 3, inicio + timedelta(minutes=i), METODOS[i % 5], Decimal(i % 5000) / 3)
+
+
+def consumir(chunks):
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+    return total
+
+
+def bench_generadores(n):
+    print(f'== Generadores ({n:,} filas sintéticas) ==')
+    for formato in ('csv', 'ndjson', 'xlsx'):
+        generador = getattr(ExportacionService, f'generar_{formato}')
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        total = consumir(generador(COLUMNAS, pagos_sinteticos(n)))
+        segundos = time.perf_counter() - t0
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{formato:7} {total / 1e6:9.1f} MB  {segundos:6.1f} s  '
+              f'{n / segundos:10,.0f} filas/s  pico {pico / 1024:8.0f} KB')
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_postgres(url, n):
+    from sqlalchemy import create_engine, text
+
+    print(f'\n== PostgreSQL: tabla temporal de {n:,} pagos ==')
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TEMP TABLE pagos_bench AS
+            SELECT g AS id, g / 3 AS factura_id,
+                   TIMESTAMP '2025-01-01' + g * INTERVAL '1 minute' AS fecha_pago,
+                   (ARRAY['efectivo','tarjeta','transferencia','cheque','seguro'])[g % 5 + 1] AS metodo_pago,
+                   ROUND((g % 5000) / 3.0, 2) AS monto
+            FROM generate_series(1, :n) g
+        """), {'n': n})
+        consulta = text('SELECT id, factura_id, fecha_pago, metodo_pago, monto FROM pagos_bench ORDER BY id')
+
+        # Primero streaming: ru_maxrss solo crece, así la comparación es justa
+        antes = rss_mb()
+        t0 = time.perf_counter()
+        result = conn.execution_options(stream_results=True, max_row_buffer=LOTE_FILAS).execute(consulta)
+        filas = (fila for particion in result.partitions(LOTE_FILAS) for fila in particion)
+        total = consumir(ExportacionService.generar_csv(COLUMNAS, filas))
+        print(f'streaming  {total / 1e6:9.1f} MB CSV  {time.perf_counter() - t0:6.1f} s  '
+              f'RSS pico +{rss_mb() - antes:7.1f} MB')
+
+        antes = rss_mb()
+        t0 = time.perf_counter()
+        filas = conn.execute(consulta).fetchall()
+        total = consumir(ExportacionService.generar_csv(COLUMNAS, filas))
+        print(f'fetchall   {total / 1e6:9.1f} MB CSV  {time.perf_counter() - t0:6.1f} s  '
+              f'RSS pico +{rss_mb() - antes:7.1f} MB')
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bench_generadores(n)
+    url = os.getenv('DATABASE_URL', '')
+    if url.startswith('postgresql'):
+        bench_postgres(url, n)
+    else:
+        print('\nDATABASE_URL no es PostgreSQL: se omite la comparación con cursor de servidor')
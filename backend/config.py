@@ -21,6 +21,28 @@ class Config:
         'pool_pre_ping': True,
     }
 
+    # Pool psycopg2 para los blueprints con SQL directo (app/db_pool.py)
+    DB_POOL_MINCONN = int(os.getenv('DB_POOL_MINCONN', 1))
+    DB_POOL_MAXCONN = int(os.getenv('DB_POOL_MAXCONN', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_HEALTH_CHECK_AFTER = 30  # segundos inactiva antes de verificar con SELECT 1
+    DB_POOL_LEAK_SECONDS = 30
+
+    # Cache de respuestas (app/cache.py): 'sqlite' compartido entre los workers de
+    # gunicorn (las invalidaciones llegan a todos) o 'memory' para un solo proceso
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+    CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', './cache/respuestas.db')
+
+    # Sesiones de imagen del visor de radiografías (app/services/sesiones_imagen.py): el
+    # registro de sesiones es compartido por los workers; la memoria decodificada, por worker
+    IMAGEN_SESION_MAX_MB = int(os.getenv('IMAGEN_SESION_MAX_MB', 512))
+    IMAGEN_SESION_TTL = int(os.getenv('IMAGEN_SESION_TTL', 1800))  # segundos sin uso
+    IMAGEN_SESION_DB = os.getenv('IMAGEN_SESION_DB', './cache/sesiones_imagen.db')
+
+    # Presupuesto de consultas por endpoint (app/utils/query_budget.py): error en vez de warning
+    QUERY_BUDGET_STRICT = False
+
     # JWT
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-jwt-key-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=8)
@@ -33,9 +55,19 @@ class Config:
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './uploads')
     RESULTADOS_FOLDER = os.path.join(UPLOAD_FOLDER, 'resultados')
     TEMP_FOLDER = os.path.join(UPLOAD_FOLDER, 'temp')
+    TRABAJOS_FOLDER = os.path.join(UPLOAD_FOLDER, 'trabajos')  # PDFs generados por worker.py
+    TRABAJOS_RETENCION_HORAS = int(os.getenv('TRABAJOS_RETENCION_HORAS', 24))  # luego se borran (se regeneran a pedido)
+    DICOM_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'cache_dicom')  # pirámides renderizadas (app/services/dicom_render.py)
+    DICOM_CACHE_MAX_MB = int(os.getenv('DICOM_CACHE_MAX_MB', 2048))  # tope; se borra lo usado hace más tiempo
+    ARCHIVOS_EQUIPOS_FOLDER = os.path.join(UPLOAD_FOLDER, 'archivos_equipos')  # subidas por bloques del desktop-agent
+    ARCHIVOS_EQUIPOS_MAX_MB = int(os.getenv('ARCHIVOS_EQUIPOS_MAX_MB', 2048))     # tamaño máximo declarado
+    ARCHIVOS_EQUIPOS_TTL_HORAS = int(os.getenv('ARCHIVOS_EQUIPOS_TTL_HORAS', 48))  # subidas sin actividad se borran
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
     ALLOWED_EXTENSIONS = {'pdf', 'dcm', 'jpg', 'jpeg', 'png', 'hl7', 'txt'}
 
+    # Desktop-agent: claves aceptadas en /api/maquinas (app/utils/agentes.py), separadas por coma
+    AGENTES_API_KEYS = [k.strip() for k in os.getenv('AGENTES_API_KEYS', '').split(',') if k.strip()]
+
     # Monitoreo
     EQUIPOS_EXPORT_PATH = os.getenv('EQUIPOS_EXPORT_PATH', './uploads/equipos')
 
@@ -53,6 +85,10 @@ class Config:
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
 
+    # WhatsApp (campañas: app/services/campanas_whatsapp.py)
+    WHATSAPP_TASA = float(os.getenv('WHATSAPP_TASA', 10))  # mensajes/segundo por defecto
+    WHATSAPP_HILOS = int(os.getenv('WHATSAPP_HILOS', 8))   # llamadas simultáneas a Twilio
+
     # NCF / ITBIS
     NCF_VALIDATION_ENABLED = True
     ITBIS_RATE = 0.18
@@ -80,6 +116,10 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # pool_size no aplica a SQLite
+    CACHE_BACKEND = 'memory'
+    IMAGEN_SESION_DB = ''
+    QUERY_BUDGET_STRICT = True
 
 
 # Seleccionar configuración según entorno
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Worker de la cola de trabajos (app/services/cola_trabajos.py).
+
+Ejecuta los PDFs, emails, mensajes de WhatsApp y subidas a la nube que las
+rutas encolan, fuera de los workers de gunicorn. Se despierta con
+LISTEN/NOTIFY en cuanto se encola algo y, por si se pierde un aviso,
+revisa la cola cada INTERVALO segundos. Se pueden levantar varios en
+paralelo (en una o varias máquinas): SKIP LOCKED reparte los trabajos.
+Mientras ejecuta un trabajo, un hilo renueva su bloqueo cada LATIDO
+segundos: un trabajo largo no se da por huérfano mientras el worker viva.
+Cada MANTENIMIENTO segundos borra además las subidas de archivos de
+equipos abandonadas y los PDFs generados con más de
+TRABAJOS_RETENCION_HORAS.
+
+SIGTERM/SIGINT terminan el trabajo en curso y salen.
+
+Uso:
+    python worker.py                      # 2 hilos, todos los tipos
+    python worker.py --hilos 4
+    python worker.py --tipos email_factura,email_resultados
+    python worker.py --una-vez            # vacía la cola y termina (cron)
+"""
+from app import create_app, db
+from app.services import trabajos  # registra los tipos de trabajo al importarse
+from app.services.cola_trabajos import ColaTrabajos, nombre_worker, BLOQUEO_MAXIMO, LATIDO
+from app.services.smtp_sesion import pool as pool_smtp
+import argparse
+import logging
+import os
+import select
+import signal
+import threading
+import time
+
+INTERVALO = 5
+MANTENIMIENTO = 3600
+CANAL = 'cola_trabajos'
+
+logger = logging.getLogger('worker')
+
+
+def latir(app, trabajo_id, nombre, fin):
+    """Renueva el bloqueo del trabajo en curso hasta que termine."""
+    while not fin.wait(LATIDO):
+        with app.app_context():
+            try:
+                if not ColaTrabajos.latido(trabajo_id, nombre):
+                    logger.warning('Trabajo %s ya no está bloqueado por %s', trabajo_id, nombre)
+                    return
+            except Exception:
+                logger.exception('Error renovando el bloqueo del trabajo %s', trabajo_id)
+
+
+def procesar(app, nombre, tipos, parar, aviso, una_vez=False):
+    """Bucle de un hilo: toma un trabajo, lo ejecuta, repite."""
+    while not parar.is_set():
+        filas = []
+        with app.app_context():
+            try:
+                filas = ColaTrabajos.tomar(nombre, 1, tipos)
+                for fila in filas:
+                    inicio = time.monotonic()
+                    fin = threading.Event()
+                    threading.Thread(target=latir, args=(app, fila[0], nombre, fin),
+                                     name=f'latido-{fila[0]}', daemon=True).start()
+                    try:
+                        estado = ColaTrabajos.ejecutar(fila)
+                    finally:
+                        fin.set()
+                    logger.info('Trabajo %s (%s): %s en %.1f s', fila[0], fila[1], estado,
+                                time.monotonic() - inicio)
+            except Exception:
+                logger.exception('Error leyendo la cola')
+                time.sleep(INTERVALO)
+            finally:
+                db.session.remove()
+        if not filas:
+            if una_vez:
+                return
+            aviso.wait(INTERVALO)
+            aviso.clear()
+
+
+def mantenimiento(app):
+    """Limpieza periódica de archivos temporales."""
+    from app.services.archivos_equipos import ArchivosEquipos
+
+    with app.app_context():
+        try:
+            filas, parciales = ArchivosEquipos.limpiar_abandonadas()
+            if filas or parciales:
+                logger.info('Subidas abandonadas borradas: %s filas, %s parciales', filas, parciales)
+        except Exception:
+            logger.exception('Error limpiando subidas abandonadas')
+        try:
+            borrados = trabajos.limpiar_archivos()
+            if borrados:
+                logger.info('Archivos de trabajos vencidos borrados: %s', borrados)
+        except Exception:
+            logger.exception('Error limpiando la carpeta de trabajos')
+
+
+def escuchar(parar, aviso):
+    """LISTEN en una conexión propia (fuera del pool) para despertar a los hilos."""
+    import psycopg2
+
+    while not parar.is_set():
+        try:
+            conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {CANAL}')
+            while not parar.is_set():
+                if select.select([conn], [], [], INTERVALO) != ([], [], []):
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        aviso.set()
+        except Exception as e:
+            logger.warning('LISTEN %s no disponible (%s); se revisa la cola cada %s s', CANAL, e, INTERVALO)
+            parar.wait(INTERVALO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker de la cola de trabajos')
+    parser.add_argument('--hilos', type=int, default=int(os.getenv('WORKER_HILOS', 2)))
+    parser.add_argument('--tipos', help='Solo estos tipos de trabajo, separados por coma')
+    parser.add_argument('--una-vez', action='store_true', help='Vaciar la cola y terminar')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    app = create_app(os.getenv('FLASK_ENV', 'production'))
+    tipos = [t.strip() for t in args.tipos.split(',')] if args.tipos else None
+
+    parar, aviso = threading.Event(), threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+
+    with app.app_context():
+        recuperados = ColaTrabajos.recuperar_huerfanos()
+    if recuperados:
+        logger.info('%s trabajos huérfanos devueltos a la cola', recuperados)
+
+    nombre = nombre_worker()
+    hilos = [
+        threading.Thread(target=procesar, args=(app, f'{nombre}/{i}', tipos, parar, aviso, args.una_vez),
+                         name=f'trabajos-{i}', daemon=True)
+        for i in range(max(1, args.hilos))
+    ]
+    for hilo in hilos:
+        hilo.start()
+    logger.info('Worker %s con %s hilos%s', nombre, len(hilos), f' (tipos: {args.tipos})' if tipos else '')
+
+    if args.una_vez:
+        for hilo in hilos:
+            hilo.join()
+        pool_smtp.cerrar_todas()
+        return
+
+    threading.Thread(target=escuchar, args=(parar, aviso), name='listen', daemon=True).start()
+    ultima_recuperacion = time.monotonic()
+    ultimo_mantenimiento = time.monotonic() - MANTENIMIENTO  # la primera en la primera vuelta
+    while not parar.wait(INTERVALO):
+        if time.monotonic() - ultima_recuperacion > BLOQUEO_MAXIMO / 3:
+            with app.app_context():
+                ColaTrabajos.recuperar_huerfanos()
+            ultima_recuperacion = time.monotonic()
+        if time.monotonic() - ultimo_mantenimiento > MANTENIMIENTO:
+            mantenimiento(app)
+            ultimo_mantenimiento = time.monotonic()
+    # Despertar a los hilos dormidos para que vean `parar`
+    aviso.set()
+    for hilo in hilos:
+        hilo.join()
+    pool_smtp.cerrar_todas()
+    logger.info('Worker detenido')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+-- ============================================
+-- ARCHIVOS DE EQUIPOS (subida por bloques reanudable)
+-- El desktop-agent sube los archivos grandes (DICOM) por bloques a
+-- /api/maquinas/archivos (app/services/archivos_equipos.py) y después
+-- envía el resultado con archivo_id en vez de los bytes. upload_id es la
+-- idempotency_key del dato en el outbox del agente: una subida
+-- interrumpida continúa desde el tamaño del archivo parcial.
+--   estado  subiendo, completo
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS archivos_equipos (
+    id BIGSERIAL PRIMARY KEY,
+    upload_id VARCHAR(64) NOT NULL UNIQUE,
+    nombre VARCHAR(255) NOT NULL,
+    tamano BIGINT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'subiendo',
+    ruta VARCHAR(500),                                -- archivo final, por sha256
+    estacion VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    completado_en TIMESTAMP
+);
+
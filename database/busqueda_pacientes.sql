@@ -0,0 +1,50 @@
+-- ============================================
+-- ÍNDICE DE BÚSQUEDA DE PACIENTES
+-- Columna normalizada (minúsculas, sin acentos) mantenida por trigger,
+-- con índice trigram para búsquedas '%termino%' e índices de prefijo
+-- para cédula, teléfono y código de paciente.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- La normalización debe coincidir con BusquedaPacientes.normalizar()
+-- en backend/app/services/busqueda_service.py.
+-- ============================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- codigo_paciente lo usa el backend Flask (PAC-YYYYMMDD-XXXX); schema.sql no lo crea
+ALTER TABLE pacientes ADD COLUMN IF NOT EXISTS codigo_paciente VARCHAR(30);
+ALTER TABLE pacientes ADD COLUMN IF NOT EXISTS busqueda TEXT;
+
+CREATE OR REPLACE FUNCTION pacientes_busqueda_normalizar()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.busqueda := lower(unaccent(concat_ws(' ',
+        NEW.nombre, NEW.apellido, NEW.cedula, NEW.telefono,
+        NEW.celular, NEW.email, NEW.codigo_paciente
+    )));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_pacientes_busqueda ON pacientes;
+CREATE TRIGGER trg_pacientes_busqueda
+    BEFORE INSERT OR UPDATE OF nombre, apellido, cedula, telefono, celular, email, codigo_paciente
+    ON pacientes
+    FOR EACH ROW EXECUTE FUNCTION pacientes_busqueda_normalizar();
+
+-- Rellenar filas existentes (dispara el trigger)
+UPDATE pacientes SET nombre = nombre WHERE busqueda IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_pacientes_busqueda_trgm
+    ON pacientes USING GIN (busqueda gin_trgm_ops);
+
+-- Prefijos exactos: "001-12" o "809555" no necesitan el índice trigram
+CREATE INDEX IF NOT EXISTS idx_pacientes_cedula_prefijo
+    ON pacientes (cedula varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_pacientes_telefono_prefijo
+    ON pacientes (telefono varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_pacientes_celular_prefijo
+    ON pacientes (celular varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_pacientes_codigo_prefijo
+    ON pacientes (codigo_paciente varchar_pattern_ops);
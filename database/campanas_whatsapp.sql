@@ -0,0 +1,56 @@
+-- ============================================
+-- CAMPAÑAS DE WHATSAPP
+-- Una fila por campaña y una por destinatario. El motor de envío
+-- (app/services/campanas_whatsapp.py) corre como trabajo de la cola
+-- (cola_trabajos.sql): toma los destinatarios pendientes por lotes con
+-- FOR UPDATE SKIP LOCKED y guarda el resultado de cada uno, así una
+-- campaña interrumpida continúa donde quedó.
+--   campanas_whatsapp.estado  pendiente, enviando, pausada, cancelada, completada
+--   campanas_envios.estado    pendiente, enviando, enviado, fallido, sin_numero, cancelado
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS campanas_whatsapp (
+    id SERIAL PRIMARY KEY,
+    nombre VARCHAR(200) NOT NULL,
+    mensaje TEXT NOT NULL,
+    fecha_programada TIMESTAMP,
+    estado VARCHAR(50) DEFAULT 'pendiente',
+    total_enviados INTEGER DEFAULT 0,
+    total_fallidos INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    usuario_creador_id INTEGER REFERENCES usuarios(id)
+);
+
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS total INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS tasa NUMERIC(6,2);               -- mensajes/segundo; NULL = WHATSAPP_TASA
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS filtros JSONB;
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS creada_por VARCHAR(100);         -- identidad JWT
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS iniciada_en TIMESTAMP;
+ALTER TABLE campanas_whatsapp ADD COLUMN IF NOT EXISTS finalizada_en TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS campanas_envios (
+    id SERIAL PRIMARY KEY,
+    campana_id INTEGER REFERENCES campanas_whatsapp(id),
+    paciente_id INTEGER REFERENCES pacientes(id),
+    numero_telefono VARCHAR(20),
+    estado VARCHAR(50) DEFAULT 'pendiente',
+    fecha_envio TIMESTAMP,
+    mensaje_id VARCHAR(100),
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE campanas_envios ADD COLUMN IF NOT EXISTS intentos SMALLINT NOT NULL DEFAULT 0;        -- llamadas a Twilio
+ALTER TABLE campanas_envios ADD COLUMN IF NOT EXISTS tomado_en TIMESTAMP;    -- cuándo lo tomó una pasada ('enviando')
+
+-- Un paciente recibe la campaña una sola vez
+CREATE UNIQUE INDEX IF NOT EXISTS ux_campanas_envios_paciente ON campanas_envios(campana_id, paciente_id);
+
+-- Siguiente lote a enviar
+CREATE INDEX IF NOT EXISTS idx_campanas_envios_pendientes
+    ON campanas_envios(campana_id, id) WHERE estado = 'pendiente';
+
+-- Progreso y listado de fallidos
+CREATE INDEX IF NOT EXISTS idx_campanas_envios_estado ON campanas_envios(campana_id, estado, id);
@@ -0,0 +1,42 @@
+-- ============================================
+-- COLA DE TRABAJOS EN SEGUNDO PLANO (sobre sync_queue)
+-- PDFs, emails, WhatsApp y subidas a la nube se encolan aquí y los
+-- ejecuta backend/worker.py fuera de gunicorn.
+--   tipo           nombre del trabajo (app/services/trabajos.py); NULL en
+--                  las filas de sincronización anteriores, que el worker ignora
+--   prioridad      menor = antes (0 urgente, 100 normal, 200 masivo)
+--   disponible_en  no se toma antes de esta hora (reintentos con espera)
+--   estado 'muerto' trabajos que agotaron max_intentos (dead-letter)
+-- Los workers toman filas con FOR UPDATE SKIP LOCKED: varios procesos
+-- pueden leer la cola sin bloquearse ni tomar el mismo trabajo.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS tipo VARCHAR(50);
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS prioridad SMALLINT NOT NULL DEFAULT 100;
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS max_intentos INTEGER NOT NULL DEFAULT 5;
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS disponible_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS bloqueado_por VARCHAR(100);
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS bloqueado_en TIMESTAMP;
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS resultado JSONB;
+ALTER TABLE sync_queue ADD COLUMN IF NOT EXISTS solicitado_por VARCHAR(100);  -- identidad JWT de quien lo encoló
+
+-- Un trabajo no siempre corresponde a un registro (p. ej. un respaldo)
+ALTER TABLE sync_queue ALTER COLUMN registro_id DROP NOT NULL;
+
+ALTER TABLE sync_queue DROP CONSTRAINT IF EXISTS sync_queue_estado_check;
+ALTER TABLE sync_queue ADD CONSTRAINT sync_queue_estado_check
+    CHECK (estado IN ('pendiente', 'procesando', 'completado', 'error', 'muerto'));
+
+-- Lo que lee el worker en cada vuelta: solo las filas pendientes
+CREATE INDEX IF NOT EXISTS idx_sync_queue_pendientes
+    ON sync_queue(prioridad, disponible_en, id) WHERE estado = 'pendiente' AND tipo IS NOT NULL;
+
+-- Reutilización de documentos: último trabajo de un tipo para un registro
+CREATE INDEX IF NOT EXISTS idx_sync_queue_documento
+    ON sync_queue(tipo, tabla, registro_id, id DESC) WHERE tipo IS NOT NULL;
+
+-- Recuperación de trabajos de un worker caído
+CREATE INDEX IF NOT EXISTS idx_sync_queue_procesando
+    ON sync_queue(bloqueado_en) WHERE estado = 'procesando';
@@ -0,0 +1,19 @@
+-- ============================================
+-- DEDUPLICACIÓN DE RESULTADOS RECIBIDOS DE EQUIPOS
+-- clave_dedup identifica el contenido del resultado, no el envío:
+--   hl7:<MSH-3>|<MSH-10>|<MSH-7>  aplicación emisora + ID de control + fecha
+--                            del mensaje (muchos equipos reinician el contador
+--                            de MSH-10 al apagarse: sin la fecha, dos
+--                            resultados distintos chocarían)
+--   dicom:<SOPInstanceUID>   instancia DICOM
+--   sha256:<hash>            contenido, cuando no hay identificador
+-- Un reintento del agente o una instancia DICOM recibida dos veces choca
+-- con el índice único y la ingesta devuelve el resultado existente.
+--
+-- Las filas anteriores quedan con clave NULL (no participan del índice).
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+ALTER TABLE resultados ADD COLUMN IF NOT EXISTS clave_dedup VARCHAR(200);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_resultados_clave_dedup ON resultados(clave_dedup);
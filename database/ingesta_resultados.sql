@@ -0,0 +1,12 @@
+-- ============================================
+-- INGESTA IDEMPOTENTE DE RESULTADOS
+-- Clave enviada por el desktop-agent con cada resultado; un reenvío
+-- tras un timeout choca con el índice único y no crea otra fila.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+ALTER TABLE resultados ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_resultados_idempotency_key
+    ON resultados(idempotency_key) WHERE idempotency_key IS NOT NULL;
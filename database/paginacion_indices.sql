@@ -0,0 +1,35 @@
+-- ============================================
+-- ÍNDICES PARA PAGINACIÓN POR CURSOR
+-- Los listados ordenan por (fecha, id) descendente y piden
+-- "filas anteriores a la última vista"; con estos índices cada
+-- página es un recorrido corto del índice, sin OFFSET.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+-- Las fechas NULL se ordenan como '-infinity' (app/utils/pagination.py): los
+-- índices son sobre COALESCE(fecha, '-infinity'), la misma expresión del
+-- ORDER BY y de la comparación con el cursor. Reemplazan a los índices
+-- *_keyset sobre la columna sola, que esas consultas ya no usan.
+DROP INDEX IF EXISTS idx_pacientes_keyset;
+DROP INDEX IF EXISTS idx_ordenes_keyset;
+DROP INDEX IF EXISTS idx_facturas_keyset;
+DROP INDEX IF EXISTS idx_resultados_keyset;
+DROP INDEX IF EXISTS idx_auditoria_keyset;
+DROP INDEX IF EXISTS idx_ordenes_estado_keyset;
+DROP INDEX IF EXISTS idx_facturas_estado_keyset;
+DROP INDEX IF EXISTS idx_auditoria_tabla_keyset;
+
+CREATE INDEX IF NOT EXISTS idx_pacientes_keyset_nulos ON pacientes((COALESCE(created_at, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ordenes_keyset_nulos ON ordenes((COALESCE(fecha_orden, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_facturas_keyset_nulos ON facturas((COALESCE(fecha_factura, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_resultados_keyset_nulos ON resultados((COALESCE(fecha_importacion, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_auditoria_keyset_nulos ON auditoria((COALESCE(created_at, '-infinity')) DESC, id DESC);
+
+-- Filtros frecuentes combinados con el orden del listado
+CREATE INDEX IF NOT EXISTS idx_ordenes_estado_keyset_nulos
+    ON ordenes(estado, (COALESCE(fecha_orden, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_facturas_estado_keyset_nulos
+    ON facturas(estado, (COALESCE(fecha_factura, '-infinity')) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_auditoria_tabla_keyset_nulos
+    ON auditoria(tabla, (COALESCE(created_at, '-infinity')) DESC, id DESC);
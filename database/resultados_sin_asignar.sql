@@ -0,0 +1,21 @@
+-- ============================================
+-- RESULTADOS SIN ASIGNAR
+-- Los resultados de equipos que llegan sin orden (archivos DICOM/PDF del
+-- desktop-agent) o con una orden que no existe (OBR-2 con el código del
+-- analizador) se guardan igual, con orden_detalle_id NULL, y quedan en la
+-- cola "sin asignar" (GET /api/resultados/sin-asignar) hasta que alguien
+-- los asigna a una orden (PUT /api/resultados/<id>/asignar).
+-- orden_referencia y paciente_referencia conservan lo que envió el equipo
+-- para buscar la orden a mano.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- ============================================
+
+ALTER TABLE resultados ADD COLUMN IF NOT EXISTS orden_referencia VARCHAR(100);
+ALTER TABLE resultados ADD COLUMN IF NOT EXISTS paciente_referencia VARCHAR(100);
+ALTER TABLE resultados ADD COLUMN IF NOT EXISTS estacion VARCHAR(100);
+
+-- Mismo orden que el listado (COALESCE: fechas NULL al final, ver paginacion_indices.sql)
+DROP INDEX IF EXISTS idx_resultados_sin_asignar;
+CREATE INDEX IF NOT EXISTS idx_resultados_sin_asignar_nulos
+    ON resultados((COALESCE(fecha_importacion, '-infinity')) DESC, id DESC) WHERE orden_detalle_id IS NULL;
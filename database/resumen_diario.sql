@@ -0,0 +1,210 @@
+-- ============================================
+-- RESÚMENES DIARIOS PARA EL DASHBOARD
+-- Agregados por día mantenidos con triggers, para que
+-- /api/reportes/dashboard lea pocas filas en vez de recorrer
+-- pagos, facturas, órdenes y pacientes.
+--
+-- Idempotente: se puede ejecutar sobre una base existente.
+-- Al final reconstruye los resúmenes desde las tablas base.
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS resumen_diario (
+    fecha DATE NOT NULL,
+    metrica VARCHAR(20) NOT NULL CHECK (metrica IN ('pacientes', 'ordenes', 'estudios', 'facturas', 'pagos')),
+    clave VARCHAR(50) NOT NULL DEFAULT '', -- estado, método de pago o estudio_id según la métrica
+    cantidad INTEGER NOT NULL DEFAULT 0,
+    total DECIMAL(14,2) NOT NULL DEFAULT 0,
+    pagado DECIMAL(14,2) NOT NULL DEFAULT 0, -- solo facturas: suma de pagos recibidos
+    PRIMARY KEY (metrica, clave, fecha)
+);
+
+CREATE INDEX IF NOT EXISTS idx_resumen_diario_fecha ON resumen_diario(fecha, metrica);
+
+COMMENT ON TABLE resumen_diario IS 'Agregados diarios para el dashboard, mantenidos por triggers';
+
+-- ============================================
+-- FUNCIÓN BASE: sumar un delta a un día/métrica/clave
+-- ============================================
+CREATE OR REPLACE FUNCTION resumen_diario_sumar(
+    p_fecha DATE, p_metrica VARCHAR, p_clave VARCHAR,
+    p_cantidad INTEGER, p_total DECIMAL, p_pagado DECIMAL
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_fecha IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad, total, pagado)
+    VALUES (p_fecha, p_metrica, COALESCE(p_clave, ''), p_cantidad,
+            COALESCE(p_total, 0), COALESCE(p_pagado, 0))
+    ON CONFLICT (metrica, clave, fecha) DO UPDATE SET
+        cantidad = resumen_diario.cantidad + EXCLUDED.cantidad,
+        total = resumen_diario.total + EXCLUDED.total,
+        pagado = resumen_diario.pagado + EXCLUDED.pagado;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============================================
+-- TRIGGERS POR TABLA
+-- ============================================
+CREATE OR REPLACE FUNCTION resumen_diario_pacientes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM resumen_diario_sumar(OLD.created_at::date, 'pacientes', OLD.estado, -1, 0, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM resumen_diario_sumar(NEW.created_at::date, 'pacientes', NEW.estado, 1, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION resumen_diario_ordenes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM resumen_diario_sumar(OLD.fecha_orden::date, 'ordenes', OLD.estado, -1, 0, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM resumen_diario_sumar(NEW.fecha_orden::date, 'ordenes', NEW.estado, 1, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION resumen_diario_estudios()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM resumen_diario_sumar(OLD.created_at::date, 'estudios', OLD.estudio_id::text, -1, -OLD.precio_final, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM resumen_diario_sumar(NEW.created_at::date, 'estudios', NEW.estudio_id::text, 1, NEW.precio_final, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las facturas llevan el pagado acumulado para calcular cuentas por cobrar
+-- por estado sin tocar la tabla de pagos desde el dashboard.
+CREATE OR REPLACE FUNCTION resumen_diario_facturas()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_pagado DECIMAL(14,2);
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COALESCE(SUM(monto), 0) INTO v_pagado FROM pagos WHERE factura_id = OLD.id;
+        PERFORM resumen_diario_sumar(OLD.fecha_factura::date, 'facturas', OLD.estado, -1, -OLD.total, -v_pagado);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COALESCE(SUM(monto), 0) INTO v_pagado FROM pagos WHERE factura_id = NEW.id;
+        PERFORM resumen_diario_sumar(NEW.fecha_factura::date, 'facturas', NEW.estado, 1, NEW.total, v_pagado);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION resumen_diario_pagos()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_factura RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM resumen_diario_sumar(OLD.fecha_pago::date, 'pagos', OLD.metodo_pago, -1, -OLD.monto, 0);
+        IF OLD.factura_id IS NOT NULL THEN
+            SELECT fecha_factura, estado INTO v_factura FROM facturas WHERE id = OLD.factura_id;
+            IF FOUND THEN
+                PERFORM resumen_diario_sumar(v_factura.fecha_factura::date, 'facturas', v_factura.estado, 0, 0, -OLD.monto);
+            END IF;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM resumen_diario_sumar(NEW.fecha_pago::date, 'pagos', NEW.metodo_pago, 1, NEW.monto, 0);
+        IF NEW.factura_id IS NOT NULL THEN
+            SELECT fecha_factura, estado INTO v_factura FROM facturas WHERE id = NEW.factura_id;
+            IF FOUND THEN
+                PERFORM resumen_diario_sumar(v_factura.fecha_factura::date, 'facturas', v_factura.estado, 0, 0, NEW.monto);
+            END IF;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_resumen_diario_pacientes ON pacientes;
+CREATE TRIGGER trg_resumen_diario_pacientes
+    AFTER INSERT OR DELETE OR UPDATE OF estado, created_at ON pacientes
+    FOR EACH ROW EXECUTE FUNCTION resumen_diario_pacientes();
+
+DROP TRIGGER IF EXISTS trg_resumen_diario_ordenes ON ordenes;
+CREATE TRIGGER trg_resumen_diario_ordenes
+    AFTER INSERT OR DELETE OR UPDATE OF estado, fecha_orden ON ordenes
+    FOR EACH ROW EXECUTE FUNCTION resumen_diario_ordenes();
+
+DROP TRIGGER IF EXISTS trg_resumen_diario_estudios ON orden_detalles;
+CREATE TRIGGER trg_resumen_diario_estudios
+    AFTER INSERT OR DELETE OR UPDATE OF estudio_id, precio_final, created_at ON orden_detalles
+    FOR EACH ROW EXECUTE FUNCTION resumen_diario_estudios();
+
+DROP TRIGGER IF EXISTS trg_resumen_diario_facturas ON facturas;
+CREATE TRIGGER trg_resumen_diario_facturas
+    AFTER INSERT OR DELETE OR UPDATE OF estado, total, fecha_factura ON facturas
+    FOR EACH ROW EXECUTE FUNCTION resumen_diario_facturas();
+
+DROP TRIGGER IF EXISTS trg_resumen_diario_pagos ON pagos;
+CREATE TRIGGER trg_resumen_diario_pagos
+    AFTER INSERT OR DELETE OR UPDATE OF monto, metodo_pago, fecha_pago, factura_id ON pagos
+    FOR EACH ROW EXECUTE FUNCTION resumen_diario_pagos();
+
+-- ============================================
+-- RECONSTRUCCIÓN COMPLETA (carga inicial o reparación)
+-- Bloquea escrituras en las tablas base mientras recalcula.
+-- ============================================
+CREATE OR REPLACE FUNCTION reconstruir_resumen_diario()
+RETURNS INTEGER AS $$
+DECLARE
+    filas INTEGER;
+BEGIN
+    LOCK TABLE pacientes, ordenes, orden_detalles, facturas, pagos IN SHARE MODE;
+    LOCK TABLE resumen_diario IN EXCLUSIVE MODE;
+
+    DELETE FROM resumen_diario;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad)
+    SELECT created_at::date, 'pacientes', COALESCE(estado, ''), COUNT(*)
+    FROM pacientes WHERE created_at IS NOT NULL
+    GROUP BY 1, 3;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad)
+    SELECT fecha_orden::date, 'ordenes', COALESCE(estado, ''), COUNT(*)
+    FROM ordenes WHERE fecha_orden IS NOT NULL
+    GROUP BY 1, 3;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad, total)
+    SELECT created_at::date, 'estudios', COALESCE(estudio_id::text, ''), COUNT(*), COALESCE(SUM(precio_final), 0)
+    FROM orden_detalles WHERE created_at IS NOT NULL
+    GROUP BY 1, 3;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad, total, pagado)
+    SELECT f.fecha_factura::date, 'facturas', COALESCE(f.estado, ''), COUNT(*),
+           COALESCE(SUM(f.total), 0), COALESCE(SUM(p.pagado), 0)
+    FROM facturas f
+    LEFT JOIN (
+        SELECT factura_id, SUM(monto) AS pagado FROM pagos GROUP BY factura_id
+    ) p ON p.factura_id = f.id
+    WHERE f.fecha_factura IS NOT NULL
+    GROUP BY 1, 3;
+
+    INSERT INTO resumen_diario (fecha, metrica, clave, cantidad, total)
+    SELECT fecha_pago::date, 'pagos', COALESCE(metodo_pago, ''), COUNT(*), COALESCE(SUM(monto), 0)
+    FROM pagos WHERE fecha_pago IS NOT NULL
+    GROUP BY 1, 3;
+
+    SELECT COUNT(*) INTO filas FROM resumen_diario;
+    RETURN filas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT reconstruir_resumen_diario();
@@ -551,3 +551,16 @@ COMMENT ON TABLE ordenes IS 'Órdenes de servicio generadas';
 COMMENT ON TABLE facturas IS 'Facturas emitidas con NCF';
 COMMENT ON TABLE resultados IS 'Resultados de estudios importados de equipos';
 COMMENT ON TABLE ncf_secuencias IS 'Control de secuencias de NCF según DGII';
+
+-- ============================================
+-- MÓDULOS ADICIONALES (ejecutar después de este archivo)
+-- ============================================
+-- resumen_diario.sql : agregados diarios para el dashboard de reportes
+-- busqueda_pacientes.sql : índice trigram y prefijos para búsqueda de pacientes
+-- paginacion_indices.sql : índices (fecha, id) para los listados paginados por cursor
+-- ingesta_resultados.sql : clave de idempotencia para /api/maquinas/recibir-lote
+-- dedup_resultados.sql : clave de deduplicación (MSH-10, SOPInstanceUID o hash) en resultados
+-- cola_trabajos.sql : cola de trabajos en segundo plano (PDF, email, WhatsApp, nube) sobre sync_queue
+-- campanas_whatsapp.sql : campañas de WhatsApp con estado por destinatario (envío reanudable)
+-- archivos_equipos.sql : subida por bloques reanudable de archivos grandes del desktop-agent
+-- resultados_sin_asignar.sql : resultados de equipos sin orden (cola para asignar a mano)
@@ -18,7 +18,6 @@ import os
 import sys
 import time
 import threading
-from queue import Queue
 from pathlib import Path
 
 # Importar collectors
@@ -26,12 +25,16 @@ from collectors.serial_collector import SerialCollector
 from collectors.file_watcher import FileWatcherCollector
 from collectors.dicom_listener import DicomListener
 
-# Importar uploader
+# Importar uploader y cola persistente
 from uploader import ResultUploader
+from outbox import Outbox
 
 # Importar detector de puertos
 from port_detector import PortDetector
 
+# Endpoint local de estado y métricas
+from status_server import StatusServer
+
 
 class DesktopAgent:
     """Agente principal que coordina los collectors y el uploader."""
@@ -45,14 +48,22 @@ class DesktopAgent:
         """
         self.config_path = config_path
         self.config = self._load_config()
-        self.queue = Queue()
         self.collectors = []
         self.uploader = None
+        self.port_detector = None
+        self.serial_collector = None
+        self.file_watcher = None
+        self.status_server = None
         self.running = False
         
         # Configurar logging
         self._setup_logging()
         
+        # Cola persistente: los datos recolectados sobreviven a un reinicio
+        self.queue = Outbox(self.config.get('outbox_path', 'outbox.db'))
+        if self.queue.recovered:
+            self.logger.info(f"Outbox: {self.queue.recovered} envíos interrumpidos vuelven a la cola")
+        
         self.logger.info("=" * 60)
         self.logger.info("Desktop Agent - Centro Diagnóstico v5")
         self.logger.info("=" * 60)
@@ -120,39 +131,31 @@ class DesktopAgent:
                     
                     if cached_ports:
                         self.logger.info(f"Cache encontrado con {len(cached_ports)} puertos")
-                        # Verificar que los puertos cacheados siguen siendo válidos
-                        invalid = detector.verify_cached_ports()
-                        if invalid:
-                            self.logger.warning(f"Puertos inválidos removidos: {invalid}")
-                        
-                        # Si quedan puertos válidos, usarlos
-                        if detector.detected_ports:
-                            ports_config = detector.get_ports_config()
-                            self.logger.info(f"Usando {len(ports_config)} puertos del cache")
-                        else:
-                            # Cache vacío, escanear
-                            self.logger.info("Cache vacío, escaneando puertos...")
-                            detector.scan_all_ports()
-                            detector.save_cache()
-                            ports_config = detector.get_ports_config()
-                    else:
-                        # No hay cache, escanear
-                        self.logger.info("No se encontró cache, escaneando puertos...")
-                        detector.scan_all_ports()
-                        detector.save_cache()
+                        # Los puertos cacheados que no están conectados se
+                        # conservan: el supervisor del collector los abre
+                        # cuando el adaptador vuelve a aparecer
                         ports_config = detector.get_ports_config()
+                        if ports_config:
+                            self.logger.info(f"Usando {len(ports_config)} puertos del cache")
                     
+                    # Los puertos sin equipo se escanean en segundo plano (al
+                    # arrancar y cada rescan_interval_seconds): los demás
+                    # collectors no esperan al escaneo
                     if not ports_config:
-                        self.logger.warning("No se detectaron equipos en puertos COM")
-                        self.logger.info("El agente seguirá ejecutándose por si se conectan equipos más tarde")
+                        self.logger.info("Sin puertos en cache: el escaneo continúa en segundo plano")
+                    self.port_detector = detector
                 
-                if ports_config:
+                if ports_config or self.port_detector:
                     collector = SerialCollector(
                         ports_config=ports_config,
                         queue=self.queue,
-                        logger=self.logger
+                        logger=self.logger,
+                        detector=self.port_detector,
+                        poll_interval=serial_config.get('hotplug_poll_seconds', 2),
+                        backoff_max=serial_config.get('reconnect_backoff_max_seconds', 60)
                     )
                     self.collectors.append(collector)
+                    self.serial_collector = collector
                     self.logger.info(f"Serial Collector inicializado con {len(ports_config)} puertos")
                     
                     # Mostrar resumen de equipos detectados
@@ -170,9 +173,12 @@ class DesktopAgent:
                 collector = FileWatcherCollector(
                     watch_dirs=fw_config.get('watch_dirs', []),
                     queue=self.queue,
-                    logger=self.logger
+                    logger=self.logger,
+                    workers=fw_config.get('workers', 4),
+                    settle_seconds=fw_config.get('settle_seconds', 1.0)
                 )
                 self.collectors.append(collector)
+                self.file_watcher = collector
                 self.logger.info(f"File Watcher inicializado con {len(fw_config.get('watch_dirs', []))} directorios")
             except Exception as e:
                 self.logger.error(f"Error inicializando File Watcher: {e}")
@@ -209,7 +215,12 @@ class DesktopAgent:
                 upload_interval=self.config.get('upload_interval_seconds', 10),
                 retry_on_failure=self.config.get('retry_on_failure', True),
                 max_retries=self.config.get('max_retries', 3),
-                logger=self.logger
+                logger=self.logger,
+                batch_size=self.config.get('upload_batch_size', 50),
+                workers=self.config.get('upload_workers', 2),
+                batch_endpoint=self.config.get('batch_endpoint', '/maquinas/recibir-lote'),
+                file_endpoint=self.config.get('file_endpoint', '/maquinas/archivos'),
+                chunk_size=int(self.config.get('upload_chunk_size_mb', 4) * 1024 * 1024)
             )
             self.logger.info("Uploader inicializado")
         except Exception as e:
@@ -240,6 +251,16 @@ class DesktopAgent:
             thread.start()
             self.logger.info(f"Thread iniciado: {thread.name}")
         
+        # Re-escaneo de puertos COM: agrega equipos nuevos sin parar los conectados
+        if self.port_detector and self.serial_collector:
+            interval = self.config['collectors']['serial'].get('rescan_interval_seconds', 300)
+            self.port_detector.start_background_scan(
+                interval,
+                on_detected=self.serial_collector.add_port,
+                busy_ports=self.serial_collector.active_ports
+            )
+            self.logger.info(f"Re-escaneo de puertos COM cada {interval} s")
+        
         # Iniciar uploader en thread separado
         if self.uploader:
             thread = threading.Thread(
@@ -250,6 +271,21 @@ class DesktopAgent:
             thread.start()
             self.logger.info(f"Thread iniciado: {thread.name}")
         
+        # Estado y métricas por HTTP (Prometheus en /metrics, JSON en /status)
+        status_config = self.config.get('status_server', {})
+        if status_config.get('enabled', True):
+            try:
+                self.status_server = StatusServer(
+                    self,
+                    logger=self.logger,
+                    host=status_config.get('host', '127.0.0.1'),
+                    port=status_config.get('port', 8765)
+                )
+                self.status_server.start()
+            except OSError as e:
+                self.status_server = None
+                self.logger.error(f"No se pudo iniciar el status server: {e}")
+        
         self.logger.info("=" * 60)
         self.logger.info("Desktop Agent ejecutándose correctamente")
         self.logger.info("Presiona Ctrl+C para detener")
@@ -268,6 +304,12 @@ class DesktopAgent:
         self.logger.info("Deteniendo Desktop Agent...")
         self.running = False
         
+        if self.status_server:
+            self.status_server.stop()
+        
+        if self.port_detector:
+            self.port_detector.stop_background_scan()
+        
         # Detener collectors
         for collector in self.collectors:
             try:
@@ -285,7 +327,54 @@ class DesktopAgent:
                 self.logger.error(f"Error deteniendo uploader: {e}")
         
         self.logger.info("Desktop Agent detenido correctamente")
-
+    
+    def status(self):
+        """
+        Estado del agente para el status server: outbox, uploader, métricas
+        por puerto serial y la lista de problemas que hacen fallar /health.
+        
+        Returns:
+            Diccionario serializable a JSON
+        """
+        outbox = self.queue.backlog()
+        outbox['counts'] = self.queue.counts()
+        outbox['collected'] = self.queue.collected()
+        status = {
+            'station_name': self.config['station_name'],
+            'running': self.running,
+            'collectors': [c.__class__.__name__ for c in self.collectors],
+            'outbox': outbox
+        }
+        if self.uploader:
+            status['uploader'] = self.uploader.snapshot()
+        if self.serial_collector:
+            status['serial'] = self.serial_collector.status()
+        if self.file_watcher:
+            status['file_watcher'] = self.file_watcher.status()
+        status['problems'] = self._problems(status)
+        return status
+    
+    def _problems(self, status):
+        """Síntomas de una estación lenta o atascada."""
+        problems = []
+        stuck_after = self.config.get('status_server', {}).get('stuck_after_seconds', 900)
+        
+        uploader = status.get('uploader')
+        if self.running and (not uploader or not uploader['running']):
+            problems.append("Uploader detenido")
+        
+        outbox = status['outbox']
+        oldest = outbox['oldest_pending_seconds']
+        if oldest is not None and oldest > stuck_after:
+            pendientes = outbox['ready'] + outbox['scheduled'] + outbox['sending']
+            detalle = f": {uploader['ultimo_error']}" if uploader and uploader['ultimo_error'] else ""
+            problems.append(f"{pendientes} datos sin enviar, el más antiguo hace {oldest:.0f} s{detalle}")
+        
+        for port in status.get('serial', {}).get('ports', []):
+            if port['state'] in ('reintentando', 'desconectado'):
+                error = f" ({port['last_error']})" if port['last_error'] else ""
+                problems.append(f"Puerto {port['port']} ({port['equipment_name']}) {port['state']}{error}")
+        return problems
 
 def main():
     """Función principal."""
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la ingesta del File Watcher ante una exportación masiva.
+
+Escribe N archivos HL7 en una carpeta vigilada (cada uno en varias
+escrituras, como un equipo lento) y mide cuánto tarda el FileWatcherCollector
+en ponerlos todos en la cola, y que ninguno se lea a medias ni dos veces.
+Con --preexistentes los archivos se crean antes de arrancar (barrido
+inicial). Con --legacy mide el handler anterior (sleep de 0.5 s en el hilo
+de watchdog, un archivo a la vez): usar pocos archivos.
+
+Uso:
+    python bench_file_watcher.py                  # 500 archivos
+    python bench_file_watcher.py 2000 --preexistentes
+    python bench_file_watcher.py 40 --legacy
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from collectors.file_watcher import FileWatcherCollector
+
+
+class Cola:
+    """Cola en memoria que verifica que cada archivo llegue completo y una sola vez."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nombres = set()
+        self.incompletos = 0
+        self.duplicados = 0
+
+    def put(self, data):
+        with self.lock:
+            if data['file_name'] in self.nombres:
+                self.duplicados += 1
+            self.nombres.add(data['file_name'])
+            if not data['raw_data'].rstrip().endswith('FIN'):
+                self.incompletos += 1
+
+    def __len__(self):
+        return len(self.nombres)
+
+
+def escribir(carpeta, n, partes=4, pausa=0.002):
+    for i in range(n):
+        with open(os.path.join(carpeta, f'resultado_{i:05d}.hl7'), 'w') as f:
+            for p in range(partes):
+                f.write(f'OBX|{p}|NM|GLU^Glucosa||{90 + p}|mg/dL\r' * 20)
+                f.flush()
+                time.sleep(pausa)
+            f.write('FIN\r')
+
+
+def esperar(cola, n, t0, limite=600):
+    while len(cola) < n and time.perf_counter() - t0 < limite:
+        time.sleep(0.01)
+    return time.perf_counter() - t0
+
+
+class HandlerAnterior(FileSystemEventHandler):
+    """El on_created de antes: dormir 0.5 s en el hilo de watchdog y procesar."""
+
+    def __init__(self, collector, dir_config):
+        self.collector = collector
+        self.dir_config = dir_config
+
+    def on_created(self, event):
+        if event.is_directory:
+            return
+        time.sleep(0.5)
+        self.collector.process_file(event.src_path, self.dir_config)
+
+
+def medir(nombre, n, preexistentes, legacy=False):
+    carpeta = tempfile.mkdtemp()
+    dir_config = {'path': carpeta, 'file_type': 'hl7', 'equipment_name': 'Bench'}
+    cola = Cola()
+    collector = FileWatcherCollector([dir_config], cola, logging.getLogger('bench'))
+
+    if legacy:
+        os.makedirs(os.path.join(carpeta, 'procesados'))
+        observer = Observer()
+        observer.schedule(HandlerAnterior(collector, dir_config), carpeta)
+        observer.start()
+    elif preexistentes:
+        escribir(carpeta, n)
+    t0 = time.perf_counter()
+    if not legacy:
+        threading.Thread(target=collector.start, daemon=True).start()
+    if legacy or not preexistentes:
+        escribir(carpeta, n)
+    segundos = esperar(cola, n, t0)
+
+    if legacy:
+        observer.stop()
+        observer.join()
+    else:
+        collector.stop()
+    print(f'{nombre:22} {len(cola):6} archivos  {segundos:7.2f} s  {len(cola) / segundos:7.1f} archivos/s  '
+          f'incompletos {cola.incompletos}  duplicados {cola.duplicados}')
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    n = int(args[0]) if args else 500
+    preexistentes = '--preexistentes' in sys.argv
+    logging.basicConfig(level=logging.WARNING)
+
+    medir('barrido inicial' if preexistentes else 'eventos', n, preexistentes)
+    if '--legacy' in sys.argv:
+        medir('anterior (sleep 0.5 s)', n, False, legacy=True)
+
+
+if __name__ == '__main__':
+    main()
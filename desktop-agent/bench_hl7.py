@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser HL7 del agente.
+
+Genera un corpus de mensajes ORU^R01 sintéticos (varios OBR, OBX con
+escapes) y mide:
+  - HL7Parser (tokenizador HL7Message en una pasada)
+  - el parser anterior (replace + split por línea + split por campo)
+  - hl7apy.parse_message, lo que hace HL7Service.parse_hl7_file en el
+    backend, si hl7apy está instalado (sobre una muestra)
+
+El parser anterior borraba los CR y unía todos los segmentos en una línea,
+así que se le da el corpus con LF para que al menos extraiga los OBX.
+
+Uso:
+    python bench_hl7.py            # 10.000 mensajes
+    python bench_hl7.py 50000
+"""
+import importlib.util
+import random
+import sys
+import time
+
+from parsers.hl7_parser import HL7Parser
+
+MUESTRA_HL7APY = 200
+
+
+def mensaje(i, sep):
+    segmentos = [
+        f'MSH|^~\\&|COBAS|LAB|HIS|HOSP|20250101120000||ORU^R01|MSG{i:08d}|P|2.5',
+        f'PID|1||{i % 9999}^^^HOSP~V{i}^^^VISITA||PEREZ^JUAN^A||19800101|M',
+    ]
+    for orden in range(random.randint(1, 3)):
+        segmentos.append(f'OBR|{orden + 1}|{i}-{orden}|F{i}|PANEL{orden}')
+        for n in range(1, random.randint(5, 25)):
+            segmentos.append(
+                f'OBX|{n}|NM|{n:04d}^ANALITO {n}^LN||{random.uniform(1, 500):.2f}|'
+                f'mg/dL^mg/dL^UCUM|1-500|{random.choice("NHL")}|||F'
+            )
+        segmentos.append('NTE|1||Comentario con \\F\\ y \\S\\ escapados')
+    return sep.join(segmentos) + sep
+
+
+def legacy(message):
+    """HL7Parser.parse anterior (mismos pasos y mismo resultado por OBX)."""
+    message = message.replace('\x0B', '').replace('\x1C', '').replace('\x0D', '')
+    segments = [line for line in message.split('\n') if line.strip()]
+    result = {'patient_id': None, 'patient_name': None, 'order_id': None,
+              'test_results': [], 'timestamp': None}
+    for segment in segments:
+        if not segment:
+            continue
+        fields = segment.split('|')
+        segment_type = fields[0] if fields else ''
+        if segment_type == 'MSH':
+            result['timestamp'] = HL7Parser._parse_timestamp(fields[6] if len(fields) > 6 else '')
+        elif segment_type == 'PID':
+            result['patient_id'] = fields[3].split('^')[0] if len(fields) > 3 else None
+            if len(fields) > 5:
+                components = fields[5].split('^')
+                result['patient_name'] = f"{components[1]} {components[0]}"
+        elif segment_type == 'OBR':
+            result['order_id'] = fields[2] if len(fields) > 2 else None
+        elif segment_type == 'OBX' and len(fields) >= 6:
+            identifier = fields[3].split('^')
+            test_code = identifier[0] if len(identifier) > 0 else ''
+            result['test_results'].append({
+                'test_code': test_code,
+                'test_name': identifier[1] if len(identifier) > 1 else test_code,
+                'value': fields[5],
+                'units': fields[6] if len(fields) > 6 else '',
+                'reference_range': fields[7] if len(fields) > 7 else '',
+                'status': HL7Parser._interpret_flag(fields[8] if len(fields) > 8 else ''),
+            })
+    return result
+
+
+def hl7apy_parse(message):
+    from hl7apy.parser import parse_message
+    msg = parse_message(message)
+    return [str(obx.obx_5) for obx in msg.obx]
+
+
+def medir(nombre, funcion, corpus, obx):
+    t0 = time.perf_counter()
+    for m in corpus:
+        funcion(m)
+    segundos = time.perf_counter() - t0
+    print(f'{nombre:12} {len(corpus) / segundos:10,.0f} msg/s  '
+          f'{obx / segundos:12,.0f} OBX/s  {segundos:6.2f} s  ({len(corpus):,} mensajes)')
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    random.seed(1)
+    estados = random.getstate()
+    corpus = [mensaje(i, '\r') for i in range(n)]
+    random.setstate(estados)
+    corpus_lf = [mensaje(i, '\n') for i in range(n)]
+
+    obx = sum(len(HL7Parser.parse(m)['test_results']) for m in corpus)
+    assert obx == sum(len(legacy(m)['test_results']) for m in corpus_lf)
+    print(f'{n:,} mensajes, {obx:,} OBX, {sum(map(len, corpus)) / 1e6:.1f} MB')
+
+    medir('HL7Parser', HL7Parser.parse, corpus, obx)
+    medir('anterior', legacy, corpus_lf, obx)
+    if importlib.util.find_spec('hl7apy') is None:
+        print('hl7apy no está instalado: se omite la comparación')
+    else:
+        # hl7apy valida contra la estructura del mensaje y es órdenes de
+        # magnitud más lento: se mide sobre una muestra
+        muestra = corpus[:MUESTRA_HL7APY]
+        obx_muestra = sum(len(HL7Parser.parse(m)['test_results']) for m in muestra)
+        medir('hl7apy', hl7apy_parse, muestra, obx_muestra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark del framing MLLP del Serial Collector.
+
+Genera tráfico sintético de analizador (mensajes ORU^R01 con basura entre
+frames), lo entrega en bloques como llegarían del puerto y mide el
+MLLPFramer. Con --legacy compara contra el algoritmo anterior
+(buffer += data, reescaneo completo y buffer.replace), que es cuadrático:
+usar pocos MB.
+
+Uso:
+    python bench_mllp.py                 # 16 MB, bloques de 4096 bytes
+    python bench_mllp.py 64 512
+    python bench_mllp.py 2 4096 --legacy
+"""
+import random
+import sys
+import time
+
+from parsers.mllp import MLLPFramer
+
+VT, FS, CR = b'\x0b', b'\x1c', b'\x0d'
+
+
+def mensaje(i):
+    obx = ''.join(
+        f'OBX|{n}|NM|{n:04d}^ANALITO{n}||{random.uniform(1, 500):.2f}|mg/dL|1-500|N|||F\r'
+        for n in range(1, random.randint(5, 40))
+    )
+    return (
+        f'MSH|^~\\&|COBAS|LAB|HIS|HOSP|20250101120000||ORU^R01|MSG{i:08d}|P|2.5\r'
+        f'PID|1||{i % 9999}^^^HOSP||PACIENTE^PRUEBA\r'
+        f'OBR|1|{i}|{i}|PANEL\r{obx}'
+    ).encode()
+
+
+def trafico(megabytes):
+    partes, total, i = [], 0, 0
+    while total < megabytes * 1024 * 1024:
+        frame = VT + mensaje(i) + FS + CR
+        if i % 50 == 0:
+            frame = b'\r\nRUIDO' + frame
+        partes.append(frame)
+        total += len(frame)
+        i += 1
+    return b''.join(partes), i
+
+
+def legacy(datos, bloque):
+    """Algoritmo anterior de SerialCollector._read_port/_extract_messages."""
+    buffer = b''
+    n = 0
+    for i in range(0, len(datos), bloque):
+        buffer += datos[i:i + bloque]
+        messages = []
+        start = 0
+        while True:
+            vt_pos = buffer.find(VT, start)
+            if vt_pos == -1:
+                break
+            fs_pos = buffer.find(FS, vt_pos)
+            if fs_pos == -1:
+                break
+            if fs_pos + 1 < len(buffer) and buffer[fs_pos + 1:fs_pos + 2] == CR:
+                messages.append(buffer[vt_pos:fs_pos + 2])
+                start = fs_pos + 2
+            else:
+                start = fs_pos + 1
+        for message in messages:
+            buffer = buffer.replace(message, b'', 1)
+            n += 1
+    return n
+
+
+def framer(datos, bloque):
+    f = MLLPFramer()
+    n = 0
+    for i in range(0, len(datos), bloque):
+        n += len(f.feed(datos[i:i + bloque]))
+    return n, f
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    megabytes = float(args[0]) if args else 16
+    bloque = int(args[1]) if len(args) > 1 else 4096
+
+    random.seed(1)
+    datos, esperados = trafico(megabytes)
+    mb = len(datos) / 1e6
+    print(f'{mb:.1f} MB, {esperados:,} mensajes, bloques de {bloque} bytes')
+
+    t0 = time.perf_counter()
+    n, f = framer(datos, bloque)
+    segundos = time.perf_counter() - t0
+    print(f'MLLPFramer  {n:8,} mensajes  {segundos:7.2f} s  {mb / segundos:8.1f} MB/s  '
+          f'descartados {f.discarded_bytes} bytes')
+    assert n == esperados
+
+    if '--legacy' in sys.argv:
+        t0 = time.perf_counter()
+        n = legacy(datos, bloque)
+        segundos = time.perf_counter() - t0
+        print(f'anterior    {n:8,} mensajes  {segundos:7.2f} s  {mb / segundos:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
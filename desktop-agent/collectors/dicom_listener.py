@@ -110,17 +110,26 @@ class DicomListener:
             study_time = getattr(ds, 'StudyTime', '')
             modality = getattr(ds, 'Modality', 'UNKNOWN')
             series_description = getattr(ds, 'SeriesDescription', '')
+            sop_instance_uid = str(getattr(ds, 'SOPInstanceUID', '') or '')
             
             self.logger.info(f"Imagen DICOM recibida:")
             self.logger.info(f"  Paciente: {patient_name} ({patient_id})")
             self.logger.info(f"  Modalidad: {modality}")
             self.logger.info(f"  Fecha: {study_date}")
             
-            # Generar nombre de archivo único
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{patient_id}_{modality}_{timestamp}.dcm"
+            # Nombre por SOPInstanceUID: si el equipo reenvía la misma instancia
+            # no se guarda otra copia ni se vuelve a encolar
+            if sop_instance_uid:
+                filename = f"{sop_instance_uid}.dcm"
+            else:
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filename = f"{patient_id}_{modality}_{timestamp}.dcm"
             filepath = os.path.join(self.store_path, filename)
             
+            if sop_instance_uid and os.path.exists(filepath):
+                self.logger.info(f"Instancia ya recibida, se ignora: {sop_instance_uid}")
+                return 0x0000
+            
             # Guardar archivo DICOM
             ds.save_as(filepath, write_like_original=False)
             self.logger.info(f"Archivo guardado: {filename}")
@@ -139,6 +148,7 @@ class DicomListener:
                 'study_time': study_time,
                 'modality': modality,
                 'series_description': series_description,
+                'sop_instance_uid': sop_instance_uid,
                 'timestamp': datetime.now().isoformat()
             }
             
@@ -2,9 +2,12 @@
 File Watcher Collector - Monitorea carpetas para archivos nuevos (HL7, DICOM, PDF)
 """
 
+import fnmatch
+import hashlib
 import os
-import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from watchdog.observers import Observer
@@ -12,121 +15,268 @@ from watchdog.events import FileSystemEventHandler
 
 
 class FileHandler(FileSystemEventHandler):
-    """Handler para eventos de archivos."""
-    
+    """
+    Handler para eventos de archivos. No procesa nada en el hilo de
+    watchdog: solo avisa al collector, que decide cuándo el archivo está
+    completo.
+    """
+
     def __init__(self, collector, dir_config):
         """
         Inicializa el handler.
-        
+
         Args:
             collector: Instancia del FileWatcherCollector
             dir_config: Configuración del directorio
         """
         self.collector = collector
         self.dir_config = dir_config
-    
+
     def on_created(self, event):
         """Se ejecuta cuando se crea un archivo nuevo."""
-        if event.is_directory:
-            return
-        
-        # Esperar un poco para asegurar que el archivo esté completo
-        time.sleep(0.5)
-        
-        # Procesar el archivo
-        self.collector.process_file(event.src_path, self.dir_config)
+        if not event.is_directory:
+            self.collector.notify(event.src_path, self.dir_config)
+
+    def on_modified(self, event):
+        """El archivo sigue escribiéndose: reinicia su espera."""
+        if not event.is_directory:
+            self.collector.notify(event.src_path, self.dir_config)
+
+    def on_moved(self, event):
+        """Equipos que escriben un temporal y lo renombran al terminar."""
+        if not event.is_directory:
+            self.collector.notify(event.dest_path, self.dir_config)
+
+    def on_closed(self, event):
+        """IN_CLOSE_WRITE (Linux): el equipo cerró el archivo, está completo."""
+        if not event.is_directory:
+            self.collector.notify(event.src_path, self.dir_config, closed=True)
 
 
 class FileWatcherCollector:
-    """Monitorea carpetas para detectar archivos nuevos."""
-    
-    def __init__(self, watch_dirs, queue, logger):
+    """
+    Monitorea carpetas para detectar archivos nuevos.
+
+    Los eventos de watchdog y el barrido inicial de archivos preexistentes
+    dejan cada archivo como pendiente. El hilo de start() revisa los
+    pendientes y considera completo un archivo cuando su tamaño y mtime no
+    cambian durante settle_seconds, o en cuanto llega su close_write en
+    Linux; entonces lo procesa un pool de `workers` hilos. El archivo se
+    mueve a procesados/ antes de leerlo: en Windows el rename falla
+    mientras el equipo lo tiene abierto, y en ese caso se reintenta. Si no
+    se puede leer ni encolar se aparta en errores/, para revisarlo a mano:
+    devolverlo a la carpeta lo haría fallar una y otra vez.
+    """
+
+    # Temporales que los equipos escriben y luego renombran
+    IGNORE_PATTERNS = ('*.tmp', '*.part', '*.partial', '~*', '.*')
+
+    # Tipos que se leen y se encolan como texto; el resto va por referencia
+    TEXT_TYPES = ('hl7', 'txt', 'csv')
+
+    def __init__(self, watch_dirs, queue, logger, workers=4, settle_seconds=1.0, poll_interval=0.2):
         """
         Inicializa el File Watcher.
-        
+
         Args:
             watch_dirs: Lista de configuraciones de directorios a monitorear
             queue: Cola para poner los datos recolectados
             logger: Logger para mensajes
+            workers: Archivos procesados en paralelo
+            settle_seconds: Segundos sin cambios de tamaño/mtime para dar un archivo por completo
+            poll_interval: Segundos entre revisiones de los archivos pendientes
         """
         self.watch_dirs = watch_dirs
         self.queue = queue
         self.logger = logger
+        self.workers = max(1, workers)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
         self.observers = []
         self.running = False
-    
+        self._pending = {}       # ruta -> {'config', 'sig', 'since', 'closed'}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._executor = None
+        self.stats = {'procesados': 0, 'errores': 0, 'reintentos': 0}
+
     def start(self):
         """Inicia el monitoreo de todas las carpetas configuradas."""
         self.running = True
         self.logger.info(f"File Watcher: Iniciando con {len(self.watch_dirs)} directorios")
-        
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='FileWatcher')
+
         for dir_config in self.watch_dirs:
             path = dir_config['path']
-            
+
             # Crear el directorio si no existe
             Path(path).mkdir(parents=True, exist_ok=True)
-            
-            # Crear directorio para archivos procesados
-            processed_path = os.path.join(path, 'procesados')
-            Path(processed_path).mkdir(exist_ok=True)
-            
+
+            # Crear directorios para archivos procesados y con error
+            Path(os.path.join(path, 'procesados')).mkdir(exist_ok=True)
+            Path(os.path.join(path, 'errores')).mkdir(exist_ok=True)
+
             # Crear observer
             event_handler = FileHandler(self, dir_config)
             observer = Observer()
             observer.schedule(event_handler, path, recursive=False)
             observer.start()
-            
+
             self.observers.append(observer)
             self.logger.info(f"Monitoreando: {path} ({dir_config.get('file_type', 'unknown')})")
-        
-        # Mantener el thread vivo
+
+            # Archivos que llegaron con el agente detenido (el observer ya
+            # está activo, así que no queda hueco entre el barrido y los eventos)
+            existentes = 0
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        existentes += self.notify(entry.path, dir_config)
+            if existentes:
+                self.logger.info(f"{existentes} archivos preexistentes en {path}")
+
+        # Revisar pendientes hasta que se detenga el collector
         try:
             while self.running:
-                time.sleep(1)
+                self._wake.wait(self.poll_interval if self._pending else 1)
+                self._wake.clear()
+                self._dispatch_ready()
         except Exception as e:
             self.logger.error(f"Error en File Watcher: {e}")
-    
+
+    def notify(self, file_path, dir_config, closed=False):
+        """
+        Registra un evento sobre un archivo; se procesará cuando esté completo.
+
+        Returns:
+            True si el archivo quedó pendiente
+        """
+        file_path = os.path.abspath(file_path)
+        if os.path.normcase(os.path.dirname(file_path)) != os.path.normcase(os.path.abspath(dir_config['path'])):
+            return False  # p. ej. el propio movimiento a procesados/
+        file_name = os.path.basename(file_path)
+        patterns = dir_config.get('ignore_patterns', self.IGNORE_PATTERNS)
+        if any(fnmatch.fnmatch(file_name, p) for p in patterns):
+            return False
+
+        with self._lock:
+            pending = self._pending.get(file_path)
+            if pending is None:
+                pending = self._pending[file_path] = {
+                    'config': dir_config, 'sig': None, 'since': time.monotonic(), 'closed': False
+                }
+            pending['closed'] = pending['closed'] or closed
+        if closed:
+            self._wake.set()
+        return True
+
+    def _dispatch_ready(self):
+        """Envía al pool los pendientes que ya están completos."""
+        ahora = time.monotonic()
+        with self._lock:
+            items = [(p, d) for p, d in self._pending.items() if p not in self._in_flight]
+
+        listos, desaparecidos = [], []
+        for file_path, pending in items:
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                desaparecidos.append(file_path)
+                continue
+            except OSError:
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig != pending['sig']:
+                pending['sig'], pending['since'] = sig, ahora
+                if not pending['closed']:
+                    continue
+            elif not pending['closed'] and ahora - pending['since'] < self.settle_seconds:
+                continue
+            listos.append((file_path, pending['config']))
+
+        with self._lock:
+            for file_path in desaparecidos:
+                self._pending.pop(file_path, None)
+            for file_path, dir_config in listos:
+                self._pending.pop(file_path, None)
+                self._in_flight.add(file_path)
+        for file_path, dir_config in listos:
+            self._executor.submit(self._process, file_path, dir_config)
+
+    def _process(self, file_path, dir_config):
+        try:
+            self.process_file(file_path, dir_config)
+        finally:
+            with self._lock:
+                self._in_flight.discard(file_path)
+
+    def _retry_later(self, file_path, dir_config):
+        """El equipo todavía tiene el archivo abierto: volver a esperar."""
+        with self._lock:
+            self.stats['reintentos'] += 1
+            self._pending[file_path] = {
+                'config': dir_config, 'sig': None, 'since': time.monotonic(), 'closed': False
+            }
+
+    @staticmethod
+    def _destino(carpeta, file_name):
+        """Ruta libre para file_name en carpeta (agrega un timestamp si ya existe)."""
+        destino = os.path.join(carpeta, file_name)
+        if os.path.exists(destino):
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            name, ext = os.path.splitext(file_name)
+            destino = os.path.join(carpeta, f"{name}_{timestamp}{ext}")
+        return destino
+
+    @staticmethod
+    def _checksum(path, block_size=1024 * 1024):
+        """Tamaño y sha256 del archivo, leído por bloques."""
+        h, size = hashlib.sha256(), 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+                size += len(block)
+        return size, h.hexdigest()
+
     def process_file(self, file_path, dir_config):
         """
         Procesa un archivo nuevo.
-        
+
         Args:
             file_path: Ruta del archivo
             dir_config: Configuración del directorio
         """
+        processed_path = None
         try:
             # Verificar que el archivo existe y no está vacío
             if not os.path.exists(file_path):
                 return
-            
+
             file_size = os.path.getsize(file_path)
             if file_size == 0:
                 self.logger.warning(f"Archivo vacío ignorado: {file_path}")
                 return
-            
+
             file_name = os.path.basename(file_path)
             file_type = dir_config.get('file_type', 'unknown')
             equipment_type = dir_config.get('equipment_type', 'unknown')
             equipment_name = dir_config.get('equipment_name', 'Unknown Equipment')
-            
+
             self.logger.info(f"Archivo detectado: {file_name} ({file_type})")
-            
-            # Leer el contenido del archivo
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-            
-            # Determinar si es texto o binario
-            is_text = file_type in ['hl7', 'txt', 'csv']
-            
-            if is_text:
-                try:
-                    content = raw_data.decode('utf-8', errors='replace')
-                except:
-                    content = raw_data.decode('latin-1', errors='replace')
-            else:
-                # Para archivos binarios (DICOM, PDF), guardar como bytes
-                content = raw_data
-            
+
+            # Mover el archivo a la carpeta de procesados antes de leerlo
+            processed_path = self._destino(os.path.join(dir_config['path'], 'procesados'), file_name)
+
+            try:
+                os.replace(file_path, processed_path)
+            except PermissionError:
+                processed_path = None
+                self.logger.debug(f"{file_name} sigue abierto por el equipo; se reintenta")
+                self._retry_later(file_path, dir_config)
+                return
+            self.logger.info(f"Archivo movido a: {processed_path}")
+
             # Crear objeto de datos para la cola
             data = {
                 'source': 'file_watcher',
@@ -134,37 +284,56 @@ class FileWatcherCollector:
                 'equipment_name': equipment_name,
                 'data_type': file_type,
                 'file_name': file_name,
-                'file_path': file_path,
-                'raw_data': content,
-                'file_size': file_size,
+                'file_path': processed_path,
                 'timestamp': datetime.now().isoformat()
             }
-            
+
+            if file_type in self.TEXT_TYPES:
+                # Texto (HL7): el uploader lo parsea desde raw_data
+                with open(processed_path, 'rb') as f:
+                    raw_data = f.read()
+                data['raw_data'] = raw_data.decode('utf-8', errors='replace')
+                data['file_size'] = len(raw_data)
+            else:
+                # Binarios (DICOM, PDF): la cola lleva solo la referencia y el
+                # sha256; el uploader sube el archivo por bloques
+                data['file_size'], data['sha256'] = self._checksum(processed_path)
+
             # Poner en la cola
             self.queue.put(data)
             self.logger.info(f"Archivo puesto en cola: {file_name}")
-            
-            # Mover el archivo a la carpeta de procesados
-            processed_dir = os.path.join(dir_config['path'], 'procesados')
-            processed_path = os.path.join(processed_dir, file_name)
-            
-            # Si ya existe un archivo con ese nombre, agregar timestamp
-            if os.path.exists(processed_path):
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                name, ext = os.path.splitext(file_name)
-                processed_path = os.path.join(processed_dir, f"{name}_{timestamp}{ext}")
-            
-            shutil.move(file_path, processed_path)
-            self.logger.info(f"Archivo movido a: {processed_path}")
-            
+            with self._lock:
+                self.stats['procesados'] += 1
+
         except Exception as e:
             self.logger.error(f"Error procesando archivo {file_path}: {e}")
-    
+            with self._lock:
+                self.stats['errores'] += 1
+            # Apartarlo en errores/: en procesados/ parecería enviado, y de
+            # vuelta en la carpeta se reintentaría sin fin
+            if processed_path and os.path.exists(processed_path):
+                try:
+                    error_path = self._destino(os.path.join(dir_config['path'], 'errores'),
+                                               os.path.basename(file_path))
+                    os.replace(processed_path, error_path)
+                    self.logger.warning(f"Archivo movido a: {error_path}")
+                except OSError:
+                    pass
+
+    def status(self):
+        """Pendientes, en proceso y contadores, para el status server."""
+        with self._lock:
+            return dict(self.stats, pendientes=len(self._pending), en_proceso=len(self._in_flight))
+
     def stop(self):
         """Detiene el monitoreo de carpetas."""
         self.logger.info("Deteniendo File Watcher...")
         self.running = False
-        
+        self._wake.set()
+
         for observer in self.observers:
             observer.stop()
             observer.join()
+
+        if self._executor:
+            self._executor.shutdown(wait=True)
@@ -2,179 +2,430 @@
 Serial Collector - Recolecta datos de equipos conectados por puerto serial (RS-232/USB)
 """
 
+import random
 import serial
+import serial.tools.list_ports
 import threading
 import time
+from collections import deque
 from datetime import datetime
 
+from parsers.mllp import MLLPFramer
+
+
+class PortMetrics:
+    """
+    Contadores de un puerto. Las tasas (bytes/s, frames/s) se calculan sobre
+    una ventana deslizante de VENTANA segundos, en cubetas de un segundo.
+    """
+
+    VENTANA = 60
+
+    def __init__(self, port_config):
+        self._lock = threading.Lock()
+        self.port = port_config['port']
+        self.equipment_name = port_config.get('equipment_name', 'Unknown Equipment')
+        self.equipment_type = port_config.get('equipment_type', 'unknown')
+        self.state = 'detenido'
+        self.bytes = 0
+        self.frames = 0
+        self.parse_errors = 0
+        self.discarded_bytes = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_seen = None
+        self.last_frame = None
+        self.connected_since = None
+        self._cubetas = deque()   # [segundo, bytes, frames]
+        self._desde = time.monotonic()
+
+    def set_state(self, state):
+        with self._lock:
+            if state == 'conectado' and self.state != 'conectado':
+                if self.connected_since is not None:
+                    self.reconnects += 1
+                self.connected_since = datetime.now().isoformat()
+                self._desde = time.monotonic()
+            self.state = state
+
+    def error(self, e):
+        with self._lock:
+            self.errors += 1
+            self.last_error = str(e)
+
+    def add(self, nbytes, frames=0, parse_errors=0, discarded=0):
+        ahora = time.monotonic()
+        segundo = int(ahora)
+        with self._lock:
+            self.bytes += nbytes
+            self.frames += frames
+            self.parse_errors += parse_errors
+            self.discarded_bytes += discarded
+            self.last_seen = datetime.now().isoformat()
+            if frames:
+                self.last_frame = self.last_seen
+            if self._cubetas and self._cubetas[-1][0] == segundo:
+                self._cubetas[-1][1] += nbytes
+                self._cubetas[-1][2] += frames
+            else:
+                self._cubetas.append([segundo, nbytes, frames])
+            self._purgar(ahora)
+
+    def _purgar(self, ahora):
+        limite = ahora - self.VENTANA
+        while self._cubetas and self._cubetas[0][0] < limite:
+            self._cubetas.popleft()
+
+    def snapshot(self):
+        """Estado y contadores del puerto como diccionario serializable a JSON."""
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            # Recién conectado, la ventana es lo transcurrido (al menos 1 s)
+            ventana = max(1.0, min(self.VENTANA, ahora - self._desde))
+            bytes_ventana = sum(c[1] for c in self._cubetas)
+            frames_ventana = sum(c[2] for c in self._cubetas)
+            return {
+                'port': self.port,
+                'equipment_name': self.equipment_name,
+                'equipment_type': self.equipment_type,
+                'state': self.state,
+                'bytes': self.bytes,
+                'frames': self.frames,
+                'bytes_per_second': round(bytes_ventana / ventana, 2),
+                'frames_per_second': round(frames_ventana / ventana, 3),
+                'parse_errors': self.parse_errors,
+                'discarded_bytes': self.discarded_bytes,
+                'reconnects': self.reconnects,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'last_seen': self.last_seen,
+                'last_frame': self.last_frame,
+                'connected_since': self.connected_since
+            }
+
+
+class PortReader:
+    """
+    Hilo lector de un puerto. Se detiene por separado (al desconectar el
+    adaptador USB) y reintenta con espera exponencial aleatoria entre
+    backoff_min y backoff_max segundos; wake() corta la espera cuando el
+    supervisor ve reaparecer el dispositivo.
+    """
+
+    def __init__(self, port_config, collector, metrics, backoff_min=1, backoff_max=60):
+        self.config = port_config
+        self.port = port_config['port']
+        self.collector = collector
+        self.metrics = metrics
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.logger = collector.logger
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._fallos = 0
+        self._ser = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"Serial-{self.port}")
+
+    def start(self):
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def wake(self):
+        """Reintenta ya, sin esperar el resto del backoff."""
+        self._fallos = 0
+        self._wake.set()
+
+    def stop(self, state='detenido'):
+        """Cierra el puerto; el read() bloqueado vuelve y el hilo termina."""
+        self._stop.set()
+        self._wake.set()
+        ser = self._ser
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception:
+                pass
+        self.metrics.set_state(state)
+
+    def _backoff(self):
+        """Segundos hasta el próximo intento: min * 2^fallos, tope max, con jitter."""
+        espera = min(self.backoff_max, self.backoff_min * (2 ** self._fallos))
+        self._fallos += 1
+        return random.uniform(espera / 2, espera)
+
+    def _esperar(self):
+        espera = self._backoff()
+        self.metrics.set_state('reintentando')
+        self._wake.wait(espera)
+        self._wake.clear()
+
+    def _cerrar(self):
+        ser, self._ser = self._ser, None
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        """Lee datos continuamente del puerto."""
+        cfg = self.config
+        baud_rate = cfg.get('baud_rate', 9600)
+        max_message_size = cfg.get('max_message_size', 1024 * 1024)
+        framer = MLLPFramer(max_message_size=max_message_size)
+
+        while not self._stop.is_set():
+            try:
+                # Intentar abrir el puerto si no está abierto
+                if self._ser is None:
+                    self.logger.info(f"Conectando a {self.port} ({baud_rate} baud)...")
+                    self.metrics.set_state('conectando')
+                    self._ser = serial.Serial(
+                        port=self.port,
+                        baudrate=baud_rate,
+                        bytesize=cfg.get('data_bits', 8),
+                        stopbits=cfg.get('stop_bits', 1),
+                        parity=cfg.get('parity', 'N'),
+                        timeout=1
+                    )
+                    if self._stop.is_set():
+                        break
+                    self.metrics.set_state('conectado')
+                    self.logger.info(f"Conectado a {self.port}")
+
+                # Leer datos: read() bloquea hasta que llega al menos un byte
+                # (o vence el timeout de 1 s, para poder detenerse)
+                ser = self._ser
+                data = ser.read(ser.in_waiting or 1)
+                if not data:
+                    continue
+                self._fallos = 0
+
+                overflows, discarded = framer.overflows, framer.discarded_bytes
+                messages = framer.feed(data)
+                errores = framer.overflows - overflows
+                for message in messages:
+                    if not self.collector._process_message(
+                            message, cfg.get('equipment_type', 'unknown'),
+                            cfg.get('equipment_name', 'Unknown Equipment'), self.port):
+                        errores += 1
+                self.metrics.add(len(data), len(messages), errores, framer.discarded_bytes - discarded)
+                if framer.overflows != overflows:
+                    self.logger.warning(
+                        f"Mensaje de {self.port} supera {max_message_size} bytes, descartado"
+                    )
+
+            except serial.SerialException as e:
+                self._cerrar()
+                framer.reset()
+                if self._stop.is_set():
+                    break
+                self.logger.error(f"Error en puerto {self.port}: {e}")
+                self.metrics.error(e)
+                self._esperar()
+
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.logger.error(f"Error inesperado en {self.port}: {e}")
+                self.metrics.error(e)
+                self._esperar()
+
+        # Cleanup al salir
+        if self._ser is not None:
+            self._cerrar()
+            self.logger.info(f"Puerto {self.port} cerrado")
+
 
 class SerialCollector:
-    """Recolecta datos de puertos seriales."""
-    
-    # Delimitadores estándar HL7
-    VT = b'\x0B'  # Vertical Tab - inicio de mensaje
-    FS = b'\x1C'  # File Separator - fin de mensaje
-    CR = b'\x0D'  # Carriage Return
-    
-    def __init__(self, ports_config, queue, logger):
+    """
+    Recolecta datos de puertos seriales.
+
+    Un hilo supervisor revisa cada poll_interval segundos la lista de
+    dispositivos seriales: arranca el lector de un puerto configurado cuando
+    su adaptador aparece, lo detiene (liberando el COM) cuando desaparece, y
+    busca en el cache del PortDetector los adaptadores nuevos (por nombre o,
+    si Windows le asignó otro COM, por hwid). Un adaptador desconocido dispara
+    un sondeo inmediato del detector. Los puertos que nunca aparecen en la
+    lista (p. ej. puertos virtuales) se mantienen abiertos como antes, con
+    backoff.
+    """
+
+    def __init__(self, ports_config, queue, logger, detector=None, poll_interval=2,
+                 backoff_min=1, backoff_max=60):
         """
         Inicializa el Serial Collector.
-        
+
         Args:
             ports_config: Lista de configuraciones de puertos
             queue: Cola para poner los datos recolectados
             logger: Logger para mensajes
+            detector: PortDetector cuyo cache se consulta al conectar un adaptador (opcional)
+            poll_interval: Segundos entre revisiones de la lista de dispositivos
+            backoff_min: Espera inicial tras un error del puerto
+            backoff_max: Espera máxima tras errores consecutivos
         """
         self.ports_config = ports_config
         self.queue = queue
         self.logger = logger
+        self.detector = detector
+        self.poll_interval = poll_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
         self.running = False
-        self.connections = []
-    
+        self.readers = {}
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._supervisor = None
+        self._devices = {}        # Dispositivos presentes en la última revisión
+        self._seen = set()        # Puertos que alguna vez aparecieron en la lista
+
     def start(self):
-        """Inicia la recolección de datos de todos los puertos configurados."""
+        """Inicia la recolección de datos y el supervisor de dispositivos."""
         self.running = True
+        self._stop.clear()
         self.logger.info(f"Serial Collector: Iniciando con {len(self.ports_config)} puertos")
-        
-        # Crear un thread por cada puerto
-        for port_config in self.ports_config:
-            thread = threading.Thread(
-                target=self._read_port,
-                args=(port_config,),
-                daemon=True,
-                name=f"Serial-{port_config['port']}"
-            )
-            thread.start()
-            self.logger.info(f"Thread iniciado para puerto {port_config['port']}")
-    
-    def _read_port(self, port_config):
+
+        self._supervise_once()
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True, name='SerialSupervisor')
+        self._supervisor.start()
+
+    def _start_port(self, port_config):
+        port = port_config['port']
+        reader = self.readers.get(port)
+        if reader and reader.is_alive():
+            return
+        metrics = self.metrics.get(port)
+        if metrics is None:
+            metrics = self.metrics[port] = PortMetrics(port_config)
+        reader = PortReader(port_config, self, metrics, self.backoff_min, self.backoff_max)
+        self.readers[port] = reader
+        reader.start()
+        self.logger.info(f"Thread iniciado para puerto {port}")
+
+    def _stop_port(self, port, state='detenido'):
+        reader = self.readers.pop(port, None)
+        if reader:
+            reader.stop(state)
+
+    def add_port(self, port_config):
         """
-        Lee datos continuamente de un puerto serial.
-        
-        Args:
-            port_config: Configuración del puerto
+        Agrega un puerto detectado después del arranque (re-escaneo en segundo
+        plano) sin tocar los que ya están conectados.
+
+        Returns:
+            False si el puerto ya estaba configurado
         """
-        port_name = port_config['port']
-        baud_rate = port_config.get('baud_rate', 9600)
-        data_bits = port_config.get('data_bits', 8)
-        stop_bits = port_config.get('stop_bits', 1)
-        parity = port_config.get('parity', 'N')
-        equipment_type = port_config.get('equipment_type', 'unknown')
-        equipment_name = port_config.get('equipment_name', 'Unknown Equipment')
-        
-        ser = None
-        buffer = b''
-        
-        while self.running:
+        with self._lock:
+            if port_config['port'] in self.active_ports():
+                return False
+            self.ports_config.append(port_config)
+            if self.running:
+                self._start_port(port_config)
+        self.logger.info(f"Puerto agregado: {port_config['port']} ({port_config.get('equipment_name')})")
+        return True
+
+    def active_ports(self):
+        """Nombres de los puertos configurados (abiertos, reintentando o desconectados)."""
+        return {pc['port'] for pc in self.ports_config}
+
+    def _list_devices(self):
+        """Dispositivos seriales presentes, por nombre; None si no se pudo listar."""
+        try:
+            return {p.device: p for p in serial.tools.list_ports.comports()}
+        except Exception as e:
+            self.logger.debug(f"No se pudo listar los puertos seriales: {e}")
+            return None
+
+    def _supervise(self):
+        while not self._stop.wait(self.poll_interval):
             try:
-                # Intentar abrir el puerto si no está abierto
-                if ser is None or not ser.is_open:
-                    self.logger.info(f"Conectando a {port_name} ({baud_rate} baud)...")
-                    ser = serial.Serial(
-                        port=port_name,
-                        baudrate=baud_rate,
-                        bytesize=data_bits,
-                        stopbits=stop_bits,
-                        parity=parity,
-                        timeout=1
-                    )
-                    self.connections.append(ser)
-                    self.logger.info(f"Conectado a {port_name}")
-                
-                # Leer datos
-                if ser.in_waiting > 0:
-                    data = ser.read(ser.in_waiting)
-                    buffer += data
-                    
-                    # Buscar mensajes completos en el buffer
-                    messages = self._extract_messages(buffer)
-                    
-                    for message in messages:
-                        # Remover el mensaje del buffer
-                        buffer = buffer.replace(message, b'', 1)
-                        
-                        # Procesar el mensaje
-                        self._process_message(message, equipment_type, equipment_name, port_name)
-                
-                # Pequeña pausa para no saturar la CPU
-                time.sleep(0.1)
-                
-            except serial.SerialException as e:
-                self.logger.error(f"Error en puerto {port_name}: {e}")
-                if ser:
-                    try:
-                        ser.close()
-                    except:
-                        pass
-                    ser = None
-                # Esperar antes de reintentar
-                time.sleep(5)
-                
+                self._supervise_once()
             except Exception as e:
-                self.logger.error(f"Error inesperado en {port_name}: {e}")
-                time.sleep(5)
-        
-        # Cleanup al salir
-        if ser and ser.is_open:
-            ser.close()
-            self.logger.info(f"Puerto {port_name} cerrado")
-    
-    def _extract_messages(self, buffer):
+                self.logger.error(f"Error en el supervisor de puertos: {e}")
+
+    def _supervise_once(self):
+        devices = self._list_devices()
+        if devices is None:
+            devices = self._devices
+        with self._lock:
+            if not self.running:
+                return
+            appeared = set(devices) - set(self._devices)
+            self._seen.update(devices)
+            configured = {pc['port']: pc for pc in self.ports_config}
+
+            for port, pc in configured.items():
+                reader = self.readers.get(port)
+                alive = reader is not None and reader.is_alive()
+                if port in devices or port not in self._seen:
+                    if not alive:
+                        self._start_port(pc)
+                    elif port in appeared:
+                        reader.wake()
+                elif alive:
+                    self.logger.warning(f"Puerto {port} desconectado ({pc.get('equipment_name')})")
+                    self._stop_port(port, 'desconectado')
+
+            nuevos = [devices[p] for p in sorted(appeared) if p not in configured]
+            self._devices = devices
+
+        for info in nuevos:
+            self._adopt(info)
+
+    def _adopt(self, info):
+        """Adaptador recién conectado sin configuración: cache del detector o sondeo."""
+        if not self.detector:
+            return
+        config = self.detector.config_for(info.device, info.hwid)
+        if config:
+            self.logger.info(f"Adaptador conectado en {info.device}: {config['equipment_name']} (cache)")
+            self.add_port(config)
+        else:
+            self.logger.info(f"Adaptador nuevo en {info.device}: se sondea ahora")
+            self.detector.rescan_now()
+
+    def status(self):
         """
-        Extrae mensajes completos del buffer.
-        
-        Los mensajes HL7 están delimitados por:
-        VT (0x0B) al inicio, FS (0x1C) al final, seguido de CR (0x0D)
-        
-        Args:
-            buffer: Buffer de bytes
-            
+        Métricas por puerto para la API de estado local del agente.
+
         Returns:
-            Lista de mensajes completos
+            Diccionario con los dispositivos presentes y una entrada por puerto
         """
-        messages = []
-        
-        # Buscar patrón VT...FS+CR
-        start = 0
-        while True:
-            # Buscar inicio de mensaje
-            vt_pos = buffer.find(self.VT, start)
-            if vt_pos == -1:
-                break
-            
-            # Buscar fin de mensaje
-            fs_pos = buffer.find(self.FS, vt_pos)
-            if fs_pos == -1:
-                break
-            
-            # Verificar CR después de FS
-            if fs_pos + 1 < len(buffer) and buffer[fs_pos + 1:fs_pos + 2] == self.CR:
-                # Mensaje completo encontrado
-                message = buffer[vt_pos:fs_pos + 2]
-                messages.append(message)
-                start = fs_pos + 2
-            else:
-                start = fs_pos + 1
-        
-        return messages
-    
+        with self._lock:
+            metrics = list(self.metrics.values())
+            devices = sorted(self._devices)
+        return {
+            'running': self.running,
+            'devices': devices,
+            'ports': [m.snapshot() for m in metrics]
+        }
+
     def _process_message(self, message, equipment_type, equipment_name, port_name):
         """
         Procesa un mensaje recibido y lo pone en la cola.
-        
+
         Args:
-            message: Mensaje en bytes
+            message: Mensaje en bytes (sin el framing MLLP)
             equipment_type: Tipo de equipo
             equipment_name: Nombre del equipo
             port_name: Nombre del puerto
+
+        Returns:
+            False si el mensaje no es HL7 válido o no se pudo encolar
         """
         try:
             # Decodificar mensaje
             message_str = message.decode('utf-8', errors='replace')
-            
+
             self.logger.info(f"Mensaje recibido de {equipment_name} ({port_name})")
             self.logger.debug(f"Contenido: {message_str[:200]}...")  # Log primeros 200 chars
-            
+
             # Crear objeto de datos para la cola
             data = {
                 'source': 'serial',
@@ -185,23 +436,24 @@ class SerialCollector:
                 'raw_data': message_str,
                 'timestamp': datetime.now().isoformat()
             }
-            
-            # Poner en la cola para procesamiento
+
+            # Poner en la cola para procesamiento; un mensaje sin MSH se
+            # encola igual (lo rechaza el servidor) pero cuenta como error
             self.queue.put(data)
             self.logger.info(f"Mensaje puesto en cola: {equipment_name}")
-            
+            return message.lstrip().startswith(b'MSH')
+
         except Exception as e:
             self.logger.error(f"Error procesando mensaje de {port_name}: {e}")
-    
+            return False
+
     def stop(self):
-        """Detiene la recolección de datos."""
+        """Detiene el supervisor y cierra todos los puertos."""
         self.logger.info("Deteniendo Serial Collector...")
-        self.running = False
-        
-        # Cerrar todas las conexiones
-        for ser in self.connections:
-            try:
-                if ser.is_open:
-                    ser.close()
-            except:
-                pass
+        with self._lock:
+            self.running = False
+            self._stop.set()
+            for port in list(self.readers):
+                self._stop_port(port)
+        if self._supervisor:
+            self._supervisor.join(timeout=5)
@@ -0,0 +1,261 @@
+"""
+Outbox - Cola persistente en disco (SQLite/WAL) entre collectors y uploader
+"""
+
+import base64
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+class Outbox:
+    """
+    Cola durable de datos pendientes de envío.
+
+    Los collectors llaman put() igual que con una Queue; cada dato queda
+    guardado con una clave de idempotencia antes de devolver el control,
+    así que sobrevive a un reinicio del agente. El uploader reclama lotes
+    con claim(), y marca cada elemento con ack() o fail().
+    """
+
+    PENDIENTE = 'pendiente'
+    ENVIANDO = 'enviando'
+    ENVIADO = 'enviado'
+    ERROR = 'error'
+
+    def __init__(self, path='outbox.db', retention_days=7):
+        """
+        Inicializa la cola.
+
+        Args:
+            path: Ruta del archivo SQLite
+            retention_days: Días que se conservan los elementos ya enviados
+        """
+        self.path = path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._disponible = threading.Event()
+        self._collected = {}   # source -> {'count', 'last'} desde el arranque
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                data TEXT NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                proximo_intento REAL NOT NULL DEFAULT 0,
+                ultimo_error TEXT,
+                creado REAL NOT NULL,
+                enviado REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pendientes ON outbox(estado, proximo_intento)")
+
+        # Lo que quedó "enviando" cuando el agente se detuvo vuelve a la cola;
+        # el servidor descarta duplicados por idempotency_key.
+        recuperados = conn.execute(
+            "UPDATE outbox SET estado = ? WHERE estado = ?", (self.PENDIENTE, self.ENVIANDO)
+        ).rowcount
+        self.recovered = recuperados
+        if self.pending_count():
+            self._disponible.set()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(data):
+        """Serializar el dato; los bytes (archivos binarios) van en base64"""
+        def default(obj):
+            if isinstance(obj, (bytes, bytearray)):
+                return {'__bytes__': base64.b64encode(obj).decode('ascii')}
+            return str(obj)
+        return json.dumps(data, default=default, ensure_ascii=False)
+
+    @staticmethod
+    def _decode(text):
+        def hook(obj):
+            if len(obj) == 1 and '__bytes__' in obj:
+                return base64.b64decode(obj['__bytes__'])
+            return obj
+        return json.loads(text, object_hook=hook)
+
+    # ------------------------------------------------------------------
+    # API compatible con Queue (usada por los collectors)
+    # ------------------------------------------------------------------
+
+    def put(self, data, block=True, timeout=None):
+        """Guarda un dato en la cola y devuelve su clave de idempotencia."""
+        key = data.get('idempotency_key') or str(uuid.uuid4())
+        data = dict(data, idempotency_key=key)
+        self._conn().execute(
+            "INSERT OR IGNORE INTO outbox (idempotency_key, data, creado) VALUES (?, ?, ?)",
+            (key, self._encode(data), time.time())
+        )
+        self._disponible.set()
+        source = data.get('source', 'unknown')
+        with self._lock:
+            c = self._collected.setdefault(source, {'count': 0, 'last': None})
+            c['count'] += 1
+            c['last'] = datetime.now().isoformat()
+        return key
+
+    def empty(self):
+        return self.pending_count() == 0
+
+    def qsize(self):
+        return self.pending_count()
+
+    # ------------------------------------------------------------------
+    # API del uploader
+    # ------------------------------------------------------------------
+
+    def notify(self):
+        """Despierta al uploader (p. ej. al liberarse un worker)."""
+        self._disponible.set()
+
+    def wait(self, timeout):
+        """Espera hasta que llegue un dato nuevo o pase el timeout."""
+        llego = self._disponible.wait(timeout)
+        self._disponible.clear()
+        return llego
+
+    def claim(self, limit):
+        """
+        Reclama hasta `limit` elementos listos para enviar.
+
+        Returns:
+            Lista de (id, data, intentos)
+        """
+        ahora = time.time()
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("""
+                    SELECT id, data, intentos FROM outbox
+                    WHERE estado = ? AND proximo_intento <= ?
+                    ORDER BY id LIMIT ?
+                """, (self.PENDIENTE, ahora, limit)).fetchall()
+                if rows:
+                    conn.executemany(
+                        "UPDATE outbox SET estado = ? WHERE id = ?",
+                        [(self.ENVIANDO, row[0]) for row in rows]
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [(row[0], self._decode(row[1]), row[2]) for row in rows]
+
+    def ack(self, ids):
+        """Marca elementos como enviados."""
+        if not ids:
+            return
+        ahora = time.time()
+        self._conn().executemany(
+            "UPDATE outbox SET estado = ?, enviado = ?, ultimo_error = NULL WHERE id = ?",
+            [(self.ENVIADO, ahora, item_id) for item_id in ids]
+        )
+
+    def fail(self, item_id, error, intentos, max_retries=None, base_delay=2.0, max_delay=300.0):
+        """
+        Devuelve un elemento a la cola con backoff exponencial y jitter.
+
+        Si se superó max_retries queda en estado 'error' (no se reintenta).
+        """
+        if max_retries is not None and intentos > max_retries:
+            self._conn().execute(
+                "UPDATE outbox SET estado = ?, intentos = ?, ultimo_error = ? WHERE id = ?",
+                (self.ERROR, intentos, str(error)[:500], item_id)
+            )
+            return None
+
+        # "Full jitter": espera aleatoria entre 0 y el tope exponencial
+        espera = random.uniform(0, min(max_delay, base_delay * (2 ** min(intentos, 16))))
+        self._conn().execute("""
+            UPDATE outbox SET estado = ?, intentos = ?, ultimo_error = ?, proximo_intento = ?
+            WHERE id = ?
+        """, (self.PENDIENTE, intentos, str(error)[:500], time.time() + espera, item_id))
+        return espera
+
+    def release(self, ids):
+        """Devuelve elementos reclamados a la cola sin contar intento."""
+        self._conn().executemany(
+            "UPDATE outbox SET estado = ? WHERE id = ? AND estado = ?",
+            [(self.PENDIENTE, item_id, self.ENVIANDO) for item_id in ids]
+        )
+        self._disponible.set()
+
+    def next_due_in(self):
+        """Segundos hasta el próximo elemento pendiente (None si no hay)."""
+        row = self._conn().execute(
+            "SELECT MIN(proximo_intento) FROM outbox WHERE estado = ?", (self.PENDIENTE,)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def pending_count(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM outbox WHERE estado IN (?, ?)", (self.PENDIENTE, self.ENVIANDO)
+        ).fetchone()[0]
+
+    def counts(self):
+        """Cantidad de elementos por estado."""
+        rows = self._conn().execute("SELECT estado, COUNT(*) FROM outbox GROUP BY estado").fetchall()
+        return dict(rows)
+
+    def backlog(self):
+        """
+        Profundidad de la cola para el status server: elementos listos para
+        enviar, esperando reintento, en vuelo y en error, y la antigüedad del
+        pendiente más viejo (si crece, la estación está atascada).
+        """
+        ahora = time.time()
+        listos, programados, enviando, error, mas_viejo = self._conn().execute("""
+            SELECT
+                COALESCE(SUM(estado = ? AND proximo_intento <= ?), 0),
+                COALESCE(SUM(estado = ? AND proximo_intento > ?), 0),
+                COALESCE(SUM(estado = ?), 0),
+                COALESCE(SUM(estado = ?), 0),
+                MIN(CASE WHEN estado != ? THEN creado END)
+            FROM outbox WHERE estado IN (?, ?, ?)
+        """, (self.PENDIENTE, ahora, self.PENDIENTE, ahora, self.ENVIANDO, self.ERROR, self.ERROR,
+              self.PENDIENTE, self.ENVIANDO, self.ERROR)).fetchone()
+        return {
+            'ready': listos,
+            'scheduled': programados,
+            'sending': enviando,
+            'error': error,
+            'oldest_pending_seconds': round(ahora - mas_viejo, 1) if mas_viejo else None
+        }
+
+    def collected(self):
+        """Datos puestos por cada collector (por 'source') desde el arranque."""
+        with self._lock:
+            return {source: dict(c) for source, c in self._collected.items()}
+
+    def purge(self):
+        """Elimina los elementos enviados más antiguos que la retención."""
+        limite = time.time() - self.retention_days * 86400
+        return self._conn().execute(
+            "DELETE FROM outbox WHERE estado = ? AND enviado < ?", (self.ENVIADO, limite)
+        ).rowcount
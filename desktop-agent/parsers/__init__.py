@@ -3,6 +3,8 @@ Parsers package - Data parsing modules for different formats
 """
 
 from .hl7_parser import HL7Parser
+from .hl7_message import HL7Message, HL7Segment
 from .dicom_parser import DicomParser
+from .mllp import MLLPFramer
 
-__all__ = ['HL7Parser', 'DicomParser']
+__all__ = ['HL7Parser', 'HL7Message', 'HL7Segment', 'DicomParser', 'MLLPFramer']
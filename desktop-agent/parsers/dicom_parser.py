@@ -4,6 +4,8 @@ DICOM Parser - Extrae metadatos de archivos DICOM
 
 from datetime import datetime
 
+from .dicom_header import read_header
+
 
 class DicomParser:
     """Parser para archivos DICOM."""
@@ -13,6 +15,10 @@ class DicomParser:
         """
         Parsea un archivo DICOM y extrae metadatos relevantes.
         
+        Solo se lee el encabezado (sin píxeles) y el resultado queda en la
+        caché de parsers/dicom_header.py, así volver a parsear el mismo
+        archivo no lo abre de nuevo.
+        
         Args:
             file_path: Ruta al archivo DICOM
             
@@ -20,10 +26,7 @@ class DicomParser:
             Dict con los metadatos extraídos
         """
         try:
-            import pydicom
-            
-            # Leer archivo DICOM
-            ds = pydicom.dcmread(file_path)
+            ds = read_header(file_path)
             
             # Extraer metadatos
             result = {
@@ -35,6 +38,7 @@ class DicomParser:
                 'study_date': DicomParser._parse_date(DicomParser._get_tag(ds, 'StudyDate')),
                 'study_time': DicomParser._parse_time(DicomParser._get_tag(ds, 'StudyTime')),
                 'study_description': DicomParser._get_tag(ds, 'StudyDescription'),
+                'accession_number': DicomParser._get_tag(ds, 'AccessionNumber'),
                 'series_instance_uid': DicomParser._get_tag(ds, 'SeriesInstanceUID'),
                 'series_number': DicomParser._get_tag(ds, 'SeriesNumber'),
                 'series_description': DicomParser._get_tag(ds, 'SeriesDescription'),
@@ -61,19 +65,18 @@ class DicomParser:
         Obtiene el valor de un tag DICOM de forma segura.
         
         Args:
-            ds: Dataset de pydicom
+            ds: Metadatos devueltos por read_header
             tag_name: Nombre del tag
             
         Returns:
             Valor del tag o None si no existe
         """
-        try:
-            value = getattr(ds, tag_name, None)
-            if value is not None:
-                return str(value)
-            return None
-        except:
+        value = ds.get(tag_name)
+        if value is None:
             return None
+        if isinstance(value, list):
+            return '\\'.join(str(v) for v in value)
+        return str(value)
     
     @staticmethod
     def _parse_date(date_str):
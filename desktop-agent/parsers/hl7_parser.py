@@ -2,9 +2,10 @@
 HL7 Parser - Parsea mensajes HL7 v2.5 de equipos de laboratorio
 """
 
-import re
 from datetime import datetime
 
+from .hl7_message import HL7Message, HL7Segment, interpret_flag
+
 
 class HL7Parser:
     """Parser para mensajes HL7 v2.5."""
@@ -15,54 +16,65 @@ class HL7Parser:
         Parsea un mensaje HL7 y extrae información relevante.
         
         Args:
-            message: String con el mensaje HL7
+            message: Mensaje HL7 (str o bytes, con o sin framing MLLP)
             
         Returns:
-            Dict con los datos parseados
+            Dict con los datos parseados. test_results trae todos los OBX;
+            orders los agrupa por OBR (ORU^R01 con varias órdenes).
         """
         try:
-            # Limpiar el mensaje de caracteres de control
-            message = message.replace('\x0B', '').replace('\x1C', '').replace('\x0D', '')
-            
-            # Separar en líneas (segmentos)
-            segments = [line for line in message.split('\n') if line.strip()]
+            msg = message if isinstance(message, HL7Message) else HL7Message(message)
             
             # Inicializar resultado
             result = {
                 'patient_id': None,
                 'patient_name': None,
                 'order_id': None,
+                'orders': [],
                 'test_results': [],
-                'timestamp': None
+                'timestamp': None,
+                'sending_application': None,
+                'message_control_id': None,
+                'message_datetime': None
             }
             
-            # Procesar cada segmento
-            for segment in segments:
-                if not segment:
-                    continue
+            escapes = msg.escape_char if msg.has_escapes else None
+            
+            for i, fields in msg.records():
+                segment_type = fields[0]
                 
-                # Dividir segmento en campos
-                fields = segment.split('|')
-                segment_type = fields[0] if fields else ''
+                # Segmento OBX (Observation/Result), el más frecuente
+                if segment_type == 'OBX':
+                    test_result = HL7Parser._parse_obx(
+                        fields, msg, escapes is not None and escapes in msg.lines[i]
+                    )
+                    if test_result:
+                        result['test_results'].append(test_result)
+                        if result['orders']:
+                            result['orders'][-1]['test_results'].append(test_result)
                 
                 # Segmento MSH (Message Header)
-                if segment_type == 'MSH':
-                    result['timestamp'] = HL7Parser._parse_timestamp(fields[6] if len(fields) > 6 else '')
+                elif segment_type == 'MSH':
+                    segment = HL7Segment(msg, i)
+                    result['timestamp'] = HL7Parser._parse_timestamp(segment.value(7))
+                    # MSH-3, MSH-10 y MSH-7 (tal cual): el servidor deduplica reenvíos con ellos
+                    result['sending_application'] = segment.value(3) or None
+                    result['message_control_id'] = segment.value(10) or None
+                    result['message_datetime'] = segment.value(7) or None
                 
                 # Segmento PID (Patient Identification)
                 elif segment_type == 'PID':
-                    result['patient_id'] = HL7Parser._parse_patient_id(fields)
-                    result['patient_name'] = HL7Parser._parse_patient_name(fields)
+                    segment = HL7Segment(msg, i)
+                    result['patient_id'] = HL7Parser._parse_patient_id(segment)
+                    result['patient_name'] = HL7Parser._parse_patient_name(segment)
                 
-                # Segmento OBR (Observation Request)
+                # Segmento OBR (Observation Request): abre un grupo de OBX
                 elif segment_type == 'OBR':
-                    result['order_id'] = fields[2] if len(fields) > 2 else None
-                
-                # Segmento OBX (Observation/Result)
-                elif segment_type == 'OBX':
-                    test_result = HL7Parser._parse_obx(fields)
-                    if test_result:
-                        result['test_results'].append(test_result)
+                    segment = HL7Segment(msg, i)
+                    order_id = segment.value(2) or segment.value(3) or None
+                    if result['order_id'] is None:
+                        result['order_id'] = order_id
+                    result['orders'].append({'order_id': order_id, 'test_results': []})
             
             return result
             
@@ -70,36 +82,32 @@ class HL7Parser:
             raise Exception(f"Error parseando mensaje HL7: {e}")
     
     @staticmethod
-    def _parse_patient_id(fields):
+    def _parse_patient_id(segment):
         """Extrae el Patient ID del segmento PID."""
-        # PID-3: Patient Identifier List
-        if len(fields) > 3:
-            pid_field = fields[3]
-            # El ID puede estar en formato: ID^ID_TYPE^ID_SYSTEM
-            components = pid_field.split('^')
-            return components[0] if components else None
-        return None
+        # PID-3: Patient Identifier List (ID^ID_TYPE^ID_SYSTEM, primera repetición)
+        return segment.value(3) or None
     
     @staticmethod
-    def _parse_patient_name(fields):
+    def _parse_patient_name(segment):
         """Extrae el nombre del paciente del segmento PID."""
         # PID-5: Patient Name (Formato: Apellido^Nombre^SegundoNombre)
-        if len(fields) > 5:
-            name_field = fields[5]
-            components = name_field.split('^')
-            if len(components) >= 2:
-                return f"{components[1]} {components[0]}"
-            elif len(components) == 1:
-                return components[0]
+        components = segment.components(5)
+        if len(components) >= 2:
+            return f"{components[1]} {components[0]}"
+        elif components[0]:
+            return components[0]
         return None
     
     @staticmethod
-    def _parse_obx(fields):
+    def _parse_obx(fields, msg, unescape=False):
         """
         Parsea un segmento OBX (Observation/Result).
         
+        Es el segmento que más se repite, así que trabaja directo sobre los
+        campos ya separados en vez de pasar por HL7Segment.value(), y solo
+        resuelve escapes si el segmento los tiene (unescape=True).
+        
         OBX structure:
-        0: OBX
         1: Set ID
         2: Value Type (NM=numeric, ST=string, etc.)
         3: Observation Identifier (código^nombre^sistema)
@@ -109,64 +117,38 @@ class HL7Parser:
         7: Reference Range
         8: Abnormal Flags (N=normal, H=high, L=low, etc.)
         """
-        if len(fields) < 6:
+        n = len(fields)
+        if n < 6:
             return None
         
-        try:
-            # Extraer código y nombre del test
-            identifier = fields[3].split('^')
-            test_code = identifier[0] if len(identifier) > 0 else ''
-            test_name = identifier[1] if len(identifier) > 1 else test_code
-            
-            # Valor del resultado
-            value = fields[5]
-            
-            # Unidades
-            units = fields[6] if len(fields) > 6 else ''
-            
-            # Rango de referencia
-            reference_range = fields[7] if len(fields) > 7 else ''
-            
+        comp, rep = msg.component_sep, msg.repetition_sep
+        
+        # Extraer código y nombre del test
+        identifier = fields[3].split(comp)
+        test_code = identifier[0]
+        test_name = identifier[1] if len(identifier) > 1 and identifier[1] else test_code
+        
+        result = {
+            'test_code': test_code,
+            'test_name': test_name,
+            'value': fields[5].partition(rep)[0],
+            'units': fields[6].partition(comp)[0] if n > 6 else '',
+            'reference_range': fields[7].partition(rep)[0] if n > 7 else '',
             # Flags (normal, alto, bajo, crítico)
-            abnormal_flag = fields[8] if len(fields) > 8 else ''
-            status = HL7Parser._interpret_flag(abnormal_flag)
-            
-            return {
-                'test_code': test_code,
-                'test_name': test_name,
-                'value': value,
-                'units': units,
-                'reference_range': reference_range,
-                'status': status
-            }
-            
-        except Exception as e:
-            return None
+            'status': HL7Parser._interpret_flag(fields[8].partition(rep)[0] if n > 8 else '')
+        }
+        if unescape:
+            for key in ('test_code', 'test_name', 'value', 'units', 'reference_range'):
+                result[key] = msg.unescape(result[key])
+        return result
     
     @staticmethod
     def _interpret_flag(flag):
         """
-        Interpreta el flag de anormalidad.
-        
-        Flags comunes:
-        N = Normal
-        H = High
-        L = Low
-        HH = Critically high
-        LL = Critically low
+        Interpreta el flag de anormalidad (N, H, L, HH, LL...) con la tabla
+        compartida con el backend (hl7_message.ABNORMAL_FLAGS).
         """
-        flag = flag.upper().strip()
-        
-        if flag in ['N', '']:
-            return 'normal'
-        elif flag in ['H', 'HH', '>']:
-            return 'alto'
-        elif flag in ['L', 'LL', '<']:
-            return 'bajo'
-        elif flag in ['HH', 'LL', 'AA']:
-            return 'critico'
-        else:
-            return 'normal'
+        return interpret_flag(flag)
     
     @staticmethod
     def _parse_timestamp(timestamp_str):
@@ -0,0 +1,116 @@
+"""
+MLLP Framer - Separa mensajes HL7 de un flujo de bytes con framing MLLP
+"""
+
+
+class MLLPFramer:
+    """
+    Máquina de estados incremental para framing MLLP (VT ... FS CR).
+
+    Cada byte recibido se examina una sola vez: feed() continúa la búsqueda
+    desde donde quedó la llamada anterior y solo conserva el mensaje
+    incompleto, así una ráfaga grande cuesta O(n) en total. Los bytes fuera
+    de un frame se descartan, y un mensaje que supera max_message_size se
+    abandona para que el buffer no crezca sin límite.
+    """
+
+    VT = 0x0B  # Vertical Tab - inicio de mensaje
+    FS = 0x1C  # File Separator - fin de mensaje
+    CR = 0x0D  # Carriage Return
+
+    # Lo que suele aparecer entre frames y no cuenta como basura
+    _SEPARADORES = b'\r\n'
+
+    def __init__(self, max_message_size=1024 * 1024):
+        """
+        Inicializa el framer.
+
+        Args:
+            max_message_size: Tamaño máximo de un mensaje en bytes
+        """
+        self.max_message_size = max_message_size
+        self._buffer = bytearray()
+        self._pos = 0        # Próximo byte a examinar
+        self._inicio = -1    # Posición del VT del frame abierto, -1 si se busca uno
+
+        # Estadísticas
+        self.frames = 0
+        self.discarded_bytes = 0
+        self.overflows = 0
+
+    def _descartar(self, inicio, fin):
+        self.discarded_bytes += len(self._buffer[inicio:fin].strip(self._SEPARADORES))
+
+    def feed(self, data):
+        """
+        Agrega bytes recibidos y devuelve los mensajes completos.
+
+        Args:
+            data: Bytes leídos del puerto
+
+        Returns:
+            Lista de mensajes (bytes, sin VT/FS/CR de framing)
+        """
+        buf = self._buffer
+        buf += data
+        mensajes = []
+
+        while True:
+            if self._inicio == -1:
+                # Buscando inicio de frame
+                vt = buf.find(self.VT, self._pos)
+                if vt == -1:
+                    self._descartar(self._pos, len(buf))
+                    self._pos = len(buf)
+                    break
+                self._descartar(self._pos, vt)
+                self._inicio = vt
+                self._pos = vt + 1
+                continue
+
+            # Dentro de un frame: buscar FS, atento a un VT que lo interrumpa
+            fs = buf.find(self.FS, self._pos)
+            fin = fs if fs != -1 else len(buf)
+            vt = buf.find(self.VT, self._pos, fin)
+            if vt != -1:
+                # Frame truncado: el equipo empezó otro sin cerrar el anterior
+                self._descartar(self._inicio, vt)
+                self._inicio = vt
+                self._pos = vt + 1
+                continue
+
+            if fs == -1:
+                self._pos = len(buf)
+                if self._pos - self._inicio > self.max_message_size:
+                    self._descartar(self._inicio, self._pos)
+                    self.overflows += 1
+                    self._inicio = -1
+                break
+
+            # El CR tras el FS queda como separador y se ignora al buscar el próximo VT
+            mensajes.append(bytes(buf[self._inicio + 1:fs]))
+            self.frames += 1
+            self._inicio = -1
+            self._pos = fs + 1
+
+        # Compactar: solo se conserva el frame abierto
+        conservar = self._inicio if self._inicio != -1 else self._pos
+        if conservar:
+            del buf[:conservar]
+            self._pos -= conservar
+            if self._inicio != -1:
+                self._inicio = 0
+
+        return mensajes
+
+    def pending(self):
+        """Bytes del mensaje incompleto que espera más datos."""
+        return len(self._buffer) if self._inicio != -1 else 0
+
+    def reset(self):
+        """Descarta el mensaje incompleto (p. ej. al reconectar el puerto)."""
+        if self._inicio != -1:
+            self._descartar(self._inicio, len(self._buffer))
+        self._buffer.clear()
+        self._pos = 0
+        self._inicio = -1
@@ -6,10 +6,85 @@ import serial
 import serial.tools.list_ports
 import json
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
+class PatternMatcher:
+    """
+    Autómata Aho-Corasick sobre un conjunto de patrones de bytes.
+    
+    Una sola pasada por los datos encuentra todos los patrones a la vez, y el
+    estado se conserva entre llamadas a feed(): un patrón partido entre dos
+    lecturas del puerto también se encuentra, sin volver a recorrer el buffer.
+    """
+    
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: Iterable de (patrón en bytes, valor que se devuelve al encontrarlo)
+        """
+        goto = [{}]
+        out = [set()]
+        for pattern, value in patterns:
+            state = 0
+            for byte in pattern:
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    goto.append({})
+                    out.append(set())
+                    nxt = goto[state][byte] = len(goto) - 1
+                state = nxt
+            out[state].add(value)
+        
+        # Transiciones completas (goto + enlaces de fallo) en orden BFS: cada
+        # estado copia las de su estado de fallo, que es menos profundo
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = goto[0]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            out[state] |= out[fail[state]]
+            for byte, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(byte, 0)
+                queue.append(nxt)
+        
+        self._delta = delta
+        self._out = [frozenset(o) for o in out]
+        self.state = 0
+    
+    def copy(self):
+        """Matcher nuevo (estado inicial) que comparte las tablas ya construidas."""
+        clone = object.__new__(PatternMatcher)
+        clone._delta, clone._out, clone.state = self._delta, self._out, 0
+        return clone
+    
+    def reset(self):
+        self.state = 0
+    
+    def feed(self, data):
+        """
+        Avanza el autómata con `data`.
+        
+        Returns:
+            Conjunto de valores de los patrones que terminan en estos datos
+        """
+        delta, out = self._delta, self._out
+        state = self.state
+        found = set()
+        for byte in data:
+            state = delta[state].get(byte, 0)
+            if out[state]:
+                found |= out[state]
+        self.state = state
+        return found
+
+
 class PortDetector:
     """Detecta automáticamente puertos COM y los equipos conectados."""
     
@@ -61,6 +136,19 @@ class PortDetector:
         self.cache_file = cache_file
         self.logger = logger
         self.detected_ports = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._rescan_thread = None
+        
+        # Prioridad = orden en EQUIPMENT_PATTERNS (el HL7 genérico va último)
+        self._equipment_ids = list(self.EQUIPMENT_PATTERNS)
+        self._generic = self._equipment_ids.index('generic_hl7')
+        self._matcher = PatternMatcher(
+            (pattern, priority)
+            for priority, eq_id in enumerate(self._equipment_ids)
+            for pattern in self.EQUIPMENT_PATTERNS[eq_id]['patterns']
+        )
         
     def _log(self, message, level='info'):
         """Helper para logging."""
@@ -93,38 +181,30 @@ class PortDetector:
         """
         Sondea un puerto para detectar qué tipo de equipo está conectado.
         
+        Prueba cada velocidad durante `timeout` segundos como máximo y pasa a
+        identificar en cuanto aparece el patrón de un fabricante; el HL7
+        genérico sigue leyendo hasta el final de la ventana por si llega el
+        nombre del equipo.
+        
         Args:
             port_name: Nombre del puerto (ej: COM3)
-            timeout: Timeout en segundos para lectura
-            read_attempts: Número de intentos de lectura
+            timeout: Ventana de lectura en segundos por velocidad
+            read_attempts: Lecturas por ventana (cada read espera timeout/read_attempts)
             
         Returns:
             Diccionario con información del equipo o None si no se detecta
         """
         for baud_rate in self.COMMON_BAUDS:
+            if self._stop.is_set():
+                return None
             try:
-                self._log(f"Probando {port_name} a {baud_rate} baud...")
-                
-                ser = serial.Serial(
-                    port=port_name,
-                    baudrate=baud_rate,
-                    timeout=timeout / read_attempts
-                )
+                self._log(f"Probando {port_name} a {baud_rate} baud...", 'debug')
                 
-                # Leer datos durante varios intentos
-                buffer = b''
-                for attempt in range(read_attempts):
-                    if ser.in_waiting > 0:
-                        data = ser.read(ser.in_waiting)
-                        buffer += data
-                        self._log(f"  Recibidos {len(data)} bytes...", 'debug')
-                    time.sleep(timeout / read_attempts)
-                
-                ser.close()
+                received, found = self._read_window(port_name, baud_rate, timeout, read_attempts)
                 
                 # Si recibimos datos, intentar identificar el equipo
-                if buffer:
-                    equipment = self._identify_equipment(buffer)
+                if received:
+                    equipment = self._equipment_info(found, received)
                     if equipment:
                         equipment['port'] = port_name
                         equipment['baud_rate'] = baud_rate
@@ -144,27 +224,47 @@ class PortDetector:
         self._log(f"✗ No se detectó equipo en {port_name}")
         return None
     
-    def _identify_equipment(self, data):
+    def _read_window(self, port_name, baud_rate, timeout, read_attempts):
         """
-        Identifica el tipo de equipo basado en los datos recibidos.
+        Lee del puerto hasta `timeout` segundos pasando cada bloque por el
+        autómata; corta en cuanto encuentra un fabricante.
         
-        Args:
-            data: Datos en bytes recibidos del puerto
-            
         Returns:
-            Diccionario con información del equipo o None
+            (bytes recibidos, prioridades de los patrones encontrados)
         """
-        for eq_id, eq_info in self.EQUIPMENT_PATTERNS.items():
-            for pattern in eq_info['patterns']:
-                if pattern in data:
-                    return {
-                        'equipment_type': eq_info['type'],
-                        'equipment_name': eq_info['name'],
-                        'pattern_matched': eq_id
-                    }
+        ser = serial.Serial(port=port_name, baudrate=baud_rate, timeout=timeout / read_attempts)
+        matcher = self._matcher.copy()
+        received = 0
+        found = set()
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline and not self._stop.is_set():
+                # read() espera hasta timeout/read_attempts si no llega nada
+                data = ser.read(ser.in_waiting or 1)
+                if not data:
+                    continue
+                received += len(data)
+                self._log(f"  Recibidos {len(data)} bytes de {port_name}...", 'debug')
+                found |= matcher.feed(data)
+                if found and min(found) < self._generic:
+                    break
+        finally:
+            ser.close()
+        return received, found
+    
+    def _equipment_info(self, found, received):
+        """Equipo de mayor prioridad entre los patrones encontrados, o desconocido si hubo datos."""
+        if found:
+            eq_id = self._equipment_ids[min(found)]
+            eq_info = self.EQUIPMENT_PATTERNS[eq_id]
+            return {
+                'equipment_type': eq_info['type'],
+                'equipment_name': eq_info['name'],
+                'pattern_matched': eq_id
+            }
         
         # Si recibimos datos pero no coinciden con patrones conocidos
-        if len(data) > 10:
+        if received > 10:
             return {
                 'equipment_type': 'unknown',
                 'equipment_name': 'Unknown Medical Device',
@@ -173,9 +273,25 @@ class PortDetector:
         
         return None
     
-    def scan_all_ports(self):
+    def _identify_equipment(self, data):
         """
-        Escanea todos los puertos COM disponibles e intenta detectar equipos.
+        Identifica el tipo de equipo basado en los datos recibidos.
+        
+        Args:
+            data: Datos en bytes recibidos del puerto
+            
+        Returns:
+            Diccionario con información del equipo o None
+        """
+        return self._equipment_info(self._matcher.copy().feed(data), len(data))
+    
+    def scan_all_ports(self, ports=None):
+        """
+        Escanea los puertos COM disponibles (o `ports`) en paralelo, un hilo
+        por puerto, e intenta detectar equipos.
+        
+        Args:
+            ports: Lista de puertos como la de list_available_ports(); None = todos
         
         Returns:
             Diccionario con puertos detectados y sus equipos
@@ -184,19 +300,23 @@ class PortDetector:
         self._log("Iniciando escaneo automático de puertos...")
         self._log("=" * 60)
         
-        available_ports = self.list_available_ports()
-        self._log(f"Puertos COM disponibles: {len(available_ports)}")
+        available_ports = self.list_available_ports() if ports is None else ports
+        self._log(f"Puertos COM a escanear: {len(available_ports)}")
         
-        for port_info in available_ports:
-            self._log(f"\nEscaneando {port_info['port']} ({port_info['description']})...")
+        def probe(port_info):
+            self._log(f"Escaneando {port_info['port']} ({port_info['description']})...")
             equipment = self.probe_port(port_info['port'])
-            
             if equipment:
-                self.detected_ports[port_info['port']] = {
-                    **equipment,
-                    'description': port_info['description'],
-                    'hwid': port_info['hwid']
-                }
+                with self._lock:
+                    self.detected_ports[port_info['port']] = {
+                        **equipment,
+                        'description': port_info['description'],
+                        'hwid': port_info['hwid']
+                    }
+        
+        if available_ports:
+            with ThreadPoolExecutor(max_workers=len(available_ports), thread_name_prefix='PortProbe') as pool:
+                list(pool.map(probe, available_ports))
         
         self._log("=" * 60)
         self._log(f"Escaneo completado. Equipos detectados: {len(self.detected_ports)}")
@@ -204,6 +324,64 @@ class PortDetector:
         
         return self.detected_ports
     
+    def start_background_scan(self, interval, on_detected, busy_ports=None):
+        """
+        Re-escanea en segundo plano, ahora y luego cada `interval` segundos,
+        los puertos sin equipo detectado que no estén en uso. No toca los
+        puertos que ya tienen un collector conectado.
+        
+        Args:
+            interval: Segundos entre escaneos
+            on_detected: Función que recibe la configuración (como get_ports_config) de cada equipo nuevo
+            busy_ports: Función que devuelve los puertos abiertos por los collectors
+        """
+        if self._rescan_thread and self._rescan_thread.is_alive():
+            return
+        self._stop.clear()
+        self._wake.clear()
+        self._rescan_thread = threading.Thread(
+            target=self._background_loop,
+            args=(interval, on_detected, busy_ports or (lambda: ())),
+            daemon=True,
+            name='PortRescan'
+        )
+        self._rescan_thread.start()
+    
+    def rescan_now(self):
+        """Adelanta el próximo re-escaneo (p. ej. al conectarse un adaptador USB)."""
+        self._wake.set()
+    
+    def stop_background_scan(self):
+        """Detiene el re-escaneo; un sondeo en curso termina en menos de un segundo."""
+        self._stop.set()
+        self._wake.set()
+        if self._rescan_thread:
+            self._rescan_thread.join(timeout=5)
+    
+    def _background_loop(self, interval, on_detected, busy_ports):
+        while not self._stop.is_set():
+            try:
+                busy = set(busy_ports())
+                with self._lock:
+                    known = set(self.detected_ports)
+                candidates = [
+                    p for p in self.list_available_ports()
+                    if p['port'] not in known and p['port'] not in busy
+                ]
+                if candidates:
+                    self.scan_all_ports(candidates)
+                    with self._lock:
+                        new_ports = [p for p in self.detected_ports if p not in known]
+                    if new_ports:
+                        self.save_cache()
+                        for config in self.get_ports_config():
+                            if config['port'] in new_ports:
+                                on_detected(config)
+            except Exception as e:
+                self._log(f"Error en el re-escaneo de puertos: {e}", 'error')
+            self._wake.wait(interval)
+            self._wake.clear()
+    
     def save_cache(self):
         """Guarda el mapeo de puertos en un archivo cache."""
         try:
@@ -260,17 +438,43 @@ class PortDetector:
         Returns:
             Lista de configuraciones de puertos
         """
-        config = []
-        
-        for port_name, port_info in self.detected_ports.items():
-            config.append({
-                'port': port_name,
-                'baud_rate': port_info.get('baud_rate', 9600),
-                'data_bits': port_info.get('data_bits', 8),
-                'stop_bits': port_info.get('stop_bits', 1),
-                'parity': port_info.get('parity', 'N'),
-                'equipment_type': port_info.get('equipment_type', 'unknown'),
-                'equipment_name': port_info.get('equipment_name', 'Unknown Equipment')
-            })
+        return [self._port_config(port_name, port_info)
+                for port_name, port_info in self.detected_ports.items()]
+    
+    def _port_config(self, port_name, port_info):
+        return {
+            'port': port_name,
+            'baud_rate': port_info.get('baud_rate', 9600),
+            'data_bits': port_info.get('data_bits', 8),
+            'stop_bits': port_info.get('stop_bits', 1),
+            'parity': port_info.get('parity', 'N'),
+            'equipment_type': port_info.get('equipment_type', 'unknown'),
+            'equipment_name': port_info.get('equipment_name', 'Unknown Equipment')
+        }
+    
+    def config_for(self, port_name, hwid=None):
+        """
+        Configuración cacheada para un adaptador recién conectado. Si no está
+        por nombre se busca por hwid (Windows suele asignar otro COM al mismo
+        adaptador USB) y el cache se actualiza al nombre nuevo.
         
-        return config
+        Returns:
+            Configuración como las de get_ports_config(), o None si no se conoce
+        """
+        with self._lock:
+            port_info = self.detected_ports.get(port_name)
+            if port_info is None and hwid:
+                matches = [p for p, info in self.detected_ports.items() if info.get('hwid') == hwid]
+                if len(matches) != 1:
+                    return None
+                port_info = self.detected_ports.pop(matches[0])
+                self.detected_ports[port_name] = port_info
+                self._log(f"{port_info.get('equipment_name')} pasó de {matches[0]} a {port_name}")
+                relocated = True
+            else:
+                relocated = False
+        if port_info is None:
+            return None
+        if relocated:
+            self.save_cache()
+        return self._port_config(port_name, port_info)
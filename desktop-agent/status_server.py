@@ -0,0 +1,246 @@
+"""
+Status Server - Endpoint HTTP local con el estado y las métricas del agente
+"""
+
+import json
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram:
+    """
+    Histograma acumulativo al estilo Prometheus (buckets fijos, suma y
+    cantidad), seguro entre hilos.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)   # el último es +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Buckets acumulados [(le, cantidad)], suma y cantidad total."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        acumulado, buckets = 0, []
+        for le, n in zip(self.buckets + ('+Inf',), counts):
+            acumulado += n
+            buckets.append((le, acumulado))
+        return {
+            'buckets': buckets,
+            'count': acumulado,
+            'sum': round(total, 3),
+            'avg': round(total / acumulado, 3) if acumulado else None
+        }
+
+
+def _epoch(iso):
+    return datetime.fromisoformat(iso).timestamp() if iso else None
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metricas:
+    """
+    Acumula muestras del formato de texto de Prometheus (0.0.4), agrupadas
+    por métrica como exige el formato aunque se agreguen intercaladas.
+    """
+
+    def __init__(self, prefix, station):
+        self.prefix = prefix
+        self.station = station
+        self._familias = {}   # nombre -> (tipo, ayuda, líneas)
+
+    def _familia(self, name, kind, help_text):
+        return self._familias.setdefault(name, (kind, help_text, []))[2]
+
+    def _sample(self, lines, name, value, **labels):
+        labels = dict(station=self.station, **labels)
+        texto = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+        value = float(value)
+        lines.append(f"{name}{{{texto}}} {int(value) if value.is_integer() else repr(value)}")
+
+    def add(self, name, kind, help_text, value, **labels):
+        if value is None:
+            return
+        name = f"{self.prefix}_{name}"
+        self._sample(self._familia(name, kind, help_text), name, value, **labels)
+
+    def histogram(self, name, help_text, snapshot):
+        name = f"{self.prefix}_{name}"
+        lines = self._familia(name, 'histogram', help_text)
+        for le, n in snapshot['buckets']:
+            self._sample(lines, f"{name}_bucket", n, le=le if le == '+Inf' else f"{le:g}")
+        self._sample(lines, f"{name}_sum", snapshot['sum'])
+        self._sample(lines, f"{name}_count", snapshot['count'])
+
+    def text(self):
+        out = []
+        for name, (kind, help_text, lines) in self._familias.items():
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+def prometheus_text(status, prefix='desktop_agent'):
+    """
+    Convierte DesktopAgent.status() al formato de texto de Prometheus.
+
+    Args:
+        status: Diccionario devuelto por DesktopAgent.status()
+        prefix: Prefijo de los nombres de métrica
+
+    Returns:
+        Texto listo para servir en /metrics
+    """
+    m = _Metricas(prefix, status.get('station_name', ''))
+    m.add('up', 'gauge', 'Agente ejecutándose', 1 if status.get('running') else 0)
+    m.add('healthy', 'gauge', 'Sin problemas detectados por /health', 0 if status.get('problems') else 1)
+
+    outbox = status.get('outbox', {})
+    for estado, n in sorted(outbox.get('counts', {}).items()):
+        m.add('outbox_items', 'gauge', 'Elementos del outbox por estado', n, estado=estado)
+    m.add('outbox_ready', 'gauge', 'Elementos listos para enviar ahora (cola)', outbox.get('ready'))
+    m.add('outbox_scheduled', 'gauge', 'Elementos esperando un reintento', outbox.get('scheduled'))
+    m.add('outbox_oldest_pending_seconds', 'gauge', 'Antigüedad del elemento pendiente más viejo',
+          outbox.get('oldest_pending_seconds'))
+    for source, c in sorted(outbox.get('collected', {}).items()):
+        m.add('collected_total', 'counter', 'Datos recolectados por collector', c['count'], source=source)
+        m.add('collected_last_timestamp_seconds', 'gauge', 'Último dato recolectado por collector',
+              _epoch(c['last']), source=source)
+
+    uploader = status.get('uploader')
+    if uploader:
+        for resultado in ('enviados', 'fallidos', 'duplicados'):
+            m.add('uploads_total', 'counter', 'Datos procesados por el uploader', uploader[resultado],
+                  resultado=resultado)
+        m.add('upload_batches_total', 'counter', 'Lotes enviados', uploader['lotes'])
+        m.add('upload_retries_total', 'counter', 'Reintentos programados', uploader['reintentos'])
+        m.add('uploaded_files_total', 'counter', 'Archivos subidos por bloques', uploader['archivos_subidos'])
+        m.add('uploaded_file_bytes_total', 'counter', 'Bytes de archivos subidos', uploader['bytes_subidos'])
+        m.add('last_upload_timestamp_seconds', 'gauge', 'Último envío exitoso', _epoch(uploader['ultimo_envio']))
+        # El texto del error va solo en /status: como etiqueta, cada mensaje distinto sería una serie nueva
+        if uploader['ultimo_error']:
+            m.add('last_error_timestamp_seconds', 'gauge', 'Último error de envío',
+                  _epoch(uploader['ultimo_error_en']))
+        m.histogram('upload_duration_seconds', 'Duración de las peticiones al servidor', uploader['latencia'])
+
+    file_watcher = status.get('file_watcher')
+    if file_watcher:
+        m.add('file_watcher_pending', 'gauge', 'Archivos esperando a estar completos', file_watcher['pendientes'])
+        m.add('file_watcher_in_progress', 'gauge', 'Archivos procesándose', file_watcher['en_proceso'])
+        m.add('file_watcher_processed_total', 'counter', 'Archivos puestos en el outbox', file_watcher['procesados'])
+        m.add('file_watcher_errors_total', 'counter', 'Archivos con error al procesar', file_watcher['errores'])
+        m.add('file_watcher_locked_retries_total', 'counter', 'Archivos todavía abiertos por el equipo',
+              file_watcher['reintentos'])
+
+    for port in status.get('serial', {}).get('ports', []):
+        labels = {'port': port['port'], 'equipment': port['equipment_name']}
+        m.add('serial_connected', 'gauge', 'Puerto serial conectado', 1 if port['state'] == 'conectado' else 0,
+              **labels)
+        m.add('serial_bytes_total', 'counter', 'Bytes recibidos por puerto', port['bytes'], **labels)
+        m.add('serial_frames_total', 'counter', 'Mensajes MLLP recibidos por puerto', port['frames'], **labels)
+        m.add('serial_parse_errors_total', 'counter', 'Mensajes descartados o inválidos', port['parse_errors'],
+              **labels)
+        m.add('serial_reconnects_total', 'counter', 'Reconexiones del puerto', port['reconnects'], **labels)
+        m.add('serial_errors_total', 'counter', 'Errores del puerto', port['errors'], **labels)
+        m.add('serial_bytes_per_second', 'gauge', 'Bytes/s del último minuto', port['bytes_per_second'], **labels)
+        m.add('serial_frames_per_second', 'gauge', 'Mensajes/s del último minuto', port['frames_per_second'],
+              **labels)
+        m.add('serial_last_seen_timestamp_seconds', 'gauge', 'Últimos datos recibidos',
+              _epoch(port['last_seen']), **labels)
+    return m.text()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = 'DesktopAgentStatus/1.0'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/') or '/'
+        try:
+            if path == '/metrics':
+                body = prometheus_text(self.server.agent.status()).encode('utf-8')
+                self._send(200, body, 'text/plain; version=0.0.4; charset=utf-8')
+            elif path in ('/', '/status'):
+                self._json(200, self.server.agent.status())
+            elif path == '/health':
+                status = self.server.agent.status()
+                problems = status.get('problems', [])
+                self._json(503 if problems else 200, {'ok': not problems, 'problems': problems})
+            else:
+                self._json(404, {'error': 'No encontrado'})
+        except Exception as e:
+            self.server.logger.error(f"Status server: error en {path}: {e}")
+            self._json(500, {'error': str(e)})
+
+    def _json(self, code, data):
+        self._send(code, json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'),
+                   'application/json; charset=utf-8')
+
+    def _send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(f"Status server: {self.address_string()} {format % args}")
+
+
+class StatusServer:
+    """
+    Servidor HTTP embebido (stdlib) que publica el estado del agente:
+
+    - /metrics: formato de texto de Prometheus
+    - /status: el mismo estado en JSON
+    - /health: 200 o 503 con la lista de problemas (estación atascada)
+    """
+
+    def __init__(self, agent, logger, host='127.0.0.1', port=8765):
+        """
+        Inicializa el servidor.
+
+        Args:
+            agent: Objeto con un método status() (DesktopAgent)
+            logger: Logger para mensajes
+            host: Interfaz donde escuchar (0.0.0.0 para exponerlo en la red)
+            port: Puerto TCP
+        """
+        self.agent = agent
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.agent = self.agent
+        self._httpd.logger = self.logger
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name='StatusServer')
+        self._thread.start()
+        self.logger.info(f"Status server en http://{self.host}:{self.port}/metrics (también /status y /health)")
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
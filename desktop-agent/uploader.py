@@ -2,19 +2,73 @@
 Result Uploader - Envía resultados al servidor central vía API REST
 """
 
+import hashlib
 import json
+import os
+import threading
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from parsers.hl7_parser import HL7Parser
 from parsers.dicom_parser import DicomParser
+from status_server import Histogram
+
+
+class _FileUploadError(Exception):
+    """Falla de la subida de un archivo; de_red indica que el dato no tiene la culpa."""
+    
+    def __init__(self, mensaje, de_red=False):
+        super().__init__(mensaje)
+        self.de_red = de_red
+
+
+def _sha256(path, block_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {}
 
 
 class ResultUploader:
-    """Procesa la cola de datos y los envía al servidor."""
+    """
+    Procesa la cola persistente (Outbox) y envía los datos al servidor.
+
+    Los datos se envían en lotes a `batch_endpoint`, con varios lotes en
+    paralelo y una sesión HTTP keep-alive por worker. Cada elemento lleva
+    su clave de idempotencia, de modo que un reenvío tras un corte o un
+    reinicio no crea duplicados en el servidor. Si el servidor no tiene
+    endpoint de lotes se envía elemento por elemento a `upload_endpoint`.
+
+    Los archivos (DICOM, PDF) viajan en la cola solo como referencia: antes de
+    enviar su resultado se suben a `file_endpoint` en bloques de
+    `chunk_size` bytes, cada uno con su sha256, retomando desde el offset
+    que el servidor ya tiene. La memoria usada es la de un bloque, sea cual
+    sea el tamaño del archivo.
+    """
+    
+    # Tipos de dato cuyo archivo se sube al servidor
+    FILE_TYPES = ('dicom', 'pdf')
+    
+    # Segundos sin volver a probar file_endpoint tras un 404/405
+    FILE_REPROBE_SECONDS = 300
     
     def __init__(self, server_url, station_name, api_key, queue, 
-                 upload_interval, retry_on_failure, max_retries, logger):
+                 upload_interval, retry_on_failure, max_retries, logger,
+                 batch_size=50, workers=2,
+                 upload_endpoint='/equipos/recibir-json',
+                 batch_endpoint='/maquinas/recibir-lote',
+                 file_endpoint='/maquinas/archivos',
+                 chunk_size=4 * 1024 * 1024):
         """
         Inicializa el uploader.
         
@@ -22,11 +76,18 @@ class ResultUploader:
             server_url: URL base del servidor
             station_name: Nombre de la estación
             api_key: Clave de API para autenticación
-            queue: Cola de datos a procesar
-            upload_interval: Intervalo entre uploads en segundos
+            queue: Outbox con los datos a procesar
+            upload_interval: Espera máxima (segundos) sin actividad
             retry_on_failure: Si reintentar en caso de fallo
-            max_retries: Número máximo de reintentos
+            max_retries: Reintentos de un dato rechazado por el servidor
+                         (los errores de red se reintentan siempre)
             logger: Logger para mensajes
+            batch_size: Máximo de resultados por petición
+            workers: Peticiones simultáneas
+            upload_endpoint: Endpoint para envío individual
+            batch_endpoint: Endpoint de lotes (None para desactivar)
+            file_endpoint: Endpoint de subida por bloques (None para no subir archivos)
+            chunk_size: Bytes por bloque de subida
         """
         self.server_url = server_url.rstrip('/')
         self.station_name = station_name
@@ -36,68 +97,353 @@ class ResultUploader:
         self.retry_on_failure = retry_on_failure
         self.max_retries = max_retries
         self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.upload_endpoint = upload_endpoint
+        self.batch_endpoint = batch_endpoint
+        self.file_endpoint = file_endpoint
+        self.chunk_size = max(64 * 1024, chunk_size)
+        self._file_endpoint_retry_at = 0
         self.running = False
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
         
         # Estadísticas
         self.stats = {
             'enviados': 0,
             'fallidos': 0,
-            'ultimo_envio': None
+            'duplicados': 0,
+            'lotes': 0,
+            'reintentos': 0,
+            'archivos_subidos': 0,
+            'bytes_subidos': 0,
+            'ultimo_envio': None,
+            'ultimo_error': None,
+            'ultimo_error_en': None
         }
+        self.latencia = Histogram()
     
     def start(self):
         """Inicia el procesamiento y envío de datos."""
         self.running = True
-        self.logger.info(f"Uploader: Iniciando (intervalo: {self.upload_interval}s)")
+        self.logger.info(
+            f"Uploader: Iniciando ({self.workers} workers, lotes de {self.batch_size}, "
+            f"{self.queue.pending_count()} pendientes en outbox)"
+        )
         
-        while self.running:
-            try:
-                # Verificar si hay datos en la cola
-                if not self.queue.empty():
-                    data = self.queue.get()
-                    self._process_and_upload(data)
-                else:
-                    # No hay datos, esperar
-                    time.sleep(1)
+        en_vuelo = set()
+        ultima_purga = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='Upload') as executor:
+            while self.running:
+                try:
+                    en_vuelo = {f for f in en_vuelo if not f.done()}
                     
+                    if len(en_vuelo) < self.workers:
+                        items = self.queue.claim(self.batch_size)
+                        if items:
+                            future = executor.submit(self._upload_batch, items)
+                            future.add_done_callback(lambda _: self.queue.notify())
+                            en_vuelo.add(future)
+                            continue
+                    
+                    if time.time() - ultima_purga > 3600:
+                        self.queue.purge()
+                        ultima_purga = time.time()
+                    
+                    # Dormir hasta que llegue un dato, termine un lote o venza un reintento
+                    espera = self.upload_interval
+                    proximo = self.queue.next_due_in()
+                    if proximo is not None and len(en_vuelo) < self.workers:
+                        espera = min(espera, proximo)
+                    self.queue.wait(max(espera, 0.05))
+                    
+                except Exception as e:
+                    self.logger.error(f"Error en Uploader: {e}")
+                    time.sleep(5)
+    
+    def _session(self):
+        """Sesión HTTP keep-alive por hilo."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            session.headers['Content-Type'] = 'application/json'
+            if self.api_key:
+                session.headers['Authorization'] = f'Bearer {self.api_key}'
+            self._local.session = session
+        return session
+    
+    def _contar(self, campo, n=1):
+        with self._stats_lock:
+            self.stats[campo] += n
+            if campo == 'enviados' and n:
+                self.stats['ultimo_envio'] = datetime.now().isoformat()
+    
+    def _error(self, error):
+        with self._stats_lock:
+            self.stats['ultimo_error'] = str(error)[:500]
+            self.stats['ultimo_error_en'] = datetime.now().isoformat()
+    
+    def _post(self, endpoint, body, method='POST', **kwargs):
+        """Petición con la sesión del hilo; la duración va al histograma de latencia."""
+        t0 = time.perf_counter()
+        try:
+            return self._session().request(method, endpoint, data=body, timeout=30, **kwargs)
+        finally:
+            self.latencia.observe(time.perf_counter() - t0)
+    
+    def snapshot(self):
+        """Copia de las estadísticas con el histograma de latencia, para el status server."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['latencia'] = self.latencia.snapshot()
+        stats['running'] = self.running
+        return stats
+    
+    def _upload_batch(self, items):
+        """
+        Parsea y envía un lote reclamado del outbox.
+        
+        Args:
+            items: Lista de (id, data, intentos)
+        """
+        listos = []
+        for item_id, data, intentos in items:
+            try:
+                self.logger.info(f"Procesando dato de {data.get('source')} ({data.get('equipment_name')})")
+                parsed_data = self._parse_data(data)
+                if not parsed_data:
+                    raise ValueError("No se pudo parsear el dato")
+                payload = self._prepare_payload(data, parsed_data)
+                if self.file_endpoint and data.get('file_path') and data.get('data_type') in self.FILE_TYPES:
+                    try:
+                        archivo_id = self._upload_file(data)
+                    except _FileUploadError as e:
+                        self._retry(item_id, intentos, e, de_red=e.de_red)
+                        continue
+                    payload['archivo_id'] = archivo_id
+                listos.append((item_id, intentos, payload))
             except Exception as e:
-                self.logger.error(f"Error en Uploader: {e}")
-                time.sleep(5)
+                # Un dato que no se puede parsear no mejora reintentando
+                self.logger.warning(f"Dato descartado ({data.get('idempotency_key')}): {e}")
+                self.queue.fail(item_id, e, intentos + 1, max_retries=0)
+                self._contar('fallidos')
+                self._error(e)
+        
+        if not listos:
+            return
+        
+        if self.batch_endpoint:
+            self._send_batch(listos)
+        else:
+            for item in listos:
+                self._send_one(*item)
     
-    def _process_and_upload(self, data):
+    def _upload_file(self, data):
         """
-        Procesa un dato de la cola y lo envía al servidor.
+        Sube el archivo del dato por bloques, retomando donde quedó.
+        
+        Si el servidor responde 404/405 (versión sin subida por bloques, proxy
+        mal configurado) el dato se reintenta como un error de red y el
+        endpoint no se vuelve a probar hasta pasados FILE_REPROBE_SECONDS:
+        sin su archivo el resultado no sirve, así que no se envía sin él.
+        
+        Returns:
+            archivo_id para el payload
+        
+        Raises:
+            _FileUploadError: Error de red o del servidor (se reintenta)
+            OSError: El archivo ya no existe o no se puede leer
+        """
+        endpoint = f"{self.server_url}{self.file_endpoint}"
+        if time.monotonic() < self._file_endpoint_retry_at:
+            raise _FileUploadError(f"{endpoint} no disponible; se vuelve a probar más tarde", de_red=True)
+        path = data['file_path']
+        upload_id = data['idempotency_key']
+        size = os.path.getsize(path)
+        sha256 = data.get('sha256')
+        if not sha256 or data.get('file_size') != size:
+            sha256 = _sha256(path)
+        
+        estado = self._file_request('POST', endpoint, json.dumps({
+            'upload_id': upload_id,
+            'nombre': data.get('file_name') or os.path.basename(path),
+            'tamano': size,
+            'sha256': sha256,
+            'station_name': self.station_name
+        }))
+        if estado is None:
+            self._file_endpoint_retry_at = time.monotonic() + self.FILE_REPROBE_SECONDS
+            self.logger.warning(
+                f"{endpoint} no disponible (404/405); las subidas se reintentan en {self.FILE_REPROBE_SECONDS} s"
+            )
+            raise _FileUploadError(f"{endpoint} no disponible", de_red=True)
+        if estado['offset']:
+            self.logger.info(f"Subida de {os.path.basename(path)} retomada en {estado['offset']}/{size} bytes")
+        
+        conflictos = 0
+        with open(path, 'rb') as f:
+            while not estado['completo']:
+                offset = estado['offset']
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    raise _FileUploadError(f"{path} cambió de tamaño durante la subida")
+                try:
+                    response = self._post(
+                        f"{endpoint}/{upload_id}", chunk, method='PATCH',
+                        headers={
+                            'Content-Type': 'application/offset+octet-stream',
+                            'Upload-Offset': str(offset),
+                            'Upload-Checksum': f"sha256 {hashlib.sha256(chunk).hexdigest()}"
+                        }
+                    )
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                    raise _FileUploadError(f"Error de conexión en {offset}/{size}: {e}", de_red=True)
+                if response.status_code in (409, 422):
+                    # Offset desfasado o bloque corrupto: seguir desde lo que tiene el servidor
+                    conflictos += 1
+                    if conflictos > 5:
+                        raise _FileUploadError(f"Subida de {path}: HTTP {response.status_code}")
+                    estado = dict(estado, offset=_json(response).get('offset', 0))
+                    continue
+                estado = self._file_response(response)
+                self._contar('bytes_subidos', len(chunk))
+        
+        self._contar('archivos_subidos')
+        self.logger.info(f"✓ Archivo subido: {os.path.basename(path)} ({size} bytes)")
+        return upload_id
+    
+    def _file_request(self, method, endpoint, body):
+        """Inicio de subida; None si el servidor no tiene el endpoint."""
+        try:
+            response = self._post(endpoint, body, method=method)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            raise _FileUploadError(f"Error de conexión: {e}", de_red=True)
+        if response.status_code in (404, 405):
+            return None
+        return self._file_response(response)
+    
+    @staticmethod
+    def _file_response(response):
+        if response.status_code >= 400:
+            raise _FileUploadError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                de_red=response.status_code >= 500 or response.status_code == 429
+            )
+        return response.json()
+    
+    def _retry(self, item_id, intentos, error, de_red=False):
+        """Reprograma un elemento con backoff o lo marca como error definitivo."""
+        if not self.retry_on_failure:
+            max_retries = 0
+        elif de_red:
+            max_retries = None  # servidor caído: el dato no tiene la culpa
+        else:
+            max_retries = self.max_retries
+        espera = self.queue.fail(item_id, error, intentos + 1, max_retries=max_retries)
+        self._error(error)
+        if espera is None:
+            self._contar('fallidos')
+            self.logger.error(f"✗ Dato descartado tras {intentos + 1} intentos: {error}")
+        else:
+            self._contar('reintentos')
+            self.logger.warning(f"Reintento en {espera:.1f}s (intento {intentos + 1}): {error}")
+    
+    def _send_batch(self, listos):
+        """
+        Envía un lote a batch_endpoint y procesa el estado de cada elemento.
         
         Args:
-            data: Diccionario con los datos recolectados
+            listos: Lista de (id, intentos, payload)
         """
+        endpoint = f"{self.server_url}{self.batch_endpoint}"
+        body = {
+            'station_name': self.station_name,
+            'resultados': [payload for _, _, payload in listos]
+        }
+        
         try:
-            self.logger.info(f"Procesando dato de {data.get('source')} ({data.get('equipment_name')})")
-            
-            # Parsear los datos según el tipo
-            parsed_data = self._parse_data(data)
-            
-            if not parsed_data:
-                self.logger.warning("No se pudo parsear el dato")
-                return
-            
-            # Preparar payload para el servidor
-            payload = self._prepare_payload(data, parsed_data)
-            
-            # Enviar al servidor
-            success = self._send_to_server(payload)
-            
-            if success:
-                self.stats['enviados'] += 1
-                self.stats['ultimo_envio'] = datetime.now().isoformat()
-                self.logger.info(f"✓ Dato enviado exitosamente (Total: {self.stats['enviados']})")
+            response = self._post(endpoint, json.dumps(body))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            for item_id, intentos, _ in listos:
+                self._retry(item_id, intentos, f"Error de conexión: {e}", de_red=True)
+            return
+        
+        if response.status_code in (404, 405):
+            # Servidor sin endpoint de lotes: pasar a envío individual
+            self.logger.warning(f"{endpoint} no disponible; se envía elemento por elemento")
+            self.batch_endpoint = None
+            for item in listos:
+                self._send_one(*item)
+            return
+        
+        if response.status_code >= 500 or response.status_code == 429:
+            for item_id, intentos, _ in listos:
+                self._retry(item_id, intentos, f"HTTP {response.status_code}", de_red=True)
+            return
+        
+        if response.status_code >= 400:
+            for item_id, intentos, _ in listos:
+                self._retry(item_id, intentos, f"HTTP {response.status_code}: {response.text[:200]}")
+            return
+        
+        estados = {}
+        try:
+            for r in response.json().get('resultados', []):
+                estados[r.get('idempotency_key')] = r
+        except ValueError:
+            pass
+        
+        enviados = []
+        for item_id, intentos, payload in listos:
+            estado = estados.get(payload['idempotency_key'])
+            if estado is None:
+                # Sin estado no hay confirmación de que se guardó: reenviar es
+                # seguro porque el servidor deduplica por idempotency_key
+                self._retry(item_id, intentos, "El servidor no devolvió estado para el elemento", de_red=True)
+            elif estado.get('estado') in ('creado', 'duplicado'):
+                enviados.append(item_id)
+                if estado['estado'] == 'duplicado':
+                    self._contar('duplicados')
             else:
-                self.stats['fallidos'] += 1
-                self.logger.error(f"✗ Fallo al enviar dato (Total fallidos: {self.stats['fallidos']})")
-            
-        except Exception as e:
-            self.logger.error(f"Error procesando dato: {e}")
-            self.stats['fallidos'] += 1
+                self._retry(item_id, intentos, estado.get('error') or estado.get('estado') or 'Estado desconocido')
+        
+        self.queue.ack(enviados)
+        self._contar('enviados', len(enviados))
+        self._contar('lotes')
+        self.logger.info(f"✓ Lote enviado: {len(enviados)}/{len(listos)} (Total: {self.stats['enviados']})")
+    
+    def _send_one(self, item_id, intentos, payload):
+        """Envía un elemento a upload_endpoint."""
+        endpoint = f"{self.server_url}{self.upload_endpoint}"
+        try:
+            response = self._post(
+                endpoint, json.dumps(payload),
+                headers={'Idempotency-Key': payload['idempotency_key']}
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            self._retry(item_id, intentos, f"Error de conexión: {e}", de_red=True)
+            return
+        
+        if 200 <= response.status_code < 300 or response.status_code == 409:
+            self.queue.ack([item_id])
+            self._contar('enviados')
+            try:
+                response_data = response.json()
+                # Si el servidor devuelve un código de muestra, loguearlo
+                if 'codigoMuestra' in response_data:
+                    self.logger.info(f"Código de muestra generado: {response_data['codigoMuestra']}")
+            except ValueError:
+                pass
+            self.logger.info(f"✓ Dato enviado exitosamente (Total: {self.stats['enviados']})")
+        else:
+            self.logger.error(f"Error del servidor: {response.status_code} - {response.text[:200]}")
+            self._retry(
+                item_id, intentos, f"HTTP {response.status_code}",
+                de_red=response.status_code >= 500 or response.status_code == 429
+            )
     
     def _parse_data(self, data):
         """
@@ -131,9 +477,19 @@ class ResultUploader:
                         'patient_name': data.get('patient_name'),
                         'study_date': data.get('study_date'),
                         'modality': data.get('modality'),
-                        'series_description': data.get('series_description')
+                        'series_description': data.get('series_description'),
+                        'sop_instance_uid': data.get('sop_instance_uid'),
+                        'accession_number': data.get('accession_number')
                     }
             
+            elif data_type == 'pdf':
+                # Informe PDF: no se interpreta, el archivo se sube por bloques
+                return {
+                    'file_name': data.get('file_name'),
+                    'file_size': data.get('file_size'),
+                    'sha256': data.get('sha256')
+                }
+            
             else:
                 self.logger.warning(f"Tipo de dato no soportado: {data_type}")
                 return None
@@ -159,6 +515,7 @@ class ResultUploader:
             'equipment_type': raw_data.get('equipment_type'),
             'equipment_name': raw_data.get('equipment_name'),
             'timestamp': raw_data.get('timestamp', datetime.now().isoformat()),
+            'idempotency_key': raw_data.get('idempotency_key'),
         }
         
         # Agregar datos específicos según el tipo
@@ -168,6 +525,9 @@ class ResultUploader:
             payload['cedula'] = parsed_data.get('patient_id')  # Usar patient_id como cédula por ahora
             payload['orden_id'] = parsed_data.get('order_id')
             payload['tipo_estudio'] = raw_data.get('equipment_type')
+            payload['control_id'] = parsed_data.get('message_control_id')
+            payload['aplicacion_emisora'] = parsed_data.get('sending_application')
+            payload['fecha_mensaje'] = parsed_data.get('message_datetime')
             
             # Convertir resultados de tests a formato de valores
             valores = {}
@@ -187,89 +547,24 @@ class ResultUploader:
             payload['study_date'] = parsed_data.get('study_date')
             payload['series_description'] = parsed_data.get('series_description')
             payload['file_path'] = raw_data.get('file_path')
+            payload['sop_instance_uid'] = parsed_data.get('sop_instance_uid')
+            # El número de acceso suele ser el número de orden; si no coincide
+            # con ninguna, el servidor deja el resultado sin asignar
+            payload['orden_id'] = parsed_data.get('accession_number')
         
-        return payload
-    
-    def _send_to_server(self, payload):
-        """
-        Envía el payload al servidor.
-        
-        Args:
-            payload: Dict con los datos a enviar
-            
-        Returns:
-            True si se envió exitosamente, False en caso contrario
-        """
-        endpoint = f"{self.server_url}/equipos/recibir-json"
-        
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        # Agregar API key si está configurada
-        if self.api_key:
-            headers['Authorization'] = f'Bearer {self.api_key}'
-        
-        retries = 0
-        
-        while retries <= self.max_retries:
-            try:
-                self.logger.debug(f"Enviando a: {endpoint}")
-                self.logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
-                
-                response = requests.post(
-                    endpoint,
-                    json=payload,
-                    headers=headers,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    self.logger.info(f"Respuesta del servidor: {response_data}")
-                    
-                    # Si el servidor devuelve un código de muestra, loguearlo
-                    if 'codigoMuestra' in response_data:
-                        self.logger.info(f"Código de muestra generado: {response_data['codigoMuestra']}")
-                    
-                    return True
-                    
-                else:
-                    self.logger.error(f"Error del servidor: {response.status_code} - {response.text}")
-                    
-                    if not self.retry_on_failure:
-                        return False
-                    
-                    retries += 1
-                    if retries <= self.max_retries:
-                        wait_time = retries * 5  # Backoff exponencial
-                        self.logger.warning(f"Reintentando en {wait_time}s... (intento {retries}/{self.max_retries})")
-                        time.sleep(wait_time)
-                    
-            except requests.exceptions.Timeout:
-                self.logger.error("Timeout al conectar con el servidor")
-                retries += 1
-                if retries <= self.max_retries and self.retry_on_failure:
-                    time.sleep(retries * 5)
-                else:
-                    return False
-                    
-            except requests.exceptions.ConnectionError:
-                self.logger.error("Error de conexión con el servidor")
-                retries += 1
-                if retries <= self.max_retries and self.retry_on_failure:
-                    time.sleep(retries * 5)
-                else:
-                    return False
-                    
-            except Exception as e:
-                self.logger.error(f"Error al enviar al servidor: {e}")
-                return False
+        elif raw_data.get('data_type') == 'pdf':
+            # Informes PDF de los equipos
+            payload['tipo_archivo'] = 'pdf'
+            payload['tipo_estudio'] = raw_data.get('equipment_type')
+            payload['file_name'] = parsed_data.get('file_name')
+            payload['file_path'] = raw_data.get('file_path')
+            payload['sha256'] = parsed_data.get('sha256')
         
-        return False
+        return payload
     
     def stop(self):
         """Detiene el uploader."""
         self.logger.info("Deteniendo Uploader...")
         self.running = False
-        self.logger.info(f"Estadísticas finales: {self.stats}")
+        self.queue.notify()
+        self.logger.info(f"Estadísticas finales: {self.stats} - outbox: {self.queue.counts()}")
@@ -203,7 +203,7 @@ class ApiService {
             body: JSON.stringify({ motivo })
         });
     }
-    async imprimirFactura(id) { return this.request('/impresion/factura-termica/' + id); }
+    async imprimirFactura(id) { return this.request('/impresion/factura-termica/' + id, { method: 'POST' }); }
 
     // Resultados endpoints: /api/resultados
     async getResultados(params = {}) {
@@ -33,6 +33,9 @@ if [ "$1" == "dev" ]; then
     # Modo desarrollo
     python run.py
 else
-    # Modo producción
+    # Modo producción: el worker de la cola (PDFs, emails, WhatsApp, nube) en segundo plano
+    python worker.py >> logs/worker.log 2>&1 &
+    # Cache compartido entre los 4 workers: invalidar en uno invalida en todos
+    export CACHE_BACKEND=${CACHE_BACKEND:-sqlite}
     gunicorn -w 4 -b 0.0.0.0:5000 --access-logfile logs/access.log --error-logfile logs/error.log run:create_app
 fi
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Caché de disco del render DICOM (app/services/dicom_render.py).
+
+Un DICOM sintético: pedir la miniatura solo escribe la miniatura, una
+ventana elegida en el visor (wc/ww) no deja archivos, y con el tope
+superado se borra primero el render usado hace más tiempo.
+
+Uso (desde la raíz del repo):
+    python tests/test_dicom_cache.py
+    python -m pytest tests/test_dicom_cache.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND)
+
+import numpy as np
+
+try:
+    import pydicom  # noqa: F401
+except ImportError:
+    pydicom = None
+
+from app.services.dicom_render import DicomRender
+
+if pydicom is not None:
+    from bench_dicom_render import escribir_dicom
+
+
+def renders(directorio):
+    return sorted(os.path.relpath(os.path.join(r, n), directorio)
+                  for r, _, nombres in os.walk(directorio) for n in nombres)
+
+
+@unittest.skipIf(pydicom is None, 'pydicom no instalado')
+class DicomCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directorio, 'cache')
+        self.estudios = []
+        for i in range(3):
+            path = os.path.join(self.directorio, f'estudio{i}.dcm')
+            escribir_dicom(path, np.random.default_rng(i).integers(0, 4096, (600, 600), dtype=np.uint16))
+            self.estudios.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_solo_el_nivel_pedido(self):
+        ruta = DicomRender.renderizar(self.estudios[0], 'miniatura', cache_dir=self.cache)
+        self.assertEqual([os.path.basename(r) for r in renders(self.cache)], ['miniatura.png'])
+        self.assertEqual(DicomRender.renderizar(self.estudios[0], 'miniatura', cache_dir=self.cache), ruta)
+
+    def test_ventana_elegida_no_se_guarda(self):
+        datos = DicomRender.renderizar(self.estudios[0], 'completa', centro=1000, ancho=400, cache_dir=self.cache)
+        self.assertTrue(datos.getvalue().startswith(b'\x89PNG'))
+        self.assertEqual(renders(self.cache), [])
+
+    def test_tope_descarta_lo_menos_usado(self):
+        rutas = [DicomRender.piramide(p, cache_dir=self.cache, niveles=('completa',))['completa']
+                 for p in self.estudios[:2]]
+        for i, ruta in enumerate(rutas):
+            os.utime(ruta, (1000 + i, 1000 + i))
+        # El primero se vuelve a usar: ahora el menos usado es el segundo
+        DicomRender.piramide(self.estudios[0], cache_dir=self.cache, niveles=('completa',))
+        tope = int(sum(os.path.getsize(r) for r in rutas) * 1.25)  # caben dos, no tres
+        nueva = DicomRender.piramide(self.estudios[2], cache_dir=self.cache, niveles=('completa',),
+                                     max_bytes=tope)['completa']
+        self.assertTrue(os.path.exists(rutas[0]))
+        self.assertFalse(os.path.exists(rutas[1]))
+        self.assertTrue(os.path.exists(nueva))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Un mensaje HL7 leído por el desktop-agent y por el backend, sin servidor ni base.
+
+El agente parsea el mensaje y envía sus campos en el payload; el backend
+recibe ese payload por /maquinas/recibir-lote o el mensaje crudo por
+/recibir-hl7. Las dos vías tienen que llegar a la misma clave_dedup y a la
+misma gravedad de cada valor (HH/LL son críticos en ambas), y dos mensajes
+distintos con el mismo MSH-10 (equipo que reinició su contador) no pueden
+chocar.
+
+Uso (desde la raíz del repo):
+    python tests/test_hl7_agente_backend.py
+    python -m pytest tests/test_hl7_agente_backend.py
+"""
+import logging
+import os
+import sys
+import unittest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(RAIZ, 'backend'))
+sys.path.insert(0, os.path.join(RAIZ, 'desktop-agent'))
+
+from uploader import ResultUploader
+from app.services.hl7_service import HL7Service
+from app.services.ingesta_resultados import IngestaResultados
+
+
+def mensaje(control='MSG0001', fecha='20260101083000', obx=('OBX|1|NM|GLU^Glucosa||95|mg/dL|70-110|N|||F',)):
+    return '\r'.join((
+        f'MSH|^~\\&|ANALIZADOR^1.2.3^ISO|LAB|LIS|CLINICA|{fecha}||ORU^R01|{control}|P|2.5',
+        'PID|1||001-1234567-8||PEREZ^JUAN',
+        'OBR|1|1234||GLU^Glucosa',
+    ) + tuple(obx))
+
+
+class HL7AgenteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = ResultUploader(
+            'http://servidor/api', 'PC-LAB', 'clave', queue=None, upload_interval=1,
+            retry_on_failure=True, max_retries=3, logger=logging.getLogger('test')
+        )
+
+    def payload(self, texto):
+        """Payload que el agente envía a /maquinas/recibir-lote"""
+        dato = {'source': 'file_watcher', 'data_type': 'hl7', 'raw_data': texto,
+                'equipment_type': 'quimica', 'idempotency_key': 'k'}
+        return self.uploader._prepare_payload(dato, self.uploader._parse_data(dato))
+
+    def test_misma_clave_por_las_dos_vias(self):
+        texto = mensaje()
+        por_lote = IngestaResultados.clave_dedup(self.payload(texto))
+        por_mensaje = IngestaResultados.clave_dedup({'mensaje_hl7': '\x0b' + texto + '\x1c\r'})
+        self.assertEqual(por_lote, por_mensaje)
+        self.assertEqual(por_lote, 'hl7:ANALIZADOR|MSG0001|20260101083000')
+
+    def test_contador_reiniciado_no_choca(self):
+        antes = IngestaResultados.clave_dedup(self.payload(mensaje(fecha='20260101083000')))
+        despues = IngestaResultados.clave_dedup(self.payload(mensaje(fecha='20260315101500')))
+        self.assertNotEqual(antes, despues)
+
+    def test_reenvio_del_mismo_mensaje_choca(self):
+        self.assertEqual(IngestaResultados.clave_dedup(self.payload(mensaje())),
+                         IngestaResultados.clave_dedup(self.payload(mensaje())))
+
+    def test_misma_gravedad_por_las_dos_vias(self):
+        banderas = {'GLU': 'HH', 'K': 'LL', 'NA': 'H', 'CA': 'L', 'CL': 'N', 'MG': 'AA', 'P': ''}
+        texto = mensaje(obx=[f'OBX|{i}|NM|{codigo}^{codigo}||1|mg/dL|1-2|{flag}|||F'
+                             for i, (codigo, flag) in enumerate(banderas.items(), 1)])
+        por_agente = {k: v['estado'] for k, v in self.payload(texto)['valores'].items()}
+        por_backend = {k: v['estado'] for k, v in HL7Service.valores(HL7Service.parse_hl7(texto)).items()}
+        self.assertEqual(por_agente, por_backend)
+        self.assertEqual(por_agente, {'GLU': 'critico', 'K': 'critico', 'NA': 'alto', 'CA': 'bajo',
+                                      'CL': 'normal', 'MG': 'critico', 'P': 'normal'})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Resultados con archivo (PDF, DICOM) de punta a punta, sin servidor ni base.
+
+El payload sale del propio desktop-agent: ResultUploader._upload_batch
+parsea el dato con _parse_data, lo arma con _prepare_payload y le agrega el
+archivo_id de la subida. Ese lote entra tal cual en
+IngestaResultados.insertar_lote (con la conexión a PostgreSQL simulada) y
+se verifica la fila que se insertaría: un archivo sin orden queda sin
+asignar en vez de rechazarse, y un DICOM cuyo número de acceso es una orden
+existente queda asignado a ella.
+
+Uso (desde la raíz del repo):
+    python tests/test_ingesta_archivos.py
+    python -m pytest tests/test_ingesta_archivos.py
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(RAIZ, 'backend'))
+sys.path.insert(0, os.path.join(RAIZ, 'desktop-agent'))
+
+from uploader import ResultUploader
+from app.services import ingesta_resultados
+from app.services.ingesta_resultados import IngestaResultados
+
+# Columnas del INSERT de insertar_lote, en orden
+COLUMNAS = ('orden_detalle_id', 'tipo_archivo', 'nombre_archivo', 'ruta_archivo', 'datos_hl7',
+            'datos_dicom', 'estado_validacion', 'idempotency_key', 'clave_dedup',
+            'orden_referencia', 'paciente_referencia', 'estacion')
+
+
+class _Cursor:
+    """Cursor simulado: órdenes existentes para _resolver_detalles, nada más"""
+
+    def __init__(self, ordenes):
+        self.ordenes = ordenes   # numero_orden -> (orden_id, orden_detalle_id)
+        self.filas = []
+
+    def execute(self, sql, params=()):
+        if 'FROM ordenes' in sql:
+            ids, numeros = params
+            self.filas = [(oid, numero, detalle) for numero, (oid, detalle) in self.ordenes.items()
+                          if oid in ids or numero in numeros]
+        else:
+            self.filas = []
+
+    def fetchall(self):
+        return self.filas
+
+    def close(self):
+        pass
+
+
+class _Conexion:
+    def __init__(self, ordenes):
+        self.ordenes = ordenes
+
+    def cursor(self):
+        return _Cursor(self.ordenes)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class IngestaArchivosTest(unittest.TestCase):
+
+    def setUp(self):
+        self.carpeta = tempfile.mkdtemp()
+        self.uploader = ResultUploader(
+            'http://servidor/api', 'PC-LAB', 'clave', queue=None, upload_interval=1,
+            retry_on_failure=True, max_retries=3, logger=logging.getLogger('test')
+        )
+        # La subida por bloques tiene sus propias pruebas: aquí devuelve el upload_id
+        self.uploader._upload_file = lambda data: data['idempotency_key']
+        self.lotes = []
+        self.uploader._send_batch = self.lotes.append
+
+    def tearDown(self):
+        shutil.rmtree(self.carpeta, ignore_errors=True)
+
+    def _archivo(self, nombre, contenido):
+        ruta = os.path.join(self.carpeta, nombre)
+        with open(ruta, 'wb') as f:
+            f.write(contenido)
+        return ruta
+
+    def _dato(self, ruta, data_type, clave):
+        """Dato como lo pone en la cola FileWatcherCollector.process_file"""
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        return {
+            'source': 'file_watcher', 'equipment_type': 'imagenes', 'equipment_name': 'Equipo',
+            'data_type': data_type, 'file_name': os.path.basename(ruta), 'file_path': ruta,
+            'file_size': len(contenido), 'sha256': hashlib.sha256(contenido).hexdigest(),
+            'timestamp': '2026-01-01T08:00:00', 'idempotency_key': clave,
+        }
+
+    def _ingerir(self, datos, ordenes=None):
+        """Lote del agente -> insertar_lote; devuelve (estados, filas insertadas por columna)"""
+        self.uploader._upload_batch([(i, dato, 0) for i, dato in enumerate(datos)])
+        self.assertEqual(len(self.lotes), 1, 'El uploader descartó algún dato')
+        payloads = [payload for _, _, payload in self.lotes[0]]
+
+        insertadas = []
+
+        def execute_values(cur, sql, filas, **kwargs):
+            insertadas.extend(dict(zip(COLUMNAS, fila)) for fila in filas)
+            return [(n + 1, fila[COLUMNAS.index('idempotency_key')]) for n, fila in enumerate(filas)]
+
+        rutas = {p['archivo_id']: f"/srv/archivos_equipos/{p['archivo_id']}" for p in payloads}
+        with mock.patch.object(ingesta_resultados, 'get_db_connection', lambda: _Conexion(ordenes or {})), \
+                mock.patch.object(ingesta_resultados, 'execute_values', execute_values), \
+                mock.patch.object(ingesta_resultados.ArchivosEquipos, 'rutas', lambda ids: rutas):
+            estados = IngestaResultados.insertar_lote(payloads)
+        return estados, insertadas
+
+    def test_pdf_sin_orden_queda_sin_asignar(self):
+        ruta = self._archivo('informe.pdf', b'%PDF-1.4 informe')
+        estados, filas = self._ingerir([self._dato(ruta, 'pdf', 'pdf-1')])
+
+        self.assertEqual(estados[0]['estado'], 'creado', estados[0])
+        self.assertTrue(estados[0].get('sin_asignar'))
+        self.assertIsNone(filas[0]['orden_detalle_id'])
+        self.assertEqual(filas[0]['tipo_archivo'], 'pdf')
+        self.assertEqual(filas[0]['nombre_archivo'], 'informe.pdf')
+        self.assertEqual(filas[0]['ruta_archivo'], '/srv/archivos_equipos/pdf-1')
+        self.assertEqual(filas[0]['estacion'], 'PC-LAB')
+
+    def test_dicom_con_numero_de_acceso(self):
+        try:
+            from pydicom.dataset import Dataset, FileMetaDataset
+            from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+        except ImportError:
+            raise unittest.SkipTest('pydicom no está instalado')
+
+        def dicom(nombre, acceso):
+            ds = Dataset()
+            ds.file_meta = FileMetaDataset()
+            ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.6.1'
+            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID = generate_uid()
+            ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+            ds.PatientID, ds.Modality, ds.AccessionNumber = '001-1234567-8', 'US', acceso
+            ruta = os.path.join(self.carpeta, nombre)
+            ds.save_as(ruta, write_like_original=False)
+            return ruta
+
+        datos = [
+            self._dato(dicom('eco.dcm', 'ORD-7'), 'dicom', 'dcm-1'),
+            self._dato(dicom('otro.dcm', 'EQ-999'), 'dicom', 'dcm-2'),
+        ]
+        estados, filas = self._ingerir(datos, ordenes={'ORD-7': (7, 70)})
+
+        self.assertEqual([e['estado'] for e in estados], ['creado', 'creado'])
+        self.assertEqual(filas[0]['orden_detalle_id'], 70)
+        self.assertNotIn('sin_asignar', estados[0])
+        self.assertEqual(filas[0]['tipo_archivo'], 'dicom')
+        # Número de acceso que no es una orden: sin asignar, con la referencia
+        self.assertIsNone(filas[1]['orden_detalle_id'])
+        self.assertTrue(estados[1].get('sin_asignar'))
+        self.assertEqual(filas[1]['orden_referencia'], 'EQ-999')
+        self.assertEqual(filas[1]['paciente_referencia'], '001-1234567-8')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
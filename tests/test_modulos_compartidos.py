@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Módulos que el desktop-agent y el backend comparten como copias idénticas.
+
+hl7_message.py y dicom_header.py viven en desktop-agent/parsers/ y en
+backend/app/utils/ (el agente se instala sin el backend). Una corrección
+aplicada en un solo lado haría que el agente y el servidor lean distinto el
+mismo mensaje: esta prueba falla en cuanto las copias divergen.
+
+Uso (desde la raíz del repo):
+    python tests/test_modulos_compartidos.py
+    python -m pytest tests/test_modulos_compartidos.py
+"""
+import os
+import unittest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+COMPARTIDOS = ('hl7_message.py', 'dicom_header.py')
+
+
+class ModulosCompartidosTest(unittest.TestCase):
+
+    def test_copias_identicas(self):
+        for nombre in COMPARTIDOS:
+            with self.subTest(modulo=nombre):
+                agente = os.path.join(RAIZ, 'desktop-agent', 'parsers', nombre)
+                backend = os.path.join(RAIZ, 'backend', 'app', 'utils', nombre)
+                self.assertFalse(os.path.islink(backend), f'{backend} debe ser un archivo, no un enlace')
+                with open(agente, 'rb') as a, open(backend, 'rb') as b:
+                    self.assertEqual(a.read(), b.read(),
+                                     f'{nombre} difiere entre desktop-agent/parsers/ y backend/app/utils/; '
+                                     'copie el archivo corregido al otro lado')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
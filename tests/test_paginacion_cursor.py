@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Paginación por cursor (app/utils/pagination.py) con fechas NULL.
+
+Se recorre un listado siguiendo siguiente_cursor página por página, con
+filas sin fecha mezcladas y empates de fecha, por la ruta ORM
+(keyset_paginate) y por la de SQL crudo (keyset_sql, como resultados y
+auditoría). Cada fila tiene que salir una sola vez y las sin fecha al
+final: antes, un cursor con fecha NULL cortaba el listado.
+
+Uso (desde la raíz del repo):
+    python tests/test_paginacion_cursor.py
+    python -m pytest tests/test_paginacion_cursor.py
+"""
+import datetime
+import os
+import sys
+import unittest
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND)
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.utils.pagination import (decode_cursor, keyset_paginate, keyset_rows, keyset_sql,
+                                  respuesta_paginada, valores_cursor)
+
+
+class Registro(db.Model):
+    __tablename__ = 'prueba_keyset'
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, nullable=True)
+
+
+BASE = datetime.datetime(2026, 1, 1, 8, 0)
+# id -> fecha: NULL al principio, en medio y al final de los ids, y empates
+FECHAS = {
+    1: None, 2: BASE, 3: BASE, 4: None, 5: BASE + datetime.timedelta(days=1),
+    6: BASE - datetime.timedelta(days=1), 7: None, 8: BASE, 9: BASE + datetime.timedelta(days=2),
+}
+ESPERADO = [9, 5, 8, 3, 2, 6, 7, 4, 1]   # fecha DESC, id DESC, NULL al final
+
+
+class PaginacionCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add_all(Registro(id=i, fecha=f) for i, f in FECHAS.items())
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _recorrer(self, pagina):
+        """Sigue siguiente_cursor hasta el final; devuelve los ids en orden"""
+        vistos, posicion = [], None
+        for _ in range(len(FECHAS) + 1):
+            ids, siguiente = pagina(posicion)
+            vistos.extend(ids)
+            if siguiente is None:
+                return vistos
+            posicion = decode_cursor(siguiente)
+        self.fail('El cursor no termina')
+
+    def test_orm_con_fechas_nulas(self):
+        def pagina(posicion):
+            with self.app.test_request_context('/'):
+                items, siguiente, _ = keyset_paginate(Registro.query, Registro.fecha, Registro.id, posicion, 2)
+            return [r.id for r in items], siguiente
+
+        self.assertEqual(self._recorrer(pagina), ESPERADO)
+
+    def test_sql_crudo_con_fechas_nulas(self):
+        orden, despues = keyset_sql('fecha', 'id', (':cursor_fecha', ':cursor_id'))
+
+        def pagina(posicion):
+            sql, params = 'SELECT id, fecha FROM prueba_keyset', {'limite': 3}
+            if posicion is not None:
+                sql += f' WHERE {despues}'
+                params['cursor_fecha'], params['cursor_id'] = valores_cursor(posicion)
+                if isinstance(params['cursor_fecha'], datetime.datetime):
+                    # Formato en que SQLAlchemy guarda DateTime en SQLite (PostgreSQL compara el tipo)
+                    params['cursor_fecha'] = params['cursor_fecha'].strftime('%Y-%m-%d %H:%M:%S.%f')
+            filas = db.session.execute(text(f'{sql} ORDER BY {orden} LIMIT :limite'), params).fetchall()
+            filas, siguiente = keyset_rows(filas, 2, 1, 0)
+            return [f[0] for f in filas], siguiente
+
+        self.assertEqual(self._recorrer(pagina), ESPERADO)
+
+    def test_page_conserva_la_respuesta_anterior(self):
+        with self.app.test_request_context('/?page=2&per_page=4'):
+            items, siguiente, total = keyset_paginate(Registro.query, Registro.fecha, Registro.id, None, 4)
+            respuesta = respuesta_paginada('registros', [r.id for r in items], siguiente, total, 4)
+        self.assertEqual(respuesta['registros'], ESPERADO[4:8])
+        self.assertEqual((respuesta['total'], respuesta['pages'], respuesta['current_page']), (9, 3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Regresión del presupuesto de consultas (app/utils/query_budget.py).
+
+- El decorador lanza PresupuestoExcedido con QUERY_BUDGET_STRICT cuando la
+  vista ejecuta una consulta más que su presupuesto.
+- Cada vista de app/routes/reportes.py con @presupuesto_consultas se llama
+  con TestingConfig (SQLite en memoria con filas de ejemplo en todas las
+  tablas) y su X-Query-Count debe quedar dentro del presupuesto: un N+1
+  multiplica las consultas por fila y hace fallar la prueba.
+
+app/models todavía no define los modelos que usa reportes: mientras falten
+se declaran aquí con las columnas que leen las consultas (tablas de
+database/schema.sql). Si existen en app/models se usan esos.
+
+Uso (desde la raíz del repo):
+    python tests/test_presupuesto_consultas.py
+    python -m pytest tests/test_presupuesto_consultas.py
+"""
+import datetime
+import os
+import sys
+import unittest
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND)
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import (Boolean, Date, DateTime, Enum, Float, Integer, Numeric, String, Text, Time,
+                        insert, text)
+
+import app.models
+from app import create_app, db, cache
+from app.utils.query_budget import presupuesto_consultas, PresupuestoExcedido
+
+FILAS = 5
+
+# SQL crudo solo de PostgreSQL (FILTER, ::text sobre resumen_diario): no corre en SQLite
+SOLO_POSTGRES = {'reportes.dashboard'}
+
+# Valores que las consultas de reportes filtran; el resto se genera por tipo
+VALORES = {
+    'estado': 'pendiente',
+    'rol': 'admin',
+    'activo': True,
+}
+
+
+def _valor(columna, i):
+    if columna.name in VALORES:
+        return VALORES[columna.name]
+    if columna.foreign_keys:
+        return i                       # las tablas padre ya tienen ids 1..FILAS
+    tipo = columna.type
+    if isinstance(tipo, Enum):
+        return tipo.enums[0]
+    if isinstance(tipo, Boolean):
+        return True
+    if isinstance(tipo, DateTime):
+        return datetime.datetime.now() - datetime.timedelta(days=i)
+    if isinstance(tipo, Date):
+        return datetime.date.today() - datetime.timedelta(days=i)
+    if isinstance(tipo, Time):
+        return datetime.time(8, 0)
+    if isinstance(tipo, (Integer, Numeric, Float)):
+        return i * 100
+    if isinstance(tipo, (String, Text)):
+        valor = f'{columna.name}{i}'
+        return valor[:tipo.length] if getattr(tipo, 'length', None) else valor
+    return None
+
+
+def _modelos_minimos():
+    """Declara en app.models los modelos de reportes que aún no existen"""
+    if hasattr(app.models, 'Factura'):
+        return
+    fk = db.ForeignKey
+
+    class Paciente(db.Model):
+        __tablename__ = 'pacientes'
+        id = db.Column(db.Integer, primary_key=True)
+        nombre = db.Column(db.String(100))
+        apellido = db.Column(db.String(100))
+        telefono = db.Column(db.String(20))
+        seguro_medico = db.Column(db.String(100))
+
+    class Usuario(db.Model):
+        __tablename__ = 'usuarios'
+        id = db.Column(db.Integer, primary_key=True)
+        rol = db.Column(db.String(20))
+        activo = db.Column(db.Boolean)
+
+    class CategoriaEstudio(db.Model):
+        __tablename__ = 'categorias_estudios'
+        id = db.Column(db.Integer, primary_key=True)
+        nombre = db.Column(db.String(100))
+
+    class Estudio(db.Model):
+        __tablename__ = 'estudios'
+        id = db.Column(db.Integer, primary_key=True)
+        codigo = db.Column(db.String(20))
+        nombre = db.Column(db.String(200))
+        categoria_id = db.Column(db.Integer, fk('categorias_estudios.id'))
+
+    class Orden(db.Model):
+        __tablename__ = 'ordenes'
+        id = db.Column(db.Integer, primary_key=True)
+        numero_orden = db.Column(db.String(20))
+        paciente_id = db.Column(db.Integer, fk('pacientes.id'))
+        medico_referente = db.Column(db.String(200))
+        fecha_orden = db.Column(db.DateTime)
+        estado = db.Column(db.String(20))
+
+    class OrdenDetalle(db.Model):
+        __tablename__ = 'orden_detalles'
+        id = db.Column(db.Integer, primary_key=True)
+        orden_id = db.Column(db.Integer, fk('ordenes.id'))
+        estudio_id = db.Column(db.Integer, fk('estudios.id'))
+        precio_final = db.Column(db.Numeric(10, 2))
+
+    class Factura(db.Model):
+        __tablename__ = 'facturas'
+        id = db.Column(db.Integer, primary_key=True)
+        numero_factura = db.Column(db.String(20))
+        ncf = db.Column(db.String(19))
+        paciente_id = db.Column(db.Integer, fk('pacientes.id'))
+        fecha_factura = db.Column(db.DateTime)
+        fecha_vencimiento = db.Column(db.Date)
+        subtotal = db.Column(db.Numeric(10, 2))
+        descuento = db.Column(db.Numeric(10, 2))
+        itbis = db.Column(db.Numeric(10, 2))
+        total = db.Column(db.Numeric(10, 2))
+        estado = db.Column(db.String(20))
+
+    class Pago(db.Model):
+        __tablename__ = 'pagos'
+        id = db.Column(db.Integer, primary_key=True)
+        factura_id = db.Column(db.Integer, fk('facturas.id'))
+        monto = db.Column(db.Numeric(10, 2))
+        metodo_pago = db.Column(db.String(30))
+        referencia = db.Column(db.String(100))
+        fecha_pago = db.Column(db.DateTime)
+
+    for modelo in (Paciente, Usuario, CategoriaEstudio, Estudio, Orden, OrdenDetalle, Factura, Pago):
+        setattr(app.models, modelo.__name__, modelo)
+
+
+def _funciones_sqlite():
+    """greatest() de PostgreSQL, que usa cuentas por cobrar"""
+    with db.engine.connect() as conn:
+        conn.connection.driver_connection.create_function('greatest', -1, max)
+
+
+def _sembrar():
+    """FILAS filas en cada tabla, en orden de dependencias"""
+    for tabla in db.metadata.sorted_tables:
+        filas = []
+        for i in range(1, FILAS + 1):
+            fila = {}
+            for columna in tabla.columns:
+                if columna.primary_key and isinstance(columna.type, Integer):
+                    fila[columna.name] = i
+                else:
+                    fila[columna.name] = _valor(columna, i)
+            filas.append(fila)
+        db.session.execute(insert(tabla), filas)
+    db.session.commit()
+
+
+class PresupuestoDecoradorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+
+        @self.app.route('/_consultas/<int:n>')
+        @presupuesto_consultas(2)
+        def consultas(n):
+            for _ in range(n):
+                db.session.execute(text('SELECT 1'))
+            return {'ok': True}
+
+        self.client = self.app.test_client()
+
+    def test_dentro_del_presupuesto(self):
+        response = self.client.get('/_consultas/2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Query-Count'], '2')
+
+    def test_presupuesto_excedido(self):
+        self.app.testing = True   # que la excepción llegue al test en vez de un 500
+        with self.assertRaises(PresupuestoExcedido):
+            self.client.get('/_consultas/3')
+
+    def test_fuera_de_modo_estricto_solo_avisa(self):
+        self.app.config['QUERY_BUDGET_STRICT'] = False
+        response = self.client.get('/_consultas/3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Query-Count'], '3')
+
+
+class PresupuestoReportesTest(unittest.TestCase):
+
+    def setUp(self):
+        _modelos_minimos()
+        from app.routes import reportes
+
+        self.app = create_app('testing')
+        self.app.register_blueprint(reportes.bp, url_prefix='/api/reportes')
+        self.app.testing = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        _funciones_sqlite()
+        db.create_all()
+        _sembrar()
+        self.client = self.app.test_client()
+        token = create_access_token(identity='1')
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _vistas(self):
+        for regla in self.app.url_map.iter_rules():
+            vista = self.app.view_functions[regla.endpoint]
+            if regla.endpoint.startswith('reportes.') and hasattr(vista, 'presupuesto') \
+                    and 'GET' in regla.methods and not regla.arguments and regla.endpoint not in SOLO_POSTGRES:
+                yield regla, vista.presupuesto
+
+    def test_reportes_dentro_del_presupuesto(self):
+        vistas = list(self._vistas())
+        self.assertTrue(vistas, 'No hay vistas de reportes con @presupuesto_consultas')
+        for regla, presupuesto in vistas:
+            with self.subTest(ruta=regla.rule):
+                cache.clear_cache()   # una respuesta cacheada no ejecuta la vista
+                try:
+                    response = self.client.get(regla.rule, headers=self.headers)
+                except PresupuestoExcedido as e:
+                    self.fail(str(e))
+                self.assertEqual(response.status_code, 200, response.get_data(as_text=True)[:300])
+                usadas = int(response.headers['X-Query-Count'])
+                self.assertLessEqual(usadas, presupuesto, f'{regla.rule}: {usadas} consultas')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
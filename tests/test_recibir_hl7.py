@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+/api/maquinas/recibir-hl7 con números de orden alfanuméricos, sin base.
+
+Los equipos envían en OBR-2 el código de la orden (numero_orden), no
+siempre el id numérico. El mensaje se acepta igual: con una orden que
+existe queda asignado a ella, y con una que no aparece queda sin asignar
+(orden_detalle_id NULL) guardando la referencia recibida.
+
+Uso (desde la raíz del repo):
+    python tests/test_recibir_hl7.py
+    python -m pytest tests/test_recibir_hl7.py
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(RAIZ, 'backend'))
+
+from flask import Flask
+
+from app.services import maquinas_laboratorio
+
+ORDENES = {'ORD-2026-0042': (42, 420)}   # numero_orden -> (orden_id, orden_detalle_id)
+
+
+def mensaje(orden):
+    return '\r'.join((
+        'MSH|^~\\&|ANALIZADOR|LAB|LIS|CLINICA|20260101083000||ORU^R01|MSG0001|P|2.5',
+        'PID|1||001-1234567-8||PEREZ^JUAN',
+        f'OBR|1|{orden}||GLU^Glucosa',
+        'OBX|1|NM|GLU^Glucosa||95|mg/dL|70-110|N|||F',
+    ))
+
+
+class _Cursor:
+    """Cursor simulado: órdenes para detalle_orden y el INSERT del resultado"""
+
+    def __init__(self, insertados):
+        self.insertados = insertados
+        self.filas = []
+
+    def execute(self, sql, params=()):
+        if 'FROM ordenes' in sql:
+            ids, numeros = params
+            self.filas = [(oid, numero, detalle) for numero, (oid, detalle) in ORDENES.items()
+                          if oid in ids or numero in numeros]
+        elif 'INSERT INTO resultados' in sql:
+            self.insertados.append(params)
+            self.filas = [(len(self.insertados),)]
+        else:
+            self.filas = []
+
+    def fetchone(self):
+        return self.filas[0] if self.filas else None
+
+    def fetchall(self):
+        return self.filas
+
+    def close(self):
+        pass
+
+
+class _Conexion:
+    def __init__(self, insertados):
+        self.insertados = insertados
+
+    def cursor(self):
+        return _Cursor(self.insertados)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecibirHL7Test(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(maquinas_laboratorio.maquinas_bp, url_prefix='/api/maquinas')
+        self.client = app.test_client()
+        self.insertados = []
+        parche = mock.patch.object(maquinas_laboratorio, 'get_db_connection',
+                                   lambda: _Conexion(self.insertados))
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def enviar(self, orden):
+        return self.client.post('/api/maquinas/recibir-hl7', data=mensaje(orden), content_type='x-application/hl7')
+
+    def test_numero_orden_alfanumerico(self):
+        resp = self.enviar('ORD-2026-0042')
+        self.assertEqual(resp.status_code, 201, resp.get_json())
+        self.assertFalse(resp.get_json()['sin_asignar'])
+        self.assertEqual(self.insertados[0][0], 420)
+
+    def test_orden_desconocida_queda_sin_asignar(self):
+        resp = self.enviar('LIS#0099')
+        self.assertEqual(resp.status_code, 201, resp.get_json())
+        self.assertTrue(resp.get_json()['sin_asignar'])
+        fila = self.insertados[0]
+        self.assertIsNone(fila[0])
+        # orden_referencia y paciente_referencia: lo que envió el equipo
+        self.assertEqual(fila[-2:], ('LIS#0099', '001-1234567-8'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Sesiones del visor de radiografías repartidas entre workers de gunicorn.
+
+Dos SesionesImagen con el mismo registro SQLite hacen de dos workers: una
+sesión abierta en uno se renueva, se usa y se cierra desde el otro, y el
+primero suelta su imagen en cuanto el registro dice que ya no está abierta.
+
+Uso (desde la raíz del repo):
+    python tests/test_sesiones_imagen.py
+    python -m pytest tests/test_sesiones_imagen.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND)
+
+import numpy as np
+
+from app.services import sesiones_imagen
+from app.services.sesiones_imagen import EntradaImagen, RegistroSQLite, SesionesImagen
+
+CLAVE = (7, 0)
+FIRMA = ('radiografia_7.dcm', 1, 1)
+
+
+def entrada():
+    return EntradaImagen(pixeles=np.zeros((4, 4), dtype=np.uint16))
+
+
+class SesionesImagenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.carpeta = tempfile.mkdtemp()
+        path = os.path.join(self.carpeta, 'sesiones.db')
+        self.a = SesionesImagen(ttl=60, registro=RegistroSQLite(path))
+        self.b = SesionesImagen(ttl=60, registro=RegistroSQLite(path))
+
+    def tearDown(self):
+        shutil.rmtree(self.carpeta, ignore_errors=True)
+
+    def test_cerrar_desde_otro_worker(self):
+        self.a.put(CLAVE, FIRMA, entrada())
+        sesion_id = self.a.abrir(CLAVE)
+        self.assertTrue(self.b.cerrar(sesion_id))
+        self.assertFalse(self.b.cerrar(sesion_id))
+        # El primer worker suelta la imagen en su próxima revisión
+        self.a._revisado = 0
+        self.assertIsNone(self.a.get(CLAVE, FIRMA))
+        self.assertEqual(self.a.stats()['bytes'], 0)
+
+    def test_otro_worker_retiene_y_renueva(self):
+        self.a.put(CLAVE, FIRMA, entrada())
+        sesion_id = self.a.abrir(CLAVE)
+        # Fallo en el segundo worker: carga el estudio y queda retenido por la sesión
+        self.assertIsNone(self.b.get(CLAVE, FIRMA, sesion_id))
+        self.assertIn(sesion_id, self.b.put(CLAVE, FIRMA, entrada()).sesiones)
+        self.assertIs(self.b.get(CLAVE, FIRMA, sesion_id), self.b._entradas[CLAVE])
+
+    def test_uso_renueva_la_sesion(self):
+        self.a.put(CLAVE, FIRMA, entrada())
+        sesion_id = self.a.abrir(CLAVE)
+        conn = self.a.registro._conn()
+        # Abierta hace 50 s con ttl de 60: un get en otro worker la renueva aunque falle
+        conn.execute("UPDATE sesiones_imagen SET usado = ?", (time.time() - 50,))
+        self.assertIsNone(self.b.get(CLAVE, FIRMA, sesion_id))
+        usado = conn.execute("SELECT usado FROM sesiones_imagen").fetchone()[0]
+        self.assertGreater(usado, time.time() - 5)
+
+    def test_sesion_caducada(self):
+        self.a.put(CLAVE, FIRMA, entrada())
+        sesion_id = self.a.abrir(CLAVE)
+        self.a.registro._conn().execute("UPDATE sesiones_imagen SET usado = ?", (time.time() - 120,))
+        self.assertIsNone(self.b.get(CLAVE, FIRMA, sesion_id))
+        self.a._revisado = 0
+        self.assertEqual(self.a.stats()['sesiones'], 0)
+        self.assertEqual(self.a.stats()['entradas'], 0)
+
+    def test_id_invalido(self):
+        self.assertFalse(self.a.cerrar('../../etc'))
+        self.assertIsNone(self.a.get(CLAVE, FIRMA, 'x'))
+
+    def test_init_app(self):
+        class App:
+            config = {'IMAGEN_SESION_DB': os.path.join(self.carpeta, 'app.db')}
+        anterior = sesiones_imagen.sesiones.registro
+        try:
+            sesiones_imagen.init_app(App)
+            self.assertIsInstance(sesiones_imagen.sesiones.registro, RegistroSQLite)
+        finally:
+            sesiones_imagen.sesiones.registro = anterior
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)